@@ -4,13 +4,19 @@ Riistakamera Annotator - Flask backend
 Kuvien lataus, annotaatioiden tallennus, AI-ennusteet, YOLO-eksportti
 """
 import os
-import re
 import json
+import base64
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
 from flask import Flask, render_template, jsonify, request, send_from_directory
 from PIL import Image
 
+from storage.metadata_index import MetadataIndex, INDEX_FILENAME
+from storage.watcher import DirectoryWatcher
+from storage.jobs import JobQueue, JOBS_FILENAME
+
 app = Flask(__name__)
 
 # Konfiguraatio ympäristömuuttujista
@@ -19,6 +25,9 @@ IMAGE_DIR = Path(os.environ.get('IMAGE_DIR', str(DATA_DIR / 'images' / 'incoming
 ANNOTATION_DIR = Path(os.environ.get('ANNOTATION_DIR', str(DATA_DIR / 'annotations')))
 PREDICTION_DIR = Path(os.environ.get('PREDICTION_DIR', str(DATA_DIR / 'predictions')))
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+JSON_CACHE_MAX_MB = int(os.environ.get('JSON_CACHE_MAX_MB', 64))
+# Koulutustyö lukee annotaatiot suoraan (training.streaming) eksportin sijaan
+TRAIN_STREAMING = os.environ.get('TRAIN_STREAMING', '0') == '1'
 
 CLASS_MAP = {
     0: 'kauris',
@@ -41,48 +50,142 @@ def ensure_dirs():
         d.mkdir(parents=True, exist_ok=True)
 
 
+class JsonDocumentCache:
+    """
+    Jaettu LRU-välimuisti jäsennetyille annotaatio- ja ennustedokumenteille.
+
+    Avain on tiedostopolku; merkintä mitätöityy, kun tiedoston (inode,
+    mtime_ns, koko) muuttuu. Muistikatto arvioidaan tiedostokoosta
+    kertoimella, koska jäsennetty JSON vie useita kertoja levykokonsa.
+    Palautettuja dokumentteja ei saa muokata.
+    """
+
+    MEMORY_FACTOR = 6
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (signature, data, weight)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _signature(st):
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self, path):
+        """Palauta jäsennetty dokumentti tai None, jos tiedostoa ei ole."""
+        key = str(path)
+        try:
+            st = os.stat(key)
+        except FileNotFoundError:
+            self.discard(key)
+            return None
+        signature = self._signature(st)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with open(key, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self._store(key, signature, data, st.st_size)
+        return data
+
+    def put(self, path, data):
+        """Tallenna juuri kirjoitettu dokumentti ilman uudelleenlukua."""
+        key = str(path)
+        st = os.stat(key)
+        self._store(key, self._signature(st), data, st.st_size)
+
+    def discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(str(path), None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def _store(self, key, signature, data, size):
+        weight = size * self.MEMORY_FACTOR
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if weight > self.max_bytes:
+                return
+            self._entries[key] = (signature, data, weight)
+            self._bytes += weight
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'estimated_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+json_cache = JsonDocumentCache(JSON_CACHE_MAX_MB * 1024 * 1024)
+
+_metadata_index = None
+# Kehityspalvelin on monisäikeinen: samanaikaiset ensimmäiset pyynnöt
+# rakentaisivat indeksin ja vahdin kukin erikseen
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Palauta metadataindeksi; rakenna se JSON-tiedostoista ensimmäisellä käytöllä."""
+    global _metadata_index
+    db_path = DATA_DIR / INDEX_FILENAME
+    with _index_lock:
+        if _metadata_index is None or _metadata_index.db_path != db_path:
+            index = MetadataIndex(db_path)
+            if index.needs_rebuild():
+                index.rebuild(IMAGE_DIR, ANNOTATION_DIR, PREDICTION_DIR)
+            _metadata_index = index
+        return _metadata_index
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher():
+    """Palauta tiedostovahti; ensimmäinen kutsu täsmäyttää indeksin levyyn."""
+    global _watcher
+    index = get_index()
+    with _watcher_lock:
+        if _watcher is None or _watcher.index is not index or _watcher.image_dir != IMAGE_DIR:
+            if _watcher is not None:
+                _watcher.stop()
+            watcher = DirectoryWatcher(
+                IMAGE_DIR, ANNOTATION_DIR, PREDICTION_DIR, index, load_json=json_cache.load,
+            )
+            watcher.reconcile()
+            _watcher = watcher
+        return _watcher
+
+
 def get_image_files():
-    """Hae kaikki kuvat kansiosta."""
-    if not IMAGE_DIR.exists():
-        return []
-    images = []
-    for f in sorted(IMAGE_DIR.iterdir()):
-        if f.suffix.lower() in ALLOWED_EXTENSIONS:
-            images.append(f.name)
-    return images
+    """Hae kaikki kuvat (tiedostovahdin muistista)."""
+    return get_watcher().list_images('all')
 
 
 def get_filtered_images(filter_type):
     """Suodata kuvat tyypin mukaan."""
-    all_images = get_image_files()
-    if filter_type == 'all':
-        return all_images
-
-    result = []
-    for img_name in all_images:
-        ann_path = get_annotation_path(img_name)
-        pred_path = get_prediction_path(img_name)
-
-        has_annotation = False
-        is_empty = False
-        if ann_path.exists():
-            with open(ann_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            is_empty = data.get('is_empty', False)
-            has_annotation = bool(data.get('annotations')) or is_empty
-
-        has_prediction = pred_path.exists()
-
-        if filter_type == 'annotated' and has_annotation:
-            result.append(img_name)
-        elif filter_type == 'unannotated' and not has_annotation:
-            result.append(img_name)
-        elif filter_type == 'predicted' and has_prediction and not has_annotation:
-            result.append(img_name)
-        elif filter_type == 'empty' and is_empty:
-            result.append(img_name)
-
-    return result
+    return get_watcher().list_images(filter_type)
 
 
 def get_annotation_path(image_name):
@@ -125,10 +228,8 @@ def get_image(filename):
 
 @app.route('/api/annotation/<path:image_name>')
 def get_annotation(image_name):
-    path = get_annotation_path(image_name)
-    if path.exists():
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    data = json_cache.load(get_annotation_path(image_name))
+    if data is not None:
         return jsonify(data)
     return jsonify({'image_name': image_name, 'annotations': [], 'is_empty': False})
 
@@ -148,15 +249,16 @@ def save_annotation(image_name):
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
+    json_cache.put(path, data)
+    get_watcher().annotation_changed(path, data)
+
     return jsonify({'success': True})
 
 
 @app.route('/api/predictions/<path:image_name>')
 def get_predictions(image_name):
-    path = get_prediction_path(image_name)
-    if path.exists():
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    data = json_cache.load(get_prediction_path(image_name))
+    if data is not None:
         return jsonify(data)
     return jsonify({'image_name': image_name, 'predictions': []})
 
@@ -175,41 +277,20 @@ def get_image_info(filename):
 @app.route('/api/stats')
 def get_stats():
     """Tilastot: kuvien ja annotaatioiden määrä."""
-    images = get_image_files()
-    annotated = 0
-    empty_images = 0
-    total_annotations = 0
-    species_counts = {}
-
-    for img_name in images:
-        path = get_annotation_path(img_name)
-        if path.exists():
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            if data.get('is_empty', False):
-                empty_images += 1
-                continue
-            anns = data.get('annotations', [])
-            if anns:
-                annotated += 1
-                total_annotations += len(anns)
-                for ann in anns:
-                    sp = ann.get('species', 'muu')
-                    species_counts[sp] = species_counts.get(sp, 0) + 1
-
-    predicted = 0
-    for img_name in images:
-        path = get_prediction_path(img_name)
-        if path.exists():
-            predicted += 1
+    counts = get_watcher().counts()
+    species_counts = get_index().species_counts()
+    total_images = counts['all']
+    empty_images = counts['empty']
+    # Tyhjäksi merkityt kuuluvat 'annotated'-suodattimeen, mutta eivät tähän lukuun
+    annotated = counts['annotated'] - empty_images
 
     return jsonify({
-        'total_images': len(images),
+        'total_images': total_images,
         'annotated_images': annotated,
         'empty_images': empty_images,
-        'unannotated_images': len(images) - annotated - empty_images,
-        'predicted_images': predicted,
-        'total_annotations': total_annotations,
+        'unannotated_images': total_images - annotated - empty_images,
+        'predicted_images': counts['has_prediction'],
+        'total_annotations': sum(species_counts.values()),
         'species_counts': species_counts,
         'class_map': CLASS_MAP,
     })
@@ -224,107 +305,207 @@ def active_learning_ranking():
     return jsonify({'ranking': ranking, 'total': len(ranking)})
 
 
-@app.route('/api/export/yolo', methods=['POST'])
-def export_yolo():
-    """Triggeroi YOLO-eksportin."""
+# ---------- Taustatyöt ----------
+
+def _run_export(ctx, fraction=1.0, message=None):
+    """Eksportoi YOLO-dataset; edistyminen skaalataan osuuteen `fraction`."""
+    from export_yolo import export_dataset
+
+    def progress(done, total):
+        ctx.check_cancelled()
+        ctx.progress(fraction * done / max(total, 1), message or f'Eksportoidaan {done}/{total}')
+
+    return export_dataset(
+        annotation_dir=str(ANNOTATION_DIR),
+        image_dir=str(IMAGE_DIR),
+        output_dir=str(DATA_DIR / 'dataset'),
+        class_map=CLASS_MAP,
+        species_to_id=SPECIES_TO_ID,
+        progress=progress,
+        index=get_index(),
+    )
+
+
+def export_job(ctx):
+    """Työ: YOLO-eksportti."""
+    return _run_export(ctx)
+
+
+def train_job(ctx):
+    """Työ: eksportoi dataset + kouluta YOLO-malli (CPU Dockerissa)."""
+    if TRAIN_STREAMING:
+        return _train_streaming(ctx)
+    ctx.progress(0.0, 'exporting')
+    export_result = _run_export(ctx, fraction=0.1, message='exporting')
+    if not export_result.get('success'):
+        return {'success': False, 'error': export_result.get('error', 'export failed')}
+    ctx.check_cancelled()
+
+    ctx.progress(0.1, 'training')
+    from training.train import train_species_model
+    return train_species_model(
+        dataset_yaml=str(DATA_DIR / 'dataset' / 'dataset.yaml'),
+        base_model='yolo11n.pt',
+        epochs=50,
+        imgsz=640,
+        batch=4,
+        device='cpu',
+        patience=15,
+        progress=lambda epoch, epochs: ctx.progress(0.1 + 0.9 * epoch / epochs, 'training'),
+        should_stop=lambda: ctx.cancelled,
+    )
+
+
+def _train_streaming(ctx):
+    """Koulutus suoraan annotaatioista; vain uudet kuvat dekoodataan välimuistiin."""
+    from training.train import train_from_annotations
+
+    def prepare_progress(done, total):
+        ctx.check_cancelled()
+        ctx.progress(0.1 * done / max(total, 1), f'preparing {done}/{total}')
+
+    ctx.progress(0.0, 'preparing')
+    return train_from_annotations(
+        annotation_dir=str(ANNOTATION_DIR),
+        image_dir=str(IMAGE_DIR),
+        base_model='yolo11n.pt',
+        epochs=50,
+        imgsz=640,
+        batch=4,
+        device='cpu',
+        patience=15,
+        class_map=CLASS_MAP,
+        species_to_id=SPECIES_TO_ID,
+        progress=lambda epoch, epochs: ctx.progress(0.1 + 0.9 * epoch / epochs, 'training'),
+        should_stop=lambda: ctx.cancelled,
+        prepare_progress=prepare_progress,
+    )
+
+
+def fetch_job(ctx):
+    """Työ: sähköpostinouto + tunnistus (suora IMAP, ei Gmail-agenttia)."""
+    ctx.progress(0.0, 'fetching')
+    from ingestion.fetch_camera_imap import fetch_camera_images
     try:
-        from export_yolo import export_dataset
-        result = export_dataset(
-            annotation_dir=str(ANNOTATION_DIR),
-            image_dir=str(IMAGE_DIR),
-            output_dir=str(DATA_DIR / 'dataset'),
-            class_map=CLASS_MAP,
-            species_to_id=SPECIES_TO_ID,
-        )
-        return jsonify(result)
-    except ImportError:
-        return jsonify({'error': 'export_yolo module not found'}), 500
+        result = fetch_camera_images()
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'success': False, 'error': f'Sähköpostihaku epäonnistui: {e}'}
+    ctx.check_cancelled()
 
+    if result.get('new_images'):
+        ctx.progress(0.5, 'detecting')
+        try:
+            from detection.worker import request_detection
+            result['detection'] = request_detection()
+        except Exception as e:
+            result['detection_error'] = str(e)
+    return result
 
-@app.route('/api/train', methods=['POST'])
-def train_model():
-    """Eksportoi dataset + kouluta YOLO-malli."""
-    import threading
 
-    # Check if already training
-    if getattr(app, '_training_in_progress', False):
-        return jsonify({'error': 'Koulutus on jo käynnissä'}), 409
+JOB_HANDLERS = {
+    'fetch': fetch_job,
+    'export': export_job,
+    'train': train_job,
+}
 
-    def run_training():
-        app._training_in_progress = True
-        app._training_status = 'exporting'
-        try:
-            # Step 1: Export YOLO dataset
-            from export_yolo import export_dataset
-            export_result = export_dataset(
-                annotation_dir=str(ANNOTATION_DIR),
-                image_dir=str(IMAGE_DIR),
-                output_dir=str(DATA_DIR / 'dataset'),
-                class_map=CLASS_MAP,
-                species_to_id=SPECIES_TO_ID,
-            )
-            if not export_result.get('success'):
-                app._training_status = f'error: {export_result.get("error", "export failed")}'
-                return
+_job_queue = None
+_jobs_lock = threading.Lock()
 
-            app._training_status = 'training'
-
-            # Step 2: Train model (CPU in Docker)
-            from training.train import train_species_model
-            train_result = train_species_model(
-                dataset_yaml=str(DATA_DIR / 'dataset' / 'dataset.yaml'),
-                base_model='yolo11n.pt',
-                epochs=50,
-                imgsz=640,
-                batch=4,
-                device='cpu',
-                patience=15,
-            )
-            if train_result.get('success'):
-                app._training_status = 'done'
-                app._training_result = train_result
-            else:
-                app._training_status = f'error: {train_result.get("error", "training failed")}'
-        except Exception as e:
-            app._training_status = f'error: {str(e)}'
-        finally:
-            app._training_in_progress = False
 
-    thread = threading.Thread(target=run_training, daemon=True)
-    thread.start()
+def get_jobs():
+    """Palauta taustatyöjono; työsäikeet käynnistyvät ensimmäisellä käytöllä."""
+    global _job_queue
+    db_path = DATA_DIR / JOBS_FILENAME
+    with _jobs_lock:
+        if _job_queue is None or _job_queue.db_path != db_path:
+            if _job_queue is not None:
+                _job_queue.stop()
+            queue = JobQueue(db_path)
+            for kind, handler in JOB_HANDLERS.items():
+                queue.register(kind, handler)
+            queue.start()
+            _job_queue = queue
+        return _job_queue
+
+
+def _job_response(job, status=202):
+    return jsonify({'success': True, 'job_id': job['id'], 'job': job}), status
+
+
+@app.route('/api/export/yolo', methods=['POST'])
+def export_yolo():
+    """Käynnistä YOLO-eksportti taustatyönä."""
+    jobs = get_jobs()
+    job = jobs.active('export') or jobs.submit('export')
+    return _job_response(job)
+
 
-    return jsonify({'success': True, 'message': 'Koulutus käynnistetty'})
+@app.route('/api/train', methods=['POST'])
+def train_model():
+    """Käynnistä eksportti + koulutus taustatyönä."""
+    jobs = get_jobs()
+    active = jobs.active('train')
+    if active:
+        return jsonify({'error': 'Koulutus on jo käynnissä', 'job_id': active['id']}), 409
+    job = jobs.submit('train')
+    return jsonify({'success': True, 'message': 'Koulutus käynnistetty',
+                    'job_id': job['id'], 'job': job}), 202
 
 
 @app.route('/api/train/status')
 def train_status():
-    """Koulutuksen tila."""
+    """Koulutuksen tila (viimeisimmästä koulutustyöstä)."""
+    job = get_jobs().latest('train')
+    if job is None:
+        return jsonify({'in_progress': False, 'status': 'idle', 'result': None, 'job_id': None})
+    if job['status'] == 'done':
+        status = 'done'
+    elif job['status'] == 'failed':
+        status = f"error: {job['error']}"
+    elif job['status'] == 'cancelled':
+        status = 'error: peruttu'
+    else:
+        status = job['message'] or 'exporting'
     return jsonify({
-        'in_progress': getattr(app, '_training_in_progress', False),
-        'status': getattr(app, '_training_status', 'idle'),
-        'result': getattr(app, '_training_result', None),
+        'in_progress': job['status'] in ('queued', 'running'),
+        'status': status,
+        'progress': job['progress'],
+        'result': job['result'] if job['status'] == 'done' else None,
+        'job_id': job['id'],
     })
 
 
 @app.route('/api/fetch', methods=['POST'])
 def fetch_images():
-    """Triggeroi sähköpostinouto + tunnistus (suora IMAP, ei Gmail-agenttia)."""
-    try:
-        from ingestion.fetch_camera_imap import fetch_camera_images
-        result = fetch_camera_images()
-    except Exception as e:
-        return jsonify({'error': f'Sähköpostihaku epäonnistui: {e}'}), 500
+    """Käynnistä sähköpostinouto + tunnistus taustatyönä."""
+    jobs = get_jobs()
+    job = jobs.active('fetch') or jobs.submit('fetch')
+    return _job_response(job)
 
-    if result.get('new_images'):
-        try:
-            from detection.detect_batch import detect_new_images
-            result['detection'] = detect_new_images()
-        except Exception as e:
-            result['detection_error'] = str(e)
 
-    return jsonify(result)
+@app.route('/api/jobs')
+def list_jobs():
+    """Viimeisimmät taustatyöt (valinnaisesti ?kind=fetch|export|train)."""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({'jobs': get_jobs().list(kind=request.args.get('kind'), limit=limit)})
+
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Taustatyön tila, edistyminen ja tulos."""
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Työtä ei löydy'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Peru jonossa oleva tai käynnissä oleva taustatyö."""
+    jobs = get_jobs()
+    if jobs.get(job_id) is None:
+        return jsonify({'error': 'Työtä ei löydy'}), 404
+    return jsonify(jobs.cancel(job_id))
 
 
 @app.route('/api/recent-detections')
@@ -332,32 +513,11 @@ def recent_detections():
     """Viimeisimmät tunnistukset Tapanin raportteihin."""
     limit = request.args.get('limit', 20, type=int)
 
-    if not PREDICTION_DIR.exists():
-        return jsonify({'detections': [], 'species_summary': {}})
-
-    pred_files = sorted(
-        PREDICTION_DIR.glob('*.json'),
-        key=lambda f: f.stat().st_mtime,
-        reverse=True,
-    )[:limit]
-
-    detections = []
+    detections = get_index().recent_predictions(limit)
     species_summary = {}
-
-    for pf in pred_files:
-        with open(pf, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        image_name = data.get('image', pf.stem)
-        preds = data.get('predictions', [])
-        for pred in preds:
-            sp = pred.get('species')
-            if sp:
-                species_summary[sp] = species_summary.get(sp, 0) + 1
-        detections.append({
-            'image': image_name,
-            'predictions_count': len(preds),
-            'species': [p.get('species') for p in preds if p.get('species')],
-        })
+    for det in detections:
+        for sp in det['species']:
+            species_summary[sp] = species_summary.get(sp, 0) + 1
 
     return jsonify({
         'detections': detections,
@@ -378,22 +538,6 @@ SPECIES_LABELS = {
     'muu': 'Muu',
 }
 
-_FILENAME_DATE_RE = re.compile(r'(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})')
-
-
-def _parse_camera_datetime(filename):
-    """Parse camera date+time from filename like 15339_25173_20260128_072622867."""
-    m = _FILENAME_DATE_RE.search(filename)
-    if not m:
-        return None, None
-    y, mo, d, h, mi, s = (int(x) for x in m.groups())
-    try:
-        dt = datetime(y, mo, d, h, mi, s)
-        return dt.strftime('%Y-%m-%d'), dt.hour
-    except ValueError:
-        return None, None
-
-
 @app.route('/api/dashboard')
 def dashboard_data():
     """Aggregated analytics data for the dashboard."""
@@ -405,113 +549,72 @@ def dashboard_data():
     if sp_param:
         species_filter = {s.strip() for s in sp_param.split(',') if s.strip()}
 
-    images = get_image_files()
+    index = get_index()
+    counts = index.image_counts(from_date, to_date, species_filter)
 
-    total_images = 0
-    annotated_count = 0
-    empty_count = 0
-    unannotated_count = 0
+    # Lajisuodatuksen ulkopuoliset annotoidut kuvat eivät kuulu kokonaismäärään
+    total_images = counts['total'] - (counts['annotated'] - counts['annotated_matching'])
+    annotated_count = counts['annotated_matching']
+    empty_count = counts['empty']
+    unannotated_count = counts['unannotated']
     total_annotations = 0
     species_counts = {}
     hourly_activity = {}     # hour -> {species: count}
     daily_activity = {}      # date -> {species: count}
     ai_accuracy = {}         # species -> {correct, overridden, total}
-    confidence_bins = [0] * 10  # 0-10%, 10-20%, ..., 90-100%
-    recent = []
+    # 0-10%, 10-20%, ..., 90-100%
+    confidence_bins = index.confidence_histogram(from_date, to_date, species_filter)
     from_prediction_total = 0
 
-    for img_name in images:
-        camera_date, camera_hour = _parse_camera_datetime(img_name)
-
-        # Date filtering
-        if from_date and camera_date and camera_date < from_date:
-            continue
-        if to_date and camera_date and camera_date > to_date:
-            continue
-
-        total_images += 1
-
-        ann_path = get_annotation_path(img_name)
-        if not ann_path.exists():
-            unannotated_count += 1
-            continue
-
-        with open(ann_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        if data.get('is_empty', False):
-            empty_count += 1
-            continue
-
-        anns = data.get('annotations', [])
-        if not anns:
-            unannotated_count += 1
-            continue
-
-        # Check if any annotation matches species filter
-        if species_filter:
-            has_match = any(ann.get('species', 'muu') in species_filter for ann in anns)
-            if not has_match:
-                total_images -= 1
-                continue
-
-        annotated_count += 1
-
-        for ann in anns:
-            sp = ann.get('species', 'muu')
-
-            # Species filter
-            if species_filter and sp not in species_filter:
-                continue
-
-            total_annotations += 1
-            species_counts[sp] = species_counts.get(sp, 0) + 1
-
-            # Hourly activity
-            if camera_hour is not None:
-                h_key = str(camera_hour)
-                if h_key not in hourly_activity:
-                    hourly_activity[h_key] = {}
-                hourly_activity[h_key][sp] = hourly_activity[h_key].get(sp, 0) + 1
-
-            # Daily activity
-            if camera_date:
-                if camera_date not in daily_activity:
-                    daily_activity[camera_date] = {}
-                daily_activity[camera_date][sp] = daily_activity[camera_date].get(sp, 0) + 1
-
-            # AI accuracy
-            if ann.get('from_prediction'):
-                from_prediction_total += 1
-                original = ann.get('original_species', '')
-                if sp not in ai_accuracy:
-                    ai_accuracy[sp] = {'correct': 0, 'overridden': 0, 'total': 0}
-                ai_accuracy[sp]['total'] += 1
-                if original == sp:
-                    ai_accuracy[sp]['correct'] += 1
-                else:
-                    ai_accuracy[sp]['overridden'] += 1
-
-            # Confidence histogram
-            conf = ann.get('species_confidence') or ann.get('md_confidence')
-            if conf is not None:
-                bin_idx = min(int(conf * 10), 9)
-                confidence_bins[bin_idx] += 1
-
-            # Recent feed
-            recent.append({
-                'image': img_name,
-                'species': sp,
-                'camera_date': camera_date,
-                'camera_hour': camera_hour,
-                'confidence': ann.get('species_confidence') or ann.get('md_confidence'),
-                'from_prediction': ann.get('from_prediction', False),
-                'timestamp': ann.get('timestamp', ''),
-            })
-
-    # Sort recent by timestamp descending, keep 20
-    recent.sort(key=lambda r: r.get('timestamp', ''), reverse=True)
-    recent = recent[:20]
+    for cell in index.activity_cells(from_date, to_date, species_filter):
+        sp = cell['species']
+        n = cell['n']
+        camera_date = cell['camera_date']
+        camera_hour = cell['camera_hour']
+
+        total_annotations += n
+        species_counts[sp] = species_counts.get(sp, 0) + n
+
+        # Hourly activity
+        if camera_hour is not None:
+            h_key = str(camera_hour)
+            if h_key not in hourly_activity:
+                hourly_activity[h_key] = {}
+            hourly_activity[h_key][sp] = hourly_activity[h_key].get(sp, 0) + n
+
+        # Daily activity
+        if camera_date:
+            if camera_date not in daily_activity:
+                daily_activity[camera_date] = {}
+            daily_activity[camera_date][sp] = daily_activity[camera_date].get(sp, 0) + n
+
+        # AI accuracy
+        from_prediction = int(cell['from_prediction'])
+        if from_prediction:
+            correct = int(cell['correct'])
+            from_prediction_total += from_prediction
+            if sp not in ai_accuracy:
+                ai_accuracy[sp] = {'correct': 0, 'overridden': 0, 'total': 0}
+            ai_accuracy[sp]['total'] += from_prediction
+            ai_accuracy[sp]['correct'] += correct
+            ai_accuracy[sp]['overridden'] += from_prediction - correct
+
+    # Recent feed: newest annotations by timestamp
+    recent = [
+        {
+            'image': row['image'],
+            'species': row['species'],
+            'camera_date': row['camera_date'],
+            'camera_hour': row['camera_hour'],
+            'confidence': row['confidence'],
+            'from_prediction': row['from_prediction'],
+            'timestamp': row['timestamp'],
+        }
+        for row in index.annotation_rows(
+            from_date, to_date, species_filter,
+            order_by='a.timestamp DESC, i.name, a.idx', limit=20,
+        )
+    ]
 
     return jsonify({
         'total_images': total_images,
@@ -531,87 +634,77 @@ def dashboard_data():
     })
 
 
-def _build_annotation_rows(from_date='', to_date='', species_filter=None):
-    """Build flat list of annotation rows for table/gallery views."""
-    images = get_image_files()
-    rows = []
-    for img_name in images:
-        camera_date, camera_hour = _parse_camera_datetime(img_name)
-        if from_date and camera_date and camera_date < from_date:
-            continue
-        if to_date and camera_date and camera_date > to_date:
-            continue
-
-        ann_path = get_annotation_path(img_name)
-        if not ann_path.exists():
-            continue
-        with open(ann_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if data.get('is_empty', False):
-            continue
-        anns = data.get('annotations', [])
-        if not anns:
-            continue
-
-        for ann in anns:
-            sp = ann.get('species', 'muu')
-            if species_filter and sp not in species_filter:
-                continue
-            rows.append({
-                'image': img_name,
-                'species': sp,
-                'species_label': SPECIES_LABELS.get(sp, sp),
-                'camera_date': camera_date,
-                'camera_hour': camera_hour,
-                'confidence': ann.get('species_confidence') or ann.get('md_confidence'),
-                'from_prediction': ann.get('from_prediction', False),
-                'original_species': ann.get('original_species', ''),
-            })
-    return rows
+def _encode_cursor(sort, page, after):
+    raw = json.dumps({'sort': sort, 'page': page, 'after': after}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
 
 
-@app.route('/api/dashboard/table')
-def dashboard_table():
-    """Paginated table data for observations."""
+def _decode_cursor(cursor, sort):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if data['sort'] != sort:
+            raise ValueError('sort mismatch')
+        return int(data['page']), data['after']
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f'invalid cursor: {e}')
+
+
+def _annotation_page(per_page_default, per_page_max, sort_fields):
+    """
+    Read one sorted page of annotation rows for the table/gallery views.
+
+    Supports both `page` (offset) and `cursor` (keyset, constant cost per page)
+    navigation; `next_cursor` in the response continues from the last row.
+    """
     from_date = request.args.get('from_date', '')
     to_date = request.args.get('to_date', '')
     sp_param = request.args.get('species', '')
     species_filter = {s.strip() for s in sp_param.split(',') if s.strip()} if sp_param else None
     sort = request.args.get('sort', 'date_desc')
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
-    per_page = min(per_page, 200)
+    per_page = request.args.get('per_page', per_page_default, type=int)
+    per_page = max(1, min(per_page, per_page_max))
+    cursor = request.args.get('cursor', '')
 
-    rows = _build_annotation_rows(from_date, to_date, species_filter)
-
-    # Sort
     sort_field, sort_dir = (sort.rsplit('_', 1) + ['desc'])[:2]
-    reverse = sort_dir == 'desc'
-    if sort_field == 'date':
-        rows.sort(key=lambda r: (r['camera_date'] or '', r['camera_hour'] or 0), reverse=reverse)
-    elif sort_field == 'species':
-        rows.sort(key=lambda r: r['species'], reverse=reverse)
-    elif sort_field == 'confidence':
-        rows.sort(key=lambda r: r['confidence'] or 0, reverse=reverse)
-    elif sort_field == 'hour':
-        rows.sort(key=lambda r: r['camera_hour'] or 0, reverse=reverse)
-    elif sort_field == 'source':
-        rows.sort(key=lambda r: r['from_prediction'], reverse=reverse)
+    if sort_field in sort_fields:
+        descending = sort_dir == 'desc'
     else:
-        rows.sort(key=lambda r: (r['camera_date'] or '', r['camera_hour'] or 0), reverse=True)
+        sort_field, descending = 'date', True
 
-    total = len(rows)
+    index = get_index()
+    total = int(index.annotation_total(from_date, to_date, species_filter))
     total_pages = max(1, (total + per_page - 1) // per_page)
+    after = None
+    if cursor:
+        page, after = _decode_cursor(cursor, sort)
     page = max(1, min(page, total_pages))
-    start = (page - 1) * per_page
-    page_rows = rows[start:start + per_page]
 
-    return jsonify({
-        'rows': page_rows,
+    rows, next_after = index.annotation_page(
+        from_date, to_date, species_filter,
+        sort_key=sort_field, descending=descending, limit=per_page,
+        after=after, offset=(page - 1) * per_page,
+    )
+    for row in rows:
+        row['species_label'] = SPECIES_LABELS.get(row['species'], row['species'])
+        del row['timestamp']
+    return {
+        'rows': rows,
         'total': total,
         'page': page,
         'total_pages': total_pages,
-    })
+        'next_cursor': _encode_cursor(sort, page + 1, next_after) if next_after else None,
+    }
+
+
+@app.route('/api/dashboard/table')
+def dashboard_table():
+    """Paginated table data for observations."""
+    try:
+        result = _annotation_page(50, 200, ('date', 'species', 'confidence', 'hour', 'source'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
 
 
 @app.route('/api/dashboard/day')
@@ -621,46 +714,30 @@ def dashboard_day():
     if not date:
         return jsonify({'error': 'date parameter required'}), 400
 
-    images = get_image_files()
     total_annotations = 0
     species_counts = {}
     hourly_breakdown = {}
     day_images = []
 
-    for img_name in images:
-        camera_date, camera_hour = _parse_camera_datetime(img_name)
-        if camera_date != date:
-            continue
-
-        ann_path = get_annotation_path(img_name)
-        if not ann_path.exists():
-            continue
-        with open(ann_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if data.get('is_empty', False):
-            continue
-        anns = data.get('annotations', [])
-        if not anns:
-            continue
-
-        for ann in anns:
-            sp = ann.get('species', 'muu')
-            total_annotations += 1
-            species_counts[sp] = species_counts.get(sp, 0) + 1
-
-            if camera_hour is not None:
-                h_key = str(camera_hour)
-                if h_key not in hourly_breakdown:
-                    hourly_breakdown[h_key] = {}
-                hourly_breakdown[h_key][sp] = hourly_breakdown[h_key].get(sp, 0) + 1
-
-            day_images.append({
-                'image': img_name,
-                'species': sp,
-                'species_label': SPECIES_LABELS.get(sp, sp),
-                'camera_hour': camera_hour,
-                'confidence': ann.get('species_confidence') or ann.get('md_confidence'),
-            })
+    for row in get_index().day_rows(date):
+        sp = row['species']
+        camera_hour = row['camera_hour']
+        total_annotations += 1
+        species_counts[sp] = species_counts.get(sp, 0) + 1
+
+        if camera_hour is not None:
+            h_key = str(camera_hour)
+            if h_key not in hourly_breakdown:
+                hourly_breakdown[h_key] = {}
+            hourly_breakdown[h_key][sp] = hourly_breakdown[h_key].get(sp, 0) + 1
+
+        day_images.append({
+            'image': row['image'],
+            'species': sp,
+            'species_label': SPECIES_LABELS.get(sp, sp),
+            'camera_hour': camera_hour,
+            'confidence': row['confidence'],
+        })
 
     unique_images = len({img['image'] for img in day_images})
 
@@ -675,44 +752,39 @@ def dashboard_day():
     })
 
 
-@app.route('/api/gallery')
-def gallery_data():
-    """Paginated gallery data."""
+@app.route('/api/dashboard/events')
+def dashboard_events():
+    """Kuvasarjat (saman kameran peräkkäiset kuvat) tapahtumina, uusin ensin."""
+    from detection.sequences import summarize_events
+
     from_date = request.args.get('from_date', '')
     to_date = request.args.get('to_date', '')
     sp_param = request.args.get('species', '')
-    species_filter = {s.strip() for s in sp_param.split(',') if s.strip()} if sp_param else None
-    sort = request.args.get('sort', 'date_desc')
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 24, type=int)
-    per_page = min(per_page, 100)
-
-    rows = _build_annotation_rows(from_date, to_date, species_filter)
-
-    # Sort
-    sort_field, sort_dir = (sort.rsplit('_', 1) + ['desc'])[:2]
-    reverse = sort_dir == 'desc'
-    if sort_field == 'date':
-        rows.sort(key=lambda r: (r['camera_date'] or '', r['camera_hour'] or 0), reverse=reverse)
-    elif sort_field == 'confidence':
-        rows.sort(key=lambda r: r['confidence'] or 0, reverse=reverse)
-    else:
-        rows.sort(key=lambda r: (r['camera_date'] or '', r['camera_hour'] or 0), reverse=True)
-
-    total = len(rows)
-    total_pages = max(1, (total + per_page - 1) // per_page)
-    page = max(1, min(page, total_pages))
-    start = (page - 1) * per_page
-    page_rows = rows[start:start + per_page]
+    species_filter = {s.strip() for s in sp_param.split(',') if s.strip()}
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
 
+    events = summarize_events(get_index().event_frames(from_date, to_date))
+    if species_filter:
+        events = [e for e in events if species_filter & set(e['species'])]
     return jsonify({
-        'images': page_rows,
-        'total': total,
-        'page': page,
-        'total_pages': total_pages,
+        'events': events[:limit],
+        'total': len(events),
+        'frames': sum(e['frames'] for e in events),
+        'species_labels': SPECIES_LABELS,
     })
 
 
+@app.route('/api/gallery')
+def gallery_data():
+    """Paginated gallery data."""
+    try:
+        result = _annotation_page(24, 100, ('date', 'confidence'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    result['images'] = result.pop('rows')
+    return jsonify(result)
+
+
 @app.route('/api/ai/brief')
 def ai_brief():
     """Token-efficient plain text summary for AI agents."""
@@ -744,13 +816,13 @@ def ai_brief():
     start_str = range_start.strftime('%Y-%m-%d')
     end_str = range_end.strftime('%Y-%m-%d')
 
-    images = get_image_files()
-
     _FI_WEEKDAYS = ['ma', 'ti', 'ke', 'to', 'pe', 'la', 'su']
 
-    total_images = 0
-    empty_count = 0
-    unannotated_count = 0
+    index = get_index()
+    counts = index.image_counts(start_str, end_str, to_exclusive=True)
+    total_images = counts['total']
+    empty_count = counts['empty']
+    unannotated_count = counts['unannotated']
     total_detections = 0
     species_counts = {}
     hourly_totals = {}   # hour -> count
@@ -758,58 +830,32 @@ def ai_brief():
     daily_species = {}   # date_str -> {label: count}
     ai_accuracy = {}     # species -> {correct, total}
 
-    for img_name in images:
-        camera_date, camera_hour = _parse_camera_datetime(img_name)
-
-        # Date filtering
-        if camera_date and camera_date < start_str:
-            continue
-        if camera_date and camera_date >= end_str:
-            continue
-
-        total_images += 1
-
-        ann_path = get_annotation_path(img_name)
-        if not ann_path.exists():
-            unannotated_count += 1
-            continue
-
-        with open(ann_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        if data.get('is_empty', False):
-            empty_count += 1
-            continue
-
-        anns = data.get('annotations', [])
-        if not anns:
-            unannotated_count += 1
-            continue
-
-        for ann in anns:
-            sp = ann.get('species', 'muu')
-            if species_filter and sp not in species_filter:
-                continue
-
-            total_detections += 1
-            label = SPECIES_LABELS.get(sp, sp).lower()
-            species_counts[label] = species_counts.get(label, 0) + 1
-
-            if camera_hour is not None:
-                hourly_totals[camera_hour] = hourly_totals.get(camera_hour, 0) + 1
-
-            if camera_date:
-                daily_counts[camera_date] = daily_counts.get(camera_date, 0) + 1
-                if camera_date not in daily_species:
-                    daily_species[camera_date] = {}
-                daily_species[camera_date][label] = daily_species[camera_date].get(label, 0) + 1
-
-            if ann.get('from_prediction'):
-                if sp not in ai_accuracy:
-                    ai_accuracy[sp] = {'correct': 0, 'total': 0}
-                ai_accuracy[sp]['total'] += 1
-                if ann.get('original_species', '') == sp:
-                    ai_accuracy[sp]['correct'] += 1
+    cells = index.activity_cells(start_str, end_str, species_filter, to_exclusive=True)
+    for cell in cells:
+        sp = cell['species']
+        n = cell['n']
+        camera_date = cell['camera_date']
+        camera_hour = cell['camera_hour']
+
+        total_detections += n
+        label = SPECIES_LABELS.get(sp, sp).lower()
+        species_counts[label] = species_counts.get(label, 0) + n
+
+        if camera_hour is not None:
+            hourly_totals[camera_hour] = hourly_totals.get(camera_hour, 0) + n
+
+        if camera_date:
+            daily_counts[camera_date] = daily_counts.get(camera_date, 0) + n
+            if camera_date not in daily_species:
+                daily_species[camera_date] = {}
+            daily_species[camera_date][label] = daily_species[camera_date].get(label, 0) + n
+
+        from_prediction = int(cell['from_prediction'])
+        if from_prediction:
+            if sp not in ai_accuracy:
+                ai_accuracy[sp] = {'correct': 0, 'total': 0}
+            ai_accuracy[sp]['total'] += from_prediction
+            ai_accuracy[sp]['correct'] += int(cell['correct'])
 
     # Build response
     if total_images == 0 or (total_detections == 0 and empty_count == 0 and unannotated_count == 0):
@@ -901,7 +947,13 @@ def get_thumbnail(filename):
 
 @app.route('/api/status')
 def get_status():
-    """Palvelun tila."""
+    """
+    Palvelun tila (Dockerin HEALTHCHECK).
+
+    Kevyt: ei rakenna indeksiä, käynnistä vahtia tai työjonoa eikä ota
+    yhteyttä tunnistuspalveluun. Vahdin ja töiden tila raportoidaan vain,
+    jos ne on jo alustettu; tarkemmat tiedot: /api/status/detail.
+    """
     model_path = DATA_DIR / 'models' / 'species_latest.pt'
     speciesnet_available = False
     try:
@@ -909,6 +961,8 @@ def get_status():
         speciesnet_available = True
     except ImportError:
         pass
+    from ingestion.scheduler import read_status as read_scheduler_status
+    watcher, jobs = _watcher, _job_queue
     return jsonify({
         'status': 'ok',
         'image_dir': str(IMAGE_DIR),
@@ -917,6 +971,21 @@ def get_status():
         'has_species_model': model_path.exists() or speciesnet_available,
         'has_speciesnet': speciesnet_available,
         'species_model_path': str(model_path) if model_path.exists() else None,
+        'json_cache': json_cache.stats(),
+        'watcher': watcher.status() if watcher is not None else None,
+        'jobs': {kind: jobs.active(kind) for kind in JOB_HANDLERS} if jobs is not None else None,
+        'scheduler': read_scheduler_status(DATA_DIR),
+    })
+
+
+@app.route('/api/status/detail')
+def get_status_detail():
+    """Vahdin, taustatöiden ja tunnistuspalvelun tila; alustaa vahdin ja työjonon."""
+    from detection.worker import worker_status
+    return jsonify({
+        'watcher': get_watcher().status(),
+        'detector_worker': worker_status(timeout=0.5),
+        'jobs': {kind: get_jobs().active(kind) for kind in JOB_HANDLERS},
     })
 
 
@@ -927,7 +996,11 @@ if __name__ == '__main__':
     print(f"Annotation directory: {ANNOTATION_DIR}")
     print(f"Starting server at http://localhost:5000")
 
-    image_count = len(get_image_files())
-    print(f"Found {image_count} images")
+    # Debug-tilan uudelleenlataaja ajaa moduulin kahdesti; vahti vain palvelinprosessiin
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_watcher().start()
+        get_jobs()
+        image_count = len(get_image_files())
+        print(f"Found {image_count} images")
 
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -7,33 +7,25 @@ import json
 import os
 from pathlib import Path
 
+from storage.metadata_index import index_file, open_metadata_index
+
 DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
 IMAGE_DIR = DATA_DIR / 'images' / 'incoming'
 PREDICTION_DIR = DATA_DIR / 'predictions'
 MODEL_DIR = DATA_DIR / 'models'
+# Esisuodattimen kamerakohtaiset taustamallit
+EMPTY_FILTER_DIR = DATA_DIR / 'empty_filter'
 
 MEGADETECTOR_MODEL = os.environ.get('MEGADETECTOR_MODEL', 'MDV5A')
 SPECIES_MODEL = str(MODEL_DIR / 'species_latest.pt')
+# MegaDetector-erän koko (1 = kuva kerrallaan, purku silti taustasäikeessä)
+DETECT_BATCH_SIZE = int(os.environ.get('DETECT_BATCH_SIZE', 4))
 
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
 
 
-def detect_new_images(force=False):
-    """
-    Aja tunnistus kuville joilla ei vielä ole ennusteita.
-
-    Args:
-        force: Jos True, aja uudelleen myös jo ennustetuille kuville
-
-    Returns:
-        dict: Tilastot
-    """
-    PREDICTION_DIR.mkdir(parents=True, exist_ok=True)
-
-    if not IMAGE_DIR.exists():
-        return {'processed': 0, 'error': 'Image directory not found'}
-
-    # Etsi kuvat joilta puuttuu ennuste
+def find_images_to_process(force=False):
+    """Kuvat, joilta puuttuu ennuste (force: kaikki kuvat)."""
     images_to_process = []
     for f in sorted(IMAGE_DIR.iterdir()):
         if f.suffix.lower() not in IMAGE_EXTENSIONS:
@@ -42,35 +34,66 @@ def detect_new_images(force=False):
         if not force and pred_path.exists():
             continue
         images_to_process.append(f)
+    return images_to_process
 
-    if not images_to_process:
-        return {'processed': 0, 'message': 'Ei uusia kuvia tunnistettavaksi'}
 
-    # Lataa detector
+def load_detector():
+    """Lataa WildlifeDetector (MegaDetector, SpeciesNet ja mahdollinen YOLO-lajimalli)."""
     from detection.detector import WildlifeDetector
 
     species_model = SPECIES_MODEL if Path(SPECIES_MODEL).exists() else None
     megadetector = MEGADETECTOR_MODEL
 
-    detector = WildlifeDetector(
+    return WildlifeDetector(
         megadetector_model=megadetector,
         species_model_path=species_model,
     )
 
+
+def run_detection(detector, images_to_process, batch_size=None, sequences=None):
+    """
+    Tunnista annetut kuvat ladatulla detectorilla ja tallenna ennusteet.
+
+    Args:
+        sequences: Ryhmittele kuvasarjat ja käytä lajit uudelleen sarjan
+            sisällä (oletus: SEQUENCES_ENABLED)
+
+    Returns:
+        dict: Tilastot
+    """
+    PREDICTION_DIR.mkdir(parents=True, exist_ok=True)
     results = {
         'processed': 0,
         'detections': 0,
         'errors': [],
     }
-
-    for img_path in images_to_process:
+    index = open_metadata_index(DATA_DIR)
+    detector.timings.reset()
+
+    from detection.empty_filter import EMPTY_FILTER_ENABLED, EmptyFrameFilter
+    if EMPTY_FILTER_ENABLED and detector.empty_filter is None:
+        detector.empty_filter = EmptyFrameFilter(EMPTY_FILTER_DIR)
+    if detector.empty_filter is not None:
+        detector.empty_filter.reset_stats()
+
+    from detection.sequences import SEQUENCES_ENABLED, SequenceTracker
+    tracker = None
+    if SEQUENCES_ENABLED if sequences is None else sequences:
+        tracker = SequenceTracker([Path(p).name for p in images_to_process])
+        images_to_process = tracker.ordered(images_to_process)
+
+    batches = detector.detect_many(images_to_process, batch_size=batch_size or DETECT_BATCH_SIZE,
+                                   tracker=tracker)
+    for img_path, result, error in batches:
+        if error is not None:
+            results['errors'].append(f"{img_path.name}: {error}")
+            continue
         try:
-            result = detector.detect(str(img_path))
-
             # Tallenna ennuste
             pred_path = PREDICTION_DIR / f"{img_path.stem}.json"
             with open(pred_path, 'w', encoding='utf-8') as f:
                 json.dump(result, f, indent=2, ensure_ascii=False)
+            index_file(index, 'index_prediction_file', pred_path, result)
 
             results['processed'] += 1
             results['detections'] += len(result.get('predictions', []))
@@ -78,15 +101,55 @@ def detect_new_images(force=False):
         except Exception as e:
             results['errors'].append(f"{img_path.name}: {e}")
 
+    # Vaiheittainen aikajakauma (decode, megadetector, speciesnet, yolo_species)
+    results['timings'] = detector.stage_timings()
+    if detector.empty_filter is not None:
+        # Pikapolun ohittamat (fast_path) ja MegaDetectorilla tarkistetut (verified) kuvat
+        detector.empty_filter.save()
+        results['empty_filter'] = dict(detector.empty_filter.stats)
+    if tracker is not None:
+        # Lajimallin ohittamat kohteet (reused) ja kokonaan kopioidut kuvat (copied)
+        results['sequences'] = tracker.stats
     return results
 
 
+def detect_new_images(force=False, batch_size=None):
+    """
+    Aja tunnistus kuville joilla ei vielä ole ennusteita.
+
+    Lataa mallit tässä prosessissa; pysyvä tunnistuspalvelu
+    (detection.worker) käyttää samaa polkua valmiiksi ladatuilla malleilla.
+
+    Args:
+        force: Jos True, aja uudelleen myös jo ennustetuille kuville
+        batch_size: MegaDetector-erän koko (oletus: DETECT_BATCH_SIZE)
+
+    Returns:
+        dict: Tilastot
+    """
+    PREDICTION_DIR.mkdir(parents=True, exist_ok=True)
+
+    if not IMAGE_DIR.exists():
+        return {'processed': 0, 'error': 'Image directory not found'}
+
+    # Etsi kuvat joilta puuttuu ennuste
+    images_to_process = find_images_to_process(force)
+
+    if not images_to_process:
+        return {'processed': 0, 'message': 'Ei uusia kuvia tunnistettavaksi'}
+
+    detector = load_detector()
+    return run_detection(detector, images_to_process, batch_size)
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='Tunnista eläimet uusista kuvista')
     parser.add_argument('--force', action='store_true', help='Aja uudelleen kaikille kuville')
+    parser.add_argument('--batch-size', type=int, default=DETECT_BATCH_SIZE,
+                        help='MegaDetector-erän koko')
     args = parser.parse_args()
 
     print("Ajetaan eläintunnistus...")
-    result = detect_new_images(force=args.force)
+    result = detect_new_images(force=args.force, batch_size=args.batch_size)
     print(json.dumps(result, indent=2, ensure_ascii=False))
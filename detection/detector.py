@@ -8,8 +8,12 @@ Kaksivaihemalli:
 """
 import json
 import os
+import queue
+import threading
 from pathlib import Path
 
+from detection.frame import Frame, StageTimer
+
 # MegaDetector-kategoriat
 MD_CATEGORIES = {
     '1': 'animal',
@@ -53,6 +57,11 @@ SPECIESNET_TO_FINNISH = {
 }
 
 
+SPECIESNET_BATCH_SIZE = int(os.environ.get('SPECIESNET_BATCH_SIZE', 16))
+# Käytä INT8-kvantisoitua YOLO-lajimallia (training.quantize), jos se on ajan tasalla
+SPECIES_INT8 = os.environ.get('SPECIES_INT8', '0') == '1'
+
+
 class WildlifeDetector:
     """
     Kaksivaihemalli riistakamerakuvien tunnistukseen.
@@ -63,11 +72,24 @@ class WildlifeDetector:
     """
 
     def __init__(self, megadetector_model=None, species_model_path=None,
-                 confidence_threshold=0.2, use_speciesnet=True):
+                 confidence_threshold=0.2, use_speciesnet=True,
+                 speciesnet_batch_size=SPECIESNET_BATCH_SIZE, backend=None,
+                 species_int8=SPECIES_INT8):
+        from detection.onnx_backend import INFERENCE_BACKEND
+
         self.confidence_threshold = confidence_threshold
+        # Päättelytausta MegaDetectorille ja YOLO-lajimallille: 'torch' tai 'onnx'
+        self.backend = (backend or INFERENCE_BACKEND).lower()
+        self.species_int8 = species_int8
+        # Montako rajausta SpeciesNet ajaa kerralla (1 = rajaus kerrallaan)
+        self.speciesnet_batch_size = max(1, speciesnet_batch_size)
         self.md_model = None
         self.species_model = None
         self.speciesnet_classifier = None
+        # Tyhjien kuvien esisuodatin (detection.empty_filter), valinnainen
+        self.empty_filter = None
+        # Vaiheiden ajat: decode, empty_filter, megadetector, speciesnet, yolo_species
+        self.timings = StageTimer()
 
         # Lataa MegaDetector
         if megadetector_model:
@@ -82,7 +104,14 @@ class WildlifeDetector:
             self._load_species_model(species_model_path)
 
     def _load_megadetector(self, model_path):
-        """Lataa MegaDetector-malli (v10.0.17+ API)."""
+        """Lataa MegaDetector-malli (v10.0.17+ API tai ONNX Runtime)."""
+        if self.backend == 'onnx':
+            try:
+                from detection.onnx_backend import load_megadetector
+                self.md_model = load_megadetector(model_path)
+                return
+            except Exception as e:
+                print(f"MegaDetectorin ONNX-lataus epäonnistui, käytetään PyTorchia: {e}")
         try:
             from megadetector.detection.run_detector import load_detector
             self.md_model = load_detector(model_path, force_cpu=True)
@@ -113,12 +142,38 @@ class WildlifeDetector:
             self.speciesnet_classifier = None
 
     def _load_species_model(self, model_path):
-        """Lataa YOLO-lajimalli (vaihtoehtoinen)."""
+        """
+        Lataa YOLO-lajimalli (vaihtoehtoinen).
+
+        Returns:
+            bool: Latautuiko malli; epäonnistuessa edellinen malli jää käyttöön
+        """
+        if self.species_int8:
+            from training.quantize import is_current, quantized_path
+            int8_path = quantized_path(model_path)
+            if is_current(model_path, int8_path):
+                try:
+                    from detection.onnx_backend import OnnxSpeciesModel
+                    self.species_model = OnnxSpeciesModel(int8_path)
+                    return True
+                except Exception as e:
+                    print(f"INT8-lajimallin lataus epäonnistui: {e}")
+            else:
+                print(f"INT8-lajimalli puuttuu tai on vanhentunut: {int8_path}")
+        if self.backend == 'onnx':
+            try:
+                from detection.onnx_backend import load_species_model
+                self.species_model = load_species_model(model_path)
+                return True
+            except Exception as e:
+                print(f"Lajimallin ONNX-lataus epäonnistui, käytetään PyTorchia: {e}")
         try:
             from ultralytics import YOLO
             self.species_model = YOLO(model_path)
+            return True
         except Exception as e:
             print(f"YOLO-lajimallin lataus epäonnistui: {e}")
+            return False
 
     def detect(self, image_path, confidence_threshold=None):
         """
@@ -137,14 +192,15 @@ class WildlifeDetector:
                     'md_confidence': float,
                     'species': str|None,
                     'species_confidence': float|None,
-                }]
+                }],
+                # Vain, jos esisuodatin ohitti kuvan tai se oli tarkistusotoksessa
+                'empty_filter': {'fast_path': bool, 'empty_confidence': float, ...},
             }
         """
         if confidence_threshold is None:
             confidence_threshold = self.confidence_threshold
 
         image_path = Path(image_path)
-        predictions = []
 
         if self.md_model is None:
             return {
@@ -153,76 +209,383 @@ class WildlifeDetector:
                 'error': 'MegaDetector not loaded',
             }
 
-        # Vaihe 1: MegaDetector bbox-tunnistus
-        md_results = self._run_megadetector(str(image_path), confidence_threshold)
+        # Kuva puretaan kerran ja sama Frame kulkee kaikkien vaiheiden läpi
+        with self.timings.stage('decode'):
+            frame = Frame.load(image_path)
 
-        from PIL import Image as PILImage
-        with PILImage.open(image_path) as pil_img:
-            img_w, img_h = pil_img.size
-
-        for det in md_results:
-            md_bbox_rel = det['bbox']  # [x, y, w, h] normalisoitu
-            md_conf = det['conf']
-            md_cat = det['category']
-            md_cat_name = MD_CATEGORIES.get(md_cat, 'unknown')
-
-            # Muunna [x, y, w, h] (normalisoitu) → [x1, y1, x2, y2] (pikselit)
-            x1 = int(md_bbox_rel[0] * img_w)
-            y1 = int(md_bbox_rel[1] * img_h)
-            x2 = int((md_bbox_rel[0] + md_bbox_rel[2]) * img_w)
-            y2 = int((md_bbox_rel[1] + md_bbox_rel[3]) * img_h)
-
-            prediction = {
-                'bbox': [x1, y1, x2, y2],
-                'md_category': md_cat_name,
-                'md_confidence': round(md_conf, 4),
-                'species': None,
-                'species_confidence': None,
-            }
+        decisions, prefiltered = self._prefilter([(image_path, frame, None)], {}, None)
+        if prefiltered:
+            return prefiltered[image_path]
 
-            # Ihminen tunnistetaan suoraan MegaDetectorilla
-            if md_cat == '2':
-                prediction['species'] = 'ihminen'
-                prediction['species_confidence'] = round(md_conf, 4)
+        # Vaihe 1: MegaDetector bbox-tunnistus
+        md_results = self._run_megadetector(frame, confidence_threshold)
 
-            # Vaihe 2: Lajitunnistus (SpeciesNet tai YOLO)
-            elif md_cat == '1':
-                species_result = None
+        result = self._build_result(frame, md_results)
+        if image_path in decisions:
+            self.empty_filter.observe(decisions[image_path], result)
+        return result
 
-                # Ensisijainen: SpeciesNet
-                if self.speciesnet_classifier is not None:
-                    species_result = self._classify_with_speciesnet(
-                        image_path, [x1, y1, x2, y2]
-                    )
+    def detect_many(self, image_paths, batch_size=8, confidence_threshold=None, prefetch=2,
+                    tracker=None):
+        """
+        Tunnista eläimet useasta kuvasta erissä.
 
-                # Vaihtoehtoinen: YOLO custom -malli
-                if species_result is None and self.species_model is not None:
-                    species_result = self._classify_species(
-                        image_path, [x1, y1, x2, y2]
-                    )
+        Kuvat puretaan taustasäikeessä valmiiksi seuraavaa erää varten, ja
+        MegaDetector ajetaan koko erälle kerralla, jos asennettu versio sen
+        tukee. Tulos on kuvakohtaisesti sama kuin detect()-metodilla.
 
-                if species_result:
-                    prediction['species'] = species_result['species']
-                    prediction['species_confidence'] = species_result['confidence']
+        Args:
+            image_paths: Kuvien polut
+            batch_size: MegaDetector-erän koko
+            confidence_threshold: Luottamuskynnys (oletus: self.confidence_threshold)
+            prefetch: Montako purettua erää odottaa jonossa
+            tracker: SequenceTracker; sarjan kuvat käyttävät lajin uudelleen
+                (ja edustajakuvatilassa koko ennusteen). Kuvat kannattaa antaa
+                sarjajärjestyksessä (tracker.ordered).
 
-            predictions.append(prediction)
+        Yields:
+            tuple: (kuvan polku, tulos tai None, virheilmoitus tai None)
+        """
+        if confidence_threshold is None:
+            confidence_threshold = self.confidence_threshold
+        image_paths = [Path(p) for p in image_paths]
+        if self.md_model is None:
+            for image_path in image_paths:
+                yield image_path, self.detect(image_path, confidence_threshold), None
+            return
+
+        batches = queue.Queue(maxsize=max(1, prefetch))
+        stop = threading.Event()
+        loader = threading.Thread(
+            target=self._prefetch_batches,
+            args=(image_paths, max(1, batch_size), batches, stop),
+            name='detector-prefetch',
+            daemon=True,
+        )
+        loader.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                # Edustajakuvatila: lähes identtiset sarjan kuvat eivät mene malleille
+                copies = {}
+                if tracker is not None and tracker.representative:
+                    for image_path, frame, error in batch:
+                        if error is None:
+                            rep = tracker.representative_for(
+                                image_path.name, self._thumbnail(frame))
+                            if rep is not None:
+                                copies[image_path] = rep
+
+                # Esisuodatin: selvästi tyhjät kuvat ohittavat MegaDetectorin
+                decisions, prefiltered = self._prefilter(batch, copies, tracker)
+                skip = copies.keys() | prefiltered.keys()
+
+                frames = [frame for image_path, frame, error in batch
+                          if error is None and image_path not in skip]
+                md_iter = iter(self._run_megadetector_batch(frames, confidence_threshold))
+                outcomes = []
+                for image_path, frame, error in batch:
+                    md_results = None
+                    if error is None and image_path not in skip:
+                        md_results = next(md_iter)
+                        if isinstance(md_results, Exception):
+                            error = str(md_results)
+                    outcomes.append((image_path, frame, md_results, error))
+
+                # Lajitunnistus koko erän rajauksille kerralla
+                ok = [o for o in outcomes if o[3] is None and o[0] not in skip]
+                try:
+                    built = self._build_results([o[1] for o in ok], [o[2] for o in ok], tracker)
+                except Exception:
+                    built = []
+                    for o in ok:
+                        try:
+                            built.append(self._build_result(o[1], o[2], tracker))
+                        except Exception as e:
+                            built.append(e)
+                built_by_path = {o[0]: r for o, r in zip(ok, built)}
+                for path, result in built_by_path.items():
+                    if path in decisions and not isinstance(result, Exception):
+                        self.empty_filter.observe(decisions[path], result)
+                built_by_path.update(prefiltered)
+                if tracker is not None and tracker.representative:
+                    for path, result in built_by_path.items():
+                        if not isinstance(result, Exception):
+                            tracker.results[path.name] = result
+
+                for image_path, frame, _, error in outcomes:
+                    if error is not None:
+                        yield image_path, None, error
+                        continue
+                    if image_path in copies:
+                        result = self._copy_representative(
+                            frame, copies[image_path], tracker, confidence_threshold)
+                    else:
+                        result = built_by_path[image_path]
+                    if isinstance(result, Exception):
+                        yield image_path, None, str(result)
+                    else:
+                        yield image_path, result, None
+        finally:
+            stop.set()
+            # Vapauta taustasäie, jos se odottaa täyttä jonoa
+            while loader.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def _prefetch_batches(self, image_paths, batch_size, batches, stop):
+        """Pura kuvat taustalla ja syötä ne jonoon erinä (None = loppu)."""
+        batch = []
+        for image_path in image_paths:
+            if stop.is_set():
+                break
+            try:
+                with self.timings.stage('decode'):
+                    frame = Frame.load(image_path)
+                batch.append((image_path, frame, None))
+            except Exception as e:
+                batch.append((image_path, None, str(e)))
+            if len(batch) >= batch_size:
+                batches.put(batch)
+                batch = []
+        if batch and not stop.is_set():
+            batches.put(batch)
+        batches.put(None)
+
+    def _prefilter(self, batch, copies, tracker):
+        """
+        Aja tyhjien kuvien esisuodatin erälle.
+
+        Returns:
+            tuple: (päätökset MegaDetectorille meneville kuville,
+            {polku: pikapolun ennuste})
+        """
+        decisions, prefiltered = {}, {}
+        if self.empty_filter is None:
+            return decisions, prefiltered
+        for image_path, frame, error in batch:
+            if error is not None or image_path in copies:
+                continue
+            try:
+                with self.timings.stage('empty_filter'):
+                    decision = self.empty_filter.check(frame)
+            except Exception as e:
+                print(f"Esisuodatin epäonnistui ({image_path.name}): {e}")
+                continue
+            if decision['fast_path']:
+                result = self.empty_filter.fast_result(frame, decision)
+                if tracker is not None:
+                    result['sequence'] = tracker.sequence_info(image_path.name)
+                prefiltered[image_path] = result
+            else:
+                decisions[image_path] = decision
+        return decisions, prefiltered
 
+    @staticmethod
+    def _thumbnail(frame):
+        from detection.sequences import frame_thumbnail
+        try:
+            return frame_thumbnail(frame)
+        except Exception:
+            return None
+
+    def _copy_representative(self, frame, rep_name, tracker, confidence_threshold):
+        """Edustajakuvan ennuste tälle kuvalle (tunnistetaan, jos edustaja epäonnistui)."""
+        rep = tracker.results.get(rep_name)
+        if rep is None:
+            try:
+                md_results = self._run_megadetector(frame, confidence_threshold)
+                return self._build_result(frame, md_results, tracker)
+            except Exception as e:
+                return e
         return {
-            'image': image_path.name,
-            'predictions': predictions,
+            'image': frame.path.name,
+            'predictions': [dict(p) for p in rep['predictions']],
+            'sequence': tracker.sequence_info(frame.path.name),
+            'copied_from': rep_name,
         }
 
-    def _run_megadetector(self, image_path, confidence_threshold):
+    def _build_result(self, frame, md_results, tracker=None):
+        """Muunna MegaDetector-tulokset ja aja lajitunnistus (ennuste-JSON)."""
+        return self._build_results([frame], [md_results], tracker)[0]
+
+    def _build_results(self, frames, md_results_list, tracker=None):
+        """
+        Rakenna ennuste-JSONit usealle kuvalle.
+
+        Kaikkien kuvien eläinrajaukset kerätään ensin yhteen, jotta
+        lajimalli voi ajaa ne erissä. Sarjassa (tracker) kohde, joka osuu
+        aiemmin luokiteltuun bboxiin, saa lajin siltä ilman lajimallia.
+        Jos rakennus epäonnistuu, erän ankkurit perutaan, jotta kuvakohtainen
+        uusintayritys ei käytä luokittelemattomia ennusteita.
+        """
+        state = tracker.checkpoint() if tracker is not None else None
+        try:
+            return self._build_results_tracked(frames, md_results_list, tracker)
+        except Exception:
+            if state is not None:
+                tracker.rollback(state)
+            raise
+
+    def _build_results_tracked(self, frames, md_results_list, tracker):
+        """_build_results ilman ankkurien perumista virhetilanteessa."""
+        results = []
+        animal_jobs = []   # (ennuste, frame, bbox)
+        reused = []        # (ennuste, lähde-ennuste, lähdekuva)
+        for frame, md_results in zip(frames, md_results_list):
+            img_w, img_h = frame.size
+            predictions = []
+            for det in md_results:
+                md_bbox_rel = det['bbox']  # [x, y, w, h] normalisoitu
+                md_conf = det['conf']
+                md_cat = det['category']
+                md_cat_name = MD_CATEGORIES.get(md_cat, 'unknown')
+
+                # Muunna [x, y, w, h] (normalisoitu) → [x1, y1, x2, y2] (pikselit)
+                x1 = int(md_bbox_rel[0] * img_w)
+                y1 = int(md_bbox_rel[1] * img_h)
+                x2 = int((md_bbox_rel[0] + md_bbox_rel[2]) * img_w)
+                y2 = int((md_bbox_rel[1] + md_bbox_rel[3]) * img_h)
+
+                prediction = {
+                    'bbox': [x1, y1, x2, y2],
+                    'md_category': md_cat_name,
+                    'md_confidence': round(md_conf, 4),
+                    'species': None,
+                    'species_confidence': None,
+                }
+
+                # Ihminen tunnistetaan suoraan MegaDetectorilla
+                if md_cat == '2':
+                    prediction['species'] = 'ihminen'
+                    prediction['species_confidence'] = round(md_conf, 4)
+
+                # Vaihe 2: Lajitunnistus (SpeciesNet tai YOLO)
+                elif md_cat == '1':
+                    match = None
+                    if tracker is not None:
+                        match = tracker.match_species(frame.path.name, [x1, y1, x2, y2], prediction)
+                    if match is not None:
+                        reused.append((prediction, *match))
+                    else:
+                        animal_jobs.append((prediction, frame, [x1, y1, x2, y2]))
+
+                predictions.append(prediction)
+
+            result = {
+                'image': frame.path.name,
+                'predictions': predictions,
+            }
+            if tracker is not None:
+                result['sequence'] = tracker.sequence_info(frame.path.name)
+            results.append(result)
+
+        species_results = self._classify_crops([(f, bbox) for _, f, bbox in animal_jobs])
+        for (prediction, _, _), species_result in zip(animal_jobs, species_results):
+            if species_result:
+                prediction['species'] = species_result['species']
+                prediction['species_confidence'] = species_result['confidence']
+        # Lähde on luokiteltu samassa tai aiemmassa erässä
+        for prediction, source, source_image in reused:
+            prediction['species'] = source['species']
+            prediction['species_confidence'] = source['species_confidence']
+            prediction['species_reused_from'] = source_image
+        return results
+
+    def _classify_crops(self, jobs):
+        """
+        Lajitunnistus rajauksille [(frame, bbox)].
+
+        SpeciesNet ajetaan erissä, jos asennettu versio tukee sitä
+        (batch_predict); muuten rajaus kerrallaan. YOLO-lajimalli on
+        varasuunnitelma rajauksille, joille SpeciesNet ei antanut tulosta.
+        """
+        species_results = [None] * len(jobs)
+
+        # Ensisijainen: SpeciesNet
+        if self.speciesnet_classifier is not None and jobs:
+            batched = (
+                self.speciesnet_batch_size > 1
+                and hasattr(self.speciesnet_classifier, 'batch_predict')
+            )
+            if batched:
+                for start in range(0, len(jobs), self.speciesnet_batch_size):
+                    chunk = jobs[start:start + self.speciesnet_batch_size]
+                    species_results[start:start + len(chunk)] = (
+                        self._classify_with_speciesnet_batch(chunk)
+                    )
+            else:
+                for i, (frame, bbox) in enumerate(jobs):
+                    with self.timings.stage('speciesnet'):
+                        species_results[i] = self._classify_with_speciesnet(frame, bbox)
+
+        # Vaihtoehtoinen: YOLO custom -malli
+        if self.species_model is not None:
+            for i, (frame, bbox) in enumerate(jobs):
+                if species_results[i] is None:
+                    with self.timings.stage('yolo_species'):
+                        species_results[i] = self._classify_species(frame, bbox)
+
+        return species_results
+
+    def stage_timings(self):
+        """Vaiheiden kumulatiiviset ajat edellisen nollauksen jälkeen."""
+        return self.timings.summary()
+
+    def _run_megadetector(self, frame, confidence_threshold):
         """Aja MegaDetector-tunnistus (v10.0.17+ API)."""
-        from PIL import Image as PILImage
-        import numpy as np
+        with self.timings.stage('megadetector'):
+            result = self.md_model.generate_detections_one_image(
+                frame.pixels,
+                image_id=str(frame.path),
+                detection_threshold=confidence_threshold,
+            )
+        return self._md_detections(result)
+
+    def _run_megadetector_batch(self, frames, confidence_threshold):
+        """
+        Aja MegaDetector erälle purettuja kuvia.
 
-        pil_img = PILImage.open(image_path)
-        result = self.md_model.generate_detections_one_image(
-            np.array(pil_img),
-            image_id=image_path,
-            detection_threshold=confidence_threshold,
-        )
+        Käyttää MegaDetectorin eräajoa (generate_detections_one_batch), jos
+        asennettu versio tarjoaa sen; muuten kuvat ajetaan yksitellen.
+
+        Returns:
+            list: kuvakohtaiset tunnistuslistat (tai Exception epäonnistuneelle kuvalle)
+        """
+        if not frames:
+            return []
+        batch_fn = getattr(self.md_model, 'generate_detections_one_batch', None)
+        if batch_fn is not None and len(frames) > 1:
+            try:
+                with self.timings.stage('megadetector'):
+                    results = batch_fn(
+                        [frame.pixels for frame in frames],
+                        image_id=[str(frame.path) for frame in frames],
+                        detection_threshold=confidence_threshold,
+                    )
+                if len(results) == len(frames):
+                    return [
+                        RuntimeError(r['failure']) if r.get('failure') else
+                        self._md_detections(r)
+                        for r in results
+                    ]
+            except Exception as e:
+                print(f"MegaDetector-eräajo epäonnistui, ajetaan kuvat yksitellen: {e}")
+
+        out = []
+        for frame in frames:
+            try:
+                out.append(self._run_megadetector(frame, confidence_threshold))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    @staticmethod
+    def _md_detections(result):
         return [
             {
                 'bbox': d['bbox'],      # [x, y, w, h] normalisoitu
@@ -232,77 +595,122 @@ class WildlifeDetector:
             for d in result.get('detections', [])
         ]
 
-    def _classify_with_speciesnet(self, image_path, bbox):
+    def _speciesnet_input(self, frame, bbox):
+        """Rajaa bbox-alue marginaalilla ja esikäsittele SpeciesNetille."""
+        from PIL import Image as PILImage
+
+        crop = frame.crop_image(bbox)
+        # SpeciesNet odottaa 480x480 crop
+        crop_resized = crop.resize((480, 480), PILImage.Resampling.LANCZOS)
+        return self.speciesnet_classifier.preprocess(crop_resized)
+
+    def _classify_with_speciesnet(self, frame, bbox):
         """
         Tunnista laji SpeciesNet crop classifier -mallilla.
 
         Args:
-            image_path: Kuvan polku
+            frame: Purettu kuva (Frame)
             bbox: [x1, y1, x2, y2] pikseleinä
 
         Returns:
             dict: {'species': str, 'confidence': float} tai None
         """
         try:
-            from PIL import Image as PILImage
-
-            with PILImage.open(image_path) as img:
-                # Rajaa bbox-alue pienellä marginaalilla
-                x1, y1, x2, y2 = bbox
-                margin = int(max(x2 - x1, y2 - y1) * 0.1)
-                x1 = max(0, x1 - margin)
-                y1 = max(0, y1 - margin)
-                x2 = min(img.width, x2 + margin)
-                y2 = min(img.height, y2 + margin)
-
-                crop = img.crop((x1, y1, x2, y2))
-                # SpeciesNet odottaa 480x480 crop
-                crop_resized = crop.resize((480, 480), PILImage.Resampling.LANCZOS)
-
-            # Esikäsittele ja ennusta
-            preprocessed = self.speciesnet_classifier.preprocess(crop_resized)
-            result = self.speciesnet_classifier.predict(str(image_path), preprocessed)
-
-            if result and 'classifications' in result:
-                classes = result['classifications'].get('classes', [])
-                scores = result['classifications'].get('scores', [])
-
-                if classes and scores:
-                    # SpeciesNet luokka: "uuid;class;order;family;genus;species;common"
-                    top_raw = classes[0]
-                    top_score = float(scores[0])
-
-                    finnish_name = self._parse_speciesnet_class(top_raw)
-
-                    # Jos top1 on matala, yritä aggregoida lajitason tuloksia
-                    if finnish_name == 'muu' and len(classes) > 1:
-                        # Yhdistä saman lajin tulokset
-                        species_scores = {}
-                        for cls_str, score in zip(classes[:5], scores[:5]):
-                            name = self._parse_speciesnet_class(cls_str)
-                            species_scores[name] = species_scores.get(name, 0) + float(score)
-                        # Valitse paras (paitsi 'muu')
-                        best = max(
-                            ((n, s) for n, s in species_scores.items() if n != 'muu'),
-                            key=lambda x: x[1],
-                            default=None,
-                        )
-                        if best and best[1] > top_score:
-                            finnish_name = best[0]
-                            top_score = best[1]
-
-                    if top_score >= 0.1:  # Matala kynnys riistakamerakuville
-                        return {
-                            'species': finnish_name,
-                            'confidence': round(top_score, 4),
-                            'speciesnet_class': top_raw,
-                        }
-
+            preprocessed = self._speciesnet_input(frame, bbox)
+            result = self.speciesnet_classifier.predict(str(frame.path), preprocessed)
+            return self._interpret_speciesnet(result)
         except Exception as e:
             print(f"SpeciesNet-tunnistusvirhe: {e}")
 
         return None
 
+    def _classify_with_speciesnet_batch(self, jobs):
+        """
+        Tunnista usean rajauksen laji yhdellä SpeciesNet-eräajolla.
+
+        Esikäsittely (rajaus + 480x480-skaalaus) tehdään säikeissä, sillä
+        PIL vapauttaa GIL:n skaalauksen ajaksi. Jos eräajo epäonnistuu,
+        rajaukset ajetaan yksitellen.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def prepare(job):
+            try:
+                return self._speciesnet_input(*job)
+            except Exception as e:
+                print(f"SpeciesNet-esikäsittelyvirhe: {e}")
+                return None
+
+        with self.timings.stage('speciesnet_preprocess'):
+            if len(jobs) > 1:
+                with ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as pool:
+                    preprocessed = list(pool.map(prepare, jobs))
+            else:
+                preprocessed = [prepare(job) for job in jobs]
+
+        try:
+            with self.timings.stage('speciesnet'):
+                results = self.speciesnet_classifier.batch_predict(
+                    [str(frame.path) for frame, _ in jobs], preprocessed,
+                )
+            if len(results) != len(jobs):
+                raise ValueError(f'{len(results)} tulosta {len(jobs)} rajaukselle')
+        except Exception as e:
+            print(f"SpeciesNet-eräajo epäonnistui, ajetaan rajaukset yksitellen: {e}")
+            out = []
+            for frame, bbox in jobs:
+                with self.timings.stage('speciesnet'):
+                    out.append(self._classify_with_speciesnet(frame, bbox))
+            return out
+
+        out = []
+        for pre, result in zip(preprocessed, results):
+            try:
+                out.append(self._interpret_speciesnet(result) if pre is not None else None)
+            except Exception as e:
+                print(f"SpeciesNet-tunnistusvirhe: {e}")
+                out.append(None)
+        return out
+
+    def _interpret_speciesnet(self, result):
+        """Muunna SpeciesNet-tulos {'species', 'confidence', 'speciesnet_class'}-muotoon."""
+        if result and 'classifications' in result:
+            classes = result['classifications'].get('classes', [])
+            scores = result['classifications'].get('scores', [])
+
+            if classes and scores:
+                # SpeciesNet luokka: "uuid;class;order;family;genus;species;common"
+                top_raw = classes[0]
+                top_score = float(scores[0])
+
+                finnish_name = self._parse_speciesnet_class(top_raw)
+
+                # Jos top1 on matala, yritä aggregoida lajitason tuloksia
+                if finnish_name == 'muu' and len(classes) > 1:
+                    # Yhdistä saman lajin tulokset
+                    species_scores = {}
+                    for cls_str, score in zip(classes[:5], scores[:5]):
+                        name = self._parse_speciesnet_class(cls_str)
+                        species_scores[name] = species_scores.get(name, 0) + float(score)
+                    # Valitse paras (paitsi 'muu')
+                    best = max(
+                        ((n, s) for n, s in species_scores.items() if n != 'muu'),
+                        key=lambda x: x[1],
+                        default=None,
+                    )
+                    if best and best[1] > top_score:
+                        finnish_name = best[0]
+                        top_score = best[1]
+
+                if top_score >= 0.1:  # Matala kynnys riistakamerakuville
+                    return {
+                        'species': finnish_name,
+                        'confidence': round(top_score, 4),
+                        'speciesnet_class': top_raw,
+                    }
+
+        return None
+
     @staticmethod
     def _parse_speciesnet_class(class_str):
         """Muunna SpeciesNet luokkastring suomalaiseksi lajinimeksi.
@@ -372,30 +780,28 @@ class WildlifeDetector:
         # Rodentia → 'muu' (ei erillinen luokka)
         return 'muu'
 
-    def _classify_species(self, image_path, bbox):
+    def _classify_species(self, frame, bbox):
         """
         Tunnista laji rajatusta kuva-alueesta.
 
         Args:
-            image_path: Kuvan polku
+            frame: Purettu kuva (Frame)
             bbox: [x1, y1, x2, y2] pikseleinä
 
         Returns:
             dict: {'species': str, 'confidence': float} tai None
         """
         try:
-            from PIL import Image as PILImage
-
-            with PILImage.open(image_path) as img:
-                # Rajaa bbox-alue pienellä marginaalilla
-                x1, y1, x2, y2 = bbox
-                margin = int(max(x2 - x1, y2 - y1) * 0.1)
-                x1 = max(0, x1 - margin)
-                y1 = max(0, y1 - margin)
-                x2 = min(img.width, x2 + margin)
-                y2 = min(img.height, y2 + margin)
-
-                crop = img.crop((x1, y1, x2, y2))
+            # Rajaa bbox-alue pienellä marginaalilla
+            crop = frame.crop_image(bbox)
+
+            # ONNX Runtime -lajimalli palauttaa suoraan (luokka, luottamus)
+            from detection.onnx_backend import OnnxSpeciesModel
+            if isinstance(self.species_model, OnnxSpeciesModel):
+                top = self.species_model.classify(crop)
+                if top is None:
+                    return None
+                return {'species': CLASS_MAP.get(top[0], 'muu'), 'confidence': round(top[1], 4)}
 
             # Aja lajimalli
             results = self.species_model(crop, verbose=False)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Tyhjien kuvien esisuodatin ennen MegaDetectoria.
+
+Suuri osa kuvista on tuulen tai kasvillisuuden laukaisemia ja päätyy
+tyhjiksi, mutta jokainen maksaa silti koko MegaDetector-ajon. Suodatin
+vertaa pienennettyä harmaasävykuvaa kameran liukuvaan taustamalliin
+(keskiarvo ja keskipoikkeama pikseleittäin): pikseli on muuttunut, kun se
+poikkeaa taustasta enemmän kuin kiinteä raja tai pikselin tavallinen
+vaihtelu (heiluva kasvillisuus). Kuva on "selvästi tyhjä", kun muuttuneita
+pikseleitä on niin vähän, että tyhjyysvarmuus ylittää EMPTY_FILTER_CONFIDENCE.
+
+Tausta päivittyy vain vahvistetusti tyhjillä kuvilla (MegaDetector ei
+löytänyt mitään tai kuva ohitettiin tyhjänä), ja kamera pääsee
+pikapolulle vasta EMPTY_FILTER_WARMUP vahvistetun kuvan jälkeen.
+Osa tyhjiksi merkityistä (EMPTY_FILTER_VERIFY_RATE) ajetaan silti
+MegaDetectorille; jos se löytää kohteen, kameran tausta nollataan.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+from detection.sequences import parse_frame_time
+
+EMPTY_FILTER_ENABLED = os.environ.get('EMPTY_FILTER_ENABLED', '0') == '1'
+# Tyhjyysvarmuus (0-1), jonka ylittävät kuvat ohittavat MegaDetectorin
+EMPTY_FILTER_CONFIDENCE = float(os.environ.get('EMPTY_FILTER_CONFIDENCE', 0.9))
+# Osuus pikapolun kuvista, jotka tarkistetaan silti MegaDetectorilla
+EMPTY_FILTER_VERIFY_RATE = float(os.environ.get('EMPTY_FILTER_VERIFY_RATE', 0.05))
+# Vahvistettuja tyhjiä kuvia ennen kuin kamera pääsee pikapolulle
+EMPTY_FILTER_WARMUP = int(os.environ.get('EMPTY_FILTER_WARMUP', 5))
+
+THUMB_SIZE = (96, 72)
+# Pikselin vähimmäismuutos (0-255) ja kerroin pikselin tavalliseen vaihteluun
+PIXEL_DELTA = 20
+DEVIATION_FACTOR = 3.0
+# Muuttuneiden pikseleiden osuus, jolla varmuus on nolla (2 % kuvasta)
+CHANGE_SCALE = 0.02
+# Taustamallin päivityskerroin
+BACKGROUND_ALPHA = 0.2
+
+
+def thumbnail(frame):
+    """Pienennetty harmaasävykuva, kirkkaustaso poistettuna (valaistusmuutokset)."""
+    from PIL import Image as PILImage
+    import numpy as np
+
+    img = PILImage.fromarray(frame.pixels).convert('L').resize(THUMB_SIZE, PILImage.BILINEAR)
+    pixels = np.asarray(img, dtype=np.float32)
+    return pixels - pixels.mean()
+
+
+def _sampled(name, rate):
+    """Toistettava otos nimen perusteella (sama kuva valitaan aina samoin)."""
+    if rate <= 0:
+        return False
+    digest = hashlib.sha1(name.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32 < rate
+
+
+class EmptyFrameFilter:
+    """
+    Kamerakohtaiset taustamallit ja pikapolun päätökset.
+
+    Tila tallennetaan hakemistoon state_dir (yksi .npz kameraa kohden), jotta
+    tausta säilyy tunnistusajojen välillä.
+    """
+
+    def __init__(self, state_dir=None, confidence=None, verify_rate=None, warmup=None):
+        self.state_dir = Path(state_dir) if state_dir else None
+        self.confidence = EMPTY_FILTER_CONFIDENCE if confidence is None else confidence
+        self.verify_rate = EMPTY_FILTER_VERIFY_RATE if verify_rate is None else verify_rate
+        self.warmup = EMPTY_FILTER_WARMUP if warmup is None else warmup
+        self._backgrounds = {}  # kamera -> [keskiarvo, keskipoikkeama, vahvistetut]
+        self._loaded = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'checked': 0, 'fast_path': 0, 'verified': 0, 'disagreed': 0}
+
+    def _background(self, camera):
+        if camera not in self._loaded:
+            self._loaded.add(camera)
+            path = self._state_path(camera)
+            if path is not None and path.exists():
+                import numpy as np
+                try:
+                    with np.load(path) as data:
+                        self._backgrounds[camera] = [
+                            data['mean'], data['deviation'], int(data['confirmed']),
+                        ]
+                except Exception as e:
+                    print(f"Taustamallin lataus epäonnistui ({camera}): {e}")
+        return self._backgrounds.get(camera)
+
+    def _state_path(self, camera):
+        if self.state_dir is None:
+            return None
+        return self.state_dir / f"{camera or '_'}.npz"
+
+    def check(self, frame):
+        """
+        Arvioi kuvan tyhjyys ennen MegaDetectoria.
+
+        Returns:
+            dict: camera, thumbnail, empty_confidence (None ennen lämpenemistä),
+            changed_fraction, fast_path (ohita MegaDetector) ja verify
+            (tyhjältä näyttävä kuva, joka tarkistetaan silti)
+        """
+        import numpy as np
+
+        camera, _ = parse_frame_time(frame.path.name)
+        thumb = thumbnail(frame)
+        decision = {'camera': camera, 'thumbnail': thumb, 'empty_confidence': None,
+                    'changed_fraction': None, 'fast_path': False, 'verify': False}
+        self.stats['checked'] += 1
+        background = self._background(camera)
+        if background is None or background[2] < self.warmup:
+            return decision
+
+        mean, deviation, _ = background
+        tolerance = np.maximum(PIXEL_DELTA, DEVIATION_FACTOR * deviation)
+        changed = float((np.abs(thumb - mean) > tolerance).mean())
+        confidence = 1.0 - min(1.0, changed / CHANGE_SCALE)
+        decision['changed_fraction'] = round(changed, 4)
+        decision['empty_confidence'] = round(confidence, 4)
+        if confidence >= self.confidence:
+            if _sampled(frame.path.name, self.verify_rate):
+                decision['verify'] = True
+                self.stats['verified'] += 1
+            else:
+                decision['fast_path'] = True
+                self.stats['fast_path'] += 1
+                self._update(camera, thumb)
+        return decision
+
+    def fast_result(self, frame, decision):
+        """Ennuste-JSON pikapolun kuvalle (ei tunnistuksia)."""
+        return {
+            'image': frame.path.name,
+            'predictions': [],
+            'empty_filter': {
+                'fast_path': True,
+                'empty_confidence': decision['empty_confidence'],
+                'changed_fraction': decision['changed_fraction'],
+            },
+        }
+
+    def observe(self, decision, result):
+        """
+        Kirjaa MegaDetectorin tulos kuvalle, joka ei mennyt pikapolulle.
+
+        Tyhjä tulos päivittää taustan. Tarkistusotoksen tulos lisätään
+        ennusteeseen; ristiriita nollaa kameran taustan (drift).
+        """
+        empty = not result.get('predictions')
+        if decision['verify']:
+            result['empty_filter'] = {
+                'fast_path': False,
+                'verified': True,
+                'empty_confidence': decision['empty_confidence'],
+                'changed_fraction': decision['changed_fraction'],
+                'agreed': empty,
+            }
+            if not empty:
+                self.stats['disagreed'] += 1
+                self._backgrounds.pop(decision['camera'], None)
+                return
+        if empty:
+            self._update(decision['camera'], decision['thumbnail'])
+
+    def _update(self, camera, thumb):
+        import numpy as np
+
+        background = self._backgrounds.get(camera)
+        if background is None:
+            self._backgrounds[camera] = [thumb, np.zeros_like(thumb), 1]
+            return
+        mean, deviation, confirmed = background
+        # Alussa tasainen keskiarvo, sitten liukuva
+        a = max(BACKGROUND_ALPHA, 1.0 / (confirmed + 1))
+        a_dev = max(BACKGROUND_ALPHA, 1.0 / confirmed)  # ensimmäisellä kuvalla ei poikkeamaa
+        deviation = (1 - a_dev) * deviation + a_dev * np.abs(thumb - mean)
+        mean = (1 - a) * mean + a * thumb
+        self._backgrounds[camera] = [mean, deviation, confirmed + 1]
+
+    def save(self):
+        """Tallenna taustamallit seuraavaa ajoa varten."""
+        if self.state_dir is None:
+            return
+        import numpy as np
+
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        for camera, (mean, deviation, confirmed) in self._backgrounds.items():
+            path = self._state_path(camera)
+            tmp = path.with_suffix('.tmp.npz')
+            try:
+                np.savez(tmp, mean=mean, deviation=deviation, confirmed=confirmed)
+                os.replace(tmp, path)
+            except Exception as e:
+                print(f"Taustamallin tallennus epäonnistui ({camera}): {e}")
+        # Nollatut taustat pois levyltä
+        for camera in self._loaded - set(self._backgrounds):
+            path = self._state_path(camera)
+            if path.exists():
+                path.unlink()
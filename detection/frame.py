@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Kerran purettu kuva tunnistusputkea varten.
+
+Frame kulkee MegaDetectorin, rajauksen ja lajimallien läpi, joten JPEG
+puretaan vain kerran kuvaa kohden. Rajaukset ovat numpy-näkymiä samaan
+pikselipuskuriin; PIL-kuva luodaan vasta, kun malli sellaisen vaatii.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Lajimallien rajausmarginaali (osuus bboxin pidemmästä sivusta)
+CROP_MARGIN = 0.1
+
+
+def crop_box(bbox, width, height, margin=CROP_MARGIN):
+    """
+    Laajenna [x1, y1, x2, y2] marginaalilla ja rajaa kuvan sisään.
+
+    Sama laskenta kuin lajitunnistuksessa, jotta vienti ja tunnistus
+    näkevät saman rajauksen.
+    """
+    x1, y1, x2, y2 = bbox
+    m = int(max(x2 - x1, y2 - y1) * margin)
+    return max(0, x1 - m), max(0, y1 - m), min(width, x2 + m), min(height, y2 + m)
+
+
+class Frame:
+    """Purettu kuva: pikselit (H x W [x C] numpy) ja koko."""
+
+    __slots__ = ('path', 'pixels', 'width', 'height')
+
+    def __init__(self, path, pixels):
+        self.path = Path(path)
+        self.pixels = pixels
+        self.height, self.width = pixels.shape[:2]
+
+    @classmethod
+    def load(cls, path):
+        from PIL import Image as PILImage
+        import numpy as np
+
+        with PILImage.open(path) as img:
+            return cls(path, np.array(img))
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def crop(self, bbox, margin=CROP_MARGIN):
+        """Bbox-alue marginaalilla numpy-näkymänä (ei kopiota)."""
+        x1, y1, x2, y2 = crop_box(bbox, self.width, self.height, margin)
+        return self.pixels[y1:y2, x1:x2]
+
+    def crop_image(self, bbox, margin=CROP_MARGIN):
+        """Bbox-alue PIL-kuvana malleille, jotka eivät ota numpy-taulukkoa."""
+        from PIL import Image as PILImage
+        return PILImage.fromarray(self.crop(bbox, margin))
+
+
+class StageTimer:
+    """Tunnistusvaiheiden kumulatiiviset ajat (sekuntia) ja kutsumäärät."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._seconds = {}
+            self._calls = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._seconds[name] = self._seconds.get(name, 0.0) + elapsed
+                self._calls[name] = self._calls.get(name, 0) + 1
+
+    def summary(self):
+        """{vaihe: {'seconds': s, 'calls': n, 'ms_per_call': ms}}"""
+        with self._lock:
+            return {
+                name: {
+                    'seconds': round(seconds, 4),
+                    'calls': self._calls[name],
+                    'ms_per_call': round(1000 * seconds / self._calls[name], 2),
+                }
+                for name, seconds in self._seconds.items()
+            }
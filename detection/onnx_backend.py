@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime -päättelytausta MegaDetectorille ja YOLO-lajimallille.
+
+PyTorch-mallit viedään ONNX-muotoon kerran ja tallennetaan hakemistoon
+DATA_DIR/models/onnx; myöhemmät käynnistykset lataavat valmiin ONNX-mallin
+ilman PyTorchia. Esi- ja jälkikäsittely (letterbox, NMS, koordinaattien
+skaalaus) vastaavat MegaDetectorin PTDetectoria ja ultralyticsin
+ennustinta, joten ennuste-JSON on sama pyöristystarkkuuden rajoissa.
+
+Tausta valitaan ympäristömuuttujalla INFERENCE_BACKEND (torch | onnx).
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+ONNX_CACHE_DIR = DATA_DIR / 'models' / 'onnx'
+
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch').lower()
+# Operaation sisäiset säikeet (0 = onnxruntimen oletus) ja operaatioiden väliset säikeet
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', min(4, os.cpu_count() or 1)))
+ONNX_INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', 1))
+
+# MegaDetector v5: syötekoko ja askel (PTDetector.IMAGE_SIZE / STRIDE)
+MD_IMAGE_SIZE = 1280
+MD_STRIDE = 64
+MD_NMS_IOU = 0.45
+MD_CONF_DIGITS = 3
+MD_COORD_DIGITS = 4
+# ultralyticsin ennustimen oletuskynnys (detect-lajimallit)
+YOLO_CONF = 0.25
+
+
+def session_options(intra_op_threads=None, inter_op_threads=None):
+    """onnxruntime.SessionOptions säikeistys- ja optimointiasetuksin."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = (
+        ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    )
+    options.inter_op_num_threads = (
+        ONNX_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    )
+    # Yksi kuva/erä kerrallaan: rinnakkaisuus operaatioiden sisällä
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+def create_session(onnx_path, options=None):
+    import onnxruntime as ort
+    return ort.InferenceSession(
+        str(onnx_path), sess_options=options or session_options(),
+        providers=['CPUExecutionProvider'],
+    )
+
+
+def read_metadata(session):
+    """ONNX-mallin metadata_props sanakirjana."""
+    return dict(session.get_modelmeta().custom_metadata_map)
+
+
+def cache_path(source, cache_dir=None, suffix=''):
+    """
+    ONNX-välimuistitiedosto lähdemallille.
+
+    Tiedostolähteen avaimeen kuuluvat koko ja muokkausaika, joten
+    uudelleenkoulutettu malli viedään uudestaan. Nimetty malli ('MDV5A')
+    tunnistetaan nimellään.
+    """
+    cache_dir = Path(cache_dir or ONNX_CACHE_DIR)
+    source = Path(str(source))
+    if source.is_file():
+        st = source.stat()
+        key = hashlib.sha1(f'{source.resolve()}:{st.st_size}:{st.st_mtime_ns}'.encode())
+        return cache_dir / f'{source.stem}-{key.hexdigest()[:12]}{suffix}.onnx'
+    return cache_dir / f'{source.name}{suffix}.onnx'
+
+
+def cached_export(source, export_fn, cache_dir=None, suffix=''):
+    """
+    Vie malli ONNX-muotoon, ellei välimuistissa ole jo vientiä.
+
+    Args:
+        export_fn: Kutsu export_fn(kohdepolku), joka kirjoittaa ONNX-mallin
+
+    Returns:
+        Path: ONNX-mallin polku
+    """
+    target = cache_path(source, cache_dir, suffix)
+    if target.exists():
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + '.tmp')
+    try:
+        export_fn(tmp)
+        os.replace(tmp, target)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    # Saman lähteen vanhat viennit pois
+    if Path(str(source)).is_file():
+        stem = Path(str(source)).stem
+        for old in target.parent.glob(f"{stem}-{'?' * 12}{suffix}.onnx"):
+            if old != target:
+                old.unlink()
+    print(f"ONNX-malli viety: {target}")
+    return target
+
+
+def _set_metadata(onnx_path, metadata):
+    import onnx
+
+    model = onnx.load(str(onnx_path))
+    existing = {p.key: p for p in model.metadata_props}
+    for key, value in metadata.items():
+        prop = existing.get(key) or model.metadata_props.add()
+        prop.key, prop.value = key, str(value)
+    onnx.save(model, str(onnx_path))
+
+
+# ---------- esi- ja jälkikäsittely ----------
+
+def letterbox(image, new_shape, stride=32, auto=True, color=114):
+    """
+    YOLOv5/ultralytics-letterbox: skaalaa pidempi sivu ja täytä reunat.
+
+    Returns:
+        tuple: (kuva HxWx3 uint8, suhde, (pad_w, pad_h))
+    """
+    import numpy as np
+
+    h, w = image.shape[:2]
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    new_unpad = (int(round(w * r)), int(round(h * r)))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        dw, dh = dw % stride, dh % stride
+    dw, dh = dw / 2, dh / 2
+
+    if (w, h) != new_unpad:
+        image = _resize(image, new_unpad)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    out = np.full((new_unpad[1] + top + bottom, new_unpad[0] + left + right, 3),
+                  color, dtype=np.uint8)
+    out[top:top + new_unpad[1], left:left + new_unpad[0]] = image
+    return out, r, (dw, dh)
+
+
+def _resize(image, size):
+    """Bilineaarinen skaalaus (cv2, jos asennettu, kuten alkuperäisissä malleissa)."""
+    try:
+        import cv2
+        return cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    except ImportError:
+        from PIL import Image as PILImage
+        import numpy as np
+        return np.asarray(PILImage.fromarray(image).resize(size, PILImage.BILINEAR))
+
+
+def to_tensor(images):
+    """[HxWx3 uint8, ...] → Bx3xHxW float32 (0-1)."""
+    import numpy as np
+    batch = np.stack(images).astype(np.float32) / 255.0
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+def nms(boxes, scores, iou_threshold):
+    """Ahne NMS [x1, y1, x2, y2]-laatikoille; palauttaa säilytettyjen indeksit."""
+    import numpy as np
+
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+
+def yolov5_detections(pred, input_shape, original_shape, conf_threshold,
+                      iou_threshold=MD_NMS_IOU):
+    """
+    YOLOv5-raakatulos (N x (5 + luokat)) MegaDetector-muotoon.
+
+    Vastaa non_max_suppression + scale_coords -ketjua: luokkakohtainen NMS,
+    koordinaatit takaisin alkuperäiseen kuvaan ja normalisoitu [x, y, w, h].
+    """
+    import numpy as np
+
+    pred = pred[pred[:, 4] > conf_threshold]
+    if not len(pred):
+        return []
+    scores_all = pred[:, 5:] * pred[:, 4:5]
+    cls = scores_all.argmax(1)
+    conf = scores_all[np.arange(len(pred)), cls]
+    mask = conf > conf_threshold
+    pred, cls, conf = pred[mask], cls[mask], conf[mask]
+    if not len(pred):
+        return []
+
+    xyxy = np.empty((len(pred), 4), dtype=np.float64)
+    xyxy[:, 0] = pred[:, 0] - pred[:, 2] / 2
+    xyxy[:, 1] = pred[:, 1] - pred[:, 3] / 2
+    xyxy[:, 2] = pred[:, 0] + pred[:, 2] / 2
+    xyxy[:, 3] = pred[:, 1] + pred[:, 3] / 2
+    # Luokkakohtainen NMS siirtämällä luokat erilleen
+    keep = nms(xyxy + cls[:, None] * 7680.0, conf, iou_threshold)
+
+    h0, w0 = original_shape[:2]
+    gain = min(input_shape[0] / h0, input_shape[1] / w0)
+    pad_w = (input_shape[1] - w0 * gain) / 2
+    pad_h = (input_shape[0] - h0 * gain) / 2
+    detections = []
+    for i in keep:
+        x1, y1, x2, y2 = xyxy[i]
+        x1 = min(max((x1 - pad_w) / gain, 0), w0)
+        x2 = min(max((x2 - pad_w) / gain, 0), w0)
+        y1 = min(max((y1 - pad_h) / gain, 0), h0)
+        y2 = min(max((y2 - pad_h) / gain, 0), h0)
+        detections.append({
+            'category': str(int(cls[i]) + 1),
+            'conf': round(float(conf[i]), MD_CONF_DIGITS),
+            'bbox': [
+                round(x1 / w0, MD_COORD_DIGITS), round(y1 / h0, MD_COORD_DIGITS),
+                round((x2 - x1) / w0, MD_COORD_DIGITS), round((y2 - y1) / h0, MD_COORD_DIGITS),
+            ],
+        })
+    return detections
+
+
+# ---------- MegaDetector ----------
+
+class OnnxMegaDetector:
+    """MegaDetector v5 onnxruntimella (sama rajapinta kuin PTDetector)."""
+
+    def __init__(self, onnx_path, options=None):
+        self.session = create_session(onnx_path, options)
+        meta = read_metadata(self.session)
+        self.image_size = int(meta.get('image_size', MD_IMAGE_SIZE))
+        self.stride = int(meta.get('stride', MD_STRIDE))
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _prepare(self, image):
+        padded, _, _ = letterbox(image, self.image_size, stride=self.stride, auto=True)
+        return padded
+
+    def generate_detections_one_image(self, image, image_id=None, detection_threshold=0.005):
+        padded = self._prepare(image)
+        pred = self.session.run(None, {self.input_name: to_tensor([padded])})[0][0]
+        return {
+            'file': image_id,
+            'detections': yolov5_detections(pred, padded.shape, image.shape,
+                                            detection_threshold),
+        }
+
+    def generate_detections_one_batch(self, images, image_id=None, detection_threshold=0.005):
+        """Saman kokoiset (letterbox) kuvat ajetaan yhtenä eränä."""
+        image_ids = image_id or [None] * len(images)
+        padded = [self._prepare(im) for im in images]
+        results = [None] * len(images)
+        groups = {}
+        for i, p in enumerate(padded):
+            groups.setdefault(p.shape, []).append(i)
+        for shape, indices in groups.items():
+            preds = self.session.run(
+                None, {self.input_name: to_tensor([padded[i] for i in indices])})[0]
+            for i, pred in zip(indices, preds):
+                results[i] = {
+                    'file': image_ids[i],
+                    'detections': yolov5_detections(pred, shape, images[i].shape,
+                                                    detection_threshold),
+                }
+        return results
+
+
+def export_megadetector(model_name, target):
+    """Vie MegaDetectorin PyTorch-malli ONNX-muotoon (dynaaminen erä ja koko)."""
+    import torch
+    from megadetector.detection.run_detector import load_detector
+
+    detector = load_detector(model_name, force_cpu=True)
+    model = detector.model.float().eval()
+    image_size = getattr(detector, 'IMAGE_SIZE', MD_IMAGE_SIZE)
+    stride = getattr(detector, 'STRIDE', MD_STRIDE)
+    for module in model.modules():
+        # YOLOv5 Detect: ruudukko lasketaan syötteen koosta, vain yksi tulos
+        if hasattr(module, 'dynamic'):
+            module.dynamic = True
+        if hasattr(module, 'export'):
+            module.export = True
+        if hasattr(module, 'inplace'):
+            module.inplace = False
+
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, dummy, str(target), opset_version=17,
+            input_names=['images'], output_names=['output'],
+            dynamic_axes={'images': {0: 'batch', 2: 'height', 3: 'width'},
+                          'output': {0: 'batch', 1: 'anchors'}},
+        )
+    _set_metadata(target, {'image_size': image_size, 'stride': stride,
+                           'source': str(model_name)})
+
+
+def load_megadetector(model_name, cache_dir=None, options=None):
+    """MegaDetector onnxruntimella; viedään ensimmäisellä kerralla."""
+    onnx_path = cached_export(model_name, lambda t: export_megadetector(model_name, t), cache_dir)
+    return OnnxMegaDetector(onnx_path, options)
+
+
+# ---------- YOLO-lajimalli ----------
+
+class OnnxSpeciesModel:
+    """
+    ultralyticsin viemä lajimalli (classify tai detect) onnxruntimella.
+
+    classify() palauttaa saman (luokka, luottamus) kuin ultralyticsin
+    ennustimen top1 (classify) tai luottavin laatikko NMS:n jälkeen (detect).
+    """
+
+    def __init__(self, onnx_path, options=None):
+        self.session = create_session(onnx_path, options)
+        meta = read_metadata(self.session)
+        self.task = meta.get('task', 'classify')
+        imgsz = json.loads(meta.get('imgsz', '[224, 224]'))
+        self.imgsz = tuple(imgsz) if isinstance(imgsz, list) else (imgsz, imgsz)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def preprocess(self, crop):
+        """PIL-rajaus → 1x3xHxW (ultralyticsin classify_transforms / letterbox)."""
+        import numpy as np
+        from PIL import Image as PILImage
+
+        if self.task == 'classify':
+            size = self.imgsz[0]
+            w, h = crop.size
+            scale = size / min(w, h)
+            resized = crop.convert('RGB').resize(
+                (max(size, round(w * scale)), max(size, round(h * scale))), PILImage.BILINEAR)
+            left = (resized.width - size) // 2
+            top = (resized.height - size) // 2
+            pixels = np.asarray(resized.crop((left, top, left + size, top + size)))
+        else:
+            pixels, _, _ = letterbox(np.asarray(crop.convert('RGB')), self.imgsz, auto=False)
+        return to_tensor([pixels])
+
+    def classify(self, crop):
+        """
+        Returns:
+            tuple: (luokan indeksi, luottamus) tai None
+        """
+        output = self.session.run(None, {self.input_name: self.preprocess(crop)})[0][0]
+        if self.task == 'classify':
+            idx = int(output.argmax())
+            return idx, float(output[idx])
+        # detect: (4 + luokat) x ankkurit; luottavin ankkuri vastaa boxes[0]:aa
+        scores = output[4:]
+        best = scores.max(0)
+        anchor = int(best.argmax())
+        if best[anchor] < YOLO_CONF:
+            return None
+        return int(scores[:, anchor].argmax()), float(best[anchor])
+
+
+def export_species_model(model_path, target):
+    """Vie ultralytics-lajimalli ONNX-muotoon (metadata: task, imgsz, names)."""
+    from ultralytics import YOLO
+
+    exported = YOLO(str(model_path)).export(format='onnx', dynamic=True, simplify=False)
+    os.replace(exported, target)
+
+
+def load_species_model(model_path, cache_dir=None, options=None):
+    onnx_path = cached_export(model_path, lambda t: export_species_model(model_path, t), cache_dir)
+    return OnnxSpeciesModel(onnx_path, options)
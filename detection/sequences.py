@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Kuvasarjat (burst): saman kameran peräkkäiset kuvat.
+
+Riistakamera ottaa laukaisusta useita lähes samanlaisia kuvia
+(15339_25173_20260128_072622867, ..._072623412, ...). Sarjat muodostetaan
+kameratunnisteen ja tiedostonimen aikaleiman (millisekunnit mukaan lukien)
+perusteella. Tunnistus ajaa MegaDetectorin jokaiselle kuvalle, mutta
+lajimalli ajetaan vain kerran kohdetta kohden: kun bbox osuu vahvasti
+(IoU) sarjan aiemman kuvan bboxiin, laji kopioidaan siitä. Valinnaisesti
+(SEQUENCE_REPRESENTATIVE=1) lähes identtisille kuville ei ajeta mallia
+lainkaan, vaan ne saavat sarjan edustajakuvan ennusteen.
+"""
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from storage.metadata_index import _FILENAME_DATE_RE
+
+SEQUENCES_ENABLED = os.environ.get('SEQUENCES_ENABLED', '1') != '0'
+# Enimmäisväli sarjan peräkkäisten kuvien välillä
+SEQUENCE_GAP_SECONDS = float(os.environ.get('SEQUENCE_GAP_SECONDS', 30))
+# Lajin uudelleenkäytön IoU-kynnys
+SEQUENCE_IOU = float(os.environ.get('SEQUENCE_IOU', 0.6))
+# Edustajakuvatila: lähes identtiset kuvat kopioivat edustajan ennusteen
+SEQUENCE_REPRESENTATIVE = os.environ.get('SEQUENCE_REPRESENTATIVE', '0') == '1'
+# Pikkukuvien keskimääräinen absoluuttinen ero (0-255), jonka alla kuvat ovat "samat"
+SEQUENCE_DIFF_THRESHOLD = float(os.environ.get('SEQUENCE_DIFF_THRESHOLD', 2.0))
+
+THUMB_SIZE = (32, 24)
+
+
+def parse_frame_time(name):
+    """
+    Kameratunniste ja aikaleima tiedostonimestä.
+
+    Returns:
+        tuple: (kamera, datetime) tai (kamera, None), jos aikaa ei löydy.
+        Kamera on aikaleimaa edeltävä osa ('15339_25173'), tyhjä jos sitä ei ole.
+    """
+    stem = Path(name).stem
+    m = _FILENAME_DATE_RE.search(stem)
+    if not m:
+        return '', None
+    camera = stem[:m.start()].rstrip('_-')
+    y, mo, d, h, mi, s = (int(x) for x in m.groups())
+    millis = ''
+    for ch in stem[m.end():m.end() + 3]:
+        if not ch.isdigit():
+            break
+        millis += ch
+    try:
+        dt = datetime(y, mo, d, h, mi, s)
+    except ValueError:
+        return camera, None
+    if millis:
+        dt += timedelta(milliseconds=int(millis.ljust(3, '0')))
+    return camera, dt
+
+
+def build_sequences(names, gap_seconds=None):
+    """
+    Ryhmittele kuvat sarjoiksi.
+
+    Returns:
+        list: [{'id', 'camera', 'start', 'end', 'frames': [nimi, ...]}],
+        aikajärjestyksessä kameroittain; päiväämättömät kuvat ovat omia sarjojaan
+    """
+    gap = timedelta(seconds=SEQUENCE_GAP_SECONDS if gap_seconds is None else gap_seconds)
+    dated = []
+    sequences = []
+    for name in names:
+        camera, dt = parse_frame_time(name)
+        if dt is None:
+            sequences.append({'camera': camera, 'start': None, 'end': None, 'frames': [name]})
+        else:
+            dated.append((camera, dt, name))
+
+    current = None
+    for camera, dt, name in sorted(dated):
+        if current and current['camera'] == camera and dt - current['end'] <= gap:
+            current['frames'].append(name)
+            current['end'] = dt
+            continue
+        current = {'camera': camera, 'start': dt, 'end': dt, 'frames': [name]}
+        sequences.append(current)
+
+    for seq in sequences:
+        seq['id'] = Path(seq['frames'][0]).stem
+    sequences.sort(key=lambda s: (s['start'] is None, s['start'] or datetime.min, s['id']))
+    return sequences
+
+
+def box_iou(a, b):
+    """IoU kahdelle [x1, y1, x2, y2]-laatikolle."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter <= 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+def frame_thumbnail(frame):
+    """Harmaasävyinen pikkukuva lähes identtisten kuvien vertailuun."""
+    from PIL import Image as PILImage
+    import numpy as np
+
+    img = PILImage.fromarray(frame.pixels).convert('L').resize(THUMB_SIZE, PILImage.BILINEAR)
+    return np.asarray(img, dtype=np.int16)
+
+
+class SequenceTracker:
+    """
+    Sarjakohtainen tila yhden tunnistusajon ajan.
+
+    Ankkurit ovat sarjan luokiteltuja kohteita: [viimeisin bbox, luokiteltu
+    ennuste, kuvan nimi]. Kohde, jonka bbox osuu ankkuriin, saa ankkurin lajin,
+    ja ankkurin bbox siirtyy kohteen mukana (eläin liikkuu sarjan aikana).
+    """
+
+    def __init__(self, names, gap_seconds=None, iou_threshold=None,
+                 representative=None, diff_threshold=None):
+        self.iou_threshold = SEQUENCE_IOU if iou_threshold is None else iou_threshold
+        self.representative = (
+            SEQUENCE_REPRESENTATIVE if representative is None else representative
+        )
+        self.diff_threshold = (
+            SEQUENCE_DIFF_THRESHOLD if diff_threshold is None else diff_threshold
+        )
+        self.sequences = build_sequences(names, gap_seconds)
+        self.sequence_of = {}
+        for seq in self.sequences:
+            for i, name in enumerate(seq['frames']):
+                self.sequence_of[name] = (seq, i)
+        self._anchors = {}
+        self._representatives = {}
+        self.results = {}  # edustajakuvien ennusteet (edustajakuvatila)
+        self.stats = {'sequences': len(self.sequences), 'classified': 0,
+                      'reused': 0, 'copied': 0}
+
+    def ordered(self, paths):
+        """Kuvapolut sarjajärjestyksessä (sarjan kuvat peräkkäin)."""
+        by_name = {Path(p).name: p for p in paths}
+        return [by_name[n] for seq in self.sequences for n in seq['frames'] if n in by_name]
+
+    def sequence_info(self, name):
+        seq, i = self.sequence_of.get(name, (None, 0))
+        if seq is None:
+            return None
+        return {'id': seq['id'], 'index': i, 'size': len(seq['frames'])}
+
+    def match_species(self, name, bbox, prediction):
+        """
+        Etsi sarjasta kohde, jonka laji voidaan käyttää uudelleen.
+
+        Returns:
+            tuple: (ennuste, kuvan nimi), josta laji kopioidaan, tai None, jos
+            kohde on uusi (se kirjataan ankkuriksi ja luokitellaan)
+        """
+        seq, _ = self.sequence_of.get(name, (None, 0))
+        if seq is None:
+            self.stats['classified'] += 1
+            return None
+        anchors = self._anchors.setdefault(seq['id'], [])
+        best, best_iou = None, self.iou_threshold
+        for anchor in anchors:
+            iou = box_iou(anchor[0], bbox)
+            if iou >= best_iou:
+                best, best_iou = anchor, iou
+        if best is None:
+            anchors.append([list(bbox), prediction, name])
+            self.stats['classified'] += 1
+            return None
+        best[0] = list(bbox)
+        self.stats['reused'] += 1
+        return best[1], best[2]
+
+    def checkpoint(self):
+        """Ankkurien ja laskurien tila; rollback palauttaa sen."""
+        return ({sid: [list(a) for a in anchors] for sid, anchors in self._anchors.items()},
+                dict(self.stats))
+
+    def rollback(self, state):
+        """Peru checkpointin jälkeen kirjatut ankkurit (esim. kesken jäänyt erä)."""
+        anchors, stats = state
+        self._anchors = {sid: [list(a) for a in items] for sid, items in anchors.items()}
+        self.stats = dict(stats)
+
+    def representative_for(self, name, thumbnail):
+        """
+        Edustajakuva, jonka ennuste kelpaa tälle kuvalle sellaisenaan.
+
+        Returns:
+            str tai None: edustajan nimi; None, jos kuva on itse tunnistettava
+            (se tulee sarjan uudeksi edustajaksi)
+        """
+        if not self.representative:
+            return None
+        seq, _ = self.sequence_of.get(name, (None, 0))
+        if seq is None:
+            return None
+        rep = self._representatives.get(seq['id'])
+        if rep is not None and thumbnail is not None:
+            diff = float(abs(rep[1] - thumbnail).mean())
+            if diff <= self.diff_threshold:
+                self.stats['copied'] += 1
+                return rep[0]
+        self._representatives[seq['id']] = (name, thumbnail)
+        return None
+
+
+def summarize_events(frames, gap_seconds=None):
+    """
+    Sarjat dashboardin "tapahtumiksi".
+
+    Args:
+        frames: [{'image', 'species': [...], 'predicted_species': [...]}]
+
+    Returns:
+        list: [{'id', 'camera', 'start', 'end', 'duration_seconds', 'frames',
+        'images', 'representative', 'species', 'annotated'}], uusin ensin
+    """
+    by_name = {f['image']: f for f in frames}
+    events = []
+    for seq in build_sequences(list(by_name), gap_seconds):
+        species = {}
+        annotated = 0
+        representative = seq['frames'][0]
+        best = 0
+        for name in seq['frames']:
+            frame = by_name[name]
+            labels = frame.get('species') or []
+            if labels:
+                annotated += 1
+            else:
+                labels = frame.get('predicted_species') or []
+            for sp in set(labels):
+                species[sp] = species.get(sp, 0) + 1
+            if len(labels) > best:
+                representative, best = name, len(labels)
+        events.append({
+            'id': seq['id'],
+            'camera': seq['camera'],
+            'start': seq['start'].isoformat() if seq['start'] else None,
+            'end': seq['end'].isoformat() if seq['end'] else None,
+            'duration_seconds': (
+                round((seq['end'] - seq['start']).total_seconds(), 3) if seq['start'] else 0
+            ),
+            'frames': len(seq['frames']),
+            'images': seq['frames'],
+            'representative': representative,
+            'species': species,
+            'annotated': annotated,
+        })
+    events.sort(key=lambda e: e['start'] or '', reverse=True)
+    return events
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Pysyvä tunnistuspalvelu.
+
+Lataa MegaDetectorin, SpeciesNetin ja YOLO-lajimallin kerran ja ottaa
+tunnistustöitä vastaan Unix-soketin kautta, joten jokainen nouto ei lataa
+malleja uudelleen. Kun koulutus korvaa species_latest.pt:n, lajimalli
+ladataan uudelleen ennen seuraavaa työtä.
+
+Käynnistys:
+    python -m detection.worker
+
+Protokolla: yksi JSON-rivi pyyntönä, yksi JSON-rivi vastauksena.
+    {"cmd": "detect_new", "force": false, "wait": true}
+    {"cmd": "detect", "images": ["/data/images/incoming/x.jpg"], "wait": true}
+    {"cmd": "status"}
+"""
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from detection import detect_batch
+
+DETECTOR_SOCKET = Path(os.environ.get(
+    'DETECTOR_SOCKET', str(detect_batch.DATA_DIR / 'detector.sock')
+))
+# auto = käynnistä palvelu tarvittaessa, off = tunnista aina kutsuvassa prosessissa
+DETECTOR_WORKER = os.environ.get('DETECTOR_WORKER', 'auto')
+DETECTOR_TIMEOUT = int(os.environ.get('DETECTOR_TIMEOUT_SECONDS', 1800))
+# Lajimalli ladataan uudelleen vasta, kun tiedostoa ei ole muokattu hetkeen
+RELOAD_SETTLE_SECONDS = 2.0
+
+
+class DetectionJob:
+    """Jonossa odottava tunnistustyö."""
+
+    def __init__(self, job_id, images=None, force=False):
+        self.id = job_id
+        self.images = images
+        self.force = force
+        self.submitted_at = time.time()
+        self.result = None
+        self.done = threading.Event()
+
+
+class DetectorService:
+    """Mallit kerran ladattuna pitävä tunnistusjono."""
+
+    def __init__(self, detector_factory=None, species_model_path=None, batch_size=None):
+        self.detector_factory = detector_factory or detect_batch.load_detector
+        self.species_model_path = Path(species_model_path or detect_batch.SPECIES_MODEL)
+        self.batch_size = batch_size
+        self.detector = None
+        self.state = 'starting'
+        self.model_load_seconds = None
+        self.species_model_mtime = None
+        self.species_model_key = None
+        self.species_reloads = 0
+        self.species_reload_seconds = None
+        self.jobs_done = 0
+        self.images_processed = 0
+        self.current_job = None
+        self.last_error = None
+        self._jobs = queue.Queue()
+        self._ids = itertools.count(1)
+        self._stop = threading.Event()
+
+    # ---------- jono ----------
+
+    def submit(self, images=None, force=False):
+        job = DetectionJob(next(self._ids), images=images, force=force)
+        self._jobs.put(job)
+        return job
+
+    def status(self):
+        return {
+            'state': self.state,
+            'queue_depth': self._jobs.qsize() + (1 if self.current_job else 0),
+            'current_job': self.current_job,
+            'model_load_seconds': self.model_load_seconds,
+            'species_model_mtime': self.species_model_mtime,
+            'species_reloads': self.species_reloads,
+            'species_reload_seconds': self.species_reload_seconds,
+            'jobs_done': self.jobs_done,
+            'images_processed': self.images_processed,
+            'last_error': self.last_error,
+            'pid': os.getpid(),
+        }
+
+    def stop(self):
+        self._stop.set()
+        self._jobs.put(None)
+
+    # ---------- työsäie ----------
+
+    def run(self):
+        """Lataa mallit ja käsittele töitä, kunnes stop() kutsutaan."""
+        self.state = 'loading'
+        start = time.perf_counter()
+        try:
+            self.detector = self.detector_factory()
+        except Exception as e:
+            self.state = 'failed'
+            self.last_error = f'Mallien lataus epäonnistui: {e}'
+            print(self.last_error)
+            # Vastaa jonossa oleviin töihin virheellä, ettei kukaan jää odottamaan
+            while not self._stop.is_set():
+                job = self._jobs.get()
+                if job is None:
+                    break
+                job.result = {'processed': 0, 'error': self.last_error}
+                job.done.set()
+            return
+        self.model_load_seconds = round(time.perf_counter() - start, 2)
+        self.species_model_key = self._species_key()
+        self.species_model_mtime = self.species_model_key[0]
+        self.state = 'ready'
+        print(f"Tunnistusmallit ladattu {self.model_load_seconds} s:ssa")
+
+        while not self._stop.is_set():
+            job = self._jobs.get()
+            if job is None:
+                break
+            self.current_job = job.id
+            try:
+                self._maybe_reload_species_model()
+                job.result = self._process(job)
+                self.images_processed += job.result.get('processed', 0)
+            except Exception as e:
+                self.last_error = str(e)
+                job.result = {'processed': 0, 'error': str(e)}
+            finally:
+                self.current_job = None
+                self.jobs_done += 1
+                job.done.set()
+
+    def _process(self, job):
+        if job.images is not None:
+            images = [Path(p) for p in job.images]
+        else:
+            if not detect_batch.IMAGE_DIR.exists():
+                return {'processed': 0, 'error': 'Image directory not found'}
+            images = detect_batch.find_images_to_process(job.force)
+        if not images:
+            return {'processed': 0, 'message': 'Ei uusia kuvia tunnistettavaksi'}
+        result = detect_batch.run_detection(self.detector, images, self.batch_size)
+        result['job_id'] = job.id
+        result['queued_seconds'] = round(time.time() - job.submitted_at, 2)
+        return result
+
+    def _species_key(self):
+        """
+        Lajimallitiedostojen mtimet: species_latest.pt ja INT8-tilassa myös
+        .int8.onnx, joka valmistuu koulutuksen jälkeen erikseen.
+        """
+        paths = [self.species_model_path]
+        if getattr(self.detector, 'species_int8', False):
+            from training.quantize import quantized_path
+            paths.append(quantized_path(self.species_model_path))
+        return tuple(_mtime(p) for p in paths)
+
+    def _maybe_reload_species_model(self):
+        """Lataa lajimalli uudelleen, jos koulutus tai kvantisointi on korvannut sen."""
+        key = self._species_key()
+        if key[0] is None or key == self.species_model_key:
+            return
+        if time.time() - max(m for m in key if m is not None) < RELOAD_SETTLE_SECONDS:
+            return  # Kopiointi voi olla kesken, yritetään seuraavan työn kohdalla
+        start = time.perf_counter()
+        if not self.detector._load_species_model(str(self.species_model_path)):
+            # Vanha malli jää käyttöön; yritetään uudelleen seuraavan työn kohdalla
+            self.last_error = f'Lajimallin lataus epäonnistui: {self.species_model_path}'
+            print(self.last_error)
+            return
+        self.species_reload_seconds = round(time.perf_counter() - start, 2)
+        self.species_model_key = key
+        self.species_model_mtime = key[0]
+        self.species_reloads += 1
+        print(f"Lajimalli ladattu uudelleen ({self.species_reload_seconds} s)")
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return None
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        service = self.server.service
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            cmd = request.get('cmd')
+            if cmd == 'status':
+                response = {'success': True, 'status': service.status()}
+            elif cmd in ('detect', 'detect_new'):
+                images = request.get('images') if cmd == 'detect' else None
+                job = service.submit(images=images, force=bool(request.get('force')))
+                response = {'success': True, 'job_id': job.id,
+                            'queue_depth': service.status()['queue_depth']}
+                if request.get('wait'):
+                    job.done.wait()
+                    response['result'] = job.result
+            else:
+                response = {'success': False, 'error': f'Tuntematon komento: {cmd}'}
+        except (ValueError, AttributeError) as e:
+            response = {'success': False, 'error': f'Virheellinen pyyntö: {e}'}
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class DetectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        socket_path = Path(socket_path)
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if socket_path.exists():
+            if _is_listening(socket_path):
+                raise RuntimeError(f'Tunnistuspalvelu on jo käynnissä: {socket_path}')
+            socket_path.unlink()
+        super().__init__(str(socket_path), _RequestHandler)
+
+
+def _is_listening(socket_path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(1.0)
+            s.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+
+
+# ---------- asiakas ----------
+
+class WorkerUnavailable(OSError):
+    """Palveluun ei saatu yhteyttä, joten pyyntö ei päätynyt jonoon."""
+
+
+def _request(message, timeout, socket_path=None):
+    socket_path = str(socket_path or DETECTOR_SOCKET)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            s.connect(socket_path)
+        except OSError as e:
+            raise WorkerUnavailable(e) from e
+        s.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        buf = b''
+        while not buf.endswith(b'\n'):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    return json.loads(buf.decode('utf-8'))
+
+
+def worker_status(timeout=1.0, socket_path=None):
+    """Palvelun tila, tai None jos palvelu ei ole käynnissä."""
+    try:
+        return _request({'cmd': 'status'}, timeout, socket_path)['status']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def start_worker_process(socket_path=None, wait_seconds=30):
+    """Käynnistä palvelu taustaprosessiksi ja odota, että soketti vastaa."""
+    socket_path = Path(socket_path or DETECTOR_SOCKET)
+    subprocess.Popen(
+        [sys.executable, '-m', 'detection.worker', '--socket', str(socket_path)],
+        cwd=str(Path(__file__).resolve().parent.parent),
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        if worker_status(timeout=1.0, socket_path=socket_path) is not None:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def request_detection(force=False, images=None, socket_path=None, timeout=None):
+    """
+    Tunnista uudet kuvat pysyvässä palvelussa.
+
+    Jos palvelu ei ole käynnissä, se käynnistetään (DETECTOR_WORKER=auto).
+    Jos palvelua ei saada käyttöön, tunnistus ajetaan tässä prosessissa.
+    Kun palvelu on ottanut työn vastaan, aikakatkaisu tai virhe palautetaan
+    tuloksena: työ voi olla yhä käynnissä, eikä samoja kuvia tunnisteta
+    kahdesti.
+
+    Returns:
+        dict: Sama tilastomuoto kuin detect_new_images()
+    """
+    timeout = timeout or DETECTOR_TIMEOUT
+    message = {'cmd': 'detect' if images is not None else 'detect_new',
+               'force': force, 'wait': True}
+    if images is not None:
+        message['images'] = [str(p) for p in images]
+
+    if DETECTOR_WORKER != 'off':
+        available = worker_status(socket_path=socket_path) is not None
+        if not available and DETECTOR_WORKER == 'auto':
+            available = start_worker_process(socket_path)
+        if available:
+            try:
+                response = _request(message, timeout, socket_path)
+            except WorkerUnavailable as e:
+                print(f"Tunnistuspalveluun ei saatu yhteyttä: {e}")
+            except (OSError, ValueError) as e:
+                return {'processed': 0, 'error': f'Tunnistuspalvelu ei vastannut: {e}'}
+            else:
+                if response.get('success'):
+                    return response['result']
+                return {'processed': 0,
+                        'error': f"Tunnistuspalvelu palautti virheen: {response.get('error')}"}
+
+    if images is not None:
+        detector = detect_batch.load_detector()
+        return detect_batch.run_detection(detector, [Path(p) for p in images])
+    return detect_batch.detect_new_images(force=force)
+
+
+def serve(socket_path=None, service=None):
+    """Käynnistä palvelu ja palvele pyyntöjä, kunnes prosessi lopetetaan."""
+    service = service or DetectorService()
+    server = DetectorServer(socket_path or DETECTOR_SOCKET, service)
+    threading.Thread(target=service.run, name='detector-worker', daemon=True).start()
+    print(f"Tunnistuspalvelu kuuntelee: {socket_path or DETECTOR_SOCKET}")
+    try:
+        server.serve_forever()
+    finally:
+        service.stop()
+        server.server_close()
+        Path(server.server_address).unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Pysyvä tunnistuspalvelu')
+    parser.add_argument('--socket', default=str(DETECTOR_SOCKET))
+    parser.add_argument('--status', action='store_true', help='Näytä käynnissä olevan palvelun tila')
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(worker_status(socket_path=args.socket), indent=2, ensure_ascii=False))
+    else:
+        serve(args.socket)
@@ -2,11 +2,29 @@
 """
 YOLO-formaatin eksportti annotaatioista.
 Konvertoi JSON-annotaatiot → YOLO txt-tiedostot + dataset.yaml.
+
+Eksportti on inkrementaalinen: manifest.json muistaa jokaisen kuvan
+annotaation ja kuvatiedoston tilan (mtime, koko), kuvan mitat ja jaon
+(train/val). Uudelleeneksportti kirjoittaa label-tiedostot vain muuttuneille
+annotaatioille, poistaa poistuneet kuvat datasetista ja pitää kunkin kuvan
+aina samassa jaossa. Uuden kuvan jako johdetaan tiivisteestä (kuva, sarja tai
+kamera), joten datasetin kasvu ei siirrä vanhoja kuvia jaosta toiseen.
+Kuvia ei kopioida: ne linkitetään (hardlink, tai symlink) ja kopioidaan
+vain, jos linkki ei onnistu (eri tiedostojärjestelmä). Muuttuneet kuvat
+käsitellään säiepoolissa; kuvan mitat luetaan otsakkeesta ja talletetaan
+manifestiin ja metadataindeksiin.
+
+export_crops (--crops) vie luokittelumallille (-cls) kunkin annotaation
+rajauksen ImageFolder-rakenteeseen (<jako>/<id>_<laji>/). Rajaus on sama kuin
+lajitunnistuksessa (detection.frame.crop_box), ja valmiit rajaukset
+säilytetään välimuistissa avaimella (kuva, bbox, marginaali, koko).
 """
+import hashlib
 import json
 import os
-import random
 import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 DEFAULT_CLASS_MAP = {
@@ -23,6 +41,32 @@ DEFAULT_CLASS_MAP = {
 
 DEFAULT_SPECIES_TO_ID = {v: k for k, v in DEFAULT_CLASS_MAP.items()}
 
+# Kuvien vienti datasetiin: hardlink | symlink | copy
+EXPORT_LINK_MODE = os.environ.get('EXPORT_LINK_MODE', 'hardlink')
+# Jaon ryhmittely: image | burst | camera. Saman sarjan (tai kameran) kuvat
+# ovat aina samassa jaossa, jotta lähes samat kuvat eivät vuoda validointiin.
+EXPORT_SPLIT_GROUP = os.environ.get('EXPORT_SPLIT_GROUP', 'burst')
+# Rinnakkaiset säikeet: JSON-luku, koon luku otsakkeesta, labelit ja linkit
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', min(8, (os.cpu_count() or 1) * 2)))
+# Edistymisen päivityksiä vähintään näin monta eksporttia kohden (jos kuvia riittää)
+PROGRESS_STEPS = 200
+# Säikeelle kerralla annettavien kuvien enimmäismäärä
+MATERIALIZE_BATCH = 64
+
+# Luokitteludatasetin rajausten lyhyemmän sivun enimmäiskoko (ultralytics -cls: 224)
+EXPORT_CROP_SIZE = int(os.environ.get('EXPORT_CROP_SIZE', 224))
+CROP_QUALITY = 95
+# Rajausvälimuisti luokitteludatasetin sisällä; ultralytics lukee vain train/val
+CROP_CACHE_DIRNAME = 'crops'
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 1
+# Kuvatiedoston pääte etsitään tässä järjestyksessä
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+SPLITS = ('train', 'val')
+# JPEG SOF-merkit (baseline, progressive, ...), ei DHT/JPG/DAC
+_JPEG_SOF = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+
 
 def bbox_to_yolo(bbox, img_width, img_height):
     """
@@ -43,6 +87,348 @@ def bbox_to_yolo(bbox, img_width, img_height):
     return x_center, y_center, w, h
 
 
+def load_manifest(output_dir, class_map):
+    """Edellisen eksportin manifesti; tyhjä, jos versio tai luokat ovat muuttuneet."""
+    path = Path(output_dir) / MANIFEST_FILENAME
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'images': {}}
+    if (manifest.get('version') != MANIFEST_VERSION
+            or manifest.get('class_map') != {str(k): v for k, v in class_map.items()}):
+        return {'images': {}}
+    manifest.setdefault('images', {})
+    return manifest
+
+
+def _write_atomic(path, text):
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def link_image(src, dst, mode=None):
+    """
+    Vie kuva datasetiin linkkinä.
+
+    Ajan tasalla oleva kopio (esim. vanhasta täyskopioeksportista) korvataan
+    linkillä, jos linkitys onnistuu; muuten kopio jätetään paikalleen.
+
+    Returns:
+        str: 'linked', 'copied' (linkki ei onnistunut) tai 'unchanged'
+    """
+    mode = mode or EXPORT_LINK_MODE
+    current_copy = False
+    try:
+        if dst.exists() or dst.is_symlink():
+            if os.path.samefile(src, dst):
+                return 'unchanged'
+            current_copy = not dst.is_symlink() and _same_copy(src, dst)
+    except OSError:
+        pass
+
+    tmp = dst.with_name(dst.name + '.tmp')
+    tmp.unlink(missing_ok=True)
+    try:
+        if mode == 'hardlink':
+            os.link(src, tmp)
+        elif mode == 'symlink':
+            os.symlink(Path(src).resolve(), tmp)
+        else:
+            tmp = None
+    except OSError:
+        tmp = None  # eri tiedostojärjestelmä tai ei oikeuksia
+    if tmp is not None:
+        os.replace(tmp, dst)
+        return 'linked'
+    if current_copy:
+        return 'unchanged'
+    dst.unlink(missing_ok=True)
+    shutil.copy2(src, dst)
+    return 'copied'
+
+
+def _same_copy(src, dst):
+    a, b = os.stat(src), os.stat(dst)
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+
+def _scan_images(image_dir):
+    """{stem: (nimi, DirEntry)} kuvahakemistosta yhdellä läpikäynnillä."""
+    found = {}
+    if not image_dir.exists():
+        return found
+    rank = {ext: i for i, ext in enumerate(IMAGE_EXTENSIONS)}
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() not in rank or not entry.is_file():
+                continue
+            previous = found.get(stem)
+            if previous is None or rank[ext.lower()] < rank[previous[2]]:
+                found[stem] = (entry.name, entry, ext.lower())
+    return {stem: (name, entry) for stem, (name, entry, _) in found.items()}
+
+
+def yolo_rows(annotations, species_to_id, img_w, img_h):
+    """
+    Annotaatiot YOLO-riveiksi.
+
+    Returns:
+        tuple: ([(luokka, xc, yc, w, h)], {laji: määrä}, tuntemattomien lajien määrä)
+    """
+    rows = []
+    species = {}
+    skipped = 0
+    for ann in annotations:
+        sp = ann.get('species', '')
+        if sp not in species_to_id:
+            skipped += 1
+            continue
+        bbox = ann.get('bbox', [])
+        if len(bbox) != 4:
+            continue
+        rows.append((species_to_id[sp], *bbox_to_yolo(bbox, img_w, img_h)))
+        species[sp] = species.get(sp, 0) + 1
+    return rows, species, skipped
+
+
+def _label_lines(annotations, species_to_id, img_w, img_h):
+    rows, species, skipped = yolo_rows(annotations, species_to_id, img_w, img_h)
+    lines = [f"{cls} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}" for cls, xc, yc, w, h in rows]
+    return lines, species, skipped
+
+
+def split_fraction(key, seed=42):
+    """Tiivisteestä johdettu luku väliltä [0, 1): sama avain → sama jako."""
+    digest = hashlib.sha1(f'{seed}:{key}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def split_groups(stems, mode=None):
+    """
+    Jaon ryhmäavain kullekin kuvalle.
+
+    Args:
+        stems: Kuvien nimet ilman päätettä
+        mode: image | burst (detection.sequences) | camera (oletus: EXPORT_SPLIT_GROUP)
+
+    Returns:
+        dict: {stem: ryhmäavain}; päiväämättömät kuvat ovat omia ryhmiään
+    """
+    mode = mode or EXPORT_SPLIT_GROUP
+    if mode == 'burst':
+        from detection.sequences import build_sequences
+        return {stem: seq['id'] for seq in build_sequences(stems) for stem in seq['frames']}
+    if mode == 'camera':
+        from detection.sequences import parse_frame_time
+        return {stem: parse_frame_time(stem)[0] or stem for stem in stems}
+    return {stem: stem for stem in stems}
+
+
+def assign_splits(items, val_split=0.2, seed=42, group_mode=None):
+    """
+    Aseta jako ('train'/'val') kuville, joilla sitä ei vielä ole.
+
+    Ryhmä (sarja tai kamera) seuraa jäsentensä aiempaa jakoa; uusi ryhmä
+    saa jaon avaimensa tiivisteestä. Aiemmin jaettuja kuvia ei siirretä.
+    Jos validointijoukossa ei olisi yhtään annotoitua kuvaa, pienimmän
+    tiivisteen uusi ryhmä viedään validointiin.
+
+    Args:
+        items: {stem: manifestimerkintä}, merkinnän 'split' päivitetään
+    """
+    members = {}
+    for stem, key in split_groups(sorted(items), group_mode).items():
+        members.setdefault(key, []).append(stem)
+
+    new_groups = []
+    for key, stems in members.items():
+        kept = [items[s]['split'] for s in stems if items[s].get('split')]
+        if len(kept) == len(stems):
+            continue
+        if kept:
+            split = max(SPLITS, key=kept.count)
+        else:
+            fraction = split_fraction(key, seed)
+            split = 'val' if fraction < val_split else 'train'
+            new_groups.append((fraction, key))
+        for s in stems:
+            items[s].setdefault('split', split)
+
+    # Validointiin tarvitaan vähintään yksi annotoitu kuva
+    def annotated(stems):
+        return any(items[s].get('kind', 'annotated') == 'annotated' for s in stems)
+
+    if val_split > 0 and not annotated(s for s, e in items.items() if e['split'] == 'val'):
+        candidates = [g for g in new_groups if annotated(members[g[1]])]
+        if candidates:
+            for s in members[min(candidates)[1]]:
+                items[s]['split'] = 'val'
+
+
+def image_size(path):
+    """
+    Kuvan (leveys, korkeus) otsakkeesta purkamatta pikseleitä.
+
+    JPEG- ja PNG-otsakkeet luetaan suoraan; muut muodot (ja poikkeavat
+    tiedostot) PIL:llä, joka sekin lukee vain otsakkeen.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(24)
+        size = None
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            size = _jpeg_size(f)
+        elif head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            size = struct.unpack('>II', head[16:24])
+    if size:
+        return size
+    from PIL import Image
+    with Image.open(path) as img:
+        return img.size
+
+
+def _jpeg_size(f):
+    """SOF-segmentin mitat; muut segmentit (EXIF ym.) ohitetaan pituutensa mukaan."""
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0xda:
+            return None  # kuvadata alkoi ennen SOF:ia
+        if code in (0x01, 0x00) or 0xd0 <= code <= 0xd9:
+            continue  # ei pituuskenttää
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if code in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return (width, height) if width and height else None
+        f.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+
+def _load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def scan_annotations(annotation_dir, image_dir, previous, pool):
+    """
+    Annotoidut ja tyhjiksi merkityt kuvat; muuttumattomat otetaan manifestista.
+
+    Muuttuneiden annotaatioiden JSON luetaan säiepoolissa. Merkinnän 'kind'
+    on 'annotated', 'background' tai None (ei eksportoida); muuttuneilla
+    annotoiduilla on lisäksi 'annotations'. Aiempi jako ja samasta kuvasta
+    mitatut mitat säilyvät.
+
+    Returns:
+        tuple: ({stem: manifestimerkintä}, muuttuneiden stemien joukko)
+    """
+    annotation_dir = Path(annotation_dir)
+    images = _scan_images(Path(image_dir))
+    entries = {}
+    to_read = []
+    ann_files = []
+    if annotation_dir.exists():
+        with os.scandir(annotation_dir) as it:
+            ann_files = sorted((e for e in it if e.name.endswith('.json') and e.is_file()),
+                               key=lambda e: e.name)
+    for ann_entry in ann_files:
+        stem = ann_entry.name[:-5]
+        if stem not in images:
+            continue
+        img_name, img_entry = images[stem]
+        img_st = img_entry.stat()
+        ann_st = ann_entry.stat()
+        state = {
+            'image': img_name,
+            'image_mtime_ns': img_st.st_mtime_ns,
+            'image_bytes': img_st.st_size,
+            'annotation_mtime_ns': ann_st.st_mtime_ns,
+            'annotation_bytes': ann_st.st_size,
+        }
+        old = previous.get(stem)
+        if old is not None and all(old.get(k) == v for k, v in state.items()):
+            entries[stem] = old
+            continue
+        to_read.append((stem, ann_entry.path, state, old))
+
+    changed = set()
+    datas = pool.map(_load_json, [path for _, path, _, _ in to_read])
+    for (stem, _, state, old), data in zip(to_read, datas):
+        if data.get('is_empty', False):
+            # Tyhjäksi merkityt → taustadata
+            state['kind'] = 'background'
+        elif data.get('annotations', []):
+            state['kind'] = 'annotated'
+            state['annotations'] = data['annotations']
+        else:
+            # Muistetaan, ettei annotaatiota tarvitse lukea uudelleen
+            state['kind'] = None
+            entries[stem] = state
+            continue
+        if old is not None and old.get('split'):
+            state['split'] = old['split']
+        if old is not None and old.get('image') == state['image'] \
+                and old.get('image_mtime_ns') == state['image_mtime_ns'] and 'width' in old:
+            state['width'], state['height'] = old['width'], old['height']
+        entries[stem] = state
+        changed.add(stem)
+    return entries, changed
+
+
+def _materialize_many(fn, batch, changed, *args):
+    """Erä kuvia säiepoolissa: [(stem, *fn:n tulos)]."""
+    return [(stem, *fn(stem, item, stem in changed, *args)) for stem, item in batch]
+
+
+def _materialize(stem, item, rewrite, image_dir, output_dir, annotation_dir,
+                 species_to_id, link_mode):
+    """
+    Yhden kuvan label-tiedosto ja kuvalinkki.
+
+    Returns:
+        tuple: (link_image-tulos, kirjoitettiinko label, mitattiinko koko)
+    """
+    split = item['split']
+    img_path = image_dir / item['image']
+    label_path = output_dir / 'labels' / split / f"{stem}.txt"
+    written = probed = False
+
+    if rewrite or not label_path.exists():
+        if item['kind'] == 'annotated':
+            if 'width' not in item:
+                item['width'], item['height'] = image_size(img_path)
+                probed = True
+            lines, species, skipped = _label_lines(
+                item.pop('annotations', None) or _read_annotations(annotation_dir, stem),
+                species_to_id, item['width'], item['height'])
+            item['species'] = species
+            item['skipped_unknown'] = skipped
+            text = '\n'.join(lines) + '\n' if lines else ''
+        else:
+            text = ''  # Tyhjä label = taustakuva
+        _write_atomic(label_path, text)
+        written = True
+
+    outcome = link_image(img_path, output_dir / 'images' / split / item['image'], link_mode)
+    return outcome, written, probed
+
+
 def export_dataset(
     annotation_dir,
     image_dir,
@@ -51,6 +437,12 @@ def export_dataset(
     species_to_id=None,
     val_split=0.2,
     seed=42,
+    progress=None,
+    link_mode=None,
+    incremental=True,
+    split_group=None,
+    index=None,
+    workers=None,
 ):
     """
     Eksportoi annotaatiot YOLO-formaattiin.
@@ -62,7 +454,14 @@ def export_dataset(
         class_map: {id: species_name}
         species_to_id: {species_name: id}
         val_split: Validointijoukon osuus (0.0-1.0)
-        seed: Random seed toistettavuuteen
+        seed: Jakotiivisteen suola
+        progress: Valinnainen kutsu progress(valmiit, yhteensä) kuvien edetessä
+        link_mode: hardlink | symlink | copy (oletus: EXPORT_LINK_MODE)
+        incremental: False = ohita manifesti ja rakenna kaikki uudelleen
+        split_group: image | burst | camera (oletus: EXPORT_SPLIT_GROUP)
+        index: Valinnainen MetadataIndex, johon kuvien mitat tallennetaan
+            (uusi tai --full-eksportti ei lue samoja otsakkeita uudelleen)
+        workers: Rinnakkaisten säikeiden määrä (oletus: EXPORT_WORKERS)
 
     Returns:
         dict: Tilastot eksportista
@@ -77,131 +476,105 @@ def export_dataset(
     output_dir = Path(output_dir)
 
     # Luo hakemistorakenne
-    for split in ['train', 'val']:
+    for split in SPLITS:
         (output_dir / 'images' / split).mkdir(parents=True, exist_ok=True)
         (output_dir / 'labels' / split).mkdir(parents=True, exist_ok=True)
 
-    # Kerää annotoidut ja tyhjät kuvat
-    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
-    annotated_images = []
-    background_images = []
-
-    for ann_file in sorted(annotation_dir.glob('*.json')):
-        with open(ann_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # Etsi vastaava kuva
-        stem = ann_file.stem
-        img_path = None
-        for ext in image_extensions:
-            candidate = image_dir / f"{stem}{ext}"
-            if candidate.exists():
-                img_path = candidate
-                break
-
-        if img_path is None:
-            continue
-
-        # Tyhjäksi merkityt → taustadata
-        if data.get('is_empty', False):
-            background_images.append({
-                'image_path': img_path,
-                'stem': stem,
-            })
-            continue
-
-        annotations = data.get('annotations', [])
-        if not annotations:
-            continue
-
-        annotated_images.append({
-            'image_path': img_path,
-            'annotations': annotations,
-            'stem': stem,
-        })
-
-    if not annotated_images and not background_images:
-        return {
-            'success': False,
-            'error': 'Ei annotaatioita eksportoitavaksi',
-            'total': 0,
+    previous = load_manifest(output_dir, class_map)['images'] if incremental else {}
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers or EXPORT_WORKERS),
+                              thread_name_prefix='export')
+    try:
+        entries, changed = scan_annotations(annotation_dir, image_dir, previous, pool)
+
+        exported = {stem: e for stem, e in entries.items() if e.get('kind')}
+        if not exported:
+            return {
+                'success': False,
+                'error': 'Ei annotaatioita eksportoitavaksi',
+                'total': 0,
+            }
+
+        # Jaa train/val: vanhat kuvat pysyvät jaossaan, uudet jaetaan tiivisteellä
+        assign_splits(exported, val_split, seed, split_group)
+
+        stats = {
+            'total': 0, 'train': 0, 'val': 0,
+            'background_images': 0, 'bg_train': 0, 'bg_val': 0,
+            'annotations_total': 0,
+            'species_counts': {},
+            'skipped_unknown': 0,
+            'labels_written': 0, 'linked': 0, 'copied': 0, 'unchanged': 0, 'removed': 0,
+            'sizes_probed': 0,
         }
 
-    # Jaa train/val
-    random.seed(seed)
-    random.shuffle(annotated_images)
-    random.shuffle(background_images)
-
-    val_count = max(1, int(len(annotated_images) * val_split)) if annotated_images else 0
-    val_set = annotated_images[:val_count]
-    train_set = annotated_images[val_count:]
-
-    bg_val_count = max(1, int(len(background_images) * val_split)) if background_images else 0
-    bg_val_set = background_images[:bg_val_count]
-    bg_train_set = background_images[bg_val_count:]
-
-    stats = {
-        'total': len(annotated_images),
-        'train': len(train_set),
-        'val': len(val_set),
-        'background_images': len(background_images),
-        'bg_train': len(bg_train_set),
-        'bg_val': len(bg_val_set),
-        'annotations_total': 0,
-        'species_counts': {},
-        'skipped_unknown': 0,
-    }
-
-    # Prosessoi annotoidut kuvat
-    for split_name, split_data in [('train', train_set), ('val', val_set)]:
-        for item in split_data:
-            img_path = item['image_path']
-            stem = item['stem']
-
-            # Hae kuvan dimensiot
-            from PIL import Image
-            with Image.open(img_path) as pil_img:
-                img_w, img_h = pil_img.size
-
-            # Kopioi kuva
-            dst_img = output_dir / 'images' / split_name / img_path.name
-            shutil.copy2(img_path, dst_img)
-
-            # Kirjoita label-tiedosto
-            label_lines = []
-            for ann in item['annotations']:
-                species = ann.get('species', '')
-                if species not in species_to_id:
-                    stats['skipped_unknown'] += 1
-                    continue
-
-                class_id = species_to_id[species]
-                bbox = ann.get('bbox', [])
-                if len(bbox) != 4:
-                    continue
-
-                xc, yc, w, h = bbox_to_yolo(bbox, img_w, img_h)
-                label_lines.append(f"{class_id} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}")
-
-                stats['annotations_total'] += 1
-                stats['species_counts'][species] = stats['species_counts'].get(species, 0) + 1
-
-            label_path = output_dir / 'labels' / split_name / f"{stem}.txt"
-            with open(label_path, 'w') as f:
-                f.write('\n'.join(label_lines) + '\n' if label_lines else '')
-
-    # Prosessoi taustakuvat (tyhjä label-tiedosto = YOLO background)
-    for split_name, split_data in [('train', bg_train_set), ('val', bg_val_set)]:
-        for item in split_data:
-            img_path = item['image_path']
-            stem = item['stem']
-
-            dst_img = output_dir / 'images' / split_name / img_path.name
-            shutil.copy2(img_path, dst_img)
-
-            label_path = output_dir / 'labels' / split_name / f"{stem}.txt"
-            with open(label_path, 'w') as f:
-                f.write('')  # Tyhjä label = taustakuva
+        # Poista datasetista kuvat ja labelit, joita ei enää eksportoida
+        # (tai jotka ovat vaihtaneet nimeä tai jakoa)
+        expected = {
+            ('images', e['split'], e['image']) for e in exported.values()
+        } | {
+            ('labels', e['split'], f'{stem}.txt') for stem, e in exported.items()
+        }
+        for kind_dir in ('images', 'labels'):
+            for split in SPLITS:
+                with os.scandir(output_dir / kind_dir / split) as it:
+                    for entry in it:
+                        if (kind_dir, split, entry.name) not in expected:
+                            os.unlink(entry.path)
+                            stats['removed'] += kind_dir == 'images'
+
+        # Kuvien mitat: manifesti → metadataindeksi → otsakkeen luku säikeessä
+        if index is not None and any(
+                e['kind'] == 'annotated' and 'width' not in e for e in exported.values()):
+            cached = index.image_sizes()
+            for e in exported.values():
+                hit = cached.get(e['image']) if 'width' not in e else None
+                if hit and hit[2:] == (e['image_bytes'], e['image_mtime_ns']):
+                    e['width'], e['height'] = hit[:2]
+
+        # Kuvat annetaan säikeille erinä: tehtäväkohtainen yleiskulu on
+        # muuten samaa luokkaa kuin yhden labelin kirjoitus
+        ordered = sorted(exported.items())
+        total_images = len(ordered)
+        batch = max(1, min(MATERIALIZE_BATCH, total_images // PROGRESS_STEPS))
+        futures = [
+            pool.submit(_materialize_many, _materialize, ordered[i:i + batch], changed, image_dir,
+                        output_dir, annotation_dir, species_to_id, link_mode)
+            for i in range(0, total_images, batch)
+        ]
+        done = 0
+        probed = []
+        for future in as_completed(futures):
+            for stem, outcome, written, was_probed in future.result():
+                stats[outcome] += 1
+                stats['labels_written'] += written
+                if was_probed:
+                    probed.append(exported[stem])
+                done += 1
+            if progress:
+                progress(done, total_images)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    stats['sizes_probed'] = len(probed)
+    if index is not None and probed:
+        index.put_image_sizes(
+            (e['image'], e['width'], e['height'], e['image_bytes'], e['image_mtime_ns'])
+            for e in probed
+        )
+
+    for item in exported.values():
+        split = item['split']
+        if item['kind'] == 'annotated':
+            stats['total'] += 1
+            stats[split] += 1
+            stats['skipped_unknown'] += item.get('skipped_unknown', 0)
+            for sp, n in item.get('species', {}).items():
+                stats['annotations_total'] += n
+                stats['species_counts'][sp] = stats['species_counts'].get(sp, 0) + n
+        else:
+            stats['background_images'] += 1
+            stats[f'bg_{split}'] += 1
 
     # Kirjoita dataset.yaml
     yaml_content = f"""# Riistakamera Wildlife Dataset
@@ -215,28 +588,308 @@ nc: {len(class_map)}
 names: {json.dumps(class_map)}
 """
     yaml_path = output_dir / 'dataset.yaml'
-    with open(yaml_path, 'w') as f:
-        f.write(yaml_content)
+    if not yaml_path.exists() or yaml_path.read_text(encoding='utf-8') != yaml_content:
+        _write_atomic(yaml_path, yaml_content)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'class_map': {str(k): v for k, v in class_map.items()},
+        'images': entries,
+    }
+    _write_atomic(output_dir / MANIFEST_FILENAME,
+                  json.dumps(manifest, ensure_ascii=False, separators=(',', ':')))
 
     stats['success'] = True
     stats['dataset_yaml'] = str(yaml_path)
     return stats
 
 
+def class_dirname(class_id, name, class_map):
+    """
+    ImageFolder-kansion nimi luokalle.
+
+    ultralytics numeroi luokat kansioiden aakkosjärjestyksessä; id-etuliite
+    pitää numeroinnin samana kuin CLASS_MAP, jota lajitunnistus käyttää.
+    """
+    width = len(str(max(class_map)))
+    return f'{class_id:0{width}d}_{name}'
+
+
+def crop_key(item, bbox, margin, size):
+    """Rajauksen välimuistiavain: kuva (nimi, mtime, koko), bbox, marginaali ja koko."""
+    raw = (f"{item['image']}:{item['image_mtime_ns']}:{item['image_bytes']}:"
+           f"{[int(v) for v in bbox]}:{margin}:{size}")
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def render_crop(img, bbox, margin, size):
+    """
+    Bbox-rajaus kuten lajitunnistuksessa, lyhyempi sivu pienennettynä kokoon size.
+
+    Args:
+        img: PIL-kuva (RGB)
+        bbox: [x1, y1, x2, y2] pikseleinä
+
+    Returns:
+        PIL-kuva tai None, jos rajaus on alle 2 pikseliä
+    """
+    from PIL import Image
+    from detection.frame import crop_box
+
+    x1, y1, x2, y2 = crop_box([int(v) for v in bbox], img.width, img.height, margin)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    crop = img.crop((x1, y1, x2, y2))
+    scale = size / min(crop.size)
+    if scale < 1:
+        crop = crop.resize((max(1, round(crop.width * scale)), max(1, round(crop.height * scale))),
+                           Image.BILINEAR)
+    return crop
+
+
+def _materialize_crops(stem, item, rewrite, image_dir, output_dir, annotation_dir,
+                       class_dirs, margin, size, link_mode):
+    """
+    Yhden kuvan rajaukset välimuistiin ja linkit luokkakansioihin.
+
+    Kuva avataan vain, jos jokin sen rajauksista puuttuu välimuistista.
+    class_dirs on {laji: luokkakansio}; muut lajit ohitetaan.
+
+    Returns:
+        tuple: ([(polku datasetissa, laji, link_image-tulos)], rajattujen määrä)
+    """
+    if rewrite or 'boxes' not in item:
+        annotations = item.pop('annotations', None) or _read_annotations(annotation_dir, stem)
+        item['boxes'] = [[[int(v) for v in a['bbox']], a.get('species', '')]
+                         for a in annotations if len(a.get('bbox', [])) == 4]
+
+    cache_dir = output_dir / CROP_CACHE_DIRNAME
+    img = None
+    crops = []
+    rendered = 0
+    try:
+        for bbox, sp in item['boxes']:
+            if sp not in class_dirs or bbox[2] - bbox[0] < 2 or bbox[3] - bbox[1] < 2:
+                continue
+            key = crop_key(item, bbox, margin, size)
+            cached = cache_dir / f'{key}.jpg'
+            if not cached.exists():
+                if img is None:
+                    from PIL import Image
+                    img = Image.open(image_dir / item['image'])
+                    img = img.convert('RGB')
+                crop = render_crop(img, bbox, margin, size)
+                if crop is None:
+                    continue
+                tmp = cached.with_name(cached.name + '.tmp')
+                crop.save(tmp, 'JPEG', quality=CROP_QUALITY)
+                os.replace(tmp, cached)
+                rendered += 1
+            dst = output_dir / item['split'] / class_dirs[sp] / f'{stem}_{key}.jpg'
+            crops.append((dst, sp, link_image(cached, dst, link_mode)))
+    finally:
+        if img is not None:
+            img.close()
+    return crops, rendered
+
+
+def export_crops(
+    annotation_dir,
+    image_dir,
+    output_dir,
+    class_map=None,
+    species_to_id=None,
+    val_split=0.2,
+    seed=42,
+    progress=None,
+    link_mode=None,
+    incremental=True,
+    split_group=None,
+    workers=None,
+    size=None,
+    margin=None,
+):
+    """
+    Eksportoi annotaatioiden rajaukset luokittelumallille (ImageFolder).
+
+    Rakenne: <output_dir>/<train|val>/<id>_<laji>/<kuva>_<avain>.jpg, jossa
+    tiedosto on linkki välimuistiin <output_dir>/crops/<avain>.jpg. Jako on
+    sama kuin YOLO-eksportissa (sama tiiviste ja ryhmittely). Taustakuvat
+    eivät kuulu luokitteludataan.
+
+    Args:
+        annotation_dir: Hakemisto jossa JSON-annotaatiot
+        image_dir: Hakemisto jossa kuvat
+        output_dir: Luokitteludatasetin hakemisto (ultralyticsin data=)
+        size: Rajauksen lyhyemmän sivun enimmäiskoko (oletus: EXPORT_CROP_SIZE)
+        margin: Rajausmarginaali (oletus: detection.frame.CROP_MARGIN)
+        Muut kuten export_dataset.
+
+    Returns:
+        dict: Tilastot eksportista
+    """
+    from detection.frame import CROP_MARGIN
+
+    if class_map is None:
+        class_map = DEFAULT_CLASS_MAP
+    if species_to_id is None:
+        species_to_id = DEFAULT_SPECIES_TO_ID
+    size = size or EXPORT_CROP_SIZE
+    margin = CROP_MARGIN if margin is None else margin
+
+    annotation_dir = Path(annotation_dir)
+    image_dir = Path(image_dir)
+    output_dir = Path(output_dir)
+
+    # Kaikki luokkakansiot myös tyhjinä, jotta luokkien numerointi ei muutu
+    class_dirs = {name: class_dirname(cid, name, class_map) for cid, name in class_map.items()}
+    species_to_dir = {sp: class_dirs[class_map[cid]] for sp, cid in species_to_id.items()
+                      if cid in class_map}
+    for split in SPLITS:
+        for dirname in class_dirs.values():
+            (output_dir / split / dirname).mkdir(parents=True, exist_ok=True)
+    (output_dir / CROP_CACHE_DIRNAME).mkdir(parents=True, exist_ok=True)
+
+    previous = load_manifest(output_dir, class_map)['images'] if incremental else {}
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers or EXPORT_WORKERS),
+                              thread_name_prefix='export-crops')
+    try:
+        entries, changed = scan_annotations(annotation_dir, image_dir, previous, pool)
+
+        exported = {stem: e for stem, e in entries.items() if e.get('kind') == 'annotated'}
+        if not exported:
+            return {
+                'success': False,
+                'error': 'Ei annotaatioita eksportoitavaksi',
+                'total': 0,
+            }
+        assign_splits(exported, val_split, seed, split_group)
+
+        stats = {
+            'images': len(exported),
+            'total': 0, 'train': 0, 'val': 0,
+            'species_counts': {},
+            'skipped_unknown': 0,
+            'crops_written': 0, 'linked': 0, 'copied': 0, 'unchanged': 0, 'removed': 0,
+        }
+
+        ordered = sorted(exported.items())
+        total_images = len(ordered)
+        batch = max(1, min(MATERIALIZE_BATCH, total_images // PROGRESS_STEPS))
+        futures = [
+            pool.submit(_materialize_many, _materialize_crops, ordered[i:i + batch], changed,
+                        image_dir, output_dir, annotation_dir, species_to_dir, margin, size,
+                        link_mode)
+            for i in range(0, total_images, batch)
+        ]
+        done = 0
+        expected = set()
+        for future in as_completed(futures):
+            for stem, crops, rendered in future.result():
+                stats['crops_written'] += rendered
+                for dst, sp, outcome in crops:
+                    expected.add(dst)
+                    stats[outcome] += 1
+                    stats['total'] += 1
+                    stats[exported[stem]['split']] += 1
+                    stats['species_counts'][sp] = stats['species_counts'].get(sp, 0) + 1
+                done += 1
+            if progress:
+                progress(done, total_images)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    for item in exported.values():
+        stats['skipped_unknown'] += sum(sp not in species_to_id for _, sp in item['boxes'])
+
+    # Poista rajaukset, joita ei enää eksportoida (tai jotka ovat vaihtaneet
+    # lajia tai jakoa), ja välimuistista niihin viittaamattomat tiedostot
+    referenced = set()
+    for split in SPLITS:
+        for dirname in class_dirs.values():
+            with os.scandir(output_dir / split / dirname) as it:
+                for entry in it:
+                    path = output_dir / split / dirname / entry.name
+                    if path in expected:
+                        referenced.add(entry.name.rsplit('_', 1)[-1])
+                    else:
+                        os.unlink(entry.path)
+                        stats['removed'] += 1
+    with os.scandir(output_dir / CROP_CACHE_DIRNAME) as it:
+        for entry in it:
+            if entry.name not in referenced:
+                os.unlink(entry.path)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'class_map': {str(k): v for k, v in class_map.items()},
+        'crop': {'size': size, 'margin': margin},
+        'images': entries,
+    }
+    _write_atomic(output_dir / MANIFEST_FILENAME,
+                  json.dumps(manifest, ensure_ascii=False, separators=(',', ':')))
+
+    stats['success'] = True
+    stats['dataset_dir'] = str(output_dir)
+    return stats
+
+
+def _read_annotations(annotation_dir, stem):
+    with open(annotation_dir / f'{stem}.json', 'r', encoding='utf-8') as f:
+        return json.load(f).get('annotations', [])
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='Eksportoi annotaatiot YOLO-formaattiin')
     parser.add_argument('--annotation-dir', default='/data/annotations')
     parser.add_argument('--image-dir', default='/data/images/incoming')
-    parser.add_argument('--output-dir', default='/data/dataset')
+    parser.add_argument('--output-dir', default=None,
+                        help='Oletus /data/dataset (--crops: /data/dataset_cls)')
     parser.add_argument('--val-split', type=float, default=0.2)
+    parser.add_argument('--link-mode', choices=['hardlink', 'symlink', 'copy'],
+                        default=EXPORT_LINK_MODE)
+    parser.add_argument('--split-group', choices=['image', 'burst', 'camera'],
+                        default=EXPORT_SPLIT_GROUP)
+    parser.add_argument('--full', action='store_true',
+                        help='Ohita manifesti ja eksportoi kaikki uudelleen')
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS)
+    parser.add_argument('--index', default=None,
+                        help='Metadataindeksi kuvien mittojen välimuistiksi (metadata.db)')
+    parser.add_argument('--crops', action='store_true',
+                        help='Luokittelumallin (-cls) rajausdataset ImageFolder-muodossa')
+    parser.add_argument('--crop-size', type=int, default=EXPORT_CROP_SIZE)
     args = parser.parse_args()
 
-    result = export_dataset(
-        annotation_dir=args.annotation_dir,
-        image_dir=args.image_dir,
-        output_dir=args.output_dir,
-        val_split=args.val_split,
-    )
+    if args.crops:
+        result = export_crops(
+            annotation_dir=args.annotation_dir,
+            image_dir=args.image_dir,
+            output_dir=args.output_dir or '/data/dataset_cls',
+            val_split=args.val_split,
+            link_mode=args.link_mode,
+            incremental=not args.full,
+            split_group=args.split_group,
+            workers=args.workers,
+            size=args.crop_size,
+        )
+    else:
+        index = None
+        if args.index:
+            from storage.metadata_index import MetadataIndex
+            index = MetadataIndex(args.index)
+
+        result = export_dataset(
+            annotation_dir=args.annotation_dir,
+            image_dir=args.image_dir,
+            output_dir=args.output_dir or '/data/dataset',
+            val_split=args.val_split,
+            link_mode=args.link_mode,
+            incremental=not args.full,
+            split_group=args.split_group,
+            index=index,
+            workers=args.workers,
+        )
 
     print(json.dumps(result, indent=2, ensure_ascii=False))
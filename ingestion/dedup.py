@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Kuvien kaksoiskappaleiden tunnistus sisältötiivisteellä.
+
+Kamerapilvi voi lähettää saman kuvan uudelleen, ja sama viesti voidaan
+noutaa sekä Gmail-agentilla että suoraan IMAP:lla. Nouto laskee kuvalle
+SHA-256-tiivisteen ennen tiedoston kirjoittamista ja varaa sen
+metadataindeksistä; jo tallennettu kuva ohitetaan, joten sitä ei tunnisteta,
+annotoida eikä eksportoida kahdesti.
+
+Valinnainen perceptual hash (DEDUP_PHASH=1) tunnistaa myös uudelleen
+pakatut kopiot. Se on oletuksena pois, koska saman sarjan peräkkäiset kuvat
+staattisesta taustasta voivat olla lähes identtisiä.
+
+Komentorivi käy olemassa olevan kuvahakemiston läpi, raportoi
+kaksoiskappaleet ja siirtää ne halutessa sivuun (--merge).
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+IMAGE_DIR = Path(os.environ.get('IMAGE_DIR', str(DATA_DIR / 'images' / 'incoming')))
+ANNOTATION_DIR = Path(os.environ.get('ANNOTATION_DIR', str(DATA_DIR / 'annotations')))
+PREDICTION_DIR = Path(os.environ.get('PREDICTION_DIR', str(DATA_DIR / 'predictions')))
+DUPLICATE_DIR = DATA_DIR / 'images' / 'duplicates'
+
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', '1') != '0'
+PHASH_ENABLED = os.environ.get('DEDUP_PHASH', '0') == '1'
+# Hamming-etäisyys 64 bitistä; kaistahaku löytää varmasti etäisyydet 0–3
+PHASH_MAX_DISTANCE = int(os.environ.get('DEDUP_PHASH_DISTANCE', 3))
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+
+
+class DuplicateImage(Exception):
+    """Kuva on jo tallennettu toisella nimellä."""
+
+    def __init__(self, name, existing):
+        super().__init__(f'{name} on kaksoiskappale kuvasta {existing}')
+        self.name = name
+        self.existing = existing
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def perceptual_hash(source):
+    """
+    64-bittinen erotushajautus (dHash) kuvasta.
+
+    Args:
+        source: Tiedostopolku tai tiedostomainen olio
+
+    Returns:
+        int tai None, jos kuvaa ei voi avata
+    """
+    from PIL import Image
+    try:
+        with Image.open(source) as img:
+            img.draft('L', (64, 64))  # JPEG: pienennetty purku
+            small = img.convert('L').resize((9, 8), Image.BILINEAR)
+            pixels = small.tobytes()
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
+
+
+def claim_image(index, name, sha256, source=None):
+    """
+    Varaa kuvan tiiviste indeksistä ennen tallennusta.
+
+    Args:
+        index: MetadataIndex tai None (tarkistus ohitetaan)
+        source: Kuvan polku tai tiedostomainen olio perceptual hashia varten
+
+    Raises:
+        DuplicateImage: jos sama kuva on jo tallennettu
+    """
+    if index is None or not DEDUP_ENABLED:
+        return
+    phash = perceptual_hash(source) if PHASH_ENABLED and source is not None else None
+    try:
+        existing = index.claim_image_hash(
+            name, sha256, phash, PHASH_MAX_DISTANCE if phash is not None else None,
+        )
+    except Exception as e:
+        print(f"Kaksoiskappaletarkistus epäonnistui ({name}): {e}")
+        return
+    if existing is not None:
+        raise DuplicateImage(name, existing)
+
+
+def release_image(index, name):
+    """Vapauta varaus, jos kuvan tallennus epäonnistui varauksen jälkeen."""
+    if index is None or not DEDUP_ENABLED:
+        return
+    try:
+        index.remove_image_hash(name)
+    except Exception as e:
+        print(f"Tiivistevarauksen vapautus epäonnistui ({name}): {e}")
+
+
+def write_unique(index, data, target_path):
+    """
+    Kirjoita kuvan tavut, ellei sama kuva ole jo tallennettu.
+
+    Raises:
+        DuplicateImage: kuvaa ei kirjoitettu
+    """
+    import io
+    target_path = Path(target_path)
+    claim_image(index, target_path.name, hashlib.sha256(data).hexdigest(), io.BytesIO(data))
+    try:
+        with open(target_path, 'wb') as f:
+            f.write(data)
+    except BaseException:
+        release_image(index, target_path.name)
+        raise
+    return len(data)
+
+
+# ---------- olemassa olevan hakemiston läpikäynti ----------
+
+def scan(index, image_dir=None, with_phash=False, progress=None, claim_grace=None):
+    """
+    Laske tiivisteet kuvista, joita ei ole vielä indeksissä (tai jotka ovat muuttuneet).
+
+    Args:
+        claim_grace: Sekunnit, joiden jälkeen noudon varaus ilman kuvaa
+            poistetaan (oletus CLAIM_GRACE_SECONDS)
+
+    Returns:
+        dict: images, hashed, removed
+    """
+    from storage.metadata_index import CLAIM_GRACE_SECONDS, claim_cutoff_ns
+    image_dir = Path(image_dir or IMAGE_DIR)
+    cutoff = claim_cutoff_ns(CLAIM_GRACE_SECONDS if claim_grace is None else claim_grace)
+    known = index.image_hash_stats()
+    entries = []
+    if image_dir.exists():
+        with os.scandir(image_dir) as it:
+            entries = [e for e in it if e.is_file()
+                       and Path(e.name).suffix.lower() in IMAGE_EXTENSIONS]
+
+    # Poistettujen kuvien tiivisteet pois, jotta ne eivät estä uutta noutoa.
+    # Tuore varaus (ei kokoa, mtime = varausaika) voi kuulua noudolle, joka
+    # kirjoittaa kuvaa parhaillaan väliaikaistiedostoon, joten se jää; vanha
+    # varaus ilman kuvaa on kaatuneen noudon jäänne.
+    on_disk = {e.name for e in entries}
+    removed = [name for name in set(known) - on_disk
+               if known[name][0] is not None or (known[name][1] or 0) < cutoff]
+    for name in removed:
+        index.remove_image_hash(name)
+
+    hashed = 0
+    for i, entry in enumerate(entries):
+        st = entry.stat()
+        size, mtime_ns, has_phash = known.get(entry.name, (None, None, False))
+        if size == st.st_size and mtime_ns == st.st_mtime_ns and (has_phash or not with_phash):
+            continue
+        phash = perceptual_hash(entry.path) if with_phash else None
+        index.put_image_hash(entry.name, sha256_file(entry.path), phash,
+                             st.st_size, st.st_mtime_ns)
+        hashed += 1
+        if progress:
+            progress(i + 1, len(entries))
+    return {'images': len(entries), 'hashed': hashed, 'removed': len(removed)}
+
+
+def find_duplicates(index, similar=False, max_distance=PHASH_MAX_DISTANCE):
+    """
+    Kaksoiskappaleryhmät.
+
+    Returns:
+        list: [[nimi, ...], ...]; perceptual-osumat yhdistetään samaan ryhmään
+    """
+    groups = [list(g) for g in index.duplicate_groups()]
+    if not similar:
+        return groups
+
+    # Yhdistä tarkat ryhmät ja lähes samat parit (union-find)
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(a, b):
+        parent[find(a)] = find(b)
+
+    for group in groups:
+        for name in group[1:]:
+            union(group[0], name)
+    for a, b in index.similar_pairs(max_distance):
+        union(a, b)
+
+    merged = {}
+    for name in parent:
+        merged.setdefault(find(name), []).append(name)
+    return [sorted(g) for g in merged.values() if len(g) > 1]
+
+
+def _choose_keeper(group, image_dir, annotation_dir, prediction_dir):
+    """Säilytä annotoitu, sitten tunnistettu, sitten vanhin kuva."""
+    def key(name):
+        stem = Path(name).stem
+        path = image_dir / name
+        return (
+            not (annotation_dir / f'{stem}.json').exists(),
+            not (prediction_dir / f'{stem}.json').exists(),
+            path.stat().st_mtime_ns if path.exists() else 0,
+            len(name),
+            name,
+        )
+    return min(group, key=key)
+
+
+def merge(index, groups, image_dir=None, annotation_dir=None, prediction_dir=None,
+          duplicate_dir=None):
+    """
+    Siirrä kaksoiskappaleet (kuva, metatiedosto, ennuste, annotaatio) sivuun.
+
+    Tiedostoja ei poisteta: ne siirretään hakemistoon images/duplicates,
+    josta ne voi palauttaa käsin.
+
+    Returns:
+        dict: groups, moved, kept
+    """
+    image_dir = Path(image_dir or IMAGE_DIR)
+    annotation_dir = Path(annotation_dir or ANNOTATION_DIR)
+    prediction_dir = Path(prediction_dir or PREDICTION_DIR)
+    duplicate_dir = Path(duplicate_dir or DUPLICATE_DIR)
+
+    moved = []
+    kept = []
+    for group in groups:
+        keeper = _choose_keeper(group, image_dir, annotation_dir, prediction_dir)
+        kept.append(keeper)
+        for name in group:
+            if name == keeper:
+                continue
+            stem = Path(name).stem
+            sources = [
+                (image_dir / name, duplicate_dir / name),
+                (image_dir / f'{stem}.meta.json', duplicate_dir / f'{stem}.meta.json'),
+                (prediction_dir / f'{stem}.json', duplicate_dir / 'predictions' / f'{stem}.json'),
+                (annotation_dir / f'{stem}.json', duplicate_dir / 'annotations' / f'{stem}.json'),
+            ]
+            for src, dst in sources:
+                if src.exists():
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(src), str(dst))
+            index.remove_image(name)
+            index.remove_prediction(stem)
+            index.remove_annotation(stem)
+            moved.append({'name': name, 'kept': keeper})
+    return {'groups': len(groups), 'moved': moved, 'kept': kept}
+
+
+if __name__ == '__main__':
+    import argparse
+    from storage.metadata_index import open_index
+
+    parser = argparse.ArgumentParser(description='Kuvien kaksoiskappaleet')
+    parser.add_argument('--data-dir', default=str(DATA_DIR))
+    parser.add_argument('--image-dir', default=str(IMAGE_DIR))
+    parser.add_argument('--similar', action='store_true',
+                        help='Etsi myös uudelleen pakatut kopiot (perceptual hash)')
+    parser.add_argument('--distance', type=int, default=PHASH_MAX_DISTANCE,
+                        help=f'Suurin phash-etäisyys (oletus {PHASH_MAX_DISTANCE})')
+    parser.add_argument('--merge', action='store_true',
+                        help='Siirrä kaksoiskappaleet hakemistoon images/duplicates')
+    args = parser.parse_args()
+
+    index = open_index(args.data_dir)
+    print("Lasketaan tiivisteet...")
+    result = scan(index, args.image_dir, with_phash=args.similar)
+    groups = find_duplicates(index, similar=args.similar, max_distance=args.distance)
+    result['duplicate_groups'] = groups
+    result['duplicates'] = sum(len(g) - 1 for g in groups)
+    if args.merge and groups:
+        result['merge'] = merge(index, groups, image_dir=args.image_dir)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -14,10 +14,12 @@ from pathlib import Path
 
 import requests
 
+from ingestion.dedup import DuplicateImage, write_unique
+from storage.metadata_index import index_file, open_metadata_index
+
 GMAIL_AGENT_URL = os.environ.get('GMAIL_AGENT_URL', 'http://gmail-agent:8000')
 DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
 IMAGE_DIR = DATA_DIR / 'images' / 'incoming'
-PROCESSED_FILE = DATA_DIR / 'processed_emails.json'
 
 CAMERA_SENDERS = os.environ.get(
     'CAMERA_SENDERS',
@@ -40,19 +42,10 @@ LINCKEAZI_IMAGE_PATTERN = re.compile(
 )
 
 
-def load_processed():
-    """Lataa käsiteltyjen viestien ID:t."""
-    if PROCESSED_FILE.exists():
-        with open(PROCESSED_FILE, 'r') as f:
-            return json.load(f)
-    return {'processed_ids': [], 'last_fetch': None}
-
-
-def save_processed(data):
-    """Tallenna käsitellyt viestin ID:t."""
-    PROCESSED_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(PROCESSED_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def open_processed_store():
+    """Avaa käsiteltyjen viestien varasto (siirtää processed_emails.json:n)."""
+    from storage.processed_messages import open_processed_store as open_store
+    return open_store(DATA_DIR)
 
 
 def gmail_api_call(action, params=None):
@@ -100,16 +93,14 @@ def is_camera_email(email_data):
     return False
 
 
-def download_image(url, target_path):
-    """Lataa kuva URL:sta."""
+def download_image(url, target_path, index=None):
+    """Lataa kuva URL:sta (DuplicateImage, jos sama kuva on jo tallennettu)."""
     resp = requests.get(url, timeout=30)
     resp.raise_for_status()
     content_type = resp.headers.get('content-type', '')
     if 'image' not in content_type and len(resp.content) < 1000:
         raise ValueError(f'Ei kuva: content-type={content_type}, size={len(resp.content)}')
-    with open(target_path, 'wb') as f:
-        f.write(resp.content)
-    return len(resp.content)
+    return write_unique(index, resp.content, target_path)
 
 
 def extract_exif_metadata(image_path):
@@ -209,12 +200,13 @@ def fetch_camera_images():
     Gmail-agentin IMAP-haku tukee max ~200 tulosta per haku (120s script timeout).
     """
     IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-    processed = load_processed()
-    processed_ids = set(processed.get('processed_ids', []))
+    store = open_processed_store()
+    index = open_metadata_index(DATA_DIR)
 
     results = {
         'fetched': 0,
         'skipped': 0,
+        'duplicates': 0,
         'errors': [],
         'new_images': [],
     }
@@ -232,7 +224,7 @@ def fetch_camera_images():
 
     for msg_summary in messages:
         msg_id = str(msg_summary.get('id', ''))
-        if msg_id in processed_ids:
+        if msg_id in store:
             results['skipped'] += 1
             continue
 
@@ -248,7 +240,7 @@ def fetch_camera_images():
         email_content = extract_email_content(msg_data)
 
         if not is_camera_email(email_content):
-            processed_ids.add(msg_id)
+            store.add(msg_id)
             continue
 
         # Etsi kuva-URL body-tekstistä (LinckEazi lähettää linkin, ei liitettä)
@@ -271,10 +263,13 @@ def fetch_camera_images():
             for url in image_urls:
                 target_path = make_target_path(subject, email_date)
                 try:
-                    download_image(url, target_path)
+                    download_image(url, target_path, index)
                     save_image_with_metadata(target_path, email_content, source_url=url)
                     results['fetched'] += 1
                     results['new_images'].append(target_path.name)
+                    index_file(index, 'index_image_file', target_path)
+                except DuplicateImage:
+                    results['duplicates'] += 1
                 except Exception as e:
                     results['errors'].append(f'Kuvan lataus epäonnistui ({url}): {e}')
         else:
@@ -287,20 +282,20 @@ def fetch_camera_images():
                 target_path = make_target_path(filename, email_date)
                 try:
                     image_data = base64.b64decode(att.get('data', ''))
-                    with open(target_path, 'wb') as f:
-                        f.write(image_data)
+                    write_unique(index, image_data, target_path)
                     save_image_with_metadata(target_path, email_content)
                     results['fetched'] += 1
                     results['new_images'].append(target_path.name)
+                    index_file(index, 'index_image_file', target_path)
+                except DuplicateImage:
+                    results['duplicates'] += 1
                 except Exception as e:
                     results['errors'].append(f'Liitteen {filename} tallennus epäonnistui: {e}')
 
-        processed_ids.add(msg_id)
+        store.add(msg_id)
 
-    # Tallenna käsitellyt
-    processed['processed_ids'] = list(processed_ids)
-    processed['last_fetch'] = datetime.now().isoformat()
-    save_processed(processed)
+    store.set('last_fetch', datetime.now().isoformat())
+    store.compact()
 
     return results
 
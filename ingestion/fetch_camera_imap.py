@@ -14,6 +14,9 @@ import imaplib
 import json
 import os
 import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from email.header import decode_header
 from pathlib import Path
@@ -21,13 +24,28 @@ from pathlib import Path
 import requests
 import yaml
 
+from ingestion.dedup import DuplicateImage, claim_image, release_image, write_unique
+from ingestion.mime_stream import parse_message_stream, remove_stale_parts
+from storage.metadata_index import index_file, open_metadata_index
+
 DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
 IMAGE_DIR = DATA_DIR / 'images' / 'incoming'
-PROCESSED_FILE = DATA_DIR / 'processed_emails.json'
 
 IMAP_SERVER = 'imap.gmail.com'
 IMAP_PORT = 993
 
+# Samanaikaiset kuvalataukset (ja EXIF-/metatiedostojen kirjoitus)
+DOWNLOAD_WORKERS = int(os.environ.get('FETCH_DOWNLOAD_WORKERS', 8))
+# Viestejä yhdessä UID FETCH -komennossa
+FETCH_BATCH_SIZE = int(os.environ.get('FETCH_BATCH_SIZE', 25))
+# Tätä suuremmat viestit haetaan osissa (BODY.PEEK[]<offset.length>)
+STREAM_THRESHOLD_BYTES = int(os.environ.get('FETCH_STREAM_THRESHOLD_BYTES', 2 * 1024 * 1024))
+PARTIAL_FETCH_BYTES = 1024 * 1024
+# Enimmäismäärä viestejä yhdellä kierroksella (uusimmat ensin)
+MAX_MESSAGES_PER_RUN = 500
+
+SENDER_CRITERIA = 'FROM "linckeazi.com"'
+
 # LinckEazi kuvien URL-pattern (Aliyun OSS)
 LINCKEAZI_IMAGE_PATTERN = re.compile(
     r'https?://[^"<>\s]*\.(?:aliyuncs|linckeazi)\.com/[^"<>\s]*\.(?:jpg|jpeg|png)',
@@ -81,78 +99,35 @@ def decode_mime_header(value):
     return ' '.join(parts)
 
 
-def get_email_body(msg):
-    """Pura sähköpostin tekstisisältö."""
-    body = ''
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            if content_type in ('text/plain', 'text/html'):
-                try:
-                    payload = part.get_payload(decode=True)
-                    charset = part.get_content_charset() or 'utf-8'
-                    body += payload.decode(charset, errors='ignore')
-                except Exception:
-                    pass
-    else:
-        try:
-            payload = msg.get_payload(decode=True)
-            charset = msg.get_content_charset() or 'utf-8'
-            body = payload.decode(charset, errors='ignore')
-        except Exception:
-            pass
-    return body
-
-
-def get_image_attachments(msg):
-    """Pura kuva-liitteet sähköpostista."""
-    attachments = []
-    if not msg.is_multipart():
-        return attachments
-
-    for part in msg.walk():
-        content_type = part.get_content_type()
-        filename = part.get_filename()
-        if filename:
-            filename = decode_mime_header(filename)
-
-        if content_type.startswith('image/') or (
-            filename and filename.lower().endswith(('.jpg', '.jpeg', '.png'))
-        ):
-            payload = part.get_payload(decode=True)
-            if payload:
-                attachments.append({
-                    'filename': filename or 'image.jpg',
-                    'data': payload,
-                })
-    return attachments
-
-
-def load_processed():
-    """Lataa käsiteltyjen viestien ID:t."""
-    if PROCESSED_FILE.exists():
-        with open(PROCESSED_FILE, 'r') as f:
-            return json.load(f)
-    return {'processed_ids': [], 'last_fetch': None}
-
-
-def save_processed(data):
-    """Tallenna käsitellyt viestin ID:t."""
-    PROCESSED_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(PROCESSED_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
-
-
-def download_image(url, target_path):
-    """Lataa kuva URL:sta."""
-    resp = requests.get(url, timeout=30)
+def open_processed_store():
+    """Avaa käsiteltyjen viestien varasto (siirtää processed_emails.json:n)."""
+    from storage.processed_messages import open_processed_store as open_store
+    return open_store(DATA_DIR)
+
+
+_session_local = threading.local()
+
+
+def get_http_session():
+    """Säiekohtainen requests.Session; keep-alive säilyy saman palvelimen latauksissa."""
+    session = getattr(_session_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session_local.session = session
+    return session
+
+
+def download_image(url, target_path, session=None, index=None):
+    """Lataa kuva URL:sta (DuplicateImage, jos sama kuva on jo tallennettu)."""
+    resp = (session or get_http_session()).get(url, timeout=30)
     resp.raise_for_status()
     content_type = resp.headers.get('content-type', '')
     if 'image' not in content_type and len(resp.content) < 1000:
         raise ValueError(f'Ei kuva: content-type={content_type}, size={len(resp.content)}')
-    with open(target_path, 'wb') as f:
-        f.write(resp.content)
-    return len(resp.content)
+    return write_unique(index, resp.content, target_path)
 
 
 def extract_exif_metadata(image_path):
@@ -215,8 +190,14 @@ def save_image_with_metadata(image_path, subject, sender, date_str, body, source
         json.dump(meta, f, indent=2, ensure_ascii=False)
 
 
-def make_target_path(subject, email_date_str):
-    """Luo kohdetiedostonimi sähköpostin tiedoista."""
+def make_target_path(subject, email_date_str, reserved=None):
+    """
+    Luo kohdetiedostonimi sähköpostin tiedoista.
+
+    reserved: tässä noudossa jo varatut polut. Rinnakkaiset lataukset eivät
+    ole vielä kirjoittaneet tiedostoja levylle, joten törmäykset tarkistetaan
+    myös varauksia vasten; varattu polku lisätään joukkoon.
+    """
     filename_match = re.search(r'(\d+_\d+_\d+_\d+\.jpg)', subject, re.IGNORECASE)
     if filename_match:
         filename = filename_match.group(1)
@@ -231,27 +212,252 @@ def make_target_path(subject, email_date_str):
     target_path = IMAGE_DIR / safe_name
 
     counter = 1
-    while target_path.exists():
+    while target_path.exists() or (reserved is not None and target_path in reserved):
         stem = Path(safe_name).stem
         ext = Path(safe_name).suffix
         target_path = IMAGE_DIR / f"{stem}_{counter}{ext}"
         counter += 1
 
+    if reserved is not None:
+        reserved.add(target_path)
     return target_path
 
 
-def fetch_camera_images():
+def _store_url_image(url, target_path, subject, sender, date_iso, body, index=None):
+    """Latausvaihe: lataa kuva ja kirjoita metatiedosto (ajetaan työsäikeessä)."""
+    download_image(url, target_path, index=index)
+    save_image_with_metadata(target_path, subject, sender, date_iso, body, source_url=url)
+
+
+def _store_attachment(attachment, target_path, subject, sender, date_iso, body, index=None):
+    """Nimeä purettu liite lopulliseksi ja kirjoita metatiedosto (työsäikeessä)."""
+    try:
+        # Tiiviste laskettiin purun aikana; kaksoiskappale ei päädy kuvahakemistoon
+        claim_image(index, target_path.name, attachment.sha256, attachment.temp_path)
+    except DuplicateImage:
+        attachment.discard()
+        raise
+    try:
+        attachment.commit(target_path)
+    except BaseException:
+        release_image(index, target_path.name)
+        raise
+    save_image_with_metadata(target_path, subject, sender, date_iso, body)
+
+
+def get_mailbox_uid_state(mail):
+    """
+    UIDVALIDITY ja UIDNEXT SELECT-komennon vastauksesta.
+
+    Returns:
+        tuple: (uidvalidity, uidnext); uidnext on None, jos palvelin ei kerro sitä
+    """
+    def untagged_int(name):
+        _, data = mail.response(name)
+        if data and data[0]:
+            return int(data[0])
+        return None
+
+    uidvalidity = untagged_int('UIDVALIDITY')
+    uidnext = untagged_int('UIDNEXT')
+    if uidvalidity is None:
+        _, data = mail.status('INBOX', '(UIDVALIDITY UIDNEXT)')
+        text = data[0].decode() if data and data[0] else ''
+        m = re.search(r'UIDVALIDITY (\d+)', text)
+        uidvalidity = int(m.group(1)) if m else 0
+        m = re.search(r'UIDNEXT (\d+)', text)
+        uidnext = int(m.group(1)) if m else None
+    return uidvalidity, uidnext
+
+
+def _parse_uids(data):
+    if not data or not data[0]:
+        return []
+    return [int(u) for u in data[0].split()]
+
+
+def search_new_uids(mail, store, uidvalidity):
+    """
+    Hae käsittelemättömien kameraviestien UID:t.
+
+    Kun UIDVALIDITY on ennallaan, haetaan vain `UID n+1:*`, joten tyhjä
+    kierros ei riipu postilaatikon koosta. Jos UIDVALIDITY on vaihtunut
+    (postilaatikko rakennettu uudelleen), haetaan viimeisimmän noudon
+    päivästä alkaen. Ensimmäisellä UID-kierroksella vanhat
+    järjestysnumeroihin perustuvat tunnisteet muunnetaan UID:iksi.
+
+    Returns:
+        tuple: (uids, skipped) — uids nousevassa järjestyksessä
+
+    Raises:
+        imaplib.IMAP4.error: jos haku epäonnistuu
+    """
+    last_uid = store.get('imap_last_uid')
+    stored_validity = store.get('imap_uidvalidity')
+
+    if stored_validity == uidvalidity and last_uid is not None:
+        status, data = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*', SENDER_CRITERIA)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f'UID SEARCH: {status}')
+        # `n+1:*` palauttaa aina vähintään suurimman UID:n, vaikka se olisi <= n
+        return [u for u in _parse_uids(data) if u > last_uid], 0
+
+    criteria = [SENDER_CRITERIA]
+    if stored_validity is not None and store.get('last_fetch'):
+        since = datetime.fromisoformat(store.get('last_fetch')).strftime('%d-%b-%Y')
+        print(f"UIDVALIDITY vaihtui ({stored_validity} -> {uidvalidity}), haetaan {since} alkaen")
+        criteria.insert(0, f'SINCE {since}')
+
+    status, data = mail.uid('SEARCH', None, *criteria)
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f'UID SEARCH: {status}')
+    uids = _parse_uids(data)
+
+    skipped = 0
+    if stored_validity is None and len(store):
+        # Järjestysnumerot ja UID:t ovat samassa järjestyksessä
+        status, data = mail.search(None, f'({SENDER_CRITERIA})')
+        seq_nums = data[0].split() if status == 'OK' and data and data[0] else []
+        if len(seq_nums) == len(uids):
+            done = {uid for seq, uid in zip(seq_nums, uids) if seq.decode() in store}
+            skipped = len(done)
+            uids = [u for u in uids if u not in done]
+
+    return uids, skipped
+
+
+def fetch_messages(mail, uids):
+    """
+    Hae viestit UID-erissä (FETCH_BATCH_SIZE kerrallaan).
+
+    Pienet viestit haetaan yhdellä FETCH-komennolla erää kohden; yli
+    STREAM_THRESHOLD_BYTES kokoiset haetaan osahakuina, jolloin viesti ei
+    ole koskaan kokonaan muistissa. Lohkot on luettava loppuun ennen
+    seuraavaa viestiä.
+
+    Yields:
+        tuple: (uid, tavulohkojen iteraattori) — puuttuvat viestit jätetään pois
+    """
+    for start in range(0, len(uids), FETCH_BATCH_SIZE):
+        batch = uids[start:start + FETCH_BATCH_SIZE]
+        status, data = mail.uid('FETCH', _uid_set(batch), '(UID RFC822.SIZE)')
+        if status != 'OK':
+            continue
+        sizes = _parse_sizes(data)
+        small = [u for u in batch if u in sizes and sizes[u] <= STREAM_THRESHOLD_BYTES]
+        raws = {}
+        if small:
+            status, data = mail.uid('FETCH', _uid_set(small), '(UID BODY.PEEK[])')
+            if status == 'OK':
+                raws = dict(_parse_fetch_response(data))
+        for uid in batch:
+            if uid in raws:
+                yield uid, iter([raws.pop(uid)])
+            elif uid in sizes and uid not in small:
+                yield uid, _iter_partial(mail, uid, sizes[uid])
+
+
+def _uid_set(uids):
+    return ','.join(str(u) for u in uids)
+
+
+def _parse_sizes(data):
+    sizes = {}
+    for item in data or []:
+        text = item[0] if isinstance(item, tuple) else item
+        if not isinstance(text, bytes):
+            continue
+        uid = re.search(rb'UID (\d+)', text)
+        size = re.search(rb'RFC822\.SIZE (\d+)', text)
+        if uid and size:
+            sizes[int(uid.group(1))] = int(size.group(1))
+    return sizes
+
+
+def _iter_partial(mail, uid, size):
+    """Hae viesti PARTIAL_FETCH_BYTES kokoisina osina."""
+    for offset in range(0, size, PARTIAL_FETCH_BYTES):
+        status, data = mail.uid(
+            'FETCH', str(uid), f'(UID BODY.PEEK[]<{offset}.{PARTIAL_FETCH_BYTES}>)'
+        )
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f'UID FETCH {uid} <{offset}>: {status}')
+        parts = _parse_fetch_response(data)
+        if not parts or not parts[0][1]:
+            return
+        yield parts[0][1]
+
+
+def _parse_fetch_response(data):
+    """Pura (uid, raw) -parit FETCH-vastauksesta; UID voi olla literaalin jälkeen."""
+    messages = []
+    pending_raw = None
+    for item in data or []:
+        if isinstance(item, tuple):
+            header, raw = item[0], item[1]
+            m = re.search(rb'UID (\d+)', header)
+            if m:
+                messages.append((int(m.group(1)), raw))
+                pending_raw = None
+            else:
+                pending_raw = raw
+        elif isinstance(item, bytes) and pending_raw is not None:
+            m = re.search(rb'UID (\d+)', item)
+            if m:
+                messages.append((int(m.group(1)), pending_raw))
+            pending_raw = None
+    return messages
+
+
+def _collect_message(pending, results, store, index):
+    """
+    Kirjaa valmiin viestin lataukset viestien alkuperäisessä järjestyksessä.
+
+    Viesti merkitään käsitellyksi vasta, kun kaikki sen lataukset ovat
+    valmiita (onnistuneita tai epäonnistuneita), kuten peräkkäisessäkin
+    noudossa.
+    """
+    msg_id_str, jobs = pending.popleft()
+    for future, target_path, error_text in jobs:
+        try:
+            future.result()
+            results['fetched'] += 1
+            results['new_images'].append(target_path.name)
+            index_file(index, 'index_image_file', target_path)
+        except DuplicateImage:
+            results['duplicates'] += 1
+        except Exception as e:
+            results['errors'].append(f'{error_text}: {e}')
+    store.add(msg_id_str)
+
+
+def _head_done(pending):
+    return pending and all(future.done() for future, _, _ in pending[0][1])
+
+
+def fetch_camera_images(download_workers=None):
     """Hae uudet riistakamerakuvat suoraan IMAP:lla.
 
     Ohittaa Gmail-agentin kokonaan — ei Haiku-tokeneita.
+
+    Uudet viestit haetaan UID:n perusteella (suurimman käsitellyn UID:n
+    jälkeen) ja FETCH tehdään erissä. Viestit haetaan IMAP:lla
+    pääsäikeessä; kuvalataukset ja metatiedostojen kirjoitus ajetaan
+    rinnakkain (download_workers, oletus DOWNLOAD_WORKERS). Tiedostonimet
+    varataan viestien järjestyksessä, joten nimeäminen on sama kuin
+    peräkkäisessä noudossa.
     """
     IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-    processed = load_processed()
-    processed_ids = set(processed.get('processed_ids', []))
+    stale = remove_stale_parts(IMAGE_DIR)
+    if stale:
+        print(f"Poistettiin {stale} keskeneräistä liitetiedostoa edellisestä noudosta")
+    store = open_processed_store()
+    index = open_metadata_index(DATA_DIR)
 
     results = {
         'fetched': 0,
         'skipped': 0,
+        'duplicates': 0,
         'errors': [],
         'new_images': [],
     }
@@ -270,37 +476,42 @@ def fetch_camera_images():
         results['errors'].append(f'IMAP-yhteys epäonnistui: {e}')
         return results
 
+    workers = max(1, download_workers or DOWNLOAD_WORKERS)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch-download')
+    pending = deque()  # (msg_id, [(future, target_path, virheteksti)]) viestijärjestyksessä
+    reserved = set()
+
+    uidvalidity = None
+    candidates = []
     try:
-        # Hae linckeazi.com-viestit
-        status, msg_ids = mail.search(None, '(FROM "linckeazi.com")')
-        if status != 'OK' or not msg_ids[0]:
-            mail.logout()
+        try:
+            uidvalidity, uidnext = get_mailbox_uid_state(mail)
+            uids, results['skipped'] = search_new_uids(mail, store, uidvalidity)
+        except imaplib.IMAP4.error as e:
+            results['errors'].append(f'IMAP-haku epäonnistui: {e}')
             return results
 
-        message_nums = msg_ids[0].split()
-
-        # Käsittele viimeisimmät ensin (max 500 kerralla)
-        message_nums = message_nums[-500:]
-
-        for msg_num in message_nums:
-            msg_id_str = msg_num.decode()
-
-            if msg_id_str in processed_ids:
+        # Käsittele viimeisimmät (max MAX_MESSAGES_PER_RUN kerralla)
+        candidates = uids[-MAX_MESSAGES_PER_RUN:]
+        new_uids = []
+        for uid in candidates:
+            if f'{uidvalidity}:{uid}' in store:
                 results['skipped'] += 1
-                continue
+            else:
+                new_uids.append(uid)
 
-            try:
-                status, msg_data = mail.fetch(msg_num, '(RFC822)')
-                if status != 'OK':
-                    continue
+        for uid, chunks in fetch_messages(mail, new_uids):
+            msg_id_str = f'{uidvalidity}:{uid}'
+            msg = None
 
-                raw_email = msg_data[0][1]
-                msg = email.message_from_bytes(raw_email)
+            try:
+                # Liitteet puretaan suoraan IMAGE_DIR:n väliaikaistiedostoihin
+                msg = parse_message_stream(chunks, IMAGE_DIR, decode_mime_header)
 
                 # Pura headerit
-                subject = decode_mime_header(msg.get('Subject', ''))
-                sender = decode_mime_header(msg.get('From', ''))
-                date_str = msg.get('Date', '')
+                subject = decode_mime_header(msg.headers.get('Subject', ''))
+                sender = decode_mime_header(msg.headers.get('From', ''))
+                date_str = msg.headers.get('Date', '')
 
                 # Parsitaan RFC 2822 -päivämäärä
                 try:
@@ -309,7 +520,7 @@ def fetch_camera_images():
                 except Exception:
                     date_iso = date_str
 
-                body = get_email_body(msg)
+                body = msg.body
 
                 # Etsi kuva-URL:t body-tekstistä
                 image_urls = LINCKEAZI_IMAGE_PATTERN.findall(body)
@@ -322,53 +533,64 @@ def fetch_camera_images():
                             f'https://msp-thumbnail.oss-eu-central-1.aliyuncs.com/{fn_match.group(1)}'
                         ]
 
+                jobs = []
                 if image_urls:
+                    msg.discard()
                     for url in image_urls:
-                        target_path = make_target_path(subject, date_iso)
-                        try:
-                            download_image(url, target_path)
-                            save_image_with_metadata(
-                                target_path, subject, sender, date_iso, body,
-                                source_url=url,
-                            )
-                            results['fetched'] += 1
-                            results['new_images'].append(target_path.name)
-                        except Exception as e:
-                            results['errors'].append(f'Kuvan lataus epäonnistui ({url}): {e}')
+                        target_path = make_target_path(subject, date_iso, reserved)
+                        future = pool.submit(
+                            _store_url_image, url, target_path, subject, sender, date_iso, body,
+                            index,
+                        )
+                        jobs.append((future, target_path, f'Kuvan lataus epäonnistui ({url})'))
                 else:
                     # Perinteiset liitteet
-                    attachments = get_image_attachments(msg)
-                    for att in attachments:
-                        target_path = make_target_path(att['filename'], date_iso)
-                        try:
-                            with open(target_path, 'wb') as f:
-                                f.write(att['data'])
-                            save_image_with_metadata(
-                                target_path, subject, sender, date_iso, body,
-                            )
-                            results['fetched'] += 1
-                            results['new_images'].append(target_path.name)
-                        except Exception as e:
-                            results['errors'].append(
-                                f'Liitteen {att["filename"]} tallennus epäonnistui: {e}'
-                            )
-
-                processed_ids.add(msg_id_str)
+                    for att in msg.attachments:
+                        target_path = make_target_path(att.filename, date_iso, reserved)
+                        future = pool.submit(
+                            _store_attachment, att, target_path,
+                            subject, sender, date_iso, body, index,
+                        )
+                        jobs.append((
+                            future, target_path,
+                            f'Liitteen {att.filename} tallennus epäonnistui',
+                        ))
+
+                pending.append((msg_id_str, jobs))
 
             except Exception as e:
                 results['errors'].append(f'Viestin {msg_id_str} käsittely epäonnistui: {e}')
-                processed_ids.add(msg_id_str)
+                store.add(msg_id_str)
+                if msg is not None:
+                    msg.discard()
+
+            # Kirjaa jo valmistuneet viestit, kun seuraavaa haetaan IMAP:lla
+            while _head_done(pending):
+                _collect_message(pending, results, store, index)
 
     finally:
+        while pending:
+            _collect_message(pending, results, store, index)
+        pool.shutdown(wait=True)
         try:
             mail.logout()
         except Exception:
             pass
 
-    # Tallenna käsitellyt
-    processed['processed_ids'] = list(processed_ids)
-    processed['last_fetch'] = datetime.now().isoformat()
-    save_processed(processed)
+    # Suurin käsitelty UID: eteenpäin vain yhtenäisesti käsiteltyihin asti,
+    # jotta epäonnistunut FETCH yritetään uudelleen seuraavalla kierroksella
+    last_uid = store.get('imap_last_uid') or 0
+    if store.get('imap_uidvalidity') != uidvalidity:
+        last_uid = 0
+    unfinished = [u for u in candidates if f'{uidvalidity}:{u}' not in store]
+    if unfinished:
+        last_uid = max(last_uid, min(unfinished) - 1)
+    else:
+        last_uid = max([last_uid] + candidates + ([uidnext - 1] if uidnext else []))
+    store.set('imap_uidvalidity', uidvalidity)
+    store.set('imap_last_uid', last_uid)
+    store.set('last_fetch', datetime.now().isoformat())
+    store.compact()
 
     return results
 
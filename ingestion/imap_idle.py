@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+IMAP IDLE -odotus (RFC 2177) uusien kameraviestien havaitsemiseen.
+
+imaplib ei tue IDLEä, joten odotus luetaan suoraan soketista omalla
+yhteydellä; nouto käyttää erillistä yhteyttä. Peräkkäiset
+EXISTS-ilmoitukset (kameran kuvasarja) yhdistetään yhdeksi herätykseksi.
+"""
+import imaplib
+import select
+import socket
+import ssl
+import time
+
+# RFC 2177: IDLE uusitaan ennen palvelimen 30 min aikakatkaisua
+IDLE_RENEW_SECONDS = 29 * 60
+
+
+class IdleUnsupported(Exception):
+    """Palvelin ei tue IDLE-komentoa."""
+
+
+class _SocketLines:
+    """Rivien luku soketista aikakatkaisulla (ohittaa imaplibin puskurin)."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b''
+
+    def readline(self, timeout):
+        """Palauta seuraava rivi tai None, jos aikaraja umpeutuu."""
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self.buf:
+            pending = self.sock.pending() if isinstance(self.sock, ssl.SSLSocket) else 0
+            if not pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                readable, _, _ = select.select([self.sock], [], [], remaining)
+                if not readable:
+                    return None
+            try:
+                data = self.sock.recv(65536)
+            except ssl.SSLWantReadError:
+                continue
+            if not data:
+                raise ConnectionError('IMAP-yhteys katkesi')
+            self.buf += data
+        line, _, self.buf = self.buf.partition(b'\n')
+        return line + b'\n'
+
+
+class ImapIdleWatcher:
+    """
+    Pysyvä IDLE-yhteys postilaatikkoon.
+
+    Args:
+        connect: Funktio, joka palauttaa kirjautuneen ja SELECT-tilassa olevan
+            imaplib-yhteyden
+        coalesce_seconds: Odota näin kauan hiljaisuutta ensimmäisen
+            ilmoituksen jälkeen, jotta kuvasarja noudetaan kerralla
+        max_coalesce_seconds: Yhdistämisikkunan enimmäispituus
+    """
+
+    def __init__(self, connect, coalesce_seconds=10.0, max_coalesce_seconds=60.0,
+                 renew_seconds=IDLE_RENEW_SECONDS):
+        self.connect = connect
+        self.coalesce_seconds = coalesce_seconds
+        self.max_coalesce_seconds = max_coalesce_seconds
+        self.renew_seconds = renew_seconds
+        self.mail = None
+        self.lines = None
+        self.last_events = []
+        self.last_event_at = None
+
+    def _ensure_connected(self):
+        if self.mail is not None:
+            return
+        mail = self.connect()
+        if 'IDLE' not in mail.capabilities:
+            mail.logout()
+            raise IdleUnsupported('Palvelin ei tue IMAP IDLE -komentoa')
+        self.mail = mail
+        self.lines = _SocketLines(mail.sock)
+
+    def wait_for_mail(self, timeout=None):
+        """
+        Odota uutta postia enintään timeout sekuntia.
+
+        Returns:
+            bool: True jos uutta postia tuli (ilmoitukset yhdistetty), False
+            jos aikaraja tai IDLE-uusinta umpeutui
+
+        Raises:
+            OSError, imaplib.IMAP4.error: yhteysvirheet (kutsuja yhdistää uudelleen)
+        """
+        self._ensure_connected()
+        wait = self.renew_seconds if timeout is None else min(timeout, self.renew_seconds)
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b' IDLE\r\n')
+        try:
+            first = self.lines.readline(30)
+            if first is None or not first.startswith(b'+'):
+                raise imaplib.IMAP4.error(f'IDLE hylättiin: {first!r}')
+
+            events = []
+            deadline = time.monotonic() + wait
+            window_end = None
+            while True:
+                now = time.monotonic()
+                limit = deadline if window_end is None else window_end
+                if now >= limit:
+                    break
+                line = self.lines.readline(limit - now)
+                if line is None:
+                    break
+                if line.startswith(b'* BYE'):
+                    raise ConnectionError(line.decode(errors='ignore').strip())
+                if line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line):
+                    now = time.monotonic()
+                    if not events:
+                        self.last_event_at = time.time()
+                        hard_end = now + self.max_coalesce_seconds
+                    events.append(line.strip())
+                    window_end = min(now + self.coalesce_seconds, hard_end)
+        finally:
+            self._done(tag)
+
+        self.last_events = events
+        return bool(events)
+
+    def _done(self, tag):
+        """Lopeta IDLE ja lue tagattu vastaus."""
+        try:
+            self.mail.send(b'DONE\r\n')
+            while True:
+                line = self.lines.readline(30)
+                if line is None:
+                    raise socket.timeout('IDLE DONE ei vastannut')
+                if line.startswith(tag):
+                    return
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        mail, self.mail, self.lines = self.mail, None, None
+        if mail is not None:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
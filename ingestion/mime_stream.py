@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Viestin MIME-rakenteen jäsennys virtana.
+
+Viestiä ei muodosteta kokonaisena muistiin: rivit luetaan tavulohkoista,
+kuvaliitteet puretaan suoraan väliaikaistiedostoihin kohdehakemistoon ja
+tekstiosat kerätään listaan, joka yhdistetään kerran. Muistinkäyttö on
+rajattu lohkon ja yhden rivin kokoon riippumatta liitteiden määrästä.
+
+Väliaikaistiedostot (.part) nimetään lopulliseen nimeen vasta, kun viesti
+on käsitelty (StreamedAttachment.commit), joten keskeneräinen liite ei
+koskaan näy kuvana. Tyhjät kuvaosat ohitetaan, ja kaatuneen noudon jättämät
+.part-tiedostot poistetaan seuraavan noudon alussa (remove_stale_parts).
+"""
+import binascii
+import hashlib
+import os
+import quopri
+import tempfile
+import time
+from email.parser import BytesHeaderParser
+from pathlib import Path
+
+# Rivin enimmäispituus; tätä pidempi rivi luovutetaan osissa
+MAX_LINE = 64 * 1024
+# Tekstiosien enimmäiskoko viestiä kohden (kameroiden viestit ovat pieniä)
+MAX_BODY_BYTES = 1024 * 1024
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+PART_PREFIX, PART_SUFFIX = '.incoming-', '.part'
+# Tätä vanhempi .part-tiedosto on kaatuneen noudon jäänne (kirjoitus päivittää mtimen)
+STALE_PART_SECONDS = 3600
+
+
+class StreamedAttachment:
+    """Väliaikaistiedostoon purettu liite."""
+
+    def __init__(self, filename, content_type, temp_path):
+        self.filename = filename
+        self.content_type = content_type
+        self.temp_path = Path(temp_path)
+        self.size = 0
+        self.sha256 = None  # sisällön SHA-256 (hex), lasketaan purun aikana
+
+    def commit(self, target_path):
+        """Siirrä valmis liite lopulliseen nimeen (atominen rename)."""
+        os.replace(self.temp_path, target_path)
+        return Path(target_path)
+
+    def discard(self):
+        self.temp_path.unlink(missing_ok=True)
+
+
+class StreamedMessage:
+    """Jäsennetyn viestin otsikot, tekstisisältö ja liitteet."""
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.body = ''
+        self.attachments = []
+
+    def discard(self):
+        """Poista liitteiden väliaikaistiedostot (esim. URL-viesteissä)."""
+        for att in self.attachments:
+            att.discard()
+
+
+def iter_lines(chunks):
+    """
+    Pilko tavulohkot riveiksi (rivinvaihdot mukana).
+
+    Yields:
+        tuple: (rivi, alkaako rivi rivin alusta)
+    """
+    buf = b''
+    at_start = True
+    for chunk in chunks:
+        data = buf + chunk if buf else chunk
+        pos = 0
+        while True:
+            nl = data.find(b'\n', pos)
+            if nl < 0:
+                break
+            yield data[pos:nl + 1], at_start
+            at_start = True
+            pos = nl + 1
+        buf = data[pos:]
+        if len(buf) > MAX_LINE:
+            yield buf, at_start
+            buf = b''
+            at_start = False
+    if buf:
+        yield buf, at_start
+
+
+# ---------- osien kohteet ----------
+
+class _Base64FileSink:
+    """Puraa base64-rivit suoraan tiedostoon."""
+
+    def __init__(self, f):
+        self.f = f
+        self.rest = b''
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.f.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def feed(self, line):
+        data = self.rest + b''.join(line.split())
+        n = len(data) // 4 * 4
+        if n:
+            self.write(binascii.a2b_base64(data[:n]))
+        self.rest = data[n:]
+
+    def close(self):
+        if self.rest:
+            padded = self.rest + b'=' * (-len(self.rest) % 4)
+            try:
+                self.write(binascii.a2b_base64(padded))
+            except binascii.Error:
+                pass
+        self.f.close()
+
+
+class _RawFileSink:
+    """Kirjoittaa 7bit/8bit/binary- tai quoted-printable-osan tiedostoon."""
+
+    def __init__(self, f, quoted_printable=False):
+        self.f = f
+        self.qp = quoted_printable
+        self.pending_newline = b''
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.f.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def feed(self, line):
+        if self.qp:
+            self.write(binascii.a2b_qp(line))
+            return
+        # Viimeinen rivinvaihto kuuluu rajariviin, joten se kirjoitetaan vasta
+        # kun tiedetään, että osa jatkuu.
+        content = line.rstrip(b'\r\n')
+        newline = line[len(content):]
+        self.write(self.pending_newline + content)
+        self.pending_newline = newline
+
+    def close(self):
+        self.f.close()
+
+
+class _TextSink:
+    """Kerää tekstiosan rivit; puretaan kerran osan lopussa."""
+
+    def __init__(self, encoding, charset, budget):
+        self.encoding = encoding
+        self.charset = charset
+        self.lines = []
+        self.budget = budget
+        self.size = 0
+
+    def feed(self, line):
+        if self.size + len(line) <= self.budget:
+            self.lines.append(line)
+            self.size += len(line)
+
+    def text(self):
+        raw = b''.join(self.lines)
+        try:
+            if self.encoding == 'base64':
+                raw = binascii.a2b_base64(b''.join(raw.split()))
+            elif self.encoding == 'quoted-printable':
+                raw = quopri.decodestring(raw)
+        except (binascii.Error, ValueError):
+            pass
+        try:
+            return raw.decode(self.charset, errors='ignore')
+        except LookupError:
+            return raw.decode('utf-8', errors='ignore')
+
+    def close(self):
+        pass
+
+
+class _DiscardSink:
+    size = 0
+
+    def feed(self, line):
+        pass
+
+    def close(self):
+        pass
+
+
+# ---------- jäsennin ----------
+
+class _Parser:
+
+    def __init__(self, lines, temp_dir, decode_filename):
+        self.lines = lines
+        self.temp_dir = Path(temp_dir)
+        self.decode_filename = decode_filename
+        self.message = None
+        self.body_parts = []
+        self.body_budget = MAX_BODY_BYTES
+
+    def next_line(self):
+        return next(self.lines, (None, True))
+
+    def read_headers(self):
+        """Lue otsikkolohko tyhjään riviin asti."""
+        raw = []
+        while True:
+            line, _ = self.next_line()
+            if line is None or line in (b'\r\n', b'\n'):
+                break
+            raw.append(line)
+        return BytesHeaderParser().parsebytes(b''.join(raw))
+
+    @staticmethod
+    def match_boundary(line, at_start, boundaries):
+        """Palauta (raja, onko loppuraja), jos rivi on jokin avoimista rajoista."""
+        if not at_start or not line.startswith(b'--'):
+            return None
+        stripped = line.rstrip()
+        for boundary in reversed(boundaries):
+            if stripped == b'--' + boundary:
+                return boundary, False
+            if stripped == b'--' + boundary + b'--':
+                return boundary, True
+        return None
+
+    def parse(self):
+        headers = self.read_headers()
+        self.message = StreamedMessage(headers)
+        self.entity(headers, [])
+        self.message.body = ''.join(self.body_parts)
+        return self.message
+
+    def entity(self, headers, boundaries):
+        """
+        Käsittele yksi MIME-osa; palauttaa sen päättäneen rajan
+        ((raja, onko loppuraja) tai None tiedoston lopussa).
+        """
+        if headers.get_content_maintype() == 'multipart' and headers.get_boundary():
+            return self.multipart(headers.get_boundary().encode('ascii', 'ignore'), boundaries)
+        sink = self.sink_for(headers)
+        try:
+            while True:
+                line, at_start = self.next_line()
+                if line is None:
+                    return None
+                match = self.match_boundary(line, at_start, boundaries)
+                if match:
+                    return match
+                sink.feed(line)
+        finally:
+            sink.close()
+            if isinstance(sink, _TextSink):
+                self.body_parts.append(sink.text())
+                self.body_budget -= sink.size
+            elif isinstance(sink, (_Base64FileSink, _RawFileSink)):
+                if sink.size:
+                    self.message.attachments[-1].size = sink.size
+                    self.message.attachments[-1].sha256 = sink.hash.hexdigest()
+                else:
+                    # Tyhjä kuvaosa ei ole kuva: ei tallennusta eikä tiivistevarausta
+                    self.message.attachments.pop().discard()
+
+    def multipart(self, boundary, boundaries):
+        inner = boundaries + [boundary]
+        # Johdanto ensimmäiseen rajaan asti
+        while True:
+            line, at_start = self.next_line()
+            if line is None:
+                return None
+            match = self.match_boundary(line, at_start, inner)
+            if match:
+                break
+        while match and match[0] == boundary and not match[1]:
+            match = self.entity(self.read_headers(), inner)
+        if match is None or match[0] != boundary:
+            return match  # ulomman osan raja tai tiedoston loppu
+        # Loppurajan jälkeinen epilogi ulompaan rajaan asti
+        while True:
+            line, at_start = self.next_line()
+            if line is None:
+                return None
+            match = self.match_boundary(line, at_start, boundaries)
+            if match:
+                return match
+
+    def sink_for(self, headers):
+        content_type = headers.get_content_type()
+        encoding = (headers.get('Content-Transfer-Encoding') or '7bit').strip().lower()
+        filename = headers.get_filename()
+        if filename:
+            filename = self.decode_filename(filename)
+
+        if content_type.startswith('image/') or (
+            filename and filename.lower().endswith(IMAGE_SUFFIXES)
+        ):
+            f = tempfile.NamedTemporaryFile(
+                dir=self.temp_dir, prefix=PART_PREFIX, suffix=PART_SUFFIX, delete=False,
+            )
+            self.message.attachments.append(
+                StreamedAttachment(filename or 'image.jpg', content_type, f.name)
+            )
+            if encoding == 'base64':
+                return _Base64FileSink(f)
+            return _RawFileSink(f, quoted_printable=encoding == 'quoted-printable')
+
+        if content_type in ('text/plain', 'text/html') and not filename:
+            return _TextSink(encoding, headers.get_content_charset() or 'utf-8',
+                             max(self.body_budget, 0))
+        return _DiscardSink()
+
+
+def parse_message_stream(chunks, temp_dir, decode_filename=str):
+    """
+    Jäsennä viesti tavulohkoista.
+
+    Args:
+        chunks: Iteroitava tavulohkoja (esim. IMAP-osahakujen tulokset)
+        temp_dir: Hakemisto liitteiden väliaikaistiedostoille (sama
+            tiedostojärjestelmä kuin kohde, jotta rename on atominen)
+        decode_filename: MIME-koodatun tiedostonimen purkufunktio
+
+    Returns:
+        StreamedMessage: otsikot (email.message.Message), body ja liitteet.
+        Virheen sattuessa jo kirjoitetut väliaikaistiedostot poistetaan.
+    """
+    Path(temp_dir).mkdir(parents=True, exist_ok=True)
+    parser = _Parser(iter_lines(chunks), temp_dir, decode_filename)
+    try:
+        return parser.parse()
+    except BaseException:
+        if parser.message is not None:
+            parser.message.discard()
+        raise
+
+
+def remove_stale_parts(temp_dir, max_age=STALE_PART_SECONDS):
+    """
+    Poista kaatuneen noudon jättämät väliaikaistiedostot.
+
+    Returns:
+        int: Poistettujen tiedostojen määrä
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in Path(temp_dir).glob(f'{PART_PREFIX}*{PART_SUFFIX}'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass  # Toinen nouto ehti poistaa tai nimetä sen
+    return removed
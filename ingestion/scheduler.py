@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 """
 Ajastettu kuvien nouto riistakamerasta.
-Hakee uudet kuvat 30 min välein ja ajaa tunnistuksen.
+
+Kaksi tilaa (FETCH_MODE):
+- poll (oletus): hakee uudet kuvat FETCH_INTERVAL_SECONDS välein.
+- idle: odottaa IMAP IDLE -ilmoitusta ja noutaa heti, kun uusi viesti
+  saapuu. Kuvasarjan ilmoitukset yhdistetään yhdeksi noudoksi. Yhteysvirheissä
+  palataan pollaukseen, jonka väli kasvaa eksponentiaalisesti (satunnaistettu).
+
+Edellisen erän tunnistus ajetaan taustasäikeessä samalla, kun odotetaan ja
+noudetaan seuraavaa erää. Viimeisimmän kierroksen viive (viestin saapuminen →
+ennuste kirjoitettu) tallennetaan tiedostoon DATA_DIR/scheduler_status.json
+ja näkyy /api/status-vastauksessa.
 """
+import json
 import os
+import random
+import threading
 import time
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,52 +30,311 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+IMAGE_DIR = DATA_DIR / 'images' / 'incoming'
+PREDICTION_DIR = DATA_DIR / 'predictions'
+STATUS_FILENAME = 'scheduler_status.json'
+
 FETCH_INTERVAL = int(os.environ.get('FETCH_INTERVAL_SECONDS', 1800))  # 30 min
+FETCH_MODE = os.environ.get('FETCH_MODE', 'poll')  # poll | idle
+# Kuvasarjan yhdistäminen: odota hiljaisuutta, mutta enintään maksimi-ikkuna
+IDLE_COALESCE_SECONDS = float(os.environ.get('IDLE_COALESCE_SECONDS', 10))
+IDLE_MAX_COALESCE_SECONDS = float(os.environ.get('IDLE_MAX_COALESCE_SECONDS', 60))
+# Virheiden jälkeinen uusintaväli: 30 s, 60 s, 120 s ... enintään FETCH_INTERVAL
+BACKOFF_BASE_SECONDS = float(os.environ.get('FETCH_BACKOFF_BASE_SECONDS', 30))
 
 
-def run_fetch_cycle():
-    """Aja yksi nouto- ja tunnistuskierros."""
-    from ingestion.fetch_camera_emails import fetch_camera_images
-
-    log.info("Aloitetaan kuvien nouto...")
-    result = fetch_camera_images()
-    log.info(
-        "Nouto valmis: %d uutta kuvaa, %d ohitettu, %d virhettä",
-        result.get('fetched', 0),
-        result.get('skipped', 0),
-        len(result.get('errors', [])),
-    )
-
-    # Aja tunnistus uusille kuville
-    new_images = result.get('new_images', [])
-    if new_images:
+class Backoff:
+    """
+    Eksponentiaalinen uusintaväli satunnaistuksella ("equal jitter").
+
+    Viive on välillä [d/2, d], missä d = min(maximum, base * 2^epäonnistumiset).
+    """
+
+    def __init__(self, base=BACKOFF_BASE_SECONDS, maximum=FETCH_INTERVAL, rng=random.random):
+        self.base = base
+        self.maximum = max(maximum, base)
+        self.rng = rng
+        self.failures = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.base * 2 ** self.failures)
+        self.failures += 1
+        return delay / 2 + self.rng() * delay / 2
+
+    def reset(self):
+        self.failures = 0
+
+
+def _parse_arrival(value):
+    """Metatiedoston email_date (ISO tai RFC 2822) → epoch-sekunnit."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
         try:
-            from detection.detect_batch import detect_new_images
-            det_result = detect_new_images()
-            log.info(
-                "Tunnistus valmis: %d kuvaa käsitelty",
-                det_result.get('processed', 0),
-            )
+            dt = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def measure_latency(image_names, image_dir=None, prediction_dir=None):
+    """
+    Laske viive viestin saapumisesta ennusteen kirjoittamiseen.
+
+    Saapumisaika luetaan kuvan .meta.json-tiedoston email_date-kentästä ja
+    valmistumisaika ennustetiedoston muokkausajasta.
+
+    Returns:
+        dict: images, measured, mean_seconds, p50_seconds, max_seconds
+    """
+    image_dir = Path(image_dir or IMAGE_DIR)
+    prediction_dir = Path(prediction_dir or PREDICTION_DIR)
+    latencies = []
+    for name in image_names:
+        stem = Path(name).stem
+        pred_path = prediction_dir / f'{stem}.json'
+        meta_path = image_dir / f'{stem}.meta.json'
+        if not pred_path.exists() or not meta_path.exists():
+            continue
+        try:
+            with open(meta_path, 'r') as f:
+                arrival = _parse_arrival(json.load(f).get('email_date'))
+        except (OSError, ValueError):
+            continue
+        if arrival is not None:
+            latencies.append(max(0.0, pred_path.stat().st_mtime - arrival))
+
+    stats = {'images': len(image_names), 'measured': len(latencies)}
+    if latencies:
+        latencies.sort()
+        stats.update({
+            'mean_seconds': round(sum(latencies) / len(latencies), 1),
+            'p50_seconds': round(latencies[len(latencies) // 2], 1),
+            'max_seconds': round(latencies[-1], 1),
+        })
+    return stats
+
+
+def read_status(data_dir=None):
+    """Lue ajastimen tila (None, jos ajastinta ei ole ajettu)."""
+    path = Path(data_dir or DATA_DIR) / STATUS_FILENAME
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _default_fetch(mode):
+    if mode == 'idle':
+        from ingestion.fetch_camera_imap import fetch_camera_images
+    else:
+        from ingestion.fetch_camera_emails import fetch_camera_images
+    return fetch_camera_images
+
+
+def _default_detect(image_names):
+    from detection.worker import request_detection
+    return request_detection(images=[IMAGE_DIR / name for name in image_names])
+
+
+def _default_watcher():
+    import imaplib
+    from ingestion.fetch_camera_imap import IMAP_SERVER, IMAP_PORT, get_credentials
+    from ingestion.imap_idle import ImapIdleWatcher
+
+    def connect():
+        user, password = get_credentials()
+        mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+        mail.login(user, password)
+        mail.select('INBOX', readonly=True)
+        return mail
+
+    return ImapIdleWatcher(connect, IDLE_COALESCE_SECONDS, IDLE_MAX_COALESCE_SECONDS)
+
+
+class Scheduler:
+    """
+    Nouto- ja tunnistussilmukka.
+
+    Args:
+        mode: 'poll' tai 'idle'
+        fetch: Noutofunktio (palauttaa fetch_camera_images-muotoisen dictin)
+        detect: Tunnistusfunktio, jolle annetaan uusien kuvien nimet
+        watcher: IDLE-odottaja (wait_for_mail(timeout) → bool), idle-tilassa
+        sleep: Odotusfunktio (testeissä korvattavissa)
+    """
+
+    def __init__(self, mode=None, fetch=None, detect=None, watcher=None,
+                 interval=None, backoff=None, data_dir=None, sleep=time.sleep):
+        self.mode = mode or FETCH_MODE
+        self.fetch = fetch or _default_fetch(self.mode)
+        self.detect = detect or _default_detect
+        self.watcher = watcher
+        self.interval = FETCH_INTERVAL if interval is None else interval
+        self.backoff = backoff or Backoff(maximum=self.interval)
+        self.data_dir = Path(data_dir or DATA_DIR)
+        self.sleep = sleep
+        self.detect_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scheduler-detect')
+        self.detect_future = None
+        self._status_lock = threading.Lock()
+        self.status = {'mode': self.mode, 'cycles': 0, 'consecutive_failures': 0}
+
+    # ---------- tila ----------
+
+    def _update_status(self, **fields):
+        with self._status_lock:
+            self.status.update(fields)
+            path = self.data_dir / STATUS_FILENAME
+            tmp = path.with_suffix('.tmp')
+            try:
+                self.data_dir.mkdir(parents=True, exist_ok=True)
+                with open(tmp, 'w') as f:
+                    json.dump(self.status, f, indent=2)
+                os.replace(tmp, path)
+            except OSError as e:
+                log.warning("Ajastimen tilan tallennus epäonnistui: %s", e)
+
+    # ---------- kierros ----------
+
+    def run_cycle(self, trigger='poll'):
+        """Nouda uudet kuvat ja käynnistä niiden tunnistus taustalle."""
+        started = time.time()
+        log.info("Aloitetaan kuvien nouto (%s)...", trigger)
+        result = self.fetch()
+        errors = result.get('errors', [])
+        new_images = result.get('new_images', [])
+        log.info(
+            "Nouto valmis: %d uutta kuvaa, %d ohitettu, %d virhettä",
+            result.get('fetched', 0), result.get('skipped', 0), len(errors),
+        )
+        self._update_status(
+            cycles=self.status['cycles'] + 1,
+            last_fetch={
+                'trigger': trigger,
+                'started_at': started,
+                'seconds': round(time.time() - started, 2),
+                'fetched': result.get('fetched', 0),
+                'new_images': len(new_images),
+                'errors': len(errors),
+            },
+        )
+        if new_images:
+            self.submit_detection(new_images)
+        return result
+
+    def submit_detection(self, image_names):
+        """Tunnista erä taustalla; seuraava nouto ei odota tätä."""
+        if self.detect_future is not None and not self.detect_future.done():
+            log.info("Edellisen erän tunnistus kesken, uusi erä jonoon")
+        self.detect_future = self.detect_pool.submit(self._detect, list(image_names))
+        return self.detect_future
+
+    def _detect(self, image_names):
+        started = time.time()
+        try:
+            det_result = self.detect(image_names)
         except ImportError:
             log.warning("Detection-moduulia ei löydy, ohitetaan tunnistus")
+            return None
         except Exception as e:
             log.error("Tunnistusvirhe: %s", e)
+            return None
+        latency = measure_latency(image_names, self.data_dir / 'images' / 'incoming',
+                                  self.data_dir / 'predictions')
+        log.info(
+            "Tunnistus valmis: %d kuvaa käsitelty, viive keskimäärin %s s",
+            (det_result or {}).get('processed', 0), latency.get('mean_seconds', '-'),
+        )
+        self._update_status(
+            last_detection={
+                'started_at': started,
+                'seconds': round(time.time() - started, 2),
+                'processed': (det_result or {}).get('processed', 0),
+            },
+            last_latency=latency,
+        )
+        return det_result
 
-    return result
+    # ---------- odotus ----------
 
+    def wait_for_trigger(self):
+        """
+        Odota seuraavaan noutoon.
 
-def main():
-    """Pääsilmukka: hae kuvat säännöllisin väliajoin."""
-    log.info("Riistakamera-ajastin käynnistyy (intervalli: %ds)", FETCH_INTERVAL)
+        Returns:
+            str: 'idle' (uusi posti), 'poll' (aikaraja) tai 'backoff' (IDLE-virhe)
+        """
+        if self.mode != 'idle':
+            log.info("Seuraava nouto %d sekunnin kuluttua...", self.interval)
+            self.sleep(self.interval)
+            return 'poll'
 
-    while True:
+        if self.watcher is None:
+            self.watcher = _default_watcher()
         try:
-            run_fetch_cycle()
+            if self.watcher.wait_for_mail(timeout=self.interval):
+                return 'idle'
+            return 'poll'
         except Exception as e:
-            log.error("Virhe noutokierroksessa: %s", e)
+            from ingestion.imap_idle import IdleUnsupported
+            self.watcher.close()
+            if isinstance(e, IdleUnsupported):
+                log.warning("%s, siirrytään pollaukseen", e)
+                self.mode = 'poll'
+                self._update_status(mode=self.mode)
+                return self.wait_for_trigger()
+            delay = self.backoff.next_delay()
+            log.warning("IMAP IDLE epäonnistui (%s), pollataan %.0f s kuluttua", e, delay)
+            self._update_status(consecutive_failures=self.backoff.failures)
+            self.sleep(delay)
+            return 'backoff'
+
+    def run_forever(self):
+        trigger = 'startup'
+        while True:
+            try:
+                result = self.run_cycle(trigger)
+                # Pelkkä virhe ilman noudettuja kuvia tarkoittaa yhteysongelmaa
+                if result.get('errors') and not result.get('fetched'):
+                    raise RuntimeError(result['errors'][0])
+                self.backoff.reset()
+                self._update_status(consecutive_failures=0)
+            except Exception as e:
+                delay = self.backoff.next_delay()
+                log.error("Virhe noutokierroksessa: %s (uusi yritys %.0f s kuluttua)", e, delay)
+                self._update_status(consecutive_failures=self.backoff.failures,
+                                    last_error=str(e))
+                self.sleep(delay)
+                trigger = 'retry'
+                continue
+            trigger = self.wait_for_trigger()
+
+    def close(self):
+        self.detect_pool.shutdown(wait=True)
+        if self.watcher is not None:
+            self.watcher.close()
 
-        log.info("Seuraava nouto %d sekunnin kuluttua...", FETCH_INTERVAL)
-        time.sleep(FETCH_INTERVAL)
+
+def run_fetch_cycle():
+    """Aja yksi nouto- ja tunnistuskierros (odottaa tunnistuksen)."""
+    scheduler = Scheduler(mode='poll')
+    try:
+        return scheduler.run_cycle('manual')
+    finally:
+        scheduler.close()
+
+
+def main():
+    """Pääsilmukka: hae kuvat uuden postin tai intervallin mukaan."""
+    log.info("Riistakamera-ajastin käynnistyy (tila: %s, intervalli: %ds)",
+             FETCH_MODE, FETCH_INTERVAL)
+    Scheduler().run_forever()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: MegaDetector kuva kerrallaan vs. erissä.
+
+Ajaa saman kuvajoukon detect()-polulla ja detect_many()-polulla eri
+eräkoilla ja tulostaa läpäisyn (kuvaa/s). Vaatii asennetun MegaDetectorin.
+
+    python scripts/bench_detect_batch.py --count 64 --batch-sizes 1,2,4,8
+    python scripts/bench_detect_batch.py --image-dir /data/images/incoming --count 200
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_synthetic_images(directory, count, size=(1920, 1080)):
+    """Luo kohinakuvia riistakameran resoluutiolla."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        path = Path(directory) / f'15339_25173_20260101_{i:06d}000.jpg'
+        PILImage.fromarray(pixels).save(path, 'JPEG', quality=85)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MegaDetector-eräajon läpäisymittaus')
+    parser.add_argument('--image-dir', help='Mittaa tämän hakemiston kuvilla (oletus: synteettiset)')
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--batch-sizes', default='1,2,4,8')
+    parser.add_argument('--model', default='MDV5A')
+    parser.add_argument('--with-species', action='store_true', help='Aja myös SpeciesNet')
+    args = parser.parse_args()
+
+    from detection.detector import WildlifeDetector
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.image_dir:
+            paths = sorted(
+                p for p in Path(args.image_dir).iterdir()
+                if p.suffix.lower() in {'.jpg', '.jpeg', '.png'}
+            )[:args.count]
+        else:
+            paths = make_synthetic_images(tmp, args.count)
+
+        detector = WildlifeDetector(megadetector_model=args.model, use_speciesnet=args.with_species)
+        # Lämmittely: ensimmäinen ajo sisältää mallin alustuksen
+        detector.detect(paths[0])
+
+        start = time.perf_counter()
+        for p in paths:
+            detector.detect(p)
+        baseline = len(paths) / (time.perf_counter() - start)
+        print(f'detect() kuva kerrallaan: {baseline:.2f} kuvaa/s')
+
+        for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+            start = time.perf_counter()
+            for _ in detector.detect_many(paths, batch_size=batch_size):
+                pass
+            rate = len(paths) / (time.perf_counter() - start)
+            print(f'detect_many(batch_size={batch_size}): {rate:.2f} kuvaa/s '
+                  f'({rate / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
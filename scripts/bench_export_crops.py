@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: luokittelumallin koulutusdata kokonaisina kuvina vs. rajauksina.
+
+Mittaa rajausdatasetin eksportin (ensimmäinen, ei muutoksia, --full
+välimuistin kanssa) ja koulutusnäytteen latauksen: täysikokoisen kuvan
+purku ja skaalaus (kuten -cls-koulutus YOLO-datasetista) vs. valmiin
+rajauksen purku.
+
+    python scripts/bench_export_crops.py --count 2000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f'{label}: {time.perf_counter() - start:.2f} s, rajauksia {result["total"]}, '
+          f'rajattu {result["crops_written"]}, linkitetty {result["linked"]}, '
+          f'ennallaan {result["unchanged"]}, poistettu {result["removed"]}')
+    return result
+
+
+def load_ms(paths, size):
+    from PIL import Image as PILImage
+    start = time.perf_counter()
+    for p in paths:
+        with PILImage.open(p) as img:
+            img = img.convert('RGB')
+            scale = size / min(img.size)
+            if scale < 1:
+                img.resize((round(img.width * scale), round(img.height * scale)), PILImage.BILINEAR)
+    return (time.perf_counter() - start) / len(paths) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rajausdatasetin mittaus')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=224)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    from bench_export_yolo import make_dataset
+    from export_yolo import export_crops
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        image_dir, ann_dir = make_dataset(root, args.count)
+        print(f'{args.count} kuvaa (1920x1080), rajauskoko {args.size}')
+
+        out = root / 'dataset_cls'
+        run = dict(size=args.size, workers=args.workers)
+        timed('Ensimmäinen', lambda: export_crops(ann_dir, image_dir, out, **run))
+        timed('Ei muutoksia', lambda: export_crops(ann_dir, image_dir, out, **run))
+        timed('--full (välimuisti)', lambda: export_crops(ann_dir, image_dir, out,
+                                                         incremental=False, **run))
+
+        crops = sorted(out.glob('*/*/*.jpg'))[:200]
+        frames = [image_dir / f'{p.name.rsplit("_", 1)[0]}.jpg' for p in crops]
+        full, crop = load_ms(frames, args.size), load_ms(crops, args.size)
+        print(f'Näytteen lataus: kokonainen kuva {full:.1f} ms, rajaus {crop:.2f} ms')
+        frame_mb = sum(p.stat().st_size for p in set(frames)) / len(set(frames)) / 1e6
+        crop_kb = sum(p.stat().st_size for p in crops) / len(crops) / 1e3
+        print(f'Koko: kuva {frame_mb:.2f} MB, rajaus {crop_kb:.1f} kB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: YOLO-eksportti täyskopiona vs. inkrementaalisesti.
+
+Luo synteettiset kuvat ja annotaatiot ja mittaa kolme ajoa:
+täyskopio (--full, copy-tila, kuten ennen manifestia), ensimmäinen
+linkittävä eksportti ja uudelleeneksportti ilman muutoksia. Lopuksi
+muutetaan pieni osa annotaatioista ja mitataan päivitys. Levynkäyttö
+lasketaan vain datasetin omista tiedostoista; kovalinkit jakavat
+lähdekuvien tilan.
+
+Rinnakkaisuusosio vertaa uutta eksporttia yhdellä ja --workers säikeellä
+sekä metadataindeksiin tallennetuilla mitoilla, ja kuvan koon lukua
+PIL:llä vs. otsakkeesta.
+
+    python scripts/bench_export_yolo.py --count 2000
+    python scripts/bench_export_yolo.py --count 10000 --workers 8
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_dataset(root, count, size=(1920, 1080)):
+    """Kohinaiset liukuvärikuvat EXIF-otsakkeella ja yhden bboxin annotaatiot; joka kymmenes tyhjä."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    image_dir = root / 'images'
+    ann_dir = root / 'annotations'
+    image_dir.mkdir()
+    ann_dir.mkdir()
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 200, size[0], dtype=np.float32)[None, :, None]
+    pixels = gradient + rng.normal(0, 8, (size[1], size[0], 3))
+    template = PILImage.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    exif = PILImage.Exif()
+    exif[0x010f] = 'Riistakamera'
+    exif[0x010e] = 'x' * 20000                  # kameran EXIF/esikatselukuva ennen SOF:ia
+    template.save(root / 'template.jpg', 'JPEG', quality=85, exif=exif)
+    for i in range(count):
+        stem = f'15339_25173_20260101_{i:06d}000'
+        shutil.copyfile(root / 'template.jpg', image_dir / f'{stem}.jpg')
+        write_annotation(ann_dir, stem, i)
+    return image_dir, ann_dir
+
+
+def write_annotation(ann_dir, stem, i, species=None):
+    empty = i % 10 == 0
+    data = {'image_name': f'{stem}.jpg', 'is_empty': empty, 'annotations': [] if empty else [
+        {'bbox': [100 + i % 500, 200, 600, 700], 'species': species or ('kauris', 'kettu', 'janis')[i % 3]}]}
+    (ann_dir / f'{stem}.json').write_text(json.dumps(data))
+
+
+def disk_usage(directory):
+    """Datasetin oma levynkäyttö: lähdekuvien kovalinkit ja symlinkit eivät vie tilaa."""
+    total = 0
+    for dirpath, _, files in os.walk(directory):
+        for name in files:
+            st = os.lstat(os.path.join(dirpath, name))
+            if st.st_nlink == 1 and not os.path.islink(os.path.join(dirpath, name)):
+                total += st.st_size
+    return total
+
+
+def pil_size(path):
+    from PIL import Image as PILImage
+    with PILImage.open(path) as img:
+        return img.size
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label}: {elapsed:.2f} s, tunnisteita kirjoitettu {result["labels_written"]}, '
+          f'linkitetty {result["linked"]}, kopioitu {result["copied"]}, '
+          f'ennallaan {result["unchanged"]}, poistettu {result["removed"]}, '
+          f'kokoja luettu {result["sizes_probed"]}')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YOLO-eksportin mittaus')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--changed', type=float, default=0.01, help='Muutettujen annotaatioiden osuus')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    from export_yolo import export_dataset, image_size
+    from storage.metadata_index import MetadataIndex
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        image_dir, ann_dir = make_dataset(root, args.count)
+        source_mb = sum(p.stat().st_size for p in image_dir.iterdir()) / 1e6
+        print(f'{args.count} kuvaa, {source_mb:.0f} MB')
+
+        full_dir = root / 'full'
+        timed('Täyskopio', lambda: export_dataset(ann_dir, image_dir, full_dir,
+                                                   link_mode='copy', incremental=False))
+        print(f'  levyä: {disk_usage(full_dir) / 1e6:.0f} MB')
+
+        out = root / 'dataset'
+        timed('Linkittävä, ensimmäinen', lambda: export_dataset(ann_dir, image_dir, out,
+                                                                link_mode='hardlink'))
+        print(f'  levyä (kuvat kovalinkkejä): {disk_usage(out) / 1e6:.1f} MB')
+        timed('Ei muutoksia', lambda: export_dataset(ann_dir, image_dir, out, link_mode='hardlink'))
+
+        changed = max(1, int(args.count * args.changed))
+        for i in range(1, changed + 1):
+            write_annotation(ann_dir, f'15339_25173_20260101_{i:06d}000', i, species='ilves')
+        timed(f'{changed} annotaatiota muuttunut',
+              lambda: export_dataset(ann_dir, image_dir, out, link_mode='hardlink'))
+
+        print('\nRinnakkaisuus (uusi dataset, hardlink)')
+        index = MetadataIndex(root / 'metadata.db')
+        timed('1 säie', lambda: export_dataset(ann_dir, image_dir, root / 'serial', workers=1))
+        timed(f'{args.workers} säiettä', lambda: export_dataset(
+            ann_dir, image_dir, root / 'parallel', workers=args.workers, index=index))
+        timed(f'{args.workers} säiettä, mitat indeksistä', lambda: export_dataset(
+            ann_dir, image_dir, root / 'cached', workers=args.workers, index=index))
+
+        paths = sorted(image_dir.iterdir())[:1000]
+        for label, fn in (('PIL.Image.open', pil_size), ('otsake', image_size)):
+            start = time.perf_counter()
+            for p in paths:
+                fn(p)
+            print(f'Koon luku, {label}: {(time.perf_counter() - start) / len(paths) * 1e6:.0f} µs/kuva')
+
+
+if __name__ == '__main__':
+    main()
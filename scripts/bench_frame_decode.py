@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: kuvan purku kerran (Frame) vs. purku jokaisessa vaiheessa.
+
+Vertaa tunnistusputken kuvankäsittelyä ilman malleja: vanha polku avasi
+JPEGin MegaDetectorille, koon lukemiseen ja jokaiselle bboxille erikseen;
+uusi polku purkaa kuvan kerran ja rajaa numpy-näkyminä.
+
+    python scripts/bench_frame_decode.py --count 20 --boxes 1,4,8
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from detection.frame import Frame, StageTimer, crop_box  # noqa: E402
+
+
+def make_image(path, size=(1920, 1080)):
+    import numpy as np
+    from PIL import Image as PILImage
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    PILImage.fromarray(pixels).save(path, 'JPEG', quality=85)
+
+
+def boxes_for(n, width, height):
+    w, h = width // 8, height // 6
+    return [[(i * w) % (width - w), (i * h) % (height - h),
+             (i * w) % (width - w) + w, (i * h) % (height - h) + h] for i in range(n)]
+
+
+def per_stage_decode(path, boxes, timer):
+    """Vanha polku: jokainen vaihe avaa tiedoston uudelleen."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    with timer.stage('megadetector_input'):
+        with PILImage.open(path) as img:
+            np.array(img)
+    with timer.stage('size'):
+        with PILImage.open(path) as img:
+            width, height = img.size
+    for bbox in boxes:
+        with timer.stage('crop'):
+            with PILImage.open(path) as img:
+                crop = img.crop(crop_box(bbox, img.width, img.height))
+                crop.resize((480, 480), PILImage.Resampling.LANCZOS)
+
+
+def single_decode(path, boxes, timer):
+    """Uusi polku: yksi purku, rajaukset näkyminä."""
+    from PIL import Image as PILImage
+
+    with timer.stage('decode'):
+        frame = Frame.load(path)
+    for bbox in boxes:
+        with timer.stage('crop'):
+            frame.crop_image(bbox).resize((480, 480), PILImage.Resampling.LANCZOS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kuvan purkukertojen mittaus')
+    parser.add_argument('--count', type=int, default=20, help='Toistot per bbox-määrä')
+    parser.add_argument('--boxes', default='1,4,8')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / '15339_25173_20260101_000000000.jpg'
+        make_image(path)
+        for n in (int(b) for b in args.boxes.split(',')):
+            boxes = boxes_for(n, 1920, 1080)
+            results = {}
+            for name, fn in (('vanha', per_stage_decode), ('frame', single_decode)):
+                timer = StageTimer()
+                start = time.perf_counter()
+                for _ in range(args.count):
+                    fn(path, boxes, timer)
+                results[name] = (time.perf_counter() - start) / args.count
+                stages = ', '.join(
+                    f"{stage} {v['ms_per_call']} ms x{v['calls'] // args.count}"
+                    for stage, v in timer.summary().items()
+                )
+                print(f'{n} bbox, {name}: {1000 * results[name]:.1f} ms/kuva ({stages})')
+            print(f'{n} bbox: {results["vanha"] / results["frame"]:.2f}x nopeampi')
+
+
+if __name__ == '__main__':
+    main()
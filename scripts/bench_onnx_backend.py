@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: PyTorch- vs. ONNX Runtime -päättelytausta.
+
+Ajaa saman kuvajoukon molemmilla taustoilla ja tulostaa MegaDetectorin
+latenssin (ms/kuva, mediaani ja p95), eräajon läpäisyn (kuvaa/s) sekä
+YOLO-lajimallin latenssin rajausta kohden, jos species_latest.pt on
+olemassa. Lopuksi verrataan ennusteita (sama kategoria, luottamus ja bbox
+toleranssin sisällä). Vaatii asennetun MegaDetectorin, PyTorchin ja
+onnxruntimen; ensimmäinen ajo vie mallit ONNX-muotoon (DATA_DIR/models/onnx).
+
+    python scripts/bench_onnx_backend.py --count 32
+    ONNX_INTRA_OP_THREADS=2 python scripts/bench_onnx_backend.py --image-dir /data/images/incoming
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_synthetic_images(directory, count, size=(1920, 1080)):
+    """Luo kohinakuvia riistakameran resoluutiolla."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        path = Path(directory) / f'15339_25173_20260101_{i:06d}000.jpg'
+        PILImage.fromarray(pixels).save(path, 'JPEG', quality=85)
+        paths.append(path)
+    return paths
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(detector, paths, batch_size):
+    """Latenssit kuva kerrallaan ja eräajon läpäisy."""
+    from detection.frame import Frame
+
+    detector.detect(paths[0])  # lämmittely
+    latencies = []
+    results = {}
+    for p in paths:
+        start = time.perf_counter()
+        results[p.name] = detector.detect(p)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    for _ in detector.detect_many(paths, batch_size=batch_size):
+        pass
+    throughput = len(paths) / (time.perf_counter() - start)
+
+    species = []
+    if detector.species_model is not None:
+        frame = Frame.load(paths[0])
+        bbox = [frame.width // 4, frame.height // 4, frame.width // 2, frame.height // 2]
+        detector._classify_species(frame, bbox)
+        for _ in range(20):
+            start = time.perf_counter()
+            detector._classify_species(frame, bbox)
+            species.append((time.perf_counter() - start) * 1000)
+    return {
+        'p50_ms': _percentile(latencies, 0.5),
+        'p95_ms': _percentile(latencies, 0.95),
+        'throughput': throughput,
+        'species_ms': _percentile(species, 0.5) if species else None,
+        'results': results,
+    }
+
+
+def compare(a, b, conf_tol=0.02, bbox_tol=4):
+    """Kuvat, joiden ennusteet eroavat toleranssia enemmän."""
+    differing = []
+    for name, ra in a.items():
+        pa, pb = ra['predictions'], b[name]['predictions']
+        same = len(pa) == len(pb) and all(
+            x['md_category'] == y['md_category']
+            and abs(x['md_confidence'] - y['md_confidence']) <= conf_tol
+            and all(abs(u - v) <= bbox_tol for u, v in zip(x['bbox'], y['bbox']))
+            for x, y in zip(pa, pb)
+        )
+        if not same:
+            differing.append(name)
+    return differing
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyTorch vs. ONNX Runtime -latenssimittaus')
+    parser.add_argument('--image-dir', help='Mittaa tämän hakemiston kuvilla (oletus: synteettiset)')
+    parser.add_argument('--count', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--model', default='MDV5A')
+    parser.add_argument('--species-model', help='YOLO-lajimalli (oletus: species_latest.pt)')
+    args = parser.parse_args()
+
+    from detection.detect_batch import SPECIES_MODEL
+    from detection.detector import WildlifeDetector
+
+    species_model = args.species_model or (SPECIES_MODEL if Path(SPECIES_MODEL).exists() else None)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.image_dir:
+            paths = sorted(
+                p for p in Path(args.image_dir).iterdir()
+                if p.suffix.lower() in {'.jpg', '.jpeg', '.png'}
+            )[:args.count]
+        else:
+            paths = make_synthetic_images(tmp, args.count)
+
+        measured = {}
+        for backend in ('torch', 'onnx'):
+            start = time.perf_counter()
+            detector = WildlifeDetector(megadetector_model=args.model,
+                                        species_model_path=species_model,
+                                        use_speciesnet=False, backend=backend)
+            load_s = time.perf_counter() - start
+            m = measure(detector, paths, args.batch_size)
+            measured[backend] = m
+            line = (f'{backend}: lataus {load_s:.1f} s, MegaDetector p50 {m["p50_ms"]:.0f} ms '
+                    f'p95 {m["p95_ms"]:.0f} ms, erä {m["throughput"]:.2f} kuvaa/s')
+            if m['species_ms'] is not None:
+                line += f', lajimalli {m["species_ms"]:.1f} ms/rajaus'
+            print(line)
+
+        torch_m, onnx_m = measured['torch'], measured['onnx']
+        print(f'ONNX / PyTorch: latenssi {torch_m["p50_ms"] / onnx_m["p50_ms"]:.2f}x, '
+              f'läpäisy {onnx_m["throughput"] / torch_m["throughput"]:.2f}x')
+        differing = compare(onnx_m['results'], torch_m['results'])
+        print(f'Ennusteet toleranssin sisällä: {len(paths) - len(differing)}/{len(paths)}')
+        for name in differing:
+            print(f'  eroaa: {name}')
+
+
+if __name__ == '__main__':
+    main()
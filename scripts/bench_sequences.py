@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: kuvasarjojen lajin uudelleenkäyttö.
+
+Ajaa synteettisen burst-aineiston (kamerat x sarjat x kuvat) detect_many()-
+polulla ilman sarjoja, sarjoilla ja edustajakuvatilassa ja tulostaa
+CPU-ajan (time.process_time) sekä mallikutsujen määrät. Oletuksena mallit
+ovat CPU:ta kuluttavia korvikkeita, joten mittaus toimii ilman
+MegaDetectoria; --real käyttää asennettuja malleja.
+
+    python scripts/bench_sequences.py --cameras 3 --bursts 10 --frames 5
+    python scripts/bench_sequences.py --real --with-species
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class CostlyMegaDetector:
+    """Korvike: kiinteä laskenta kuvaa kohden, yksi eläin joka liikkuu hieman."""
+
+    def __init__(self, work=60):
+        self.work = work
+        self.calls = 0
+
+    def generate_detections_one_image(self, image, image_id=None, detection_threshold=None):
+        import numpy as np
+        self.calls += 1
+        m = np.asarray(image[:128, :128, 0], dtype=np.float64)
+        for _ in range(self.work):
+            m = np.tanh(m @ m.T / 1e4)
+        frame_no = int(Path(image_id).stem[-3:]) // 100
+        return {'detections': [
+            {'bbox': [0.3 + 0.01 * frame_no, 0.3, 0.3, 0.3], 'conf': 0.9, 'category': '1'},
+        ]}
+
+
+class CostlySpeciesNet:
+    """Korvike: kiinteä laskenta rajausta kohden."""
+
+    def __init__(self, work=120):
+        self.work = work
+        self.crops = 0
+
+    def preprocess(self, crop):
+        import numpy as np
+        return np.asarray(crop, dtype=np.float64)[:96, :96, 0]
+
+    def predict(self, image_id, preprocessed):
+        import numpy as np
+        self.crops += 1
+        m = preprocessed
+        for _ in range(self.work):
+            m = np.tanh(m @ m.T / 1e4)
+        return {'classifications': {
+            'classes': ['a;mammalia;cervidae;capreolus;capreolus;roe deer'], 'scores': [0.9],
+        }}
+
+
+def make_burst_images(directory, cameras, bursts, frames, size=(640, 480)):
+    """Luo sarjakuvia: sama tausta kameraa kohden, kuvat 100 ms välein."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for c in range(cameras):
+        background = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        for b in range(bursts):
+            for f in range(frames):
+                name = f'15339_2517{c}_20260101_{b:02d}0000{f * 100:03d}.jpg'
+                path = Path(directory) / name
+                PILImage.fromarray(background).save(path, 'JPEG', quality=90)
+                paths.append(path)
+    return paths
+
+
+def _run(detector, paths, tracker):
+    if tracker is not None:
+        paths = tracker.ordered(paths)
+    start = time.process_time()
+    for _ in detector.detect_many(paths, batch_size=8, tracker=tracker):
+        pass
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kuvasarjojen CPU-säästön mittaus')
+    parser.add_argument('--cameras', type=int, default=3)
+    parser.add_argument('--bursts', type=int, default=6)
+    parser.add_argument('--frames', type=int, default=5, help='Kuvia sarjassa')
+    parser.add_argument('--real', action='store_true', help='Käytä asennettuja malleja')
+    parser.add_argument('--with-species', action='store_true', help='--real: aja SpeciesNet')
+    args = parser.parse_args()
+
+    from detection.detector import WildlifeDetector
+    from detection.sequences import SequenceTracker
+
+    def make_detector():
+        if args.real:
+            return WildlifeDetector(use_speciesnet=args.with_species)
+        detector = WildlifeDetector(use_speciesnet=False, speciesnet_batch_size=1)
+        detector.md_model = CostlyMegaDetector()
+        detector.speciesnet_classifier = CostlySpeciesNet()
+        return detector
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_burst_images(tmp, args.cameras, args.bursts, args.frames)
+        names = [p.name for p in paths]
+        print(f'{len(paths)} kuvaa, {args.cameras * args.bursts} sarjaa')
+
+        modes = [
+            ('ilman sarjoja', None),
+            ('sarjat (lajin uudelleenkäyttö)', lambda: SequenceTracker(names)),
+            ('sarjat + edustajakuvat', lambda: SequenceTracker(names, representative=True)),
+        ]
+        baseline = None
+        for label, make_tracker in modes:
+            detector = make_detector()
+            tracker = make_tracker() if make_tracker else None
+            cpu = _run(detector, paths, tracker)
+            baseline = baseline or cpu
+            line = f'{label}: {cpu:.2f} s CPU ({(1 - cpu / baseline) * 100:.0f} % säästö)'
+            if not args.real:
+                line += (f', MegaDetector {detector.md_model.calls} kutsua, '
+                         f'lajimalli {detector.speciesnet_classifier.crops} rajausta')
+            print(line)
+            if tracker is not None:
+                print(f'    {tracker.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: SpeciesNet rajaus kerrallaan vs. erissä.
+
+Synteettinen "parvi"-kuva, jossa on paljon eläinrajauksia (linnut,
+kaurisryhmät); lajitunnistusvaihe ajetaan eri SpeciesNet-eräkoilla.
+Vaatii asennetun SpeciesNetin.
+
+    python scripts/bench_speciesnet_batch.py --boxes 24 --images 4 --batch-sizes 1,8,32
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from detection.frame import Frame  # noqa: E402
+
+
+def make_flock_frames(directory, images, boxes, size=(1920, 1080)):
+    """Kohinakuvat ja bbox-ruudukko jokaiseen kuvaan."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    rng = np.random.default_rng(0)
+    cols = max(1, int(boxes ** 0.5))
+    rows = (boxes + cols - 1) // cols
+    w, h = size[0] // cols, size[1] // rows
+    jobs = []
+    for i in range(images):
+        path = Path(directory) / f'15339_25173_20260101_{i:06d}000.jpg'
+        pixels = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        PILImage.fromarray(pixels).save(path, 'JPEG', quality=85)
+        frame = Frame.load(path)
+        for b in range(boxes):
+            x, y = (b % cols) * w, (b // cols) * h
+            jobs.append((frame, [x + 5, y + 5, x + w - 5, y + h - 5]))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SpeciesNet-eräajon läpäisymittaus')
+    parser.add_argument('--images', type=int, default=4)
+    parser.add_argument('--boxes', type=int, default=16, help='Rajauksia per kuva')
+    parser.add_argument('--batch-sizes', default='1,8,16,32')
+    args = parser.parse_args()
+
+    from detection.detector import WildlifeDetector
+
+    detector = WildlifeDetector(use_speciesnet=True)
+    if detector.speciesnet_classifier is None:
+        sys.exit('SpeciesNet ei ole käytettävissä')
+    if not hasattr(detector.speciesnet_classifier, 'batch_predict'):
+        print('Huom: asennetussa SpeciesNetissä ei ole batch_predict-metodia, '
+              'kaikki eräkoot ajetaan rajaus kerrallaan')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = make_flock_frames(tmp, args.images, args.boxes)
+        detector._classify_crops(jobs[:2])  # lämmittely
+
+        baseline = None
+        for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+            detector.speciesnet_batch_size = batch_size
+            detector.timings.reset()
+            start = time.perf_counter()
+            detector._classify_crops(jobs)
+            rate = len(jobs) / (time.perf_counter() - start)
+            baseline = baseline or rate
+            stages = ', '.join(f"{k} {v['seconds']} s" for k, v in detector.stage_timings().items())
+            print(f'batch_size={batch_size}: {rate:.1f} rajausta/s '
+                  f'({rate / baseline:.2f}x; {stages})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Suorituskykymittaus: koulutuksen valmistelu eksportilla vs. suoraan annotaatioista.
+
+Mittaa ajan, joka kuluu ennen kuin ensimmäinen epookki voi alkaa:
+täyskopioeksportti (kuten ennen inkrementaalista eksporttia),
+inkrementaalinen eksportti ilman muutoksia, prepare_stream ensimmäisellä
+kerralla (kaikki kuvat dekoodataan välimuistiin) ja uudelleen (vain
+manifesti ja välimuisti luetaan). Lopuksi verrataan kuvan latausta
+koulutuksessa: täysikokoinen JPEG-dekoodaus + skaalaus vs. muistikartta.
+
+    python scripts/bench_streaming.py --count 2000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f'{label}: {time.perf_counter() - start:.2f} s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Eksportti vs. suora koulutusdata')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--imgsz', type=int, default=640)
+    args = parser.parse_args()
+
+    from PIL import Image as PILImage
+
+    from bench_export_yolo import make_dataset
+    from export_yolo import export_dataset
+    from training.streaming import prepare_stream
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        image_dir, ann_dir = make_dataset(root, args.count)
+        print(f'{args.count} kuvaa (1920x1080), imgsz {args.imgsz}')
+
+        timed('Täyskopioeksportti', lambda: export_dataset(
+            ann_dir, image_dir, root / 'full', link_mode='copy', incremental=False))
+        export_dataset(ann_dir, image_dir, root / 'dataset')
+        timed('Inkrementaalinen eksportti, ei muutoksia',
+              lambda: export_dataset(ann_dir, image_dir, root / 'dataset'))
+
+        cache_dir = root / 'cache'
+        timed('prepare_stream, ensimmäinen', lambda: prepare_stream(
+            ann_dir, image_dir, cache_dir, imgsz=args.imgsz))
+        stream = timed('prepare_stream, ei muutoksia', lambda: prepare_stream(
+            ann_dir, image_dir, cache_dir, imgsz=args.imgsz))
+        print(f'  välimuisti {stream["cache"].data_path.stat().st_size / 1e6:.0f} MB')
+
+        records = stream['records'][:200]
+        start = time.perf_counter()
+        for r in records:
+            with PILImage.open(r['path']) as img:
+                img.convert('RGB').resize((args.imgsz, args.imgsz * 9 // 16), PILImage.BILINEAR)
+        full = (time.perf_counter() - start) / len(records) * 1000
+        start = time.perf_counter()
+        for r in records:
+            stream['cache'].load(r['name'])
+        cached = (time.perf_counter() - start) / len(records) * 1000
+        print(f'Kuvan lataus koulutuksessa: dekoodaus {full:.1f} ms, muistikartta {cached:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,19 +16,18 @@ echo "Data: ${DATA_DIR}"
 echo "Aika: $(date)"
 echo ""
 
-# Tarkista dataset
-DATASET_YAML="${DATA_DIR}/dataset/dataset.yaml"
-if [ ! -f "$DATASET_YAML" ]; then
-    echo "Eksportoidaan YOLO-dataset ensin..."
-    python3 "${SCRIPT_DIR}/export_yolo.py" \
-        --annotation-dir "${DATA_DIR}/annotations" \
-        --image-dir "${DATA_DIR}/images/incoming" \
-        --output-dir "${DATA_DIR}/dataset"
-    echo ""
-fi
+# Luokittelumallille (-cls) rajausdataset: samat rajaukset kuin lajitunnistuksessa.
+# Eksportti on inkrementaalinen, joten vain uudet annotaatiot rajataan.
+DATASET_DIR="${DATA_DIR}/dataset_cls"
+echo "Päivitetään rajausdataset..."
+python3 "${SCRIPT_DIR}/export_yolo.py" --crops \
+    --annotation-dir "${DATA_DIR}/annotations" \
+    --image-dir "${DATA_DIR}/images/incoming" \
+    --output-dir "$DATASET_DIR"
+echo ""
 
-if [ ! -f "$DATASET_YAML" ]; then
-    echo "VIRHE: dataset.yaml ei löydy. Onko annotaatioita tehty?"
+if [ ! -d "${DATASET_DIR}/train" ]; then
+    echo "VIRHE: rajausdatasettia ei löydy. Onko annotaatioita tehty?"
     exit 1
 fi
 
@@ -51,7 +50,7 @@ echo ""
 # Aja koulutus
 export DATA_DIR
 python3 "${SCRIPT_DIR}/training/train.py" \
-    --dataset "$DATASET_YAML" \
+    --dataset "$DATASET_DIR" \
     --base-model "$BASE_MODEL" \
     --device mps \
     "$@"
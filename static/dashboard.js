@@ -216,7 +216,9 @@ async function loadDashboard() {
 
     // Reset sub-view pagination when filters change
     tablePage = 1;
+    tableCursor = '';
     galleryPage = 1;
+    galleryCursor = '';
 
     const qs = buildQueryParams();
     const url = '/api/dashboard' + (qs ? '?' + qs : '');
@@ -238,6 +240,7 @@ async function loadDashboard() {
         renderAIAccuracyChart(data);
         renderConfidenceChart(data);
         renderRecentFeed(data);
+        loadEvents(qs);
 
         hideLoading();
     } catch (err) {
@@ -606,11 +609,69 @@ function renderRecentFeed(data) {
     });
 }
 
+// ---- EVENTS (kuvasarjat) ----
+async function loadEvents(qs) {
+    const container = document.getElementById('events-feed');
+    try {
+        const resp = await fetch('/api/dashboard/events' + (qs ? '?' + qs : ''));
+        if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+        renderEvents(await resp.json());
+    } catch (err) {
+        console.error('Events load failed:', err);
+        container.innerHTML = '<div class="dash-empty">Tapahtumia ei voitu ladata.</div>';
+    }
+}
+
+function renderEvents(data) {
+    const container = document.getElementById('events-feed');
+    document.getElementById('events-summary').textContent =
+        data.total ? `${data.total} tapahtumaa, ${data.frames} kuvaa` : '';
+    if (!data.events || data.events.length === 0) {
+        container.innerHTML = '<div class="dash-empty">Ei tapahtumia.</div>';
+        return;
+    }
+
+    container.innerHTML = data.events.map((ev, evIdx) => {
+        const species = Object.keys(ev.species);
+        const top = species[0];
+        const colorDot = SPECIES_COLORS[top] || '#6b7280';
+        const speciesText = species.length ? species.map(label).join(', ') : 'Ei lajia';
+        const start = ev.start ? ev.start.replace('T', ' ').slice(0, 19) : '\u2014';
+        const duration = ev.duration_seconds ? ` \u00b7 ${Math.round(ev.duration_seconds)} s` : '';
+
+        return `<div class="dash-feed-item" data-idx="${evIdx}" style="cursor:pointer">
+            <img class="dash-feed-thumb" src="/api/thumbnail/${encodeURIComponent(ev.representative)}" alt="" loading="lazy">
+            <div class="dash-feed-info">
+                <span class="dash-feed-species" style="color:${colorDot}">${speciesText}</span>
+                <span class="dash-feed-meta">${start}${duration}</span>
+                <span class="dash-feed-conf">${ev.frames} kuvaa</span>
+            </div>
+        </div>`;
+    }).join('');
+
+    container.querySelectorAll('.dash-feed-item').forEach(el => {
+        el.addEventListener('click', () => {
+            const ev = data.events[parseInt(el.dataset.idx)];
+            const top = Object.keys(ev.species)[0] || '';
+            const items = ev.images.map(image => ({
+                image: image,
+                species: top,
+                camera_date: ev.start ? ev.start.slice(0, 10) : null,
+                camera_hour: ev.start ? parseInt(ev.start.slice(11, 13)) : null,
+                confidence: null,
+                from_prediction: ev.annotated === 0,
+            }));
+            openLightbox(items, Math.max(0, ev.images.indexOf(ev.representative)));
+        });
+    });
+}
+
 // ============================================================
 //  TABLE VIEW
 // ============================================================
 let tableSort = 'date_desc';
 let tablePage = 1;
+let tableCursor = '';  // keyset cursor for the next page, '' = use page number
 
 async function loadTable() {
     const qs = buildQueryParams();
@@ -618,6 +679,7 @@ async function loadTable() {
     params.set('sort', tableSort);
     params.set('page', tablePage);
     params.set('per_page', 50);
+    if (tableCursor) params.set('cursor', tableCursor);
 
     try {
         const resp = await fetch('/api/dashboard/table?' + params.toString());
@@ -679,6 +741,7 @@ function renderTable(data) {
     // Pagination
     renderPagination('table-pagination', data.page, data.total_pages, (p) => {
         tablePage = p;
+        tableCursor = p === data.page + 1 && data.next_cursor ? data.next_cursor : '';
         loadTable();
     });
 
@@ -709,6 +772,7 @@ document.addEventListener('click', (e) => {
         tableSort = field + '_desc';
     }
     tablePage = 1;
+    tableCursor = '';
     loadTable();
 });
 
@@ -716,6 +780,7 @@ document.addEventListener('click', (e) => {
 //  GALLERY VIEW
 // ============================================================
 let galleryPage = 1;
+let galleryCursor = '';
 
 async function loadGallery() {
     const qs = buildQueryParams();
@@ -724,6 +789,7 @@ async function loadGallery() {
     params.set('sort', sort);
     params.set('page', galleryPage);
     params.set('per_page', 24);
+    if (galleryCursor) params.set('cursor', galleryCursor);
 
     try {
         const resp = await fetch('/api/gallery?' + params.toString());
@@ -780,6 +846,7 @@ function renderGallery(data) {
 
     renderPagination('gallery-pagination', data.page, data.total_pages, (p) => {
         galleryPage = p;
+        galleryCursor = p === data.page + 1 && data.next_cursor ? data.next_cursor : '';
         loadGallery();
     });
 }
@@ -788,6 +855,7 @@ function renderGallery(data) {
 document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('gallery-sort').addEventListener('change', () => {
         galleryPage = 1;
+        galleryCursor = '';
         loadGallery();
     });
 });
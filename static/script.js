@@ -993,13 +993,22 @@ async function fetchNewImages() {
 
     try {
         const resp = await fetch('/api/fetch', { method: 'POST' });
-        const data = await resp.json();
+        const started = await resp.json();
 
         if (!resp.ok) {
-            showStatus(data.error || 'Haku epäonnistui', 'error');
+            showStatus(started.error || 'Haku epäonnistui', 'error');
+            return;
+        }
+
+        const job = await waitForJob(started.job_id, (j) => {
+            if (j.message === 'detecting') showStatus('Tunnistetaan uusia kuvia...', 'success');
+        });
+        if (job.status !== 'done') {
+            showStatus(job.error || 'Haku epäonnistui', 'error');
             return;
         }
 
+        const data = job.result || {};
         const fetched = data.fetched || 0;
         const detection = data.detection;
 
@@ -1023,6 +1032,18 @@ async function fetchNewImages() {
     }
 }
 
+async function waitForJob(jobId, onProgress, intervalMs = 1500) {
+    // Pollaa taustatyötä, kunnes se on valmis, epäonnistunut tai peruttu
+    while (true) {
+        const resp = await fetch(`/api/jobs/${jobId}`);
+        const job = await resp.json();
+        if (!resp.ok) throw new Error(job.error || 'Työtä ei löydy');
+        if (job.status !== 'queued' && job.status !== 'running') return job;
+        if (onProgress) onProgress(job);
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 // ===================== ACTIVE LEARNING =====================
 
 async function loadNextUncertain() {
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Pysyvä taustatyöjono (SQLite) pitkille operaatioille.
+
+Nouto, YOLO-eksportti ja koulutus ajetaan jonossa, jolloin HTTP-pyyntö
+palauttaa heti työn tunnisteen ja tilaa seurataan /api/jobs/<id>-reitiltä.
+Jokaisella työlajilla on oma säikeensä, joten saman lajin työt ajetaan
+peräkkäin mutta esim. nouto ei jää pitkän koulutuksen taakse. Tila säilyy
+uudelleenkäynnistyksen yli: jonossa olleet työt ajetaan, kesken jääneet
+merkitään epäonnistuneiksi.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+JOBS_FILENAME = 'jobs.db'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    params TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs(kind, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at);
+"""
+
+
+class JobCancelled(Exception):
+    """Työ peruttiin kesken ajon."""
+
+
+class JobContext:
+    """Työfunktiolle annettava kahva edistymiseen ja perumiseen."""
+
+    def __init__(self, queue, job_id):
+        self._queue = queue
+        self.id = job_id
+
+    def progress(self, fraction, message=None):
+        """Päivitä edistyminen (0.0-1.0) ja valinnainen tilaviesti."""
+        self._queue._update(self.id, progress=max(0.0, min(1.0, float(fraction))),
+                            message=message)
+
+    @property
+    def cancelled(self):
+        return self._queue._cancel_requested(self.id)
+
+    def check_cancelled(self):
+        """Nosta JobCancelled, jos työn perumista on pyydetty."""
+        if self.cancelled:
+            raise JobCancelled()
+
+
+class JobQueue:
+    """
+    SQLite-pohjainen työjono.
+
+    Työlajit rekisteröidään register()-kutsulla: handler(ctx, **params)
+    palauttaa tulos-dictin, joka tallennetaan työn tulokseksi.
+    """
+
+    def __init__(self, db_path, poll_seconds=1.0):
+        self.db_path = Path(db_path)
+        self.poll_seconds = poll_seconds
+        self._handlers = {}
+        self._threads = {}
+        self._wakeups = {}
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    # ---------- rekisteröinti ja käynnistys ----------
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+        self._wakeups.setdefault(kind, threading.Event())
+
+    def start(self):
+        """Merkitse kesken jääneet työt ja käynnistä säie jokaiselle työlajille."""
+        with self._lock:
+            if self._threads:
+                return
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ?',
+                    (FAILED, 'Keskeytyi palvelun uudelleenkäynnistykseen', _now(), RUNNING),
+                )
+            self._stop.clear()
+            for kind in self._handlers:
+                thread = threading.Thread(
+                    target=self._run, args=(kind,), name=f'jobs-{kind}', daemon=True
+                )
+                self._threads[kind] = thread
+                thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for event in self._wakeups.values():
+            event.set()
+        for thread in self._threads.values():
+            thread.join(timeout)
+        self._threads = {}
+
+    # ---------- työt ----------
+
+    def submit(self, kind, params=None):
+        """Lisää työ jonoon ja palauta sen tiedot."""
+        if kind not in self._handlers:
+            raise ValueError(f'Tuntematon työlaji: {kind}')
+        job_id = uuid.uuid4().hex[:12]
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, QUEUED, json.dumps(params or {}, ensure_ascii=False), _now()),
+            )
+        self._wakeups[kind].set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def active(self, kind):
+        """Jonossa oleva tai käynnissä oleva työ, tai None."""
+        row = self._connect().execute(
+            'SELECT * FROM jobs WHERE kind = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1',
+            (kind,) + ACTIVE_STATES,
+        ).fetchone()
+        return _job_dict(row) if row else None
+
+    def latest(self, kind):
+        row = self._connect().execute(
+            'SELECT * FROM jobs WHERE kind = ? ORDER BY created_at DESC LIMIT 1', (kind,)
+        ).fetchone()
+        return _job_dict(row) if row else None
+
+    def list(self, kind=None, limit=20):
+        sql = 'SELECT * FROM jobs'
+        params = []
+        if kind:
+            sql += ' WHERE kind = ?'
+            params.append(kind)
+        sql += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        return [_job_dict(r) for r in self._connect().execute(sql, params)]
+
+    def cancel(self, job_id):
+        """
+        Peru työ. Jonossa oleva työ perutaan heti; käynnissä oleva saa
+        pyynnön ja pysähtyy seuraavassa tarkistuskohdassa.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ? '
+                'WHERE id = ? AND status = ?',
+                (CANCELLED, _now(), job_id, QUEUED),
+            )
+            conn.execute(
+                'UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?',
+                (job_id, RUNNING),
+            )
+        return self.get(job_id)
+
+    # ---------- sisäiset ----------
+
+    def _update(self, job_id, **fields):
+        fields = {k: v for k, v in fields.items() if v is not None}
+        if not fields:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                list(fields.values()) + [job_id],
+            )
+
+    def _cancel_requested(self, job_id):
+        row = self._connect().execute(
+            'SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def _claim(self, kind):
+        conn = self._connect()
+        with conn:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE kind = ? AND status = ? ORDER BY created_at LIMIT 1',
+                (kind, QUEUED),
+            ).fetchone()
+            if row is None:
+                return None
+            updated = conn.execute(
+                'UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?',
+                (RUNNING, _now(), row['id'], QUEUED),
+            ).rowcount
+        return _job_dict(row) if updated else None
+
+    def _run(self, kind):
+        wakeup = self._wakeups[kind]
+        while not self._stop.is_set():
+            job = self._claim(kind)
+            if job is None:
+                wakeup.wait(self.poll_seconds)
+                wakeup.clear()
+                continue
+            self._execute(kind, job)
+
+    def _execute(self, kind, job):
+        ctx = JobContext(self, job['id'])
+        try:
+            result = self._handlers[kind](ctx, **job['params'])
+            ctx.check_cancelled()
+        except JobCancelled:
+            self._update(job['id'], status=CANCELLED, finished_at=_now())
+            return
+        except Exception as e:
+            self._update(job['id'], status=FAILED, error=str(e), finished_at=_now())
+            return
+        result = result or {}
+        if result.get('success') is False and result.get('error'):
+            self._update(job['id'], status=FAILED, error=str(result['error']),
+                         result=json.dumps(result, ensure_ascii=False, default=str),
+                         finished_at=_now())
+            return
+        self._update(job['id'], status=DONE, progress=1.0,
+                     result=json.dumps(result, ensure_ascii=False, default=str),
+                     finished_at=_now())
+
+    def wait(self, job_id, timeout=None, poll=0.05):
+        """Odota työn valmistumista (testit ja komentorivi)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] not in ACTIVE_STATES:
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                return job
+            time.sleep(poll)
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _job_dict(row):
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'progress': round(row['progress'], 4),
+        'message': row['message'],
+        'params': json.loads(row['params'] or '{}'),
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'cancel_requested': bool(row['cancel_requested']),
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+    }
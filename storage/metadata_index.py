@@ -0,0 +1,1214 @@
+#!/usr/bin/env python3
+"""
+Pysyvä metadataindeksi (SQLite) kuville, annotaatioille ja ennusteille.
+
+Analytiikkareitit kysyvät indeksistä sen sijaan, että jokainen pyyntö
+lukisi kaikki JSON-tiedostot levyltä. Kirjoituspolut (annotaation tallennus,
+tunnistus, nouto) päivittävät indeksin; koko indeksin voi rakentaa
+uudelleen JSON-tiedostoista komentoriviltä.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+IMAGE_DIR = Path(os.environ.get('IMAGE_DIR', str(DATA_DIR / 'images' / 'incoming')))
+ANNOTATION_DIR = Path(os.environ.get('ANNOTATION_DIR', str(DATA_DIR / 'annotations')))
+PREDICTION_DIR = Path(os.environ.get('PREDICTION_DIR', str(DATA_DIR / 'predictions')))
+INDEX_FILENAME = 'metadata.db'
+# Noudon tiivistevaraus ilman kuvaa vanhenee tämän jälkeen (kaatunut nouto)
+CLAIM_GRACE_SECONDS = 3600
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+
+_FILENAME_DATE_RE = re.compile(r'(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    stem TEXT NOT NULL,
+    camera_date TEXT,
+    camera_hour INTEGER,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_images_stem ON images(stem);
+CREATE INDEX IF NOT EXISTS idx_images_date ON images(camera_date, camera_hour);
+CREATE TABLE IF NOT EXISTS annotation_docs (
+    stem TEXT PRIMARY KEY,
+    is_empty INTEGER NOT NULL,
+    annotation_count INTEGER NOT NULL,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    stem TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    species TEXT NOT NULL,
+    camera_date TEXT,
+    camera_hour INTEGER,
+    md_confidence REAL,
+    species_confidence REAL,
+    confidence REAL,
+    conf_bin INTEGER,
+    from_prediction INTEGER NOT NULL,
+    original_species TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (stem, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_annotations_date ON annotations(camera_date, camera_hour);
+CREATE INDEX IF NOT EXISTS idx_annotations_species ON annotations(species);
+CREATE INDEX IF NOT EXISTS idx_annotations_timestamp ON annotations(timestamp);
+-- Taulukon ja gallerian lajittelut (ks. SORT_KEYS): kummallekin suunnalle oma
+-- indeksi, jotta sivu luetaan indeksijärjestyksessä ilman lajittelua.
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_date_asc
+    ON annotations(COALESCE(camera_date, ''), COALESCE(camera_hour, 0), stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_date_desc
+    ON annotations(COALESCE(camera_date, '') DESC, COALESCE(camera_hour, 0) DESC, stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_hour_asc
+    ON annotations(COALESCE(camera_hour, 0), stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_hour_desc
+    ON annotations(COALESCE(camera_hour, 0) DESC, stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_species_asc ON annotations(species, stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_species_desc
+    ON annotations(species DESC, stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_confidence_asc
+    ON annotations(COALESCE(confidence, 0), stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_confidence_desc
+    ON annotations(COALESCE(confidence, 0) DESC, stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_source_asc
+    ON annotations(from_prediction, stem, idx);
+CREATE INDEX IF NOT EXISTS idx_annotations_sort_source_desc
+    ON annotations(from_prediction DESC, stem, idx);
+CREATE TABLE IF NOT EXISTS prediction_docs (
+    stem TEXT PRIMARY KEY,
+    image TEXT NOT NULL,
+    prediction_count INTEGER NOT NULL,
+    max_confidence REAL,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_prediction_docs_mtime ON prediction_docs(mtime_ns);
+CREATE TABLE IF NOT EXISTS predictions (
+    stem TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    md_category TEXT,
+    md_confidence REAL,
+    species TEXT,
+    species_confidence REAL,
+    PRIMARY KEY (stem, idx)
+);
+-- Valmiiksi summatut laskurit dashboardille ja AI-yhteenvedolle.
+-- Päivätön kuva tallennetaan avaimella camera_date = '' ja camera_hour = -1.
+CREATE TABLE IF NOT EXISTS rollup_hourly (
+    camera_date TEXT NOT NULL,
+    camera_hour INTEGER NOT NULL,
+    species TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    from_prediction INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (camera_date, camera_hour, species)
+);
+CREATE TABLE IF NOT EXISTS rollup_confidence (
+    camera_date TEXT NOT NULL,
+    species TEXT NOT NULL,
+    conf_bin INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (camera_date, species, conf_bin)
+);
+CREATE TABLE IF NOT EXISTS image_hashes (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    phash TEXT,
+    phash_b0 INTEGER,
+    phash_b1 INTEGER,
+    phash_b2 INTEGER,
+    phash_b3 INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_sha256 ON image_hashes(sha256);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_b0 ON image_hashes(phash_b0);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_b1 ON image_hashes(phash_b1);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_b2 ON image_hashes(phash_b2);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_b3 ON image_hashes(phash_b3);
+CREATE TABLE IF NOT EXISTS image_sizes (
+    name TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+"""
+
+# Taulukon/gallerian lajitteluavaimet. Tasatilanteet ratkaistaan aina
+# nousevasti (stem, idx, kuvanimi), jolloin järjestys on yksikäsitteinen ja
+# sivutuksen kursori voi jatkaa viimeisestä rivistä.
+SORT_KEYS = {
+    'date': ("COALESCE(a.camera_date, '')", 'COALESCE(a.camera_hour, 0)'),
+    'hour': ('COALESCE(a.camera_hour, 0)',),
+    'species': ('a.species',),
+    'confidence': ('COALESCE(a.confidence, 0)',),
+    'source': ('a.from_prediction',),
+}
+_TIEBREAK_KEYS = ('a.stem', 'a.idx', 'i.name')
+
+# Koosteet lasketaan annotaatioista, joiden kuva on kuvahakemistossa
+# (sama rajaus kuin analytiikkanäkymissä).
+_ROLLUP_SOURCE = (
+    'FROM annotations a JOIN images i ON i.stem = a.stem '
+)
+_ROLLUP_HOURLY_SELECT = (
+    "SELECT COALESCE(a.camera_date, ''), COALESCE(a.camera_hour, -1), a.species, "
+    '{sign} * COUNT(*), {sign} * SUM(a.from_prediction), '
+    '{sign} * SUM(a.from_prediction = 1 AND a.original_species = a.species) '
+    + _ROLLUP_SOURCE + '{where} GROUP BY 1, 2, 3'
+)
+_ROLLUP_CONFIDENCE_SELECT = (
+    "SELECT COALESCE(a.camera_date, ''), a.species, a.conf_bin, {sign} * COUNT(*) "
+    + _ROLLUP_SOURCE + '{where} GROUP BY 1, 2, 3'
+)
+
+
+def parse_camera_datetime(filename):
+    """Parse camera date+time from filename like 15339_25173_20260128_072622867."""
+    m = _FILENAME_DATE_RE.search(filename)
+    if not m:
+        return None, None
+    y, mo, d, h, mi, s = (int(x) for x in m.groups())
+    try:
+        dt = datetime(y, mo, d, h, mi, s)
+        return dt.strftime('%Y-%m-%d'), dt.hour
+    except ValueError:
+        return None, None
+
+
+def annotation_confidence(ann):
+    """Annotaation näytettävä luottamus (lajimalli ensin, sitten MegaDetector)."""
+    return ann.get('species_confidence') or ann.get('md_confidence')
+
+
+def confidence_bin(conf):
+    """Luottamushistogrammin lokero 0-9 (10 % välein)."""
+    if conf is None:
+        return None
+    return min(int(conf * 10), 9)
+
+
+def claim_cutoff_ns(grace_seconds=CLAIM_GRACE_SECONDS):
+    """Tätä vanhemmat (mtime_ns) tiivistevaraukset ilman kuvaa ovat hylättyjä."""
+    return time.time_ns() - int(grace_seconds * 1e9)
+
+
+def _stat(path):
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _in_clause(values):
+    return ','.join('?' for _ in values)
+
+
+def _date_clauses(column, from_date='', to_date='', to_exclusive=False, undated='IS NULL'):
+    """Päivämääräsuodatus: kuvat ilman päivämäärää kuuluvat aina mukaan."""
+    clauses = []
+    params = []
+    if from_date:
+        clauses.append(f'({column} {undated} OR {column} >= ?)')
+        params.append(from_date)
+    if to_date:
+        op = '<' if to_exclusive else '<='
+        clauses.append(f'({column} {undated} OR {column} {op} ?)')
+        params.append(to_date)
+    return clauses, params
+
+
+def _where(clauses):
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+
+
+class MetadataIndex:
+    """
+    SQLite-indeksi kuvista, annotaatioista ja ennusteista.
+
+    Jokaisella säikeellä on oma yhteys; tietokanta on WAL-tilassa, joten
+    noutoprosessi ja Flask voivat kirjoittaa siihen rinnakkain.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # Vanhasta indeksistä puuttuvat koosteet lasketaan kerran
+        if not self.needs_rebuild() and conn.execute(
+            "SELECT 1 FROM meta WHERE key = 'rollups_built'"
+        ).fetchone() is None:
+            self.rebuild_rollups()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---------- ylläpito ----------
+
+    def needs_rebuild(self):
+        """Onko indeksi vielä rakentamatta."""
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'built_at'"
+        ).fetchone()
+        return row is None
+
+    def rebuild(self, image_dir, annotation_dir, prediction_dir):
+        """Rakenna koko indeksi uudelleen JSON-tiedostoista."""
+        image_dir = Path(image_dir)
+        annotation_dir = Path(annotation_dir)
+        prediction_dir = Path(prediction_dir)
+        stats = {'images': 0, 'annotations': 0, 'predictions': 0, 'errors': []}
+
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM images')
+            conn.execute('DELETE FROM annotation_docs')
+            conn.execute('DELETE FROM annotations')
+            conn.execute('DELETE FROM prediction_docs')
+            conn.execute('DELETE FROM predictions')
+            conn.execute('DELETE FROM rollup_hourly')
+            conn.execute('DELETE FROM rollup_confidence')
+
+            for entry in _scan(image_dir):
+                if Path(entry.name).suffix.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                st = entry.stat()
+                self._put_image(conn, entry.name, st.st_mtime_ns, st.st_size)
+                stats['images'] += 1
+
+            for entry in _scan(annotation_dir):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    data = _read_json(entry.path)
+                except (OSError, ValueError) as e:
+                    stats['errors'].append(f'{entry.name}: {e}')
+                    continue
+                st = entry.stat()
+                self._put_annotation(conn, Path(entry.name).stem, data, st.st_mtime_ns, st.st_size)
+                stats['annotations'] += 1
+
+            for entry in _scan(prediction_dir):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    data = _read_json(entry.path)
+                except (OSError, ValueError) as e:
+                    stats['errors'].append(f'{entry.name}: {e}')
+                    continue
+                st = entry.stat()
+                self._put_prediction(conn, Path(entry.name).stem, data, st.st_mtime_ns, st.st_size)
+                stats['predictions'] += 1
+
+            # Tiivisteet ja mitat lasketaan kuvista, joten ne säilyvät; vain poistetut karsitaan.
+            # Tuore noudon varaus (size NULL) jää: kuva voi olla vielä kirjoittamatta.
+            conn.execute('DELETE FROM image_hashes WHERE name NOT IN (SELECT name FROM images) '
+                         'AND (size IS NOT NULL OR COALESCE(mtime_ns, 0) < ?)',
+                         (claim_cutoff_ns(),))
+            conn.execute('DELETE FROM image_sizes WHERE name NOT IN (SELECT name FROM images)')
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)",
+                (datetime.now().isoformat(),),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_built', ?)",
+                (datetime.now().isoformat(),),
+            )
+        return stats
+
+    def rebuild_rollups(self):
+        """Laske dashboard-koosteet uudelleen indeksin annotaatioriveistä."""
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM rollup_hourly')
+            conn.execute('DELETE FROM rollup_confidence')
+            conn.execute(
+                'INSERT INTO rollup_hourly '
+                '(camera_date, camera_hour, species, n, from_prediction, correct) '
+                + _ROLLUP_HOURLY_SELECT.format(sign=1, where='')
+            )
+            conn.execute(
+                'INSERT INTO rollup_confidence (camera_date, species, conf_bin, n) '
+                + _ROLLUP_CONFIDENCE_SELECT.format(sign=1, where='WHERE a.conf_bin IS NOT NULL')
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_built', ?)",
+                (datetime.now().isoformat(),),
+            )
+        return {
+            'hourly_cells': conn.execute('SELECT COUNT(*) FROM rollup_hourly').fetchone()[0],
+            'confidence_cells': conn.execute(
+                'SELECT COUNT(*) FROM rollup_confidence').fetchone()[0],
+        }
+
+    def check_rollups(self, image_dir, annotation_dir):
+        """
+        Vertaa koosteita kuva- ja annotaatiohakemistojen täyteen läpikäyntiin.
+
+        Returns:
+            dict: {'ok': bool, 'hourly': [erot], 'confidence': [erot], 'errors': [...]}
+        """
+        expected_hourly = {}
+        expected_confidence = {}
+        errors = []
+        stems = {}
+        for entry in _scan(image_dir):
+            if Path(entry.name).suffix.lower() in IMAGE_EXTENSIONS:
+                stem = Path(entry.name).stem
+                stems[stem] = stems.get(stem, 0) + 1
+        for stem, image_count in stems.items():
+            path = Path(annotation_dir) / f'{stem}.json'
+            if not path.exists():
+                continue
+            try:
+                data = _read_json(path)
+            except (OSError, ValueError) as e:
+                errors.append(f'{path.name}: {e}')
+                continue
+            if data.get('is_empty', False):
+                continue
+            camera_date, camera_hour = parse_camera_datetime(stem)
+            camera_date = camera_date or ''
+            camera_hour = -1 if camera_hour is None else camera_hour
+            for ann in data.get('annotations') or []:
+                sp = ann.get('species') or 'muu'
+                from_prediction = bool(ann.get('from_prediction'))
+                correct = from_prediction and (ann.get('original_species') or '') == sp
+                cell = expected_hourly.setdefault((camera_date, camera_hour, sp), [0, 0, 0])
+                cell[0] += image_count
+                cell[1] += image_count * from_prediction
+                cell[2] += image_count * correct
+                conf_bin = confidence_bin(annotation_confidence(ann))
+                if conf_bin is not None:
+                    key = (camera_date, sp, conf_bin)
+                    expected_confidence[key] = expected_confidence.get(key, 0) + image_count
+
+        conn = self._connect()
+        actual_hourly = {
+            (r[0], r[1], r[2]): [r[3], r[4], r[5]] for r in conn.execute(
+                'SELECT camera_date, camera_hour, species, n, from_prediction, correct '
+                'FROM rollup_hourly'
+            )
+        }
+        actual_confidence = {
+            (r[0], r[1], r[2]): r[3] for r in conn.execute(
+                'SELECT camera_date, species, conf_bin, n FROM rollup_confidence'
+            )
+        }
+        hourly_diff = [
+            {'cell': list(key), 'expected': expected_hourly.get(key), 'actual': actual_hourly.get(key)}
+            for key in sorted(expected_hourly.keys() | actual_hourly.keys())
+            if expected_hourly.get(key) != actual_hourly.get(key)
+        ]
+        confidence_diff = [
+            {'cell': list(key), 'expected': expected_confidence.get(key),
+             'actual': actual_confidence.get(key)}
+            for key in sorted(expected_confidence.keys() | actual_confidence.keys())
+            if expected_confidence.get(key) != actual_confidence.get(key)
+        ]
+        return {
+            'ok': not hourly_diff and not confidence_diff,
+            'hourly': hourly_diff,
+            'confidence': confidence_diff,
+            'errors': errors,
+        }
+
+    def sync(self, image_dir, annotation_dir, prediction_dir, load_json=None):
+        """
+        Täsmäytä indeksi hakemistoihin.
+
+        Vain tiedostot, joiden (mtime_ns, koko) poikkeaa indeksistä, luetaan
+        uudelleen; kadonneet tiedostot poistetaan. Käytetään käynnistyksessä
+        ja tiedostovahdin varapolkuna.
+
+        Returns:
+            dict: {'images': [lisätty, poistettu], 'annotations': [...], 'predictions': [...]}
+        """
+        load_json = load_json or _read_json
+        stats = {'images': [0, 0], 'annotations': [0, 0], 'predictions': [0, 0], 'errors': []}
+        conn = self._connect()
+        known_images = {
+            r[0]: (r[1], r[2]) for r in conn.execute('SELECT name, mtime_ns, size FROM images')
+        }
+        known_annotations = {
+            r[0]: (r[1], r[2])
+            for r in conn.execute('SELECT stem, mtime_ns, size FROM annotation_docs')
+        }
+        known_predictions = {
+            r[0]: (r[1], r[2])
+            for r in conn.execute('SELECT stem, mtime_ns, size FROM prediction_docs')
+        }
+
+        with conn:
+            seen = set()
+            for entry in _scan(image_dir):
+                if Path(entry.name).suffix.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                st = entry.stat()
+                seen.add(entry.name)
+                if known_images.get(entry.name) != (st.st_mtime_ns, st.st_size):
+                    self._put_image(conn, entry.name, st.st_mtime_ns, st.st_size)
+                    stats['images'][0] += 1
+            for name in known_images.keys() - seen:
+                self._delete_image(conn, name)
+                stats['images'][1] += 1
+
+            for key, directory, known, put, delete in (
+                ('annotations', annotation_dir, known_annotations,
+                 self._put_annotation, self._delete_annotation),
+                ('predictions', prediction_dir, known_predictions,
+                 self._put_prediction, self._delete_prediction),
+            ):
+                seen = set()
+                for entry in _scan(directory):
+                    if not entry.name.endswith('.json'):
+                        continue
+                    stem = Path(entry.name).stem
+                    st = entry.stat()
+                    seen.add(stem)
+                    if known.get(stem) == (st.st_mtime_ns, st.st_size):
+                        continue
+                    try:
+                        data = load_json(entry.path)
+                    except (OSError, ValueError) as e:
+                        stats['errors'].append(f'{entry.name}: {e}')
+                        continue
+                    put(conn, stem, data, st.st_mtime_ns, st.st_size)
+                    stats[key][0] += 1
+                for stem in known.keys() - seen:
+                    delete(conn, stem)
+                    stats[key][1] += 1
+
+            for key in ('built_at', 'rollups_built'):
+                conn.execute(
+                    'INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+                    (key, datetime.now().isoformat()),
+                )
+        return stats
+
+    # ---------- kirjoituspolut ----------
+
+    def upsert_image(self, name, mtime_ns=None, size=None):
+        conn = self._connect()
+        with conn:
+            self._put_image(conn, name, mtime_ns, size)
+
+    def remove_image(self, name):
+        conn = self._connect()
+        with conn:
+            self._delete_image(conn, name)
+
+    def upsert_annotation(self, stem, data, mtime_ns=None, size=None):
+        conn = self._connect()
+        with conn:
+            self._put_annotation(conn, stem, data, mtime_ns, size)
+
+    def remove_annotation(self, stem):
+        conn = self._connect()
+        with conn:
+            self._delete_annotation(conn, stem)
+
+    def upsert_prediction(self, stem, data, mtime_ns=None, size=None):
+        conn = self._connect()
+        with conn:
+            self._put_prediction(conn, stem, data, mtime_ns, size)
+
+    def remove_prediction(self, stem):
+        conn = self._connect()
+        with conn:
+            self._delete_prediction(conn, stem)
+
+    def index_image_file(self, path):
+        """Päivitä yksittäinen kuva levyltä (poistaa, jos tiedostoa ei ole)."""
+        path = Path(path)
+        if not path.exists():
+            self.remove_image(path.name)
+            return
+        self.upsert_image(path.name, *_stat(path))
+
+    def index_annotation_file(self, path, data=None):
+        """Päivitä yksittäinen annotaatiotiedosto levyltä."""
+        path = Path(path)
+        if not path.exists():
+            self.remove_annotation(path.stem)
+            return
+        if data is None:
+            data = _read_json(path)
+        self.upsert_annotation(path.stem, data, *_stat(path))
+
+    def index_prediction_file(self, path, data=None):
+        """Päivitä yksittäinen ennustetiedosto levyltä."""
+        path = Path(path)
+        if not path.exists():
+            self.remove_prediction(path.stem)
+            return
+        if data is None:
+            data = _read_json(path)
+        self.upsert_prediction(path.stem, data, *_stat(path))
+
+    # ---------- kuvien mitat ----------
+
+    def image_sizes(self):
+        """Tallennetut kuvien mitat: {name: (width, height, size, mtime_ns)}."""
+        return {
+            r['name']: (r['width'], r['height'], r['size'], r['mtime_ns'])
+            for r in self._connect().execute(
+                'SELECT name, width, height, size, mtime_ns FROM image_sizes'
+            )
+        }
+
+    def put_image_sizes(self, rows):
+        """Kirjaa mitat riveinä (name, width, height, size, mtime_ns)."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO image_sizes (name, width, height, size, mtime_ns) '
+                'VALUES (?, ?, ?, ?, ?)', rows,
+            )
+
+    # ---------- sisältötiivisteet ----------
+
+    def claim_image_hash(self, name, sha256, phash=None, max_distance=None,
+                         size=None, mtime_ns=None):
+        """
+        Varaa kuvan sisältötiiviste ennen tiedoston kirjoittamista.
+
+        Tarkistus ja lisäys tehdään samassa kirjoitustransaktiossa, joten
+        kaksi rinnakkaista noutoa eivät voi tallentaa samaa kuvaa. Varaus
+        ilman kokoa saa mtime_ns:ksi varausajan, jotta kaatuneen noudon
+        varaus voidaan karsia CLAIM_GRACE_SECONDS-ajan jälkeen.
+
+        Args:
+            phash: Hajautusarvo 64-bittisenä kokonaislukuna (valinnainen)
+            max_distance: Suurin Hamming-etäisyys, jolla phash katsotaan
+                samaksi kuvaksi (enintään 3 löytyy aina kaistahaulla)
+
+        Returns:
+            str: Jo tallennetun kaksoiskappaleen nimi, tai None jos kuva on uusi
+            (tiiviste on tällöin kirjattu nimelle name)
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT name FROM image_hashes WHERE sha256 = ? AND name != ? LIMIT 1',
+                (sha256, name),
+            ).fetchone()
+            existing = row['name'] if row else None
+            if existing is None and phash is not None and max_distance is not None:
+                existing = self._find_similar(conn, name, phash, max_distance)
+            if existing is None:
+                if size is None and mtime_ns is None:
+                    mtime_ns = time.time_ns()
+                self._put_image_hash(conn, name, sha256, phash, size, mtime_ns)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return existing
+
+    def put_image_hash(self, name, sha256, phash=None, size=None, mtime_ns=None):
+        """Kirjaa tiiviste ilman kaksoiskappaletarkistusta (skannaus)."""
+        conn = self._connect()
+        with conn:
+            self._put_image_hash(conn, name, sha256, phash, size, mtime_ns)
+
+    def remove_image_hash(self, name):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM image_hashes WHERE name = ?', (name,))
+
+    def image_hash_stats(self):
+        """Tiivisteiden tunnistetiedot nimen mukaan: {name: (size, mtime_ns, onko phash)}."""
+        return {
+            r['name']: (r['size'], r['mtime_ns'], r['phash'] is not None)
+            for r in self._connect().execute(
+                'SELECT name, size, mtime_ns, phash FROM image_hashes'
+            )
+        }
+
+    def duplicate_groups(self):
+        """Täsmälleen samansisältöiset kuvat: [[nimi, ...], ...]."""
+        groups = {}
+        for r in self._connect().execute(
+            'SELECT sha256, name FROM image_hashes WHERE sha256 IN ('
+            'SELECT sha256 FROM image_hashes GROUP BY sha256 HAVING COUNT(*) > 1) '
+            'ORDER BY sha256, name'
+        ):
+            groups.setdefault(r['sha256'], []).append(r['name'])
+        return list(groups.values())
+
+    def similar_pairs(self, max_distance):
+        """Perceptual hashin mukaan lähes samat kuvaparit (eri sisältötiiviste)."""
+        conn = self._connect()
+        pairs = []
+        for r in conn.execute('SELECT name, sha256, phash FROM image_hashes WHERE phash IS NOT NULL'):
+            for other in self._similar_candidates(conn, r['name'], int(r['phash'], 16)):
+                if other['name'] > r['name'] and other['sha256'] != r['sha256'] and \
+                        _hamming(int(other['phash'], 16), int(r['phash'], 16)) <= max_distance:
+                    pairs.append((r['name'], other['name']))
+        return pairs
+
+    @staticmethod
+    def _similar_candidates(conn, name, phash):
+        bands = _phash_bands(phash)
+        return conn.execute(
+            'SELECT name, sha256, phash FROM image_hashes WHERE name != ? AND ('
+            'phash_b0 = ? OR phash_b1 = ? OR phash_b2 = ? OR phash_b3 = ?)',
+            (name, *bands),
+        ).fetchall()
+
+    @staticmethod
+    def _find_similar(conn, name, phash, max_distance):
+        for r in MetadataIndex._similar_candidates(conn, name, phash):
+            if _hamming(int(r['phash'], 16), phash) <= max_distance:
+                return r['name']
+        return None
+
+    @staticmethod
+    def _put_image_hash(conn, name, sha256, phash, size, mtime_ns):
+        bands = _phash_bands(phash) if phash is not None else (None,) * 4
+        conn.execute(
+            'INSERT OR REPLACE INTO image_hashes (name, sha256, phash, phash_b0, phash_b1, '
+            'phash_b2, phash_b3, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (name, sha256, f'{phash:016x}' if phash is not None else None, *bands,
+             size, mtime_ns),
+        )
+
+    @staticmethod
+    def _apply_rollups(conn, stem, sign):
+        """Lisää (sign=1) tai vähennä (sign=-1) kuvan annotaatiot koosteista."""
+        conn.execute(
+            'INSERT INTO rollup_hourly '
+            '(camera_date, camera_hour, species, n, from_prediction, correct) '
+            + _ROLLUP_HOURLY_SELECT.format(sign=sign, where='WHERE a.stem = ?')
+            + ' ON CONFLICT(camera_date, camera_hour, species) DO UPDATE SET '
+            'n = n + excluded.n, '
+            'from_prediction = from_prediction + excluded.from_prediction, '
+            'correct = correct + excluded.correct',
+            (stem,),
+        )
+        conn.execute(
+            'INSERT INTO rollup_confidence (camera_date, species, conf_bin, n) '
+            + _ROLLUP_CONFIDENCE_SELECT.format(
+                sign=sign, where='WHERE a.stem = ? AND a.conf_bin IS NOT NULL')
+            + ' ON CONFLICT(camera_date, species, conf_bin) DO UPDATE SET n = n + excluded.n',
+            (stem,),
+        )
+        if sign < 0:
+            camera_date = parse_camera_datetime(stem)[0] or ''
+            conn.execute('DELETE FROM rollup_hourly WHERE camera_date = ? AND n = 0', (camera_date,))
+            conn.execute(
+                'DELETE FROM rollup_confidence WHERE camera_date = ? AND n = 0', (camera_date,)
+            )
+
+    @staticmethod
+    def _put_image(conn, name, mtime_ns, size):
+        if conn.execute('SELECT 1 FROM images WHERE name = ?', (name,)).fetchone():
+            conn.execute(
+                'UPDATE images SET mtime_ns = ?, size = ? WHERE name = ?', (mtime_ns, size, name)
+            )
+            return
+        stem = Path(name).stem
+        camera_date, camera_hour = parse_camera_datetime(name)
+        MetadataIndex._apply_rollups(conn, stem, -1)
+        conn.execute(
+            'INSERT INTO images (name, stem, camera_date, camera_hour, mtime_ns, size) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (name, stem, camera_date, camera_hour, mtime_ns, size),
+        )
+        MetadataIndex._apply_rollups(conn, stem, 1)
+
+    @staticmethod
+    def _delete_image(conn, name):
+        stem = Path(name).stem
+        MetadataIndex._apply_rollups(conn, stem, -1)
+        conn.execute('DELETE FROM images WHERE name = ?', (name,))
+        MetadataIndex._apply_rollups(conn, stem, 1)
+        conn.execute('DELETE FROM image_hashes WHERE name = ?', (name,))
+        conn.execute('DELETE FROM image_sizes WHERE name = ?', (name,))
+
+    @staticmethod
+    def _delete_annotation(conn, stem):
+        MetadataIndex._apply_rollups(conn, stem, -1)
+        conn.execute('DELETE FROM annotation_docs WHERE stem = ?', (stem,))
+        conn.execute('DELETE FROM annotations WHERE stem = ?', (stem,))
+
+    @staticmethod
+    def _delete_prediction(conn, stem):
+        conn.execute('DELETE FROM prediction_docs WHERE stem = ?', (stem,))
+        conn.execute('DELETE FROM predictions WHERE stem = ?', (stem,))
+
+    @staticmethod
+    def _put_annotation(conn, stem, data, mtime_ns, size):
+        is_empty = bool(data.get('is_empty', False))
+        anns = data.get('annotations') or []
+        MetadataIndex._apply_rollups(conn, stem, -1)
+        conn.execute('DELETE FROM annotations WHERE stem = ?', (stem,))
+        conn.execute(
+            'INSERT OR REPLACE INTO annotation_docs (stem, is_empty, annotation_count, mtime_ns, size) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (stem, int(is_empty), len(anns), mtime_ns, size),
+        )
+        # Tyhjäksi merkityn kuvan annotaatioita ei lasketa missään näkymässä
+        if is_empty:
+            return
+        camera_date, camera_hour = parse_camera_datetime(stem)
+        rows = []
+        for idx, ann in enumerate(anns):
+            conf = annotation_confidence(ann)
+            rows.append((
+                stem, idx, ann.get('species') or 'muu', camera_date, camera_hour,
+                ann.get('md_confidence'), ann.get('species_confidence'),
+                conf, confidence_bin(conf),
+                int(bool(ann.get('from_prediction'))),
+                ann.get('original_species') or '',
+                ann.get('timestamp') or '',
+            ))
+        conn.executemany(
+            'INSERT INTO annotations (stem, idx, species, camera_date, camera_hour, '
+            'md_confidence, species_confidence, confidence, conf_bin, from_prediction, '
+            'original_species, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows,
+        )
+        MetadataIndex._apply_rollups(conn, stem, 1)
+
+    @staticmethod
+    def _put_prediction(conn, stem, data, mtime_ns, size):
+        preds = data.get('predictions') or []
+        confidences = [
+            p['species_confidence'] if p.get('species_confidence') is not None
+            else p.get('md_confidence')
+            for p in preds
+        ]
+        confidences = [c for c in confidences if c is not None]
+        conn.execute('DELETE FROM predictions WHERE stem = ?', (stem,))
+        conn.execute(
+            'INSERT OR REPLACE INTO prediction_docs '
+            '(stem, image, prediction_count, max_confidence, mtime_ns, size) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (stem, data.get('image', stem), len(preds),
+             max(confidences) if confidences else None, mtime_ns, size),
+        )
+        conn.executemany(
+            'INSERT INTO predictions (stem, idx, md_category, md_confidence, species, '
+            'species_confidence) VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (stem, idx, p.get('md_category'), p.get('md_confidence'),
+                 p.get('species'), p.get('species_confidence'))
+                for idx, p in enumerate(preds)
+            ],
+        )
+
+    # ---------- kyselyt ----------
+
+    def image_count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def annotation_flags(self):
+        """{stem: (is_empty, annotation_count)} kaikille annotaatiodokumenteille."""
+        return {
+            r[0]: (bool(r[1]), r[2]) for r in self._connect().execute(
+                'SELECT stem, is_empty, annotation_count FROM annotation_docs'
+            )
+        }
+
+    def prediction_stems(self):
+        return {r[0] for r in self._connect().execute('SELECT stem FROM prediction_docs')}
+
+    def species_counts(self):
+        """Annotaatiot lajeittain (vain kuvat, jotka ovat kuvahakemistossa)."""
+        return {
+            r[0]: r[1] for r in self._connect().execute(
+                'SELECT a.species, COUNT(*) FROM annotations a '
+                'JOIN images i ON i.stem = a.stem GROUP BY a.species'
+            )
+        }
+
+    def list_images(self, filter_type='all'):
+        """Kuvien nimet suodattimen mukaan (sama logiikka kuin annotointinäkymässä)."""
+        has_annotation = '(d.is_empty = 1 OR d.annotation_count > 0)'
+        conditions = {
+            'all': '',
+            'annotated': f'WHERE {has_annotation}',
+            'unannotated': f'WHERE d.stem IS NULL OR NOT {has_annotation}',
+            'predicted': f'WHERE p.stem IS NOT NULL AND (d.stem IS NULL OR NOT {has_annotation})',
+            'empty': 'WHERE d.is_empty = 1',
+        }
+        sql = (
+            'SELECT i.name FROM images i '
+            'LEFT JOIN annotation_docs d ON d.stem = i.stem '
+            'LEFT JOIN prediction_docs p ON p.stem = i.stem '
+            f'{conditions.get(filter_type, "")} ORDER BY i.name'
+        )
+        return [row[0] for row in self._connect().execute(sql)]
+
+    def stats(self):
+        """Kokonaistilastot /api/stats-reitille."""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT COUNT(*) AS total, '
+            'TOTAL(d.is_empty = 1) AS empty, '
+            'TOTAL(d.is_empty = 0 AND d.annotation_count > 0) AS annotated, '
+            'TOTAL(CASE WHEN d.is_empty = 0 THEN d.annotation_count ELSE 0 END) AS annotations, '
+            'TOTAL(p.stem IS NOT NULL) AS predicted '
+            'FROM images i '
+            'LEFT JOIN annotation_docs d ON d.stem = i.stem '
+            'LEFT JOIN prediction_docs p ON p.stem = i.stem'
+        ).fetchone()
+        return {
+            'total_images': row['total'],
+            'annotated_images': int(row['annotated']),
+            'empty_images': int(row['empty']),
+            'total_annotations': int(row['annotations']),
+            'predicted_images': int(row['predicted']),
+            'species_counts': self.species_counts(),
+        }
+
+    def image_counts(self, from_date='', to_date='', species_filter=None, to_exclusive=False):
+        """
+        Kuvatason laskurit aikavälillä.
+
+        Returns:
+            dict: total, empty, unannotated, annotated, annotated_matching
+        """
+        clauses, params = _date_clauses('i.camera_date', from_date, to_date, to_exclusive)
+        match_sql = 'TOTAL(d.is_empty = 0 AND d.annotation_count > 0)'
+        match_params = []
+        if species_filter:
+            species_filter = sorted(species_filter)
+            match_sql = (
+                'TOTAL(d.is_empty = 0 AND d.annotation_count > 0 AND EXISTS ('
+                'SELECT 1 FROM annotations a WHERE a.stem = i.stem '
+                f'AND a.species IN ({_in_clause(species_filter)})))'
+            )
+            match_params = species_filter
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS total, '
+            'TOTAL(d.is_empty = 1) AS empty, '
+            'TOTAL(d.stem IS NULL OR (d.is_empty = 0 AND d.annotation_count = 0)) AS unannotated, '
+            'TOTAL(d.is_empty = 0 AND d.annotation_count > 0) AS annotated, '
+            f'{match_sql} AS annotated_matching '
+            'FROM images i LEFT JOIN annotation_docs d ON d.stem = i.stem '
+            f'{_where(clauses)}',
+            match_params + params,
+        ).fetchone()
+        return {
+            'total': row['total'],
+            'empty': int(row['empty']),
+            'unannotated': int(row['unannotated']),
+            'annotated': int(row['annotated']),
+            'annotated_matching': int(row['annotated_matching']),
+        }
+
+    def _annotation_filter(self, from_date='', to_date='', species_filter=None,
+                           to_exclusive=False):
+        clauses, params = _date_clauses('i.camera_date', from_date, to_date, to_exclusive)
+        if species_filter:
+            species_filter = sorted(species_filter)
+            clauses.append(f'a.species IN ({_in_clause(species_filter)})')
+            params.extend(species_filter)
+        return clauses, params
+
+    def _rollup_filter(self, from_date='', to_date='', species_filter=None, to_exclusive=False):
+        clauses, params = _date_clauses(
+            'camera_date', from_date, to_date, to_exclusive, undated="= ''"
+        )
+        if species_filter:
+            species_filter = sorted(species_filter)
+            clauses.append(f'species IN ({_in_clause(species_filter)})')
+            params.extend(species_filter)
+        return clauses, params
+
+    def activity_cells(self, from_date='', to_date='', species_filter=None, to_exclusive=False):
+        """
+        Koosteen solut (päivä, tunti, laji) aikavälillä.
+
+        Dashboardin ja AI-yhteenvedon annotaatiotason luvut summataan näistä
+        soluista; päivättömillä kuvilla camera_date ja camera_hour ovat None.
+        """
+        clauses, params = self._rollup_filter(from_date, to_date, species_filter, to_exclusive)
+        return [
+            {
+                'camera_date': r['camera_date'] or None,
+                'camera_hour': None if r['camera_hour'] < 0 else r['camera_hour'],
+                'species': r['species'],
+                'n': r['n'],
+                'from_prediction': r['from_prediction'],
+                'correct': r['correct'],
+            }
+            for r in self._connect().execute(
+                'SELECT camera_date, camera_hour, species, n, from_prediction, correct '
+                f'FROM rollup_hourly {_where(clauses)} '
+                'ORDER BY camera_date, camera_hour, species',
+                params,
+            )
+        ]
+
+    def confidence_histogram(self, from_date='', to_date='', species_filter=None,
+                             to_exclusive=False):
+        """Luottamushistogrammi (10 lokeroa) aikavälillä."""
+        clauses, params = self._rollup_filter(from_date, to_date, species_filter, to_exclusive)
+        bins = [0] * 10
+        for r in self._connect().execute(
+            f'SELECT conf_bin, SUM(n) FROM rollup_confidence {_where(clauses)} GROUP BY conf_bin',
+            params,
+        ):
+            bins[r[0]] = r[1]
+        return bins
+
+    def annotation_rows(self, from_date='', to_date='', species_filter=None,
+                        order_by='i.name, a.idx', limit=None):
+        """Yksittäiset annotaatiorivit taulukko-, galleria- ja syötenäkymiin."""
+        clauses, params = self._annotation_filter(from_date, to_date, species_filter)
+        sql = (
+            'SELECT i.name AS image, a.species, i.camera_date, i.camera_hour, '
+            'a.confidence, a.from_prediction, a.original_species, a.timestamp '
+            'FROM annotations a JOIN images i ON i.stem = a.stem '
+            f'{_where(clauses)} ORDER BY {order_by}'
+        )
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [_annotation_row(r) for r in self._connect().execute(sql, params)]
+
+    def annotation_total(self, from_date='', to_date='', species_filter=None):
+        """Annotaatiorivien määrä suodattimella (koosteista, ei rivien läpikäyntiä)."""
+        clauses, params = self._rollup_filter(from_date, to_date, species_filter)
+        return self._connect().execute(
+            f'SELECT TOTAL(n) FROM rollup_hourly {_where(clauses)}', params
+        ).fetchone()[0]
+
+    def annotation_page(self, from_date='', to_date='', species_filter=None,
+                        sort_key='date', descending=True, limit=50, after=None, offset=0):
+        """
+        Yksi sivu annotaatiorivejä lajiteltuna.
+
+        Args:
+            sort_key: SORT_KEYS-avain
+            after: edellisen sivun viimeisen rivin avain (kursori); jos annettu,
+                offsetia ei käytetä
+            offset: rivimäärä, joka ohitetaan (sivunumeroon perustuva haku)
+
+        Returns:
+            tuple: (rivit, seuraavan sivun avain tai None)
+        """
+        keys = SORT_KEYS[sort_key]
+        all_keys = keys + _TIEBREAK_KEYS
+        clauses, params = self._annotation_filter(from_date, to_date, species_filter)
+        if after is not None:
+            if len(after) != len(all_keys):
+                raise ValueError('invalid cursor')
+            key_op = '<' if descending else '>'
+            # Lajitteluavaimen alaraja rajaa indeksihaun, loput ehdot
+            # ratkaisevat tasatilanteet leksikografisesti
+            clauses.append(f'{keys[0]} {key_op}= ?')
+            params.append(after[0])
+            alternatives = []
+            for j, column in enumerate(all_keys):
+                op = key_op if j < len(keys) else '>'
+                parts = [f'{c} = ?' for c in all_keys[:j]] + [f'{column} {op} ?']
+                alternatives.append('(' + ' AND '.join(parts) + ')')
+                params.extend(after[:j + 1])
+            clauses.append('(' + ' OR '.join(alternatives) + ')')
+        direction = 'DESC' if descending else 'ASC'
+        order_by = ', '.join(
+            [f'{k} {direction}' for k in keys] + [f'{k} ASC' for k in _TIEBREAK_KEYS]
+        )
+        key_columns = ', '.join(f'{k} AS k{j}' for j, k in enumerate(all_keys))
+        sql = (
+            'SELECT i.name AS image, a.species, i.camera_date, i.camera_hour, '
+            'a.confidence, a.from_prediction, a.original_species, a.timestamp, '
+            f'{key_columns} '
+            'FROM annotations a JOIN images i ON i.stem = a.stem '
+            f'{_where(clauses)} ORDER BY {order_by} LIMIT ?'
+        )
+        params.append(limit + 1)
+        if after is None and offset:
+            sql += ' OFFSET ?'
+            params.append(offset)
+        fetched = self._connect().execute(sql, params).fetchall()
+        page = fetched[:limit]
+        next_after = None
+        if len(fetched) > limit and page:
+            last = page[-1]
+            next_after = [last[f'k{j}'] for j in range(len(all_keys))]
+        return [_annotation_row(r) for r in page], next_after
+
+    def event_frames(self, from_date='', to_date=''):
+        """
+        Päivätyt kuvat lajeineen kuvasarjojen (tapahtumien) muodostamiseen.
+
+        Returns:
+            list: [{'image', 'species': [...], 'predicted_species': [...]}]
+        """
+        clauses, params = _date_clauses('i.camera_date', from_date, to_date)
+        clauses.append('i.camera_date IS NOT NULL')
+        rows = self._connect().execute(
+            'SELECT i.name, '
+            '(SELECT group_concat(a.species) FROM annotations a WHERE a.stem = i.stem) AS species, '
+            '(SELECT group_concat(p.species) FROM predictions p '
+            ' WHERE p.stem = i.stem AND p.species IS NOT NULL) AS predicted '
+            f'FROM images i {_where(clauses)} ORDER BY i.name',
+            params,
+        )
+        return [
+            {
+                'image': r['name'],
+                'species': r['species'].split(',') if r['species'] else [],
+                'predicted_species': r['predicted'].split(',') if r['predicted'] else [],
+            }
+            for r in rows
+        ]
+
+    def day_rows(self, date):
+        """Yhden kamerapäivän annotaatiot kuvajärjestyksessä."""
+        return [_annotation_row(r) for r in self._connect().execute(
+            'SELECT i.name AS image, a.species, i.camera_date, i.camera_hour, '
+            'a.confidence, a.from_prediction, a.original_species, a.timestamp '
+            'FROM annotations a JOIN images i ON i.stem = a.stem '
+            'WHERE i.camera_date = ? ORDER BY i.name, a.idx',
+            (date,),
+        )]
+
+    def recent_predictions(self, limit=20):
+        """Viimeisimmät ennustetiedostot muokkausajan mukaan."""
+        conn = self._connect()
+        docs = conn.execute(
+            'SELECT stem, image, prediction_count FROM prediction_docs '
+            'ORDER BY mtime_ns DESC LIMIT ?',
+            (limit,),
+        ).fetchall()
+        if not docs:
+            return []
+        stems = [d['stem'] for d in docs]
+        species_by_stem = {}
+        for r in conn.execute(
+            'SELECT stem, species FROM predictions '
+            f'WHERE stem IN ({_in_clause(stems)}) AND species IS NOT NULL AND species != \'\' '
+            'ORDER BY stem, idx',
+            stems,
+        ):
+            species_by_stem.setdefault(r['stem'], []).append(r['species'])
+        return [
+            {
+                'image': d['image'],
+                'predictions_count': d['prediction_count'],
+                'species': species_by_stem.get(d['stem'], []),
+            }
+            for d in docs
+        ]
+
+
+def _annotation_row(r):
+    return {
+        'image': r['image'],
+        'species': r['species'],
+        'camera_date': r['camera_date'],
+        'camera_hour': r['camera_hour'],
+        'confidence': r['confidence'],
+        'from_prediction': bool(r['from_prediction']),
+        'original_species': r['original_species'],
+        'timestamp': r['timestamp'],
+    }
+
+
+def _phash_bands(phash):
+    """64-bittinen phash neljänä 16-bittisenä kaistana (Hamming ≤ 3 → jokin kaista sama)."""
+    return tuple((phash >> shift) & 0xFFFF for shift in (48, 32, 16, 0))
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _scan(directory):
+    if not Path(directory).exists():
+        return []
+    with os.scandir(directory) as it:
+        return [e for e in it if e.is_file()]
+
+
+def open_index(data_dir=None):
+    """Avaa DATA_DIR:n metadataindeksi."""
+    data_dir = Path(data_dir) if data_dir else DATA_DIR
+    return MetadataIndex(data_dir / INDEX_FILENAME)
+
+
+def open_metadata_index(data_dir=None):
+    """Avaa metadataindeksi tai palauta None; tunnistus ja nouto toimivat myös ilman sitä."""
+    try:
+        return open_index(data_dir)
+    except Exception as e:
+        print(f"Metadataindeksiä ei voitu avata: {e}")
+        return None
+
+
+def index_file(index, method, *args):
+    """Päivitä metadataindeksi (index.method(*args)); virhe ei keskeytä kutsujaa."""
+    if index is None:
+        return
+    try:
+        getattr(index, method)(*args)
+    except Exception as e:
+        print(f"Metadataindeksin päivitys epäonnistui: {e}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Metadataindeksin ylläpito')
+    parser.add_argument('--data-dir', default=str(DATA_DIR))
+    parser.add_argument('--image-dir', default=str(IMAGE_DIR))
+    parser.add_argument('--annotation-dir', default=str(ANNOTATION_DIR))
+    parser.add_argument('--prediction-dir', default=str(PREDICTION_DIR))
+    parser.add_argument('--rebuild', action='store_true', help='Rakenna indeksi JSON-tiedostoista')
+    parser.add_argument('--sync', action='store_true', help='Päivitä vain muuttuneet tiedostot')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='Laske dashboard-koosteet uudelleen indeksistä')
+    parser.add_argument('--check-rollups', action='store_true',
+                        help='Vertaa koosteita hakemistojen täyteen läpikäyntiin')
+    args = parser.parse_args()
+
+    index = open_index(args.data_dir)
+    if args.rebuild:
+        print("Rakennetaan metadataindeksi uudelleen...")
+        result = index.rebuild(args.image_dir, args.annotation_dir, args.prediction_dir)
+    elif args.sync:
+        result = index.sync(args.image_dir, args.annotation_dir, args.prediction_dir)
+    elif args.rebuild_rollups:
+        result = index.rebuild_rollups()
+    elif args.check_rollups:
+        result = index.check_rollups(args.image_dir, args.annotation_dir)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        raise SystemExit(0 if result['ok'] else 1)
+    else:
+        result = index.stats()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
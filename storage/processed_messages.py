@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Käsiteltyjen sähköpostiviestien tunnisteet (SQLite).
+
+Korvaa processed_emails.json-tiedoston, joka luettiin ja kirjoitettiin
+kokonaan jokaisella noutokierroksella. Jokainen viesti kirjataan omana
+transaktionaan heti käsittelyn jälkeen, joten kesken kaatunut nouto ei
+menetä jo käsiteltyjä viestejä. Vanhat tunnisteet voi karsia iän mukaan.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+PROCESSED_DB_FILENAME = 'processed.db'
+LEGACY_FILENAME = 'processed_emails.json'
+
+# Tunnisteiden säilytysaika; uusimmat KEEP_LATEST säilytetään aina, koska
+# Gmail-agentin haku palauttaa viimeisimmät 200 viestiä iästä riippumatta.
+RETENTION_DAYS = int(os.environ.get('PROCESSED_RETENTION_DAYS', 180))
+KEEP_LATEST = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    msg_id TEXT PRIMARY KEY,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_processed_at ON messages(processed_at);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ProcessedMessageStore:
+    """Joukko käsiteltyjä viestitunnisteita sekä noudon tila-arvot."""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---------- viestit ----------
+
+    def __contains__(self, msg_id):
+        return self._connect().execute(
+            'SELECT 1 FROM messages WHERE msg_id = ?', (str(msg_id),)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def add(self, msg_id, processed_at=None):
+        """Kirjaa viesti käsitellyksi (oma transaktio)."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO messages (msg_id, processed_at) VALUES (?, ?)',
+                (str(msg_id), processed_at or time.time()),
+            )
+
+    def compact(self, max_age_days=RETENTION_DAYS, keep_latest=KEEP_LATEST):
+        """
+        Poista yli max_age_days vanhat tunnisteet (uusimmat keep_latest säilyvät).
+
+        Returns:
+            int: Poistettujen tunnisteiden määrä
+        """
+        cutoff = time.time() - max_age_days * 86400
+        conn = self._connect()
+        with conn:
+            removed = conn.execute(
+                'DELETE FROM messages WHERE processed_at < ? AND msg_id NOT IN ('
+                'SELECT msg_id FROM messages ORDER BY processed_at DESC LIMIT ?)',
+                (cutoff, keep_latest),
+            ).rowcount
+        if removed:
+            conn.execute('PRAGMA incremental_vacuum')
+        return removed
+
+    # ---------- tila ----------
+
+    def get(self, key, default=None):
+        row = self._connect().execute(
+            'SELECT value FROM state WHERE key = ?', (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                (key, json.dumps(value)),
+            )
+
+    def stats(self):
+        conn = self._connect()
+        oldest, newest = conn.execute(
+            'SELECT MIN(processed_at), MAX(processed_at) FROM messages'
+        ).fetchone()
+        return {
+            'messages': len(self),
+            'oldest': oldest,
+            'newest': newest,
+            'state': {k: json.loads(v) for k, v in conn.execute('SELECT key, value FROM state')},
+            'db_bytes': self.db_path.stat().st_size if self.db_path.exists() else 0,
+        }
+
+    # ---------- migraatio ----------
+
+    def migrate_json(self, json_path):
+        """
+        Tuo processed_emails.json kertaalleen ja nimeä se uudelleen (.migrated).
+
+        Tunnisteet saavat tuontihetken aikaleiman, joten säilytysaika alkaa
+        migraatiosta. Muut avaimet (last_fetch, imap_*) tallennetaan tilaan.
+
+        Returns:
+            int: Tuotujen tunnisteiden määrä
+        """
+        json_path = Path(json_path)
+        with open(json_path, 'r') as f:
+            data = json.load(f)
+        ids = [str(i) for i in data.get('processed_ids', [])]
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO messages (msg_id, processed_at) VALUES (?, ?)',
+                [(msg_id, now) for msg_id in ids],
+            )
+            for key, value in data.items():
+                if key != 'processed_ids':
+                    conn.execute(
+                        'INSERT OR IGNORE INTO state (key, value) VALUES (?, ?)',
+                        (key, json.dumps(value)),
+                    )
+        json_path.rename(json_path.with_name(json_path.name + '.migrated'))
+        print(f"Käsitellyt viestit siirretty: {len(ids)} tunnistetta ({json_path})")
+        return len(ids)
+
+
+def open_processed_store(data_dir=None):
+    """Avaa DATA_DIR:n viestivarasto; vanha JSON-tiedosto siirretään ensin."""
+    data_dir = Path(data_dir) if data_dir else DATA_DIR
+    store = ProcessedMessageStore(data_dir / PROCESSED_DB_FILENAME)
+    legacy = data_dir / LEGACY_FILENAME
+    if legacy.exists():
+        store.migrate_json(legacy)
+    return store
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Käsiteltyjen viestien ylläpito')
+    parser.add_argument('--data-dir', default=str(DATA_DIR))
+    parser.add_argument('--compact', action='store_true', help='Karsi vanhat tunnisteet')
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS,
+                        help=f'Säilytysaika päivinä (oletus {RETENTION_DAYS})')
+    args = parser.parse_args()
+
+    store = open_processed_store(args.data_dir)
+    if args.compact:
+        print(f"Poistettu {store.compact(args.days)} tunnistetta")
+    print(json.dumps(store.stats(), indent=2, ensure_ascii=False))
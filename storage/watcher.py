@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Tiedostovahti kuva-, annotaatio- ja ennustehakemistoille.
+
+Pitää kuvalistauksen ja annotaatio-/ennustetilan muistissa ja päivittää
+metadataindeksiä muutos kerrallaan. Linuxissa käytetään inotifya
+(ctypes, ei lisäriippuvuuksia); muualla tai jos inotify ei ole käytössä,
+hakemistot täsmäytetään säännöllisesti scandirilla. Myös muiden
+prosessien (ajastin, hostissa ajettu koulutus) kirjoittamat tiedostot
+huomataan, ja käynnistyksessä tila täsmäytetään kerran indeksiin.
+"""
+import bisect
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+
+from storage.metadata_index import IMAGE_EXTENSIONS, _read_json
+
+WATCH_POLL_SECONDS = int(os.environ.get('WATCH_POLL_SECONDS', 60))
+WATCH_RECONCILE_SECONDS = int(os.environ.get('WATCH_RECONCILE_SECONDS', 600))
+
+FILTERS = ('all', 'annotated', 'unannotated', 'predicted', 'empty')
+# Sisäinen lista: kaikki kuvat, joilla on ennuste (annotoitu tai ei)
+_LISTS = FILTERS + ('has_prediction',)
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """Minimaalinen inotify-kääre (vain Linux)."""
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._dirs = {}
+
+    def add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(directory))
+        self._dirs[wd] = Path(directory)
+
+    def read(self, timeout):
+        """
+        Odota tapahtumia enintään timeout sekuntia.
+
+        Returns:
+            list: [(hakemisto, tiedostonimi)], tai None jos jono ylivuoti
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_ISDIR or not name or wd not in self._dirs:
+                continue
+            events.append((self._dirs[wd], os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _sorted_add(items, value):
+    i = bisect.bisect_left(items, value)
+    if i == len(items) or items[i] != value:
+        items.insert(i, value)
+
+
+def _sorted_discard(items, value):
+    i = bisect.bisect_left(items, value)
+    if i < len(items) and items[i] == value:
+        del items[i]
+
+
+class DirectoryWatcher:
+    """
+    Muistissa pidettävä kuvaluettelo, jota päivitetään muutoksilla.
+
+    Jokaiselle kuvasuodattimelle pidetään oma järjestetty lista, joten
+    listaus on O(tulos) ja laskurit O(1).
+    """
+
+    def __init__(self, image_dir, annotation_dir, prediction_dir, index, load_json=None):
+        self.image_dir = Path(image_dir)
+        self.annotation_dir = Path(annotation_dir)
+        self.prediction_dir = Path(prediction_dir)
+        self.index = index
+        self.load_json = load_json or _read_json
+        self.mode = None
+        self.last_reconcile = None
+        self.events_applied = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset_state({}, {}, set())
+
+    def _reset_state(self, names_by_stem, flags, predicted):
+        self._names_by_stem = names_by_stem   # stem -> {kuvanimet}
+        self._labeled = {s for s, (empty, count) in flags.items() if empty or count > 0}
+        self._empty = {s for s, (empty, _) in flags.items() if empty}
+        self._predicted = predicted
+        self._lists = {f: [] for f in _LISTS}
+        for stem, names in names_by_stem.items():
+            for name in names:
+                for f in self._filters_for(stem):
+                    self._lists[f].append(name)
+        for items in self._lists.values():
+            items.sort()
+
+    def _filters_for(self, stem):
+        labeled = stem in self._labeled
+        filters = ['all', 'annotated' if labeled else 'unannotated']
+        if stem in self._predicted:
+            filters.append('has_prediction')
+            if not labeled:
+                filters.append('predicted')
+        if stem in self._empty:
+            filters.append('empty')
+        return filters
+
+    def _refresh_stem(self, stem):
+        names = self._names_by_stem.get(stem, ())
+        members = set(self._filters_for(stem)) if names else set()
+        for f, items in self._lists.items():
+            for name in names:
+                if f in members:
+                    _sorted_add(items, name)
+                else:
+                    _sorted_discard(items, name)
+
+    # ---------- kyselyt ----------
+
+    def list_images(self, filter_type='all'):
+        with self._lock:
+            return list(self._lists.get(filter_type, self._lists['all']))
+
+    def counts(self):
+        with self._lock:
+            return {f: len(items) for f, items in self._lists.items()}
+
+    def status(self):
+        return {
+            'mode': self.mode,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'last_reconcile': self.last_reconcile,
+            'events_applied': self.events_applied,
+        }
+
+    # ---------- muutokset ----------
+
+    def reconcile(self):
+        """Täsmäytä indeksi levyyn ja rakenna muistitila siitä."""
+        result = self.index.sync(
+            self.image_dir, self.annotation_dir, self.prediction_dir, load_json=self.load_json,
+        )
+        names_by_stem = {}
+        for name in self.index.list_images('all'):
+            names_by_stem.setdefault(Path(name).stem, set()).add(name)
+        flags = self.index.annotation_flags()
+        predicted = self.index.prediction_stems()
+        with self._lock:
+            self._reset_state(names_by_stem, flags, predicted)
+        self.last_reconcile = time.time()
+        return result
+
+    def image_changed(self, path):
+        path = Path(path)
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            return
+        self.index.index_image_file(path)
+        stem = path.stem
+        with self._lock:
+            names = self._names_by_stem.setdefault(stem, set())
+            if path.exists():
+                names.add(path.name)
+            else:
+                names.discard(path.name)
+                for items in self._lists.values():
+                    _sorted_discard(items, path.name)
+            self._refresh_stem(stem)
+            if not names:
+                del self._names_by_stem[stem]
+        self.events_applied += 1
+
+    def annotation_changed(self, path, data=None):
+        path = Path(path)
+        if path.suffix != '.json':
+            return
+        if data is None and path.exists():
+            data = self.load_json(path)
+        self.index.index_annotation_file(path, data)
+        stem = path.stem
+        with self._lock:
+            self._labeled.discard(stem)
+            self._empty.discard(stem)
+            if data is not None and path.exists():
+                if data.get('is_empty', False):
+                    self._empty.add(stem)
+                    self._labeled.add(stem)
+                elif data.get('annotations'):
+                    self._labeled.add(stem)
+            self._refresh_stem(stem)
+        self.events_applied += 1
+
+    def prediction_changed(self, path, data=None):
+        path = Path(path)
+        if path.suffix != '.json':
+            return
+        if data is None and path.exists():
+            data = self.load_json(path)
+        self.index.index_prediction_file(path, data)
+        stem = path.stem
+        with self._lock:
+            if path.exists():
+                self._predicted.add(stem)
+            else:
+                self._predicted.discard(stem)
+            self._refresh_stem(stem)
+        self.events_applied += 1
+
+    def _dispatch(self, directory, name):
+        path = directory / name
+        try:
+            if directory == self.image_dir:
+                self.image_changed(path)
+            elif directory == self.annotation_dir:
+                self.annotation_changed(path)
+            elif directory == self.prediction_dir:
+                self.prediction_changed(path)
+        except (OSError, ValueError) as e:
+            # Puolivalmis tai rikkinäinen tiedosto: seuraava täsmäytys korjaa
+            print(f"Tiedostovahti: {path}: {e}")
+
+    # ---------- taustasäie ----------
+
+    def start(self):
+        """Täsmäytä kerran ja käynnistä taustasäie."""
+        self.reconcile()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='directory-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        inotify = None
+        try:
+            inotify = Inotify()
+            for d in (self.image_dir, self.annotation_dir, self.prediction_dir):
+                d.mkdir(parents=True, exist_ok=True)
+                inotify.add_watch(d)
+            self.mode = 'inotify'
+            interval = WATCH_RECONCILE_SECONDS
+        except (OSError, AttributeError) as e:
+            print(f"inotify ei käytettävissä ({e}), käytetään kyselyä")
+            if inotify is not None:
+                inotify.close()
+                inotify = None
+            self.mode = 'poll'
+            interval = WATCH_POLL_SECONDS
+
+        next_reconcile = time.monotonic() + interval
+        try:
+            while not self._stop.is_set():
+                timeout = max(0.0, min(1.0, next_reconcile - time.monotonic()))
+                if inotify is not None:
+                    events = inotify.read(timeout)
+                    if events is None:
+                        next_reconcile = 0
+                    else:
+                        for directory, name in events:
+                            self._dispatch(directory, name)
+                else:
+                    self._stop.wait(timeout)
+                if time.monotonic() >= next_reconcile:
+                    try:
+                        self.reconcile()
+                    except Exception as e:
+                        print(f"Tiedostovahdin täsmäytys epäonnistui: {e}")
+                    next_reconcile = time.monotonic() + interval
+        finally:
+            if inotify is not None:
+                inotify.close()
@@ -122,3 +122,6 @@ def client(test_data_dir):
     flask_app.app.config['TESTING'] = True
     with flask_app.app.test_client() as c:
         yield c
+
+    if flask_app._job_queue is not None:
+        flask_app._job_queue.stop()
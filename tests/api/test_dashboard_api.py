@@ -197,6 +197,41 @@ class TestGalleryAPI:
         assert confs == sorted(confs, reverse=True)
 
 
+class TestCursorPagination:
+    """Test keyset cursors on /api/dashboard/table and /api/gallery."""
+
+    def _walk(self, client, url):
+        data = client.get(url).get_json()
+        rows = list(data.get('rows', data.get('images')))
+        while data['next_cursor']:
+            data = client.get(f"{url}&cursor={data['next_cursor']}").get_json()
+            rows.extend(data.get('rows', data.get('images')))
+        return rows
+
+    def test_cursor_walk_matches_pages(self, client):
+        for sort in ('date_desc', 'date_asc', 'species_asc', 'confidence_desc', 'source_desc'):
+            paged = []
+            for page in (1, 2, 3):
+                data = client.get(f'/api/dashboard/table?sort={sort}&per_page=1&page={page}').get_json()
+                paged.extend(data['rows'])
+            assert self._walk(client, f'/api/dashboard/table?sort={sort}&per_page=1') == paged
+
+    def test_cursor_reports_page_number(self, client):
+        first = client.get('/api/gallery?per_page=2').get_json()
+        assert first['page'] == 1
+        second = client.get(f"/api/gallery?per_page=2&cursor={first['next_cursor']}").get_json()
+        assert second['page'] == 2
+        assert second['next_cursor'] is None
+        assert len(first['images']) + len(second['images']) == first['total']
+
+    def test_invalid_cursor(self, client):
+        resp = client.get('/api/dashboard/table?cursor=bogus')
+        assert resp.status_code == 400
+        first = client.get('/api/dashboard/table?per_page=1').get_json()
+        resp = client.get(f"/api/dashboard/table?sort=species_asc&cursor={first['next_cursor']}")
+        assert resp.status_code == 400
+
+
 class TestThumbnailAPI:
     """Test GET /api/thumbnail/<filename>."""
 
@@ -269,3 +304,21 @@ class TestAiBriefAPI:
         resp_full = client.get('/api/ai/brief?days=90&detail=full')
         text_full = resp_full.data.decode('utf-8')
         assert len(text_full) < 2000, f'Full detail too long: {len(text_full)} chars'
+
+
+class TestEventsAPI:
+    """Test GET /api/dashboard/events (kuvasarjat)."""
+
+    def test_events_group_frames(self, client):
+        data = client.get('/api/dashboard/events').get_json()
+        # Kolme kuvaa eri kellonaikoina -> kolme yhden kuvan tapahtumaa
+        assert data['total'] == 3
+        assert data['frames'] == 3
+        assert data['events'][0]['start'].startswith('2026-01-29')
+        first = data['events'][-1]
+        assert first['camera'] == '15339_25173'
+        assert first['species'] == {'janis': 1}
+
+    def test_events_species_filter(self, client):
+        data = client.get('/api/dashboard/events?species=kauris').get_json()
+        assert [e['id'] for e in data['events']] == ['15339_25173_20260128_143015000']
@@ -0,0 +1,142 @@
+"""Tests for the persistent background job queue and its API."""
+import sys
+import threading
+
+import pytest
+
+from storage.jobs import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = JobQueue(tmp_path / 'jobs.db', poll_seconds=0.05)
+    yield q
+    q.stop()
+
+
+class TestJobQueue:
+
+    def test_job_runs_with_progress_and_result(self, queue):
+        def handler(ctx, n):
+            for i in range(n):
+                ctx.progress((i + 1) / n, f'{i + 1}/{n}')
+            return {'success': True, 'total': n}
+
+        queue.register('count', handler)
+        queue.start()
+        job = queue.wait(queue.submit('count', {'n': 4})['id'], timeout=5)
+        assert job['status'] == 'done'
+        assert job['progress'] == 1.0
+        assert job['message'] == '4/4'
+        assert job['result'] == {'success': True, 'total': 4}
+
+    def test_failure_is_recorded(self, queue):
+        def handler(ctx):
+            raise RuntimeError('rikki')
+
+        queue.register('broken', handler)
+        queue.register('soft', lambda ctx: {'success': False, 'error': 'ei dataa'})
+        queue.start()
+        assert queue.wait(queue.submit('broken')['id'], timeout=5)['error'] == 'rikki'
+        soft = queue.wait(queue.submit('soft')['id'], timeout=5)
+        assert soft['status'] == 'failed'
+        assert soft['error'] == 'ei dataa'
+
+    def test_cancel_running_job(self, queue):
+        started = threading.Event()
+
+        def handler(ctx):
+            started.set()
+            while True:
+                ctx.check_cancelled()
+                threading.Event().wait(0.01)
+
+        queue.register('loop', handler)
+        queue.start()
+        job = queue.submit('loop')
+        assert started.wait(5)
+        assert queue.cancel(job['id'])['cancel_requested']
+        assert queue.wait(job['id'], timeout=5)['status'] == 'cancelled'
+
+    def test_restart_resumes_queued_and_fails_interrupted(self, tmp_path):
+        first = JobQueue(tmp_path / 'jobs.db')
+        first.register('work', lambda ctx: {'success': True})
+        queued = first.submit('work')
+        interrupted = first.submit('work')
+        first._update(interrupted['id'], status='running')
+
+        second = JobQueue(tmp_path / 'jobs.db', poll_seconds=0.05)
+        second.register('work', lambda ctx: {'success': True})
+        second.start()
+        try:
+            assert second.wait(queued['id'], timeout=5)['status'] == 'done'
+            assert second.get(interrupted['id'])['status'] == 'failed'
+        finally:
+            second.stop()
+
+
+class TestJobsAPI:
+
+    def test_export_returns_job_immediately(self, client, test_data_dir):
+        resp = client.post('/api/export/yolo')
+        assert resp.status_code == 202
+        job_id = resp.get_json()['job_id']
+
+        job = sys.modules['app'].get_jobs().wait(job_id, timeout=10)
+        assert job['status'] == 'done'
+        data = client.get(f'/api/jobs/{job_id}').get_json()
+        assert data['result']['success'] is True
+        assert data['result']['annotations_total'] == 3
+        assert (test_data_dir / 'dataset' / 'dataset.yaml').exists()
+
+    def test_status_has_no_side_effects(self, client, monkeypatch):
+        flask_app = sys.modules['app']
+        from detection import worker
+        monkeypatch.setattr(worker, 'worker_status',
+                            lambda **kwargs: pytest.fail('/api/status otti yhteyttä palveluun'))
+        data = client.get('/api/status').get_json()
+        assert data['status'] == 'ok'
+        assert data['watcher'] is None and data['jobs'] is None
+        assert flask_app._metadata_index is None and flask_app._job_queue is None
+
+        monkeypatch.setattr(worker, 'worker_status', lambda **kwargs: None)
+        detail = client.get('/api/status/detail').get_json()
+        assert detail['jobs'] == {'fetch': None, 'export': None, 'train': None}
+        assert detail['watcher']['last_reconcile'] and detail['detector_worker'] is None
+        data = client.get('/api/status').get_json()
+        assert data['jobs'] == detail['jobs'] and data['watcher'] is not None
+
+    def test_unknown_job_is_404(self, client):
+        assert client.get('/api/jobs/missing').status_code == 404
+        assert client.post('/api/jobs/missing/cancel').status_code == 404
+
+    def test_train_conflict_and_cancel(self, client):
+        flask_app = sys.modules['app']
+        started = threading.Event()
+
+        def fake_train(ctx):
+            ctx.progress(0.1, 'training')
+            started.set()
+            while True:
+                ctx.check_cancelled()
+                threading.Event().wait(0.01)
+
+        flask_app.JOB_HANDLERS['train'] = fake_train
+        try:
+            resp = client.post('/api/train')
+            assert resp.status_code == 202
+            job_id = resp.get_json()['job_id']
+            assert started.wait(5)
+
+            assert client.post('/api/train').status_code == 409
+            status = client.get('/api/train/status').get_json()
+            assert status['in_progress'] is True
+            assert status['status'] == 'training'
+
+            client.post(f'/api/jobs/{job_id}/cancel')
+            assert flask_app.get_jobs().wait(job_id, timeout=5)['status'] == 'cancelled'
+            status = client.get('/api/train/status').get_json()
+            assert status['in_progress'] is False
+            assert status['status'].startswith('error')
+        finally:
+            flask_app.JOB_HANDLERS['train'] = flask_app.train_job
@@ -0,0 +1,52 @@
+"""Tests for the shared annotation/prediction document cache."""
+import json
+import os
+
+
+ANN_NAME = '15339_25173_20260128_072622867'
+
+
+class TestJsonDocumentCache:
+
+    def test_repeated_reads_hit_cache(self, client):
+        client.get(f'/api/annotation/{ANN_NAME}.jpg')
+        before = client.get('/api/status').get_json()['json_cache']
+        client.get(f'/api/annotation/{ANN_NAME}.jpg')
+        after = client.get('/api/status').get_json()['json_cache']
+        assert after['hits'] == before['hits'] + 1
+        assert after['misses'] == before['misses']
+
+    def test_changed_file_is_reloaded(self, client, test_data_dir):
+        path = test_data_dir / 'annotations' / f'{ANN_NAME}.json'
+        client.get(f'/api/annotation/{ANN_NAME}.jpg')
+        path.write_text(json.dumps({'annotations': [], 'is_empty': True, 'note': 'changed'}),
+                        encoding='utf-8')
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        data = client.get(f'/api/annotation/{ANN_NAME}.jpg').get_json()
+        assert data['note'] == 'changed'
+
+    def test_save_seeds_cache(self, client):
+        client.post(f'/api/annotation/{ANN_NAME}.jpg',
+                    json={'annotations': [], 'is_empty': True})
+        before = client.get('/api/status').get_json()['json_cache']
+        data = client.get(f'/api/annotation/{ANN_NAME}.jpg').get_json()
+        after = client.get('/api/status').get_json()['json_cache']
+        assert data['is_empty'] is True
+        assert after['hits'] == before['hits'] + 1
+
+    def test_lru_eviction_respects_ceiling(self, client, test_data_dir):
+        import app as flask_app
+        cache = flask_app.JsonDocumentCache(max_bytes=1)
+        path = test_data_dir / 'annotations' / f'{ANN_NAME}.json'
+        assert cache.load(path) is not None
+        assert cache.stats()['entries'] == 0
+
+        files = sorted((test_data_dir / 'annotations').glob('*.json'))
+        largest = max(f.stat().st_size for f in files)
+        cache = flask_app.JsonDocumentCache(max_bytes=largest * cache.MEMORY_FACTOR)
+        for f in files:
+            cache.load(f)
+        stats = cache.stats()
+        assert stats['estimated_bytes'] <= stats['max_bytes']
+        assert stats['evictions'] >= 1
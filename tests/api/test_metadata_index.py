@@ -0,0 +1,64 @@
+"""Tests for the SQLite metadata index behind the analytics routes."""
+import json
+
+
+class TestIndexSync:
+    """Write paths keep the index in sync without a rebuild."""
+
+    def test_save_annotation_updates_dashboard(self, client):
+        before = client.get('/api/dashboard').get_json()
+        resp = client.post(
+            '/api/annotation/15339_25173_20260129_061200000.jpg',
+            json={'annotations': [{'bbox': [1, 1, 2, 2], 'species': 'kettu'}], 'is_empty': False},
+        )
+        assert resp.status_code == 200
+        after = client.get('/api/dashboard').get_json()
+        assert after['total_annotations'] == before['total_annotations'] + 1
+        assert after['species_counts']['kettu'] == 1
+        assert after['empty_count'] == before['empty_count'] - 1
+
+    def test_image_filters(self, client):
+        data = client.get('/api/images?filter=empty').get_json()
+        assert data['images'] == ['15339_25173_20260129_061200000.jpg']
+        data = client.get('/api/images?filter=annotated').get_json()
+        assert data['total'] == 3
+
+    def test_stats_from_index(self, client):
+        data = client.get('/api/stats').get_json()
+        assert data['total_images'] == 3
+        assert data['annotated_images'] == 2
+        assert data['empty_images'] == 1
+        assert data['total_annotations'] == 3
+
+
+class TestIndexRebuild:
+    """Rebuilding from JSON files reproduces the incremental state."""
+
+    def test_rebuild_matches_incremental(self, client, test_data_dir):
+        import app as flask_app
+
+        client.post(
+            '/api/annotation/15339_25173_20260128_072622867.jpg',
+            json={'annotations': [{'bbox': [1, 1, 2, 2], 'species': 'peura'}]},
+        )
+        (test_data_dir / 'predictions' / '15339_25173_20260128_072622867.json').write_text(
+            json.dumps({'image': '15339_25173_20260128_072622867.jpg',
+                        'predictions': [{'species': 'peura', 'md_confidence': 0.9}]}),
+            encoding='utf-8',
+        )
+        index = flask_app.get_index()
+        index.index_prediction_file(
+            test_data_dir / 'predictions' / '15339_25173_20260128_072622867.json'
+        )
+        incremental = client.get('/api/dashboard').get_json()
+        recent = client.get('/api/recent-detections').get_json()
+        assert recent['species_summary'] == {'peura': 1}
+
+        stats = index.rebuild(
+            test_data_dir / 'images' / 'incoming',
+            test_data_dir / 'annotations',
+            test_data_dir / 'predictions',
+        )
+        assert stats['images'] == 3
+        assert stats['predictions'] == 1
+        assert client.get('/api/dashboard').get_json() == incremental
@@ -0,0 +1,81 @@
+"""Tests for the precomputed dashboard rollups in the metadata index."""
+import json
+
+
+ANN_NAME = '15339_25173_20260128_072622867'
+
+
+def _check(flask_app, test_data_dir):
+    return flask_app.get_index().check_rollups(
+        test_data_dir / 'images' / 'incoming', test_data_dir / 'annotations',
+    )
+
+
+class TestRollups:
+
+    def test_rollups_match_full_scan(self, client, test_data_dir):
+        import app as flask_app
+        client.get('/api/dashboard')
+        result = _check(flask_app, test_data_dir)
+        assert result['ok'], result
+
+    def test_save_annotation_updates_rollups(self, client, test_data_dir):
+        import app as flask_app
+        client.post(f'/api/annotation/{ANN_NAME}.jpg', json={'annotations': [], 'is_empty': True})
+        before = client.get('/api/dashboard').get_json()['confidence_bins']
+        client.post(
+            f'/api/annotation/{ANN_NAME}.jpg',
+            json={'annotations': [
+                {'bbox': [1, 1, 2, 2], 'species': 'kettu', 'md_confidence': 0.55,
+                 'from_prediction': True, 'original_species': 'kettu'},
+                {'bbox': [3, 3, 4, 4], 'species': 'jänis', 'md_confidence': 0.95},
+            ]},
+        )
+        assert _check(flask_app, test_data_dir)['ok']
+        data = client.get('/api/dashboard').get_json()
+        assert data['hourly_activity']['7'] == {'kettu': 1, 'jänis': 1}
+        assert data['ai_accuracy']['kettu'] == {'correct': 1, 'overridden': 0, 'total': 1}
+        assert data['confidence_bins'][5] == before[5] + 1
+        assert data['confidence_bins'][9] == before[9] + 1
+
+        client.post(f'/api/annotation/{ANN_NAME}.jpg', json={'annotations': [], 'is_empty': True})
+        assert _check(flask_app, test_data_dir)['ok']
+        data = client.get('/api/dashboard').get_json()
+        assert '7' not in data['hourly_activity']
+
+    def test_removed_image_leaves_rollups(self, client, test_data_dir):
+        import app as flask_app
+        client.get('/api/dashboard')
+        (test_data_dir / 'images' / 'incoming' / f'{ANN_NAME}.jpg').unlink()
+        flask_app.get_watcher().reconcile()
+        assert _check(flask_app, test_data_dir)['ok']
+        data = client.get('/api/dashboard').get_json()
+        assert '2026-01-28' in data['daily_activity']
+        assert '7' not in data['hourly_activity']
+
+    def test_check_detects_drift_and_rebuild_fixes_it(self, client, test_data_dir):
+        import app as flask_app
+        before = client.get('/api/dashboard').get_json()
+        index = flask_app.get_index()
+        conn = index._connect()
+        with conn:
+            conn.execute('UPDATE rollup_hourly SET n = n + 5')
+        result = _check(flask_app, test_data_dir)
+        assert not result['ok']
+        assert result['hourly']
+
+        index.rebuild_rollups()
+        assert _check(flask_app, test_data_dir)['ok']
+        assert client.get('/api/dashboard').get_json() == before
+
+    def test_external_write_picked_up_by_reconcile(self, client, test_data_dir):
+        import app as flask_app
+        client.get('/api/dashboard')
+        (test_data_dir / 'annotations' / f'{ANN_NAME}.json').write_text(
+            json.dumps({'annotations': [{'bbox': [1, 1, 2, 2], 'species': 'ilves'}]}),
+            encoding='utf-8',
+        )
+        flask_app.get_watcher().reconcile()
+        assert _check(flask_app, test_data_dir)['ok']
+        data = client.get('/api/dashboard').get_json()
+        assert data['species_counts']['ilves'] == 1
@@ -0,0 +1,104 @@
+"""Tests for the incremental directory watcher behind image listings."""
+import json
+import threading
+import time
+
+import pytest
+
+
+NEW_IMAGE = '15339_25173_20260130_101010000.jpg'
+
+
+def _write_image(path):
+    from PIL import Image as PILImage
+    PILImage.new('RGB', (4, 4), (10, 10, 10)).save(str(path), 'JPEG')
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestWatcherListing:
+
+    def test_filters_match_directory_state(self, client):
+        assert client.get('/api/images').get_json()['total'] == 3
+        assert client.get('/api/images?filter=empty').get_json()['total'] == 1
+        assert client.get('/api/images?filter=unannotated').get_json()['total'] == 0
+
+    def test_reconcile_picks_up_external_writes(self, client, test_data_dir):
+        import app as flask_app
+        client.get('/api/images')
+        _write_image(test_data_dir / 'images' / 'incoming' / NEW_IMAGE)
+        (test_data_dir / 'predictions' / NEW_IMAGE.replace('.jpg', '.json')).write_text(
+            json.dumps({'image': NEW_IMAGE, 'predictions': []}), encoding='utf-8',
+        )
+        result = flask_app.get_watcher().reconcile()
+        assert result['images'] == [1, 0]
+        assert NEW_IMAGE in client.get('/api/images?filter=predicted').get_json()['images']
+        stats = client.get('/api/stats').get_json()
+        assert stats['total_images'] == 4
+        assert stats['predicted_images'] == 1
+
+    def test_reconcile_removes_deleted_files(self, client, test_data_dir):
+        import app as flask_app
+        client.get('/api/images')
+        (test_data_dir / 'annotations' / '15339_25173_20260129_061200000.json').unlink()
+        flask_app.get_watcher().reconcile()
+        assert client.get('/api/images?filter=empty').get_json()['total'] == 0
+        assert client.get('/api/images?filter=unannotated').get_json()['total'] == 1
+
+    def test_concurrent_first_requests_build_once(self, client, monkeypatch):
+        import app as flask_app
+        rebuilds, watchers = [], []
+
+        class CountingIndex(flask_app.MetadataIndex):
+            def rebuild(self, *args):
+                rebuilds.append(self)
+                time.sleep(0.05)
+                return super().rebuild(*args)
+
+        class CountingWatcher(flask_app.DirectoryWatcher):
+            def reconcile(self):
+                watchers.append(self)
+                time.sleep(0.05)
+                return super().reconcile()
+
+        monkeypatch.setattr(flask_app, 'MetadataIndex', CountingIndex)
+        monkeypatch.setattr(flask_app, 'DirectoryWatcher', CountingWatcher)
+        got = []
+        threads = [threading.Thread(target=lambda: got.append(flask_app.get_watcher()))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(rebuilds) == 1 and len(watchers) == 1
+        assert all(w is watchers[0] for w in got)
+
+
+class TestWatcherThread:
+
+    def test_background_thread_applies_deltas(self, client, test_data_dir):
+        import app as flask_app
+        watcher = flask_app.get_watcher()
+        watcher.start()
+        try:
+            assert _wait_for(lambda: watcher.mode is not None)
+            if watcher.mode == 'poll':
+                pytest.skip('inotify not available on this platform')
+            _write_image(test_data_dir / 'images' / 'incoming' / NEW_IMAGE)
+            assert _wait_for(lambda: NEW_IMAGE in watcher.list_images('unannotated'))
+
+            ann_path = test_data_dir / 'annotations' / NEW_IMAGE.replace('.jpg', '.json')
+            ann_path.write_text(json.dumps({'annotations': [], 'is_empty': True}), encoding='utf-8')
+            assert _wait_for(lambda: NEW_IMAGE in watcher.list_images('empty'))
+
+            (test_data_dir / 'images' / 'incoming' / NEW_IMAGE).unlink()
+            assert _wait_for(lambda: NEW_IMAGE not in watcher.list_images('all'))
+        finally:
+            watcher.stop()
@@ -0,0 +1,104 @@
+"""Model stand-ins for detector tests: MegaDetector, SpeciesNet and a detector factory."""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from detection.detector import WildlifeDetector
+
+FOX = 'a;mammalia;carnivora;canidae;vulpes;vulpes;red fox'
+HARE = 'b;mammalia;lagomorpha;leporidae;lepus;europaeus;european hare'
+
+
+class FakeMegaDetector:
+    """
+    MegaDetector model object; detect(image, name) returns the detections.
+
+    calls lists the image names seen one at a time; batch_sizes the sizes of
+    generate_detections_one_batch calls (only offered when with_batch=True).
+    """
+
+    def __init__(self, detect, with_batch=False):
+        self.detect = detect
+        self.calls = []
+        self.batch_sizes = []
+        if with_batch:
+            self.generate_detections_one_batch = self._one_batch
+
+    def generate_detections_one_image(self, image, image_id=None, detection_threshold=None):
+        self.calls.append(Path(image_id).name)
+        return {'detections': self.detect(image, Path(image_id).name), 'file': image_id}
+
+    def _one_batch(self, images, image_id=None, detection_threshold=None):
+        self.batch_sizes.append(len(images))
+        return [{'detections': self.detect(im, Path(i).name), 'file': i}
+                for im, i in zip(images, image_id)]
+
+
+class FakeSpeciesNet:
+    """
+    Classifies a crop by its mean brightness: bright → fox, dark → hare.
+
+    With with_batch=True it also offers a SpeciesNet-style batch_predict,
+    which raises if fail_batch is set.
+    """
+
+    def __init__(self, with_batch=False, fail_batch=False):
+        self.predict_calls = 0
+        self.batch_calls = []
+        self.fail_batch = fail_batch
+        if with_batch:
+            self.batch_predict = self._batch_predict
+
+    def preprocess(self, crop):
+        return float(np.asarray(crop).mean())
+
+    def predict(self, image_id, preprocessed):
+        self.predict_calls += 1
+        return self._classify(preprocessed)
+
+    def _batch_predict(self, image_ids, preprocessed):
+        self.batch_calls.append(len(preprocessed))
+        if self.fail_batch:
+            raise RuntimeError('batch failed')
+        return [self._classify(p) for p in preprocessed]
+
+    @staticmethod
+    def _classify(brightness):
+        cls = FOX if brightness > 100 else HARE
+        return {'classifications': {'classes': [cls], 'scores': [round(brightness / 255, 4)]}}
+
+
+@pytest.fixture
+def fake_megadetector():
+    """Factory: fake_megadetector(detect, with_batch=False)."""
+    return FakeMegaDetector
+
+
+@pytest.fixture
+def fake_speciesnet():
+    """Factory: fake_speciesnet(with_batch=False, fail_batch=False)."""
+    return FakeSpeciesNet
+
+
+@pytest.fixture
+def make_detector():
+    """Factory: a WildlifeDetector without real models, using the given fakes."""
+    def make(md_model, classifier=None, **kwargs):
+        detector = WildlifeDetector(use_speciesnet=False, **kwargs)
+        detector.md_model = md_model
+        if classifier is not None:
+            detector.speciesnet_classifier = classifier
+        return detector
+    return make
+
+
+@pytest.fixture
+def run_detector():
+    """detect_many over paths (in sequence order with a tracker): {name: result}."""
+    def run(detector, paths, tracker=None, batch_size=3):
+        if tracker is not None:
+            paths = tracker.ordered(paths)
+        return {p.name: r for p, r, _ in detector.detect_many(paths, batch_size=batch_size,
+                                                              tracker=tracker)}
+    return run
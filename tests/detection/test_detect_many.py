@@ -0,0 +1,64 @@
+"""Tests for batched MegaDetector inference in WildlifeDetector.detect_many."""
+import pytest
+
+
+def shaded_boxes(image, name):
+    """An animal whose confidence follows the image shade, and a person."""
+    return [
+        {'bbox': [0.1, 0.2, 0.3, 0.4], 'conf': int(image[0, 0, 0]) / 255, 'category': '1'},
+        {'bbox': [0.5, 0.5, 0.25, 0.25], 'conf': 0.9, 'category': '2'},
+    ]
+
+
+@pytest.fixture
+def md(fake_megadetector):
+    return fake_megadetector(shaded_boxes, with_batch=True)
+
+
+@pytest.fixture
+def images(tmp_path):
+    from PIL import Image as PILImage
+    paths = []
+    for i in range(7):
+        path = tmp_path / f'15339_25173_20260101_0{i}0000000.jpg'
+        PILImage.new('RGB', (64 + i, 48), (30 * i, 0, 0)).save(path, 'PNG')
+        paths.append(path)
+    return paths
+
+
+class TestDetectMany:
+
+    def test_matches_per_image_results(self, images, md, make_detector):
+        detector = make_detector(md)
+        expected = [detector.detect(p) for p in images]
+        got = list(detector.detect_many(images, batch_size=3))
+        assert [p for p, _, _ in got] == images
+        assert [r for _, r, _ in got] == expected
+        assert all(e is None for _, _, e in got)
+
+    def test_uses_batch_api(self, images, md, make_detector):
+        list(make_detector(md).detect_many(images, batch_size=3))
+        assert md.batch_sizes == [3, 3]
+        assert len(md.calls) == 1
+
+    def test_falls_back_without_batch_api(self, images, fake_megadetector, make_detector):
+        md = fake_megadetector(shaded_boxes)
+        results = list(make_detector(md).detect_many(images, batch_size=4))
+        assert len(md.calls) == len(images)
+        assert all(r is not None for _, r, _ in results)
+
+    def test_unreadable_image_reported_per_image(self, images, tmp_path, md, make_detector):
+        broken = tmp_path / '15339_25173_20260101_090000000.jpg'
+        broken.write_bytes(b'not an image')
+        paths = images[:2] + [broken] + images[2:4]
+        results = list(make_detector(md).detect_many(paths, batch_size=2))
+        assert [p for p, _, _ in results] == paths
+        assert results[2][1] is None and results[2][2]
+        assert all(r is not None for p, r, _ in results if p != broken)
+
+    def test_early_stop_releases_prefetch_thread(self, images, md, make_detector):
+        import threading
+        gen = make_detector(md).detect_many(images, batch_size=1, prefetch=1)
+        next(gen)
+        gen.close()
+        assert not any(t.name == 'detector-prefetch' for t in threading.enumerate())
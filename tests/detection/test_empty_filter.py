@@ -0,0 +1,123 @@
+"""Empty-frame pre-filter (rolling per-camera background) in front of MegaDetector."""
+import numpy as np
+import pytest
+
+from detection.empty_filter import EmptyFrameFilter
+
+W, H = 192, 144
+
+
+def blob(always=()):
+    """Finds an animal where the test painted a bright blob (or where told to)."""
+    def detect(image, name):
+        if name in always or image[60:80, 90:110].mean() > 240:
+            return [{'bbox': [90 / W, 60 / H, 20 / W, 20 / H], 'conf': 0.9, 'category': '1'}]
+        return []
+    return detect
+
+
+def _scene(seed, blob=False, sway=True):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(40, 200, (H, W, 3), dtype=np.uint8)   # sama tausta
+    noise = np.random.default_rng(seed).integers(-3, 4, (H, W, 3))
+    pixels = np.clip(pixels.astype(int) + noise, 0, 255).astype(np.uint8)
+    if sway:
+        # Tuulessa heiluva oksa: nurkka vaihtelee kuvasta toiseen
+        pixels[:30, :40] = np.random.default_rng(seed + 100).integers(0, 255, (30, 40, 3))
+    if blob:
+        pixels[55:85, 85:115] = 255
+    return pixels
+
+
+@pytest.fixture
+def camera(tmp_path):
+    """12 frames from one camera; frames 8 and 10 contain an animal."""
+    from PIL import Image as PILImage
+    paths = []
+    for i in range(12):
+        path = tmp_path / f'15339_25173_20260128_0726{i:02d}000.png'
+        PILImage.fromarray(_scene(i, blob=i in (8, 10))).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def filtered(make_detector, fake_megadetector):
+    """Factory: (detector with an EmptyFrameFilter, fake MegaDetector)."""
+    def make(always=(), **kwargs):
+        kwargs.setdefault('verify_rate', 0)
+        kwargs.setdefault('warmup', 4)
+        md = fake_megadetector(blob(always))
+        detector = make_detector(md)
+        detector.empty_filter = EmptyFrameFilter(**kwargs)
+        return detector, md
+    return make
+
+
+@pytest.fixture
+def run(run_detector):
+    return lambda detector, paths: run_detector(detector, paths, batch_size=1)
+
+
+class TestEmptyFilter:
+
+    def test_empty_frames_skip_megadetector_after_warmup(self, camera, filtered, run):
+        detector, md = filtered()
+        results = run(detector, camera)
+
+        names = [p.name for p in camera]
+        # Lämpeneminen (4 kuvaa) ja eläinkuvat menevät MegaDetectorille
+        assert md.calls == names[:4] + [names[8], names[10]]
+        assert detector.empty_filter.stats['fast_path'] == 6
+        fast = results[names[5]]
+        assert fast['predictions'] == []
+        assert fast['empty_filter']['fast_path'] is True
+        assert fast['empty_filter']['empty_confidence'] >= 0.9
+        animal = results[names[8]]
+        assert animal['predictions'][0]['md_category'] == 'animal'
+        assert 'empty_filter' not in animal
+        assert detector.timings.summary()['empty_filter']['calls'] == 12
+
+    def test_verify_sample_still_runs_megadetector(self, camera, filtered, run):
+        detector, md = filtered(verify_rate=1.0)
+        results = run(detector, camera)
+
+        assert len(md.calls) == len(camera)
+        verified = results[camera[5].name]['empty_filter']
+        assert verified == {
+            'fast_path': False, 'verified': True, 'agreed': True,
+            'empty_confidence': verified['empty_confidence'],
+            'changed_fraction': verified['changed_fraction'],
+        }
+        assert detector.empty_filter.stats['verified'] == 6
+
+    def test_disagreement_resets_background(self, camera, filtered, run):
+        # MegaDetector löytää kohteen kuvasta, jota suodatin pitää tyhjänä
+        detector, _ = filtered(always={camera[5].name}, verify_rate=1.0)
+        results = run(detector, camera)
+
+        assert results[camera[5].name]['empty_filter']['agreed'] is False
+        assert detector.empty_filter.stats['disagreed'] == 1
+        # Tausta rakennetaan uudelleen: seuraavat 4 kuvaa eivät ole arvioitavissa
+        for p in camera[6:10]:
+            assert 'empty_filter' not in results[p.name]
+
+    def test_background_persists_between_runs(self, camera, tmp_path, filtered, run):
+        state = tmp_path / 'state'
+        first, _ = filtered(state_dir=state)
+        run(first, camera[:4])
+        first.empty_filter.save()
+        assert (state / '15339_25173.npz').exists()
+
+        second, md = filtered(state_dir=state)
+        results = run(second, camera[4:])
+        assert md.calls == [camera[8].name, camera[10].name]
+        assert results[camera[4].name]['empty_filter']['fast_path'] is True
+
+    def test_detect_uses_filter(self, camera, filtered):
+        detector, md = filtered()
+        for p in camera[:4]:
+            detector.detect(p)
+        assert detector.detect(camera[4])['empty_filter']['fast_path'] is True
+        assert detector.detect(camera[8])['predictions']
+        assert len(md.calls) == 5
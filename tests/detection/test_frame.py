@@ -0,0 +1,78 @@
+"""Tests for single-decode frames in the detection pipeline."""
+import numpy as np
+import pytest
+
+from detection.detector import WildlifeDetector
+from detection.frame import Frame, crop_box
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    from PIL import Image as PILImage
+    rng = np.random.default_rng(0)
+    path = tmp_path / '15339_25173_20260101_000000000.png'
+    PILImage.fromarray(rng.integers(0, 255, (120, 200, 3), dtype=np.uint8)).save(path)
+    return path
+
+
+class CountingSpeciesNet:
+    """Records the crops SpeciesNet would see."""
+
+    def __init__(self):
+        self.crops = []
+
+    def preprocess(self, crop):
+        self.crops.append(crop)
+        return crop
+
+    def predict(self, image_id, preprocessed):
+        return {'classifications': {'classes': ['x;mammalia;;;vulpes;vulpes;red fox'],
+                                    'scores': [0.8]}}
+
+
+class BoxesMegaDetector:
+    def generate_detections_one_image(self, image, image_id=None, detection_threshold=None):
+        return {'detections': [
+            {'bbox': [0.1, 0.1, 0.2, 0.3], 'conf': 0.9, 'category': '1'},
+            {'bbox': [0.5, 0.4, 0.4, 0.5], 'conf': 0.8, 'category': '1'},
+            {'bbox': [0.0, 0.0, 0.1, 0.1], 'conf': 0.7, 'category': '1'},
+        ]}
+
+
+class TestFrame:
+
+    def test_crop_box_matches_margin_rule(self):
+        assert crop_box([10, 20, 60, 40], 100, 100) == (5, 15, 65, 45)
+        assert crop_box([0, 0, 100, 50], 100, 50) == (0, 0, 100, 50)
+
+    def test_crop_is_view_of_decoded_pixels(self, image_path):
+        frame = Frame.load(image_path)
+        crop = frame.crop([10, 20, 60, 40])
+        assert np.shares_memory(crop, frame.pixels)
+        assert crop.shape[:2] == (30, 60)
+
+    def test_crop_matches_pil_crop(self, image_path):
+        from PIL import Image as PILImage
+        frame = Frame.load(image_path)
+        bbox = [150, 80, 199, 119]
+        with PILImage.open(image_path) as img:
+            expected = np.array(img.crop(crop_box(bbox, img.width, img.height)))
+        assert np.array_equal(np.array(frame.crop_image(bbox)), expected)
+
+
+class TestSingleDecode:
+
+    def test_detect_decodes_once_for_all_boxes(self, image_path):
+        detector = WildlifeDetector(use_speciesnet=False)
+        detector.md_model = BoxesMegaDetector()
+        detector.speciesnet_classifier = CountingSpeciesNet()
+
+        result = detector.detect(image_path)
+        timings = detector.stage_timings()
+
+        assert timings['decode']['calls'] == 1
+        assert timings['speciesnet']['calls'] == 3
+        assert timings['megadetector']['calls'] == 1
+        assert len(detector.speciesnet_classifier.crops) == 3
+        assert [p['species'] for p in result['predictions']] == ['kettu'] * 3
+        assert result['predictions'][0]['bbox'] == [20, 12, 60, 48]
@@ -0,0 +1,201 @@
+"""ONNX Runtime backend: pre/post-processing, export cache and parity with PyTorch."""
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from detection import onnx_backend
+from detection.detector import WildlifeDetector
+
+
+class FakeSession:
+    """Stands in for onnxruntime.InferenceSession; returns canned raw outputs."""
+
+    def __init__(self, output_fn, metadata=None):
+        self.output_fn = output_fn
+        self.metadata = metadata or {}
+        self.batches = []
+
+    def get_modelmeta(self):
+        return SimpleNamespace(custom_metadata_map=self.metadata)
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='images')]
+
+    def run(self, outputs, feed):
+        batch = feed['images']
+        self.batches.append(batch.shape)
+        return [np.stack([self.output_fn(x) for x in batch])]
+
+
+def _yolov5_row(cx, cy, w, h, obj, classes):
+    return [cx, cy, w, h, obj] + list(classes)
+
+
+class TestPostprocess:
+
+    def test_letterbox_matches_yolov5_padding(self):
+        image = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        padded, r, (dw, dh) = onnx_backend.letterbox(image, 1280, stride=64)
+        assert padded.shape == (768, 1280, 3)
+        assert r == pytest.approx(2 / 3)
+        assert (dw, dh) == (0, 24)
+        assert padded[0, 0, 0] == 114 and padded[400, 0, 0] == 0
+
+    def test_detections_scaled_to_original_and_suppressed(self):
+        # Syöte 768x1280 (1920x1080 letterboxattuna); eläin alkuperäisessä kuvassa
+        # kohdassa x 300-600, y 200-500
+        g, pad = 2 / 3, 24
+        cx, cy, w, h = 450 * g, 350 * g + pad, 300 * g, 300 * g
+        pred = np.array([
+            _yolov5_row(cx, cy, w, h, 0.9, [0.95, 0.03, 0.02]),
+            _yolov5_row(cx + 2, cy, w, h, 0.8, [0.9, 0.05, 0.05]),     # päällekkäinen
+            _yolov5_row(cx, cy, w, h, 0.7, [0.1, 0.85, 0.05]),          # eri luokka
+            _yolov5_row(900, 400, 50, 50, 0.1, [0.5, 0.3, 0.2]),        # alle kynnyksen
+        ], dtype=np.float32)
+        dets = onnx_backend.yolov5_detections(pred, (768, 1280), (1080, 1920), 0.2)
+        assert [d['category'] for d in dets] == ['1', '2']
+        assert dets[0]['conf'] == 0.855
+        assert dets[0]['bbox'] == pytest.approx([300 / 1920, 200 / 1080, 300 / 1920, 300 / 1080],
+                                                abs=1e-4)
+
+
+class TestOnnxMegaDetector:
+
+    def test_batches_by_letterbox_shape(self, monkeypatch):
+        def output(x):
+            return np.array([_yolov5_row(320, 200, 100, 100, 0.9, [0.9, 0.05, 0.05])],
+                            dtype=np.float32)
+        session = FakeSession(output, {'image_size': '640', 'stride': '32'})
+        monkeypatch.setattr(onnx_backend, 'create_session', lambda path, options=None: session)
+        md = onnx_backend.OnnxMegaDetector('md.onnx')
+
+        wide = np.zeros((480, 640, 3), dtype=np.uint8)
+        tall = np.zeros((640, 480, 3), dtype=np.uint8)
+        results = md.generate_detections_one_batch([wide, tall, wide], image_id=['a', 'b', 'c'],
+                                                    detection_threshold=0.2)
+        assert [r['file'] for r in results] == ['a', 'b', 'c']
+        assert sorted(session.batches) == [(1, 3, 640, 480), (2, 3, 480, 640)]
+        single = md.generate_detections_one_image(wide, image_id='a', detection_threshold=0.2)
+        assert single == results[0]
+
+    def test_detector_pipeline_uses_onnx_model(self, monkeypatch, tmp_path):
+        from PIL import Image as PILImage
+        path = tmp_path / '15339_25173_20260101_000000000.jpg'
+        PILImage.new('RGB', (640, 480), (90, 90, 90)).save(path)
+        session = FakeSession(
+            lambda x: np.array([_yolov5_row(320, 240, 64, 48, 0.9, [0.1, 0.9, 0.0])],
+                               dtype=np.float32),
+            {'image_size': '640', 'stride': '32'})
+        monkeypatch.setattr(onnx_backend, 'create_session', lambda path, options=None: session)
+
+        detector = WildlifeDetector(use_speciesnet=False, backend='onnx')
+        detector.md_model = onnx_backend.OnnxMegaDetector('md.onnx')
+        result = detector.detect(path)
+        assert result['predictions'] == [{
+            'bbox': [288, 216, 352, 264], 'md_category': 'person', 'md_confidence': 0.81,
+            'species': 'ihminen', 'species_confidence': 0.81,
+        }]
+
+
+class TestSpeciesModel:
+
+    def test_detect_task_takes_most_confident_anchor(self, monkeypatch):
+        def output(x):
+            out = np.zeros((4 + 9, 5), dtype=np.float32)
+            out[4 + 2, 1] = 0.6
+            out[4 + 5, 3] = 0.8
+            return out
+        session = FakeSession(output, {'task': 'detect', 'imgsz': '[320, 320]'})
+        monkeypatch.setattr(onnx_backend, 'create_session', lambda path, options=None: session)
+        model = onnx_backend.OnnxSpeciesModel('species.onnx')
+
+        from PIL import Image as PILImage
+        assert model.classify(PILImage.new('RGB', (200, 120))) == (5, pytest.approx(0.8))
+        assert session.batches == [(1, 3, 320, 320)]
+
+    def test_classify_task_center_crops(self, monkeypatch):
+        session = FakeSession(lambda x: np.array([0.1, 0.7, 0.2], dtype=np.float32),
+                              {'task': 'classify', 'imgsz': '[224, 224]'})
+        monkeypatch.setattr(onnx_backend, 'create_session', lambda path, options=None: session)
+        model = onnx_backend.OnnxSpeciesModel('species.onnx')
+
+        from PIL import Image as PILImage
+        assert model.classify(PILImage.new('RGB', (300, 150))) == (1, pytest.approx(0.7))
+        assert session.batches == [(1, 3, 224, 224)]
+
+
+class TestExportCache:
+
+    def test_exports_once_per_model_version(self, tmp_path):
+        source = tmp_path / 'species_latest.pt'
+        source.write_bytes(b'v1')
+        calls = []
+
+        def export(target):
+            calls.append(target)
+            target.write_bytes(b'onnx')
+
+        cache = tmp_path / 'onnx'
+        first = onnx_backend.cached_export(source, export, cache)
+        assert onnx_backend.cached_export(source, export, cache) == first
+        assert len(calls) == 1
+
+        # Uudelleenkoulutettu malli viedään uudestaan ja vanha vienti poistetaan
+        source.write_bytes(b'v2 retrained')
+        os.utime(source, ns=(1, 1))
+        second = onnx_backend.cached_export(source, export, cache)
+        assert second != first and len(calls) == 2
+        assert [p.name for p in cache.iterdir()] == [second.name]
+
+    def test_named_model_cached_by_name(self, tmp_path):
+        path = onnx_backend.cached_export('MDV5A', lambda t: t.write_bytes(b'x'), tmp_path)
+        assert path == tmp_path / 'MDV5A.onnx'
+
+
+def test_session_options_thread_tuning(tmp_path):
+    pytest.importorskip('onnxruntime')
+    onnx = pytest.importorskip('onnx')
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [helper.make_node('Identity', ['images'], ['output'])], 'identity',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, [1, 3])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, [1, 3])],
+    )
+    path = tmp_path / 'identity.onnx'
+    onnx.save(helper.make_model(graph), str(path))
+    onnx_backend._set_metadata(path, {'image_size': 640})
+
+    options = onnx_backend.session_options(intra_op_threads=2, inter_op_threads=1)
+    assert options.intra_op_num_threads == 2
+    session = onnx_backend.create_session(path, options)
+    assert onnx_backend.read_metadata(session)['image_size'] == '640'
+    x = np.ones((1, 3), dtype=np.float32)
+    assert (session.run(None, {'images': x})[0] == x).all()
+
+
+def test_megadetector_parity_with_pytorch(tmp_path, monkeypatch):
+    """Sama ennuste-JSON molemmilla taustoilla (vaatii mallit ja onnxruntimen)."""
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('torch')
+    pytest.importorskip('megadetector')
+    from PIL import Image as PILImage, ImageDraw
+
+    monkeypatch.setattr(onnx_backend, 'ONNX_CACHE_DIR', tmp_path / 'onnx')
+    img = PILImage.new('RGB', (1920, 1080), (70, 90, 60))
+    ImageDraw.Draw(img).ellipse([700, 400, 1100, 700], fill=(140, 110, 80))
+    path = tmp_path / '15339_25173_20260101_000000000.jpg'
+    img.save(path)
+
+    torch_result = WildlifeDetector('MDV5A', use_speciesnet=False, backend='torch').detect(path)
+    onnx_detector = WildlifeDetector('MDV5A', use_speciesnet=False, backend='onnx')
+    assert isinstance(onnx_detector.md_model, onnx_backend.OnnxMegaDetector)
+    onnx_result = onnx_detector.detect(path)
+
+    assert len(onnx_result['predictions']) == len(torch_result['predictions'])
+    for a, b in zip(onnx_result['predictions'], torch_result['predictions']):
+        assert a['md_category'] == b['md_category']
+        assert a['md_confidence'] == pytest.approx(b['md_confidence'], abs=0.02)
+        assert a['bbox'] == pytest.approx(b['bbox'], abs=4)
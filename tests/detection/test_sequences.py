@@ -0,0 +1,147 @@
+"""Burst/sequence grouping and per-sequence species reuse in detect_many."""
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from detection.sequences import (
+    SequenceTracker, build_sequences, parse_frame_time, summarize_events,
+)
+
+CAMERAS = {'15339_25173': 40, '15339_25174': 160, '15339_25175': 220}
+
+
+def drifting_box(image, name, broken=None):
+    """One animal per frame; the box drifts a little from frame to frame."""
+    frame_no = int(Path(name).stem[-3:]) // 250
+    bbox = [0.2 + 0.01 * frame_no, 0.3, 0.4, 0.4] if name != broken else [0.2, 0.3]
+    return [{'bbox': bbox, 'conf': 0.9, 'category': '1'}]
+
+
+@pytest.fixture
+def burst(tmp_path):
+    """3 cameras x 4 frames 250 ms apart, plus a later lone frame per camera."""
+    from PIL import Image as PILImage
+    paths = []
+    for camera, shade in CAMERAS.items():
+        names = [f'{camera}_20260128_072622{ms:03d}.jpg' for ms in (0, 250, 500, 750)]
+        names.append(f'{camera}_20260128_080000000.jpg')
+        for name in names:
+            path = tmp_path / name
+            PILImage.new('RGB', (96, 72), (shade, shade, shade)).save(path, 'PNG')
+            paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def detector_factory(make_detector, fake_megadetector, fake_speciesnet):
+    def make(broken=None):
+        md = fake_megadetector(lambda image, name: drifting_box(image, name, broken))
+        return make_detector(md, fake_speciesnet(), speciesnet_batch_size=1)
+    return make
+
+
+class TestGrouping:
+
+    def test_parse_frame_time_keeps_camera_and_millis(self):
+        camera, dt = parse_frame_time('15339_25173_20260128_072622867.jpg')
+        assert camera == '15339_25173'
+        assert dt == datetime(2026, 1, 28, 7, 26, 22, 867000)
+        assert parse_frame_time('IMG_0001.JPG') == ('', None)
+
+    def test_groups_by_camera_and_gap(self):
+        names = [
+            '15339_25173_20260128_072622000.jpg',
+            '15339_25174_20260128_072622100.jpg',
+            '15339_25173_20260128_072640000.jpg',   # 18 s myöhemmin: sama sarja
+            '15339_25173_20260128_072800000.jpg',   # 80 s: uusi sarja
+            'IMG_0001.JPG',
+        ]
+        seqs = build_sequences(names, gap_seconds=30)
+        frames = sorted(s['frames'] for s in seqs)
+        assert frames == sorted([
+            ['15339_25173_20260128_072622000.jpg', '15339_25173_20260128_072640000.jpg'],
+            ['15339_25174_20260128_072622100.jpg'],
+            ['15339_25173_20260128_072800000.jpg'],
+            ['IMG_0001.JPG'],
+        ])
+        assert seqs[0]['id'] == '15339_25173_20260128_072622000'
+
+
+class TestSpeciesReuse:
+
+    def test_classifier_runs_once_per_object_per_sequence(self, burst, detector_factory,
+                                                          run_detector):
+        full = detector_factory()
+        expected = run_detector(full, burst)
+        assert full.speciesnet_classifier.predict_calls == len(burst)
+
+        detector = detector_factory()
+        tracker = SequenceTracker([p.name for p in burst])
+        got = run_detector(detector, burst, tracker)
+
+        # 3 burstia + 3 yksittäistä kuvaa = 6 sarjaa, yksi luokittelu kussakin
+        assert detector.speciesnet_classifier.predict_calls == 6
+        assert tracker.stats == {'sequences': 6, 'classified': 6, 'reused': 9, 'copied': 0}
+        assert len(detector.md_model.calls) == len(burst)
+        for name, result in got.items():
+            assert [p['species'] for p in result['predictions']] == \
+                [p['species'] for p in expected[name]['predictions']]
+        reused = got['15339_25174_20260128_072622750.jpg']['predictions'][0]
+        assert reused['species'] == 'kettu'
+        assert reused['species_reused_from'] == '15339_25174_20260128_072622000.jpg'
+        assert got['15339_25174_20260128_072622750.jpg']['sequence'] == {
+            'id': '15339_25174_20260128_072622000', 'index': 3, 'size': 4}
+
+    def test_failed_batch_leaves_no_unclassified_anchors(self, burst, detector_factory):
+        paths = [p for p in burst if p.name.startswith('15339_25173_20260128_0726')]
+        broken = '15339_25173_20260128_072622250.jpg'
+        detector = detector_factory(broken)
+        tracker = SequenceTracker([p.name for p in paths])
+        results = list(detector.detect_many(paths, batch_size=3, tracker=tracker))
+
+        assert [p.name for p, _, error in results if error] == [broken]
+        got = {p.name: r for p, r, _ in results if r is not None}
+        assert [r['predictions'][0]['species'] for r in got.values()] == ['janis'] * 3
+        assert detector.speciesnet_classifier.predict_calls == 1
+        assert tracker.stats == {'sequences': 1, 'classified': 1, 'reused': 2, 'copied': 0}
+
+    def test_distant_box_is_classified_separately(self, burst, detector_factory, run_detector):
+        detector = detector_factory()
+        tracker = SequenceTracker([p.name for p in burst], iou_threshold=0.99)
+        run_detector(detector, burst, tracker)
+        assert detector.speciesnet_classifier.predict_calls == len(burst)
+        assert tracker.stats['reused'] == 0
+
+    def test_representative_mode_copies_identical_frames(self, burst, detector_factory,
+                                                         run_detector):
+        detector = detector_factory()
+        tracker = SequenceTracker([p.name for p in burst], representative=True)
+        got = run_detector(detector, burst, tracker, batch_size=2)
+
+        assert len(detector.md_model.calls) == 6
+        assert tracker.stats['copied'] == 9
+        copy = got['15339_25173_20260128_072622500.jpg']
+        assert copy['copied_from'] == '15339_25173_20260128_072622000.jpg'
+        assert copy['predictions'][0]['species'] == 'janis'
+        assert 'copied_from' not in got['15339_25173_20260128_080000000.jpg']
+
+
+class TestEvents:
+
+    def test_summarize_prefers_annotations(self):
+        frames = [
+            {'image': '15339_25173_20260128_072622000.jpg', 'species': [],
+             'predicted_species': ['kettu']},
+            {'image': '15339_25173_20260128_072623000.jpg', 'species': ['kettu', 'jänis'],
+             'predicted_species': ['kettu']},
+            {'image': '15339_25173_20260129_061200000.jpg', 'species': [],
+             'predicted_species': []},
+        ]
+        events = summarize_events(frames, gap_seconds=30)
+        assert [e['frames'] for e in events] == [1, 2]
+        burst = events[1]
+        assert burst['species'] == {'kettu': 2, 'jänis': 1}
+        assert burst['annotated'] == 1
+        assert burst['representative'] == '15339_25173_20260128_072623000.jpg'
+        assert burst['duration_seconds'] == 1.0
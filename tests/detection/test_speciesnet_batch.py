@@ -0,0 +1,56 @@
+"""Tests for batched SpeciesNet crop classification."""
+import numpy as np
+import pytest
+
+
+def flock(image, name, boxes=12):
+    """A grid of animal boxes per image."""
+    return [{'bbox': [(i % 4) * 0.25, (i // 4) * 0.25, 0.2, 0.2], 'conf': 0.9, 'category': '1'}
+            for i in range(boxes)]
+
+
+@pytest.fixture
+def images(tmp_path):
+    from PIL import Image as PILImage
+    rng = np.random.default_rng(1)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'15339_25173_20260101_0{i}0000000.png'
+        PILImage.fromarray(rng.integers(0, 255, (80, 120, 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def detector_for(make_detector, fake_megadetector):
+    def make(classifier, batch_size):
+        return make_detector(fake_megadetector(flock), classifier, speciesnet_batch_size=batch_size)
+    return make
+
+
+class TestSpeciesNetBatch:
+
+    def test_batched_matches_per_crop(self, images, detector_for, fake_speciesnet):
+        per_crop = detector_for(fake_speciesnet(with_batch=True), 1)
+        expected = [per_crop.detect(p) for p in images]
+        assert per_crop.speciesnet_classifier.predict_calls == 36
+
+        classifier = fake_speciesnet(with_batch=True)
+        batched = detector_for(classifier, 16)
+        got = [r for _, r, _ in batched.detect_many(images, batch_size=3)]
+        assert got == expected
+        assert classifier.predict_calls == 0
+        assert classifier.batch_calls == [16, 16, 4]
+
+    def test_falls_back_without_batch_api(self, images, detector_for, fake_speciesnet):
+        classifier = fake_speciesnet()
+        results = list(detector_for(classifier, 16).detect_many(images, batch_size=3))
+        assert classifier.predict_calls == 36
+        assert all(p['species'] for _, r, _ in results for p in r['predictions'])
+
+    def test_falls_back_when_batch_call_fails(self, images, detector_for, fake_speciesnet):
+        expected = detector_for(fake_speciesnet(with_batch=True), 1).detect(images[0])
+        classifier = fake_speciesnet(with_batch=True, fail_batch=True)
+        result = detector_for(classifier, 8).detect(images[0])
+        assert result == expected
+        assert classifier.predict_calls == 12
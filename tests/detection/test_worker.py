@@ -0,0 +1,186 @@
+"""Tests for the resident detector worker and its socket client."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from detection import detect_batch, worker
+from detection.detector import WildlifeDetector
+
+
+class StaticMegaDetector:
+    def generate_detections_one_image(self, image, image_id=None, detection_threshold=None):
+        return {'detections': [{'bbox': [0.1, 0.1, 0.5, 0.5], 'conf': 0.8, 'category': '2'}]}
+
+
+class FakeFactory:
+    """Counts model loads; the detector's species-model reloads are recorded."""
+
+    def __init__(self, species_int8=False):
+        self.loads = 0
+        self.species_loads = []
+        self.species_int8 = species_int8
+        self.reload_ok = True
+
+    def __call__(self):
+        self.loads += 1
+        detector = WildlifeDetector(use_speciesnet=False, species_int8=self.species_int8)
+        detector.md_model = StaticMegaDetector()
+        detector._load_species_model = self._load_species_model
+        return detector
+
+    def _load_species_model(self, path):
+        self.species_loads.append(path)
+        return self.reload_ok
+
+
+def _settled(path, data=b'weights'):
+    """Write a model file with an mtime older than the reload settle time."""
+    path.write_bytes(data)
+    old = time.time() - 10
+    os.utime(path, (old, old))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    from PIL import Image as PILImage
+    image_dir = tmp_path / 'images' / 'incoming'
+    image_dir.mkdir(parents=True)
+    for i in range(3):
+        PILImage.new('RGB', (8, 8)).save(image_dir / f'15339_25173_20260101_0{i}0000000.jpg')
+    monkeypatch.setattr(detect_batch, 'DATA_DIR', tmp_path)
+    monkeypatch.setattr(detect_batch, 'IMAGE_DIR', image_dir)
+    monkeypatch.setattr(detect_batch, 'PREDICTION_DIR', tmp_path / 'predictions')
+    return tmp_path
+
+
+@pytest.fixture
+def start_service(data_dir):
+    """Factory: start_service(factory) runs a DetectorService on a socket."""
+    started = []
+
+    def start(factory):
+        # Unix-soketin polku on rajattu ~100 merkkiin, joten käytetään lyhyttä hakemistoa
+        sock_dir = tempfile.mkdtemp(prefix='det', dir='/tmp')
+        socket_path = Path(sock_dir) / 'd.sock'
+        service = worker.DetectorService(
+            detector_factory=factory, species_model_path=data_dir / 'species_latest.pt',
+        )
+        server = worker.DetectorServer(socket_path, service)
+        threading.Thread(target=service.run, daemon=True).start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append((server, service, sock_dir))
+        return service, factory, socket_path
+
+    yield start
+    for server, service, sock_dir in started:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+        shutil.rmtree(sock_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def running_service(start_service):
+    return start_service(FakeFactory())
+
+
+class TestDetectorWorker:
+
+    def test_models_loaded_once_across_requests(self, running_service, data_dir, monkeypatch):
+        service, factory, socket_path = running_service
+        monkeypatch.setattr(worker, 'DETECTOR_WORKER', 'on')
+
+        first = worker.request_detection(socket_path=socket_path)
+        assert first['processed'] == 3
+        pred = json.loads((data_dir / 'predictions' / '15339_25173_20260101_000000000.json').read_text())
+        assert pred['predictions'][0]['species'] == 'ihminen'
+
+        second = worker.request_detection(socket_path=socket_path)
+        assert second['processed'] == 0
+        assert factory.loads == 1
+
+        status = worker.worker_status(socket_path=socket_path)
+        assert status['state'] == 'ready'
+        assert status['queue_depth'] == 0
+        assert status['model_load_seconds'] is not None
+        assert status['images_processed'] == 3
+
+    def test_species_model_hot_reload(self, running_service, data_dir, monkeypatch):
+        service, factory, socket_path = running_service
+        monkeypatch.setattr(worker, 'DETECTOR_WORKER', 'on')
+        worker.request_detection(socket_path=socket_path)
+        assert factory.species_loads == []
+
+        model = data_dir / 'species_latest.pt'
+        _settled(model)
+        worker.request_detection(socket_path=socket_path, force=True)
+        assert factory.species_loads == [str(model)]
+        assert worker.worker_status(socket_path=socket_path)['species_reloads'] == 1
+
+        worker.request_detection(socket_path=socket_path, force=True)
+        assert len(factory.species_loads) == 1
+
+    def test_failed_species_reload_is_retried(self, running_service, data_dir, monkeypatch):
+        service, factory, socket_path = running_service
+        monkeypatch.setattr(worker, 'DETECTOR_WORKER', 'on')
+        worker.request_detection(socket_path=socket_path)
+
+        # Puolikas kopio: lataus epäonnistuu ja vanha malli jää käyttöön
+        factory.reload_ok = False
+        _settled(data_dir / 'species_latest.pt')
+        worker.request_detection(socket_path=socket_path, force=True)
+        status = worker.worker_status(socket_path=socket_path)
+        assert status['species_reloads'] == 0 and 'Lajimallin lataus' in status['last_error']
+
+        factory.reload_ok = True
+        worker.request_detection(socket_path=socket_path, force=True)
+        assert len(factory.species_loads) == 2
+        assert worker.worker_status(socket_path=socket_path)['species_reloads'] == 1
+
+    def test_int8_model_written_after_retrain_is_loaded(self, start_service, data_dir,
+                                                         monkeypatch):
+        from training.quantize import quantized_path
+
+        model = data_dir / 'species_latest.pt'
+        _settled(model)
+        service, factory, socket_path = start_service(FakeFactory(species_int8=True))
+        monkeypatch.setattr(worker, 'DETECTOR_WORKER', 'on')
+        worker.request_detection(socket_path=socket_path)
+        assert factory.species_loads == []
+
+        # Kvantisointi valmistuu vasta koulutuksen jälkeen
+        _settled(quantized_path(model), b'int8')
+        worker.request_detection(socket_path=socket_path, force=True)
+        assert factory.species_loads == [str(model)]
+        worker.request_detection(socket_path=socket_path, force=True)
+        assert len(factory.species_loads) == 1
+
+    def test_timeout_does_not_rerun_detection_in_process(self, running_service, monkeypatch):
+        service, factory, socket_path = running_service
+        monkeypatch.setattr(worker, 'DETECTOR_WORKER', 'on')
+        release = threading.Event()
+        monkeypatch.setattr(detect_batch, 'run_detection',
+                            lambda *args: release.wait(5) and {'processed': 3})
+        monkeypatch.setattr(detect_batch, 'load_detector',
+                            lambda: pytest.fail('malleja ei pidä ladata tässä prosessissa'))
+        monkeypatch.setattr(detect_batch, 'detect_new_images',
+                            lambda force=False: pytest.fail('tunnistettiin kahdesti'))
+
+        result = worker.request_detection(socket_path=socket_path, timeout=0.3)
+        assert result['processed'] == 0 and 'ei vastannut' in result['error']
+        release.set()
+
+    def test_falls_back_in_process_without_worker(self, data_dir, monkeypatch):
+        calls = []
+        monkeypatch.setattr(worker, 'DETECTOR_WORKER', 'off')
+        monkeypatch.setattr(detect_batch, 'detect_new_images',
+                            lambda force=False: calls.append(force) or {'processed': 0})
+        assert worker.request_detection(socket_path='/tmp/missing-detector.sock') == {'processed': 0}
+        assert calls == [False]
+        assert worker.worker_status(socket_path='/tmp/missing-detector.sock') is None
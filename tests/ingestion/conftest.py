@@ -0,0 +1,134 @@
+"""Local IMAP stand-in for ingestion tests."""
+import re
+
+import pytest
+
+from ingestion import fetch_camera_imap
+
+
+class FakeMailbox:
+    """
+    In-memory INBOX with UIDs. Supports the subset of IMAP used by
+    fetch_camera_imap: SELECT, SEARCH, UID SEARCH (UID range) and UID FETCH.
+    """
+
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = {}  # uid -> raw bytes
+        self.next_uid = 1
+        self.commands = []
+        self.transferred = 0  # UID:t ja viestit, jotka palvelin on lähettänyt
+        self.largest_literal = 0
+
+    def add(self, raw, uid=None):
+        uid = uid or self.next_uid
+        self.messages[uid] = raw
+        self.next_uid = max(self.next_uid, uid + 1)
+        return uid
+
+    def expunge(self, uid):
+        del self.messages[uid]
+
+    def rebuild(self, uidvalidity):
+        """Sama sisältö uusilla UID:illa (UIDVALIDITY vaihtuu)."""
+        raws = [self.messages[u] for u in sorted(self.messages)]
+        self.uidvalidity = uidvalidity
+        self.messages = {}
+        self.next_uid = 1
+        for raw in raws:
+            self.add(raw)
+
+    def connect(self, host, port):
+        return FakeIMAPConnection(self)
+
+
+class FakeIMAPConnection:
+
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+        self._untagged = {}
+
+    def login(self, user, password):
+        return 'OK', [b'']
+
+    def select(self, name, readonly=False):
+        self._untagged = {
+            'UIDVALIDITY': [str(self.mailbox.uidvalidity).encode()],
+            'UIDNEXT': [str(self.mailbox.next_uid).encode()],
+        }
+        return 'OK', [str(len(self.mailbox.messages)).encode()]
+
+    def response(self, code):
+        return code, self._untagged.pop(code, [None])
+
+    def search(self, charset, *criteria):
+        self.mailbox.commands.append(('SEARCH',) + criteria)
+        seqs = [str(i + 1).encode() for i in range(len(self.mailbox.messages))]
+        self.mailbox.transferred += len(seqs)
+        return 'OK', [b' '.join(seqs)]
+
+    def uid(self, command, *args):
+        self.mailbox.commands.append((f'UID {command}',) + args)
+        uids = sorted(self.mailbox.messages)
+        if command == 'SEARCH':
+            criteria = ' '.join(a for a in args if a)
+            m = re.search(r'UID (\d+):\*', criteria)
+            if m:
+                low = int(m.group(1))
+                # RFC 3501: n:* sisältää aina suurimman UID:n
+                uids = [u for u in uids if u >= low] or uids[-1:]
+            self.mailbox.transferred += len(uids)
+            return 'OK', [b' '.join(str(u).encode() for u in uids)]
+        if command == 'FETCH':
+            wanted = [int(u) for u in args[0].split(',')]
+            parts = args[1]
+            partial = re.search(r'BODY\.PEEK\[\]<(\d+)\.(\d+)>', parts)
+            data = []
+            for seq, uid in enumerate(uids, 1):
+                if uid not in wanted:
+                    continue
+                raw = self.mailbox.messages[uid]
+                if 'RFC822.SIZE' in parts:
+                    data.append(f'{seq} (UID {uid} RFC822.SIZE {len(raw)})'.encode())
+                    continue
+                if partial:
+                    offset, length = int(partial.group(1)), int(partial.group(2))
+                    raw = raw[offset:offset + length]
+                    data.append((f'{seq} (UID {uid} BODY[]<{offset}> {{{len(raw)}}}'.encode(), raw))
+                else:
+                    data.append((f'{seq} (UID {uid} BODY[] {{{len(raw)}}}'.encode(), raw))
+                data.append(b')')
+                self.mailbox.transferred += 1
+                self.mailbox.largest_literal = max(self.mailbox.largest_literal, len(raw))
+            return 'OK', data
+        return 'NO', [b'unsupported']
+
+    def logout(self):
+        return 'BYE', [b'']
+
+
+@pytest.fixture
+def mailbox_factory(monkeypatch):
+    """Luo uusi postilaatikko ja ohjaa IMAP-yhteydet siihen."""
+    monkeypatch.setenv('GMAIL_USER', 'test@example.com')
+    monkeypatch.setenv('GMAIL_APP_PASSWORD', 'secret')
+
+    def make(uidvalidity=1):
+        box = FakeMailbox(uidvalidity)
+        monkeypatch.setattr(fetch_camera_imap.imaplib, 'IMAP4_SSL', box.connect)
+        return box
+
+    return make
+
+
+@pytest.fixture
+def mailbox(mailbox_factory):
+    return mailbox_factory()
+
+
+@pytest.fixture
+def ingest_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_camera_imap, 'DATA_DIR', tmp_path)
+    monkeypatch.setattr(fetch_camera_imap, 'IMAGE_DIR', tmp_path / 'images' / 'incoming')
+    monkeypatch.setattr(fetch_camera_imap, 'open_metadata_index', lambda data_dir: None)
+    return tmp_path
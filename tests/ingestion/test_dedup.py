@@ -0,0 +1,174 @@
+"""Content-hash deduplication at ingestion time and the scan/merge CLI helpers."""
+import io
+import json
+import threading
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+from PIL import Image, ImageDraw
+
+from ingestion import dedup, fetch_camera_imap
+from storage.metadata_index import claim_cutoff_ns, open_index
+
+
+def _jpeg(seed, quality=95):
+    img = Image.new('RGB', (320, 240), (20 * seed % 255, 90, 140))
+    draw = ImageDraw.Draw(img)
+    for i in range(6):
+        x = (seed * 37 + i * 53) % 280
+        draw.rectangle([x, 20 + i * 30, x + 40, 50 + i * 30], fill=(255 - 30 * i, 40 * i, 200))
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def _message(subject, images):
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = subject
+    msg['From'] = 'camera@linckeazi.com'
+    msg['Date'] = 'Thu, 01 Jan 2026 10:00:00 +0000'
+    msg.attach(MIMEText('Temperature: -4C', 'plain', 'utf-8'))
+    for i, data in enumerate(images):
+        msg.attach(MIMEImage(data, 'jpeg', name=f'IMG_{i:04d}.JPG'))
+    return msg.as_bytes()
+
+
+@pytest.fixture
+def index(tmp_path):
+    return open_index(tmp_path)
+
+
+def test_fetch_skips_resent_image_before_writing(mailbox, ingest_dirs, index, monkeypatch):
+    monkeypatch.setattr(fetch_camera_imap, 'open_metadata_index', lambda data_dir: index)
+    first, second = _jpeg(1), _jpeg(2)
+    mailbox.add(_message('Camera alert 1', [first]))
+    mailbox.add(_message('Camera alert 2', [first, second]))  # pilvi lähetti uudelleen
+
+    result = fetch_camera_imap.fetch_camera_images()
+
+    assert result['fetched'] == 2
+    assert result['duplicates'] == 1
+    image_dir = ingest_dirs / 'images' / 'incoming'
+    stored = sorted(p.read_bytes() for p in image_dir.glob('*.jpg'))
+    assert stored == sorted([first, second])
+    assert not list(image_dir.glob('*.part'))
+    assert len(result['new_images']) == 2
+
+    # Myöhempi nouto samasta kuvasta ohitetaan myös
+    mailbox.add(_message('Camera alert 3', [second]))
+    again = fetch_camera_imap.fetch_camera_images()
+    assert again['fetched'] == 0 and again['duplicates'] == 1
+    assert again['new_images'] == []
+
+
+def test_concurrent_claims_store_only_one_copy(index):
+    outcomes = []
+    barrier = threading.Barrier(8)
+
+    def claim(i):
+        barrier.wait()
+        try:
+            dedup.claim_image(index, f'img_{i}.jpg', 'a' * 64)
+            outcomes.append(None)
+        except dedup.DuplicateImage as e:
+            outcomes.append(e.existing)
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert outcomes.count(None) == 1
+    assert len(set(o for o in outcomes if o)) == 1
+
+
+def test_perceptual_hash_catches_recompressed_copy(index, monkeypatch):
+    monkeypatch.setattr(dedup, 'PHASH_ENABLED', True)
+    original, recompressed, other = _jpeg(3), _jpeg(3, quality=40), _jpeg(9)
+    assert original != recompressed
+
+    dedup.claim_image(index, 'a.jpg', dedup.hashlib.sha256(original).hexdigest(),
+                      io.BytesIO(original))
+    with pytest.raises(dedup.DuplicateImage):
+        dedup.claim_image(index, 'b.jpg', dedup.hashlib.sha256(recompressed).hexdigest(),
+                          io.BytesIO(recompressed))
+    dedup.claim_image(index, 'c.jpg', dedup.hashlib.sha256(other).hexdigest(),
+                      io.BytesIO(other))
+
+
+def test_scan_reports_and_merge_keeps_annotated_copy(tmp_path, index):
+    image_dir = tmp_path / 'images' / 'incoming'
+    annotation_dir = tmp_path / 'annotations'
+    prediction_dir = tmp_path / 'predictions'
+    for d in (image_dir, annotation_dir, prediction_dir):
+        d.mkdir(parents=True)
+    data = _jpeg(5)
+    for name in ('20260101_100000.jpg', '20260101_100000_1.jpg'):
+        (image_dir / name).write_bytes(data)
+        (prediction_dir / f'{name[:-4]}.json').write_text('{}')
+        index.index_image_file(image_dir / name)
+    (image_dir / 'unique.jpg').write_bytes(_jpeg(6))
+    (annotation_dir / '20260101_100000_1.json').write_text(json.dumps({'annotations': []}))
+
+    result = dedup.scan(index, image_dir)
+    assert result == {'images': 3, 'hashed': 3, 'removed': 0}
+    assert dedup.scan(index, image_dir)['hashed'] == 0  # muuttumattomat ohitetaan
+
+    groups = dedup.find_duplicates(index)
+    assert groups == [['20260101_100000.jpg', '20260101_100000_1.jpg']]
+
+    merged = dedup.merge(index, groups, image_dir, annotation_dir, prediction_dir,
+                         tmp_path / 'duplicates')
+    assert merged['kept'] == ['20260101_100000_1.jpg']
+    assert not (image_dir / '20260101_100000.jpg').exists()
+    assert (tmp_path / 'duplicates' / '20260101_100000.jpg').exists()
+    assert (tmp_path / 'duplicates' / 'predictions' / '20260101_100000.json').exists()
+    assert dedup.find_duplicates(index) == []
+    assert index.image_count() == 1
+
+
+def test_scan_keeps_claims_of_images_being_written(tmp_path, index):
+    image_dir = tmp_path / 'images'
+    image_dir.mkdir()
+    (image_dir / 'gone.jpg').write_bytes(_jpeg(1))
+    dedup.scan(index, image_dir)
+    (image_dir / 'gone.jpg').unlink()
+
+    # Nouto on varannut tiivisteen, mutta kuva on vielä .part-tiedostona
+    data = _jpeg(2)
+    dedup.claim_image(index, 'new.jpg', dedup.hashlib.sha256(data).hexdigest())
+    (image_dir / '.incoming-new.jpg.part').write_bytes(data)
+
+    assert dedup.scan(index, image_dir)['removed'] == 1
+    assert set(index.image_hash_stats()) == {'new.jpg'}
+    with pytest.raises(dedup.DuplicateImage):
+        dedup.claim_image(index, 'new_1.jpg', dedup.hashlib.sha256(data).hexdigest())
+    index.rebuild(image_dir, tmp_path / 'annotations', tmp_path / 'predictions')
+    assert set(index.image_hash_stats()) == {'new.jpg'}
+
+
+def test_orphaned_claim_expires_after_grace_period(tmp_path, index):
+    image_dir = tmp_path / 'images'
+    image_dir.mkdir()
+    stale, fresh = _jpeg(3), _jpeg(4)
+    # Nouto kaatui varauksen jälkeen: tiiviste on kirjattu, kuvaa ei ole
+    old_ns = claim_cutoff_ns() - 10**9
+    index.put_image_hash('crashed.jpg', dedup.hashlib.sha256(stale).hexdigest(), mtime_ns=old_ns)
+    dedup.claim_image(index, 'pending.jpg', dedup.hashlib.sha256(fresh).hexdigest())
+
+    index.rebuild(image_dir, tmp_path / 'annotations', tmp_path / 'predictions')
+    assert set(index.image_hash_stats()) == {'pending.jpg'}
+
+    index.put_image_hash('crashed.jpg', dedup.hashlib.sha256(stale).hexdigest(), mtime_ns=old_ns)
+    assert dedup.scan(index, image_dir)['removed'] == 1
+    assert set(index.image_hash_stats()) == {'pending.jpg'}
+    # Uudelleen lähetetty kuva tallennetaan; tuore varaus estää yhä kopion
+    dedup.claim_image(index, 'resent.jpg', dedup.hashlib.sha256(stale).hexdigest())
+    with pytest.raises(dedup.DuplicateImage):
+        dedup.claim_image(index, 'pending_1.jpg', dedup.hashlib.sha256(fresh).hexdigest())
+
+    # Vanhentuneena myös tuore varaus karsitaan
+    assert dedup.scan(index, image_dir, claim_grace=-1)['removed'] == 2
+    assert index.image_hash_stats() == {}
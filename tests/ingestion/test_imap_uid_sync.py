@@ -0,0 +1,116 @@
+"""Tests for UID-based incremental IMAP sync."""
+import json
+
+import pytest
+from email.mime.multipart import MIMEMultipart
+from email.mime.image import MIMEImage
+from email.mime.text import MIMEText
+
+from ingestion import fetch_camera_imap
+from storage.processed_messages import ProcessedMessageStore
+
+
+def _camera_message(i):
+    msg = MIMEMultipart()
+    # Ei tiedostonimeä otsikossa -> liitepolku (ei URL-fallbackia)
+    msg['Subject'] = f'Camera alert {i}'
+    msg['From'] = 'noreply@linckeazi.com'
+    msg['Date'] = 'Thu, 01 Jan 2026 10:00:00 +0000'
+    msg.attach(MIMEText('Temperature: 3C'))
+    msg.attach(MIMEImage(b'\xff\xd8\xff\xe0' + bytes(64), 'jpeg',
+                         name=f'15339_25173_20260101_{i:09d}.jpg'))
+    return msg.as_bytes()
+
+
+def _fill(mailbox, count, start=0):
+    return [mailbox.add(_camera_message(start + i)) for i in range(count)]
+
+
+def _fetch_commands(mailbox):
+    return [c for c in mailbox.commands if c[0] == 'UID FETCH' and 'BODY' in c[2]]
+
+
+def _state(ingest_dirs):
+    return ProcessedMessageStore(ingest_dirs / 'processed.db')
+
+
+class TestUidSync:
+
+    def test_first_run_fetches_in_batches(self, mailbox, ingest_dirs, monkeypatch):
+        monkeypatch.setattr(fetch_camera_imap, 'FETCH_BATCH_SIZE', 4)
+        uids = _fill(mailbox, 10)
+        result = fetch_camera_imap.fetch_camera_images()
+
+        assert result['fetched'] == 10
+        assert len(_fetch_commands(mailbox)) == 3
+        state = _state(ingest_dirs)
+        assert state.get('imap_uidvalidity') == 1
+        assert state.get('imap_last_uid') == uids[-1]
+
+    def test_idle_cycle_is_constant(self, ingest_dirs, mailbox_factory, monkeypatch):
+        costs = []
+        for size in (5, 500):
+            box = mailbox_factory()
+            monkeypatch.setattr(fetch_camera_imap, 'DATA_DIR', ingest_dirs / f'n{size}')
+            _fill(box, size)
+            fetch_camera_imap.fetch_camera_images()
+
+            box.commands.clear()
+            box.transferred = 0
+            idle = fetch_camera_imap.fetch_camera_images()
+            assert idle['fetched'] == 0
+            assert _fetch_commands(box) == []
+            assert box.commands[0][:2] == ('UID SEARCH', None)
+            assert box.commands[0][2] == f'UID {size + 1}:*'
+            costs.append((len(box.commands), box.transferred))
+        assert costs[0] == costs[1]
+
+    def test_only_new_messages_fetched(self, mailbox, ingest_dirs):
+        _fill(mailbox, 3)
+        fetch_camera_imap.fetch_camera_images()
+        mailbox.expunge(2)  # järjestysnumerot siirtyvät, UID:t eivät
+        new_uid = mailbox.add(_camera_message(99))
+        mailbox.commands.clear()
+
+        result = fetch_camera_imap.fetch_camera_images()
+        assert result['new_images'] == ['15339_25173_20260101_000000099.jpg']
+        assert _fetch_commands(mailbox)[0][1] == str(new_uid)
+
+    def test_legacy_sequence_ids_are_migrated(self, mailbox, ingest_dirs):
+        _fill(mailbox, 4)
+        (ingest_dirs / 'processed_emails.json').write_text(json.dumps(
+            {'processed_ids': ['1', '2', '3'], 'last_fetch': '2026-01-01T10:00:00'}
+        ))
+        result = fetch_camera_imap.fetch_camera_images()
+        assert result['skipped'] == 3
+        assert result['new_images'] == ['15339_25173_20260101_000000003.jpg']
+
+    def test_uidvalidity_change_resyncs_since_last_fetch(self, mailbox, ingest_dirs):
+        _fill(mailbox, 2)
+        fetch_camera_imap.fetch_camera_images()
+        mailbox.rebuild(uidvalidity=2)
+        mailbox.commands.clear()
+
+        fetch_camera_imap.fetch_camera_images()
+        search = mailbox.commands[0]
+        assert search[0] == 'UID SEARCH' and search[2].startswith('SINCE ')
+        assert _state(ingest_dirs).get('imap_uidvalidity') == 2
+
+    def test_crash_keeps_per_message_progress(self, mailbox, ingest_dirs, monkeypatch):
+        _fill(mailbox, 4)
+        real_fetch = fetch_camera_imap.fetch_messages
+
+        def crashing_fetch(mail, uids):
+            for n, item in enumerate(real_fetch(mail, uids)):
+                if n == 2:
+                    raise ConnectionResetError('yhteys katkesi')
+                yield item
+
+        monkeypatch.setattr(fetch_camera_imap, 'fetch_messages', crashing_fetch)
+        with pytest.raises(ConnectionResetError):
+            fetch_camera_imap.fetch_camera_images()
+        assert len(_state(ingest_dirs)) == 2
+
+        monkeypatch.setattr(fetch_camera_imap, 'fetch_messages', real_fetch)
+        result = fetch_camera_imap.fetch_camera_images()
+        assert result['fetched'] == 2
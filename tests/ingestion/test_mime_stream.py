@@ -0,0 +1,153 @@
+"""Tests for streaming MIME parsing of camera messages."""
+import email
+import os
+import time
+import tracemalloc
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from ingestion import fetch_camera_imap
+from ingestion.mime_stream import parse_message_stream, remove_stale_parts
+
+CHUNK = 64 * 1024
+
+
+def _burst_message(images, html='<p>Temperature: -4C ÄÖ</p>'):
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = 'Camera burst'
+    msg['From'] = 'camera@example.com'
+    msg['Date'] = 'Thu, 01 Jan 2026 10:00:00 +0000'
+    related = MIMEMultipart('related')
+    related.attach(MIMEText(html, 'html', 'utf-8'))
+    msg.attach(related)
+    for i, data in enumerate(images):
+        msg.attach(MIMEImage(data, 'jpeg', name=f'IMG_{i:04d}.JPG'))
+    msg.attach(MIMEApplication(b'%PDF-1.4 raportti', name='raportti.pdf'))
+    return msg.as_bytes()
+
+
+def _chunks(raw, size):
+    for i in range(0, len(raw), size):
+        yield raw[i:i + size]
+
+
+class TestMimeStream:
+
+    def test_attachments_decoded_to_temp_files(self, tmp_path):
+        images = [os.urandom(5000 + i * 1111) for i in range(3)]
+        raw = _burst_message(images)
+
+        msg = parse_message_stream(_chunks(raw, 7), tmp_path)
+
+        assert msg.headers['Subject'] == 'Camera burst'
+        assert 'Temperature: -4C ÄÖ' in msg.body
+        assert [a.filename for a in msg.attachments] == ['IMG_0000.JPG', 'IMG_0001.JPG', 'IMG_0002.JPG']
+        for att, data in zip(msg.attachments, images):
+            assert att.temp_path.parent == tmp_path
+            assert att.temp_path.name.endswith('.part')
+            assert att.temp_path.read_bytes() == data
+            assert att.size == len(data)
+
+        target = att.commit(tmp_path / 'final.jpg')
+        assert target.read_bytes() == images[-1]
+        msg.discard()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['final.jpg']
+
+    def test_single_part_text(self, tmp_path):
+        raw = MIMEText('Battery: 80%\nhttps://x.aliyuncs.com/a.jpg', 'plain', 'utf-8').as_bytes()
+        msg = parse_message_stream([raw], tmp_path)
+        assert 'Battery: 80%' in msg.body
+        assert msg.attachments == []
+
+    def test_empty_image_part_is_dropped(self, tmp_path):
+        raw = _burst_message([b'', b'\xff\xd8kuva'])
+        msg = parse_message_stream([raw], tmp_path)
+        assert [a.filename for a in msg.attachments] == ['IMG_0001.JPG']
+        assert len(list(tmp_path.glob('.incoming-*.part'))) == 1
+        msg.discard()
+        assert not list(tmp_path.iterdir())
+
+    def test_remove_stale_parts(self, tmp_path):
+        stale, fresh = tmp_path / '.incoming-a.part', tmp_path / '.incoming-b.part'
+        for path in (stale, fresh, tmp_path / 'kuva.jpg'):
+            path.write_bytes(b'x')
+        old = time.time() - 2 * 3600
+        os.utime(stale, (old, old))
+        assert remove_stale_parts(tmp_path) == 1
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['.incoming-b.part', 'kuva.jpg']
+
+    def test_peak_memory_bounded_per_message(self, tmp_path):
+        images = [os.urandom(2 * 1024 * 1024) for _ in range(4)]
+        path = tmp_path / 'burst.eml'
+        path.write_bytes(_burst_message(images))
+        out = tmp_path / 'out'
+        out.mkdir()
+        del images
+
+        def file_chunks():
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(CHUNK)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        tracemalloc.start()
+        try:
+            msg = parse_message_stream(file_chunks(), out)
+            _, streaming_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+
+            # Vertailu: koko viesti muistiin ja liitteet purettuina listaan
+            parsed = email.message_from_bytes(path.read_bytes())
+            payloads = [p.get_payload(decode=True) for p in parsed.walk()
+                        if p.get_content_type().startswith('image/')]
+            _, full_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert len(payloads) == len(msg.attachments) == 4
+        assert sum(a.size for a in msg.attachments) == 8 * 1024 * 1024
+        print(f'\npeak: streaming {streaming_peak / 1e6:.2f} MB, '
+              f'full message {full_peak / 1e6:.2f} MB')
+        assert streaming_peak < 1024 * 1024
+        assert full_peak > 10 * streaming_peak
+
+
+class TestStreamedImapFetch:
+
+    def test_large_message_fetched_in_parts(self, mailbox, ingest_dirs, monkeypatch):
+        monkeypatch.setattr(fetch_camera_imap, 'STREAM_THRESHOLD_BYTES', 100 * 1024)
+        monkeypatch.setattr(fetch_camera_imap, 'PARTIAL_FETCH_BYTES', 32 * 1024)
+        images = [os.urandom(150 * 1024) for _ in range(3)]
+        mailbox.add(_burst_message(images))
+        mailbox.add(_burst_message([b'\xff\xd8small']))
+
+        result = fetch_camera_imap.fetch_camera_images()
+
+        # Liitteiden nimissä ei ole kameran tiedostonimeä -> viestin aikaleima
+        assert result['new_images'] == ['20260101_100000.jpg', '20260101_100000_1.jpg',
+                                        '20260101_100000_2.jpg', '20260101_100000_3.jpg']
+        image_dir = ingest_dirs / 'images' / 'incoming'
+        assert (image_dir / '20260101_100000_1.jpg').read_bytes() == images[1]
+        assert not list(image_dir.glob('*.part'))
+        assert mailbox.largest_literal <= 32 * 1024 + 1024
+        meta = (image_dir / '20260101_100000.meta.json').read_text(encoding='utf-8')
+        assert '-4C' in meta
+
+    def test_empty_attachment_and_stale_parts_are_dropped(self, mailbox, ingest_dirs):
+        image_dir = ingest_dirs / 'images' / 'incoming'
+        image_dir.mkdir(parents=True)
+        crashed = image_dir / '.incoming-crashed.part'
+        crashed.write_bytes(b'\xff\xd8kesken')
+        old = time.time() - 2 * 3600
+        os.utime(crashed, (old, old))
+        mailbox.add(_burst_message([b'', b'\xff\xd8kuva']))
+
+        result = fetch_camera_imap.fetch_camera_images()
+
+        assert result['new_images'] == ['20260101_100000.jpg']
+        assert (image_dir / '20260101_100000.jpg').read_bytes() == b'\xff\xd8kuva'
+        assert not list(image_dir.glob('*.part'))
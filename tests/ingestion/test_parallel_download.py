@@ -0,0 +1,124 @@
+"""Tests for concurrent image downloads in the IMAP ingestion path."""
+import io
+import json
+import re
+import threading
+import time
+from email.mime.text import MIMEText
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ingestion import fetch_camera_imap
+from storage.processed_messages import ProcessedMessageStore
+
+DELAY_SECONDS = 0.05
+MESSAGE_COUNT = 24
+
+
+def _jpeg_bytes():
+    from PIL import Image as PILImage
+    buf = io.BytesIO()
+    PILImage.new('RGB', (16, 16), (90, 120, 60)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    payload = _jpeg_bytes()
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        time.sleep(DELAY_SECONDS)
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _add_messages(mailbox, base_url):
+    for i in range(MESSAGE_COUNT):
+        # Viestit 0 ja 1 jakavat tiedostonimen -> toinen saa _1-päätteen
+        name = f'15339_25173_20260101_{max(i, 1):09d}.jpg'
+        path = '/missing/x.jpg' if i == 5 else f'/img/{name}'
+        msg = MIMEText(f'<a href="{base_url}{path}">kuva</a>\nTemperature: 3C', 'html')
+        msg['Subject'] = f'Camera {name}'
+        msg['From'] = 'noreply@linckeazi.com'
+        msg['Date'] = 'Thu, 01 Jan 2026 10:00:00 +0000'
+        mailbox.add(msg.as_bytes())
+
+
+@pytest.fixture
+def fetch_env(tmp_path, monkeypatch, image_server, mailbox):
+    base_url = f'http://127.0.0.1:{image_server.server_port}'
+    _add_messages(mailbox, base_url)
+    monkeypatch.setattr(fetch_camera_imap, 'LINCKEAZI_IMAGE_PATTERN',
+                        re.compile(re.escape(base_url) + r'/[^"<>\s]*\.jpg'))
+    monkeypatch.setattr(fetch_camera_imap, 'open_metadata_index', lambda data_dir: None)
+
+    def run(workers):
+        data_dir = tmp_path / f'w{workers}'
+        monkeypatch.setattr(fetch_camera_imap, 'DATA_DIR', data_dir)
+        monkeypatch.setattr(fetch_camera_imap, 'IMAGE_DIR', data_dir / 'images' / 'incoming')
+        image_server.connections.clear()
+        start = time.perf_counter()
+        result = fetch_camera_imap.fetch_camera_images(download_workers=workers)
+        return result, time.perf_counter() - start, data_dir
+
+    return run
+
+
+class TestParallelDownload:
+
+    def test_naming_and_bookkeeping_match_serial(self, fetch_env):
+        serial, _, _ = fetch_env(1)
+        parallel, _, data_dir = fetch_env(8)
+
+        assert parallel['new_images'] == serial['new_images']
+        assert parallel['fetched'] == serial['fetched'] == MESSAGE_COUNT - 1
+        assert '15339_25173_20260101_000000001_1.jpg' in parallel['new_images']
+        assert len(parallel['errors']) == 1 and '404' in parallel['errors'][0]
+
+        assert len(ProcessedMessageStore(data_dir / 'processed.db')) == MESSAGE_COUNT
+        meta = json.loads((data_dir / 'images' / 'incoming' /
+                           '15339_25173_20260101_000000002.meta.json').read_text())
+        assert meta['width'] == 16 and meta['temperature'] == '3C'
+
+        rerun = fetch_camera_imap.fetch_camera_images(download_workers=8)
+        assert rerun['fetched'] == 0 and not rerun['errors']
+
+    def test_speedup_with_concurrency(self, fetch_env, image_server):
+        timings = {}
+        connections = {}
+        for workers in (1, 4, 8):
+            result, elapsed, _ = fetch_env(workers)
+            assert result['fetched'] == MESSAGE_COUNT - 1
+            timings[workers] = elapsed
+            connections[workers] = len(image_server.connections)
+
+        print('\n' + ', '.join(
+            f'{w} workers: {t:.2f}s ({timings[1] / t:.1f}x)' for w, t in timings.items()
+        ))
+        assert timings[4] < timings[1] / 2
+        assert timings[8] < timings[1] / 3
+        # Säiekohtaiset istunnot pitävät yhteydet auki latausten välillä
+        assert connections[4] <= 4
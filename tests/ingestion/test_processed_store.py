@@ -0,0 +1,50 @@
+"""Tests for the SQLite processed-message store."""
+import json
+import time
+
+from storage.processed_messages import ProcessedMessageStore, open_processed_store
+
+
+class TestProcessedStore:
+
+    def test_membership_survives_reopen(self, tmp_path):
+        store = ProcessedMessageStore(tmp_path / 'processed.db')
+        store.add('1:42')
+        store.set('imap_last_uid', 42)
+
+        reopened = ProcessedMessageStore(tmp_path / 'processed.db')
+        assert '1:42' in reopened
+        assert '1:43' not in reopened
+        assert reopened.get('imap_last_uid') == 42
+        assert reopened.get('missing', 'x') == 'x'
+
+    def test_compact_by_age_keeps_latest(self, tmp_path):
+        store = ProcessedMessageStore(tmp_path / 'processed.db')
+        old = time.time() - 400 * 86400
+        for i in range(5):
+            store.add(f'old-{i}', processed_at=old + i)
+        store.add('new')
+
+        assert store.compact(max_age_days=180, keep_latest=3) == 3
+        assert 'new' in store and 'old-4' in store and 'old-3' in store
+        assert 'old-0' not in store
+        assert store.compact(max_age_days=180, keep_latest=0) == 2
+        assert len(store) == 1
+
+    def test_migrates_legacy_json_once(self, tmp_path):
+        legacy = tmp_path / 'processed_emails.json'
+        legacy.write_text(json.dumps({
+            'processed_ids': ['5', '18c2f0a', '1:7'],
+            'last_fetch': '2026-01-01T10:00:00',
+            'imap_uidvalidity': 1,
+            'imap_last_uid': 7,
+        }))
+        store = open_processed_store(tmp_path)
+        assert len(store) == 3 and '18c2f0a' in store
+        assert store.get('imap_last_uid') == 7
+        assert store.get('last_fetch') == '2026-01-01T10:00:00'
+        assert not legacy.exists()
+        assert (tmp_path / 'processed_emails.json.migrated').exists()
+
+        store.add('new')
+        assert len(open_processed_store(tmp_path)) == 4
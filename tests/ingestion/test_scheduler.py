@@ -0,0 +1,243 @@
+"""Event-driven scheduler: IMAP IDLE coalescing, backoff, overlapped detection."""
+import imaplib
+import json
+import os
+import socketserver
+import threading
+import time
+
+import pytest
+
+from ingestion.imap_idle import ImapIdleWatcher, IdleUnsupported
+from ingestion.scheduler import Backoff, Scheduler, measure_latency, read_status
+
+
+class _IdleServer(socketserver.ThreadingTCPServer):
+    """Minimal IMAP server: CAPABILITY, LOGIN, EXAMINE, IDLE/DONE, LOGOUT."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, capabilities=b'IMAP4rev1 IDLE'):
+        super().__init__(('127.0.0.1', 0), _IdleHandler)
+        self.capabilities = capabilities
+        self.idling = threading.Event()
+        self.done_count = 0
+        self.wfile = None
+        self.lock = threading.Lock()
+
+    def push(self, line):
+        with self.lock:
+            self.wfile.write(line + b'\r\n')
+            self.wfile.flush()
+
+
+class _IdleHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        server.wfile = self.wfile
+        server.push(b'* OK fake IMAP ready')
+        idle_tag = None
+        for raw in self.rfile:
+            line = raw.rstrip(b'\r\n')
+            if line == b'DONE':
+                server.idling.clear()
+                server.done_count += 1
+                server.push(idle_tag + b' OK IDLE terminated')
+                continue
+            tag, _, rest = line.partition(b' ')
+            command = rest.split(b' ')[0].upper()
+            if command == b'CAPABILITY':
+                server.push(b'* CAPABILITY ' + server.capabilities)
+            elif command in (b'EXAMINE', b'SELECT'):
+                server.push(b'* 0 EXISTS')
+            elif command == b'IDLE':
+                idle_tag = tag
+                server.push(b'+ idling')
+                server.idling.set()
+                continue
+            elif command == b'LOGOUT':
+                server.push(b'* BYE')
+                server.push(tag + b' OK LOGOUT completed')
+                return
+            server.push(tag + b' OK done')
+
+
+@pytest.fixture
+def idle_server():
+    server = _IdleServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _connect(server):
+    def connect():
+        mail = imaplib.IMAP4('127.0.0.1', server.server_address[1])
+        mail.login('user', 'password')
+        mail.select('INBOX', readonly=True)
+        return mail
+    return connect
+
+
+def _push_burst(server, count, gap):
+    assert server.idling.wait(5)
+    for i in range(count):
+        server.push(f'* {i + 1} EXISTS'.encode())
+        time.sleep(gap)
+
+
+def test_backoff_grows_with_jitter_and_resets():
+    backoff = Backoff(base=10, maximum=60, rng=lambda: 1.0)
+    assert [backoff.next_delay() for _ in range(5)] == [10, 20, 40, 60, 60]
+
+    low = Backoff(base=10, maximum=60, rng=lambda: 0.0)
+    assert [low.next_delay() for _ in range(3)] == [5, 10, 20]
+
+    backoff.reset()
+    assert backoff.next_delay() == 10
+
+
+def test_idle_burst_is_coalesced_into_one_wakeup(idle_server):
+    watcher = ImapIdleWatcher(_connect(idle_server), coalesce_seconds=0.3,
+                              max_coalesce_seconds=5)
+    pusher = threading.Thread(target=_push_burst, args=(idle_server, 3, 0.05))
+    pusher.start()
+    started = time.monotonic()
+    try:
+        assert watcher.wait_for_mail(timeout=10) is True
+        elapsed = time.monotonic() - started
+        assert len(watcher.last_events) == 3
+        assert elapsed < 2  # heti purskeen jälkeen, ei aikarajan mukaan
+
+        # Sama yhteys jatkaa: hiljaisuudessa palataan aikarajalla
+        assert watcher.wait_for_mail(timeout=0.2) is False
+        assert idle_server.done_count == 2
+    finally:
+        pusher.join()
+        watcher.close()
+
+
+def test_idle_coalesce_window_is_capped(idle_server):
+    watcher = ImapIdleWatcher(_connect(idle_server), coalesce_seconds=0.3,
+                              max_coalesce_seconds=0.5)
+    pusher = threading.Thread(target=_push_burst, args=(idle_server, 20, 0.1))
+    pusher.start()
+    started = time.monotonic()
+    try:
+        assert watcher.wait_for_mail(timeout=10) is True
+        assert time.monotonic() - started < 1.5
+        assert len(watcher.last_events) < 20
+    finally:
+        pusher.join()
+        watcher.close()
+
+
+def test_idle_requires_server_support():
+    server = _IdleServer(capabilities=b'IMAP4rev1')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(IdleUnsupported):
+            ImapIdleWatcher(_connect(server)).wait_for_mail(timeout=1)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_detection_overlaps_next_fetch(tmp_path):
+    release = threading.Event()
+    fetch_calls = []
+    detected = []
+
+    def fetch():
+        fetch_calls.append(time.monotonic())
+        return {'fetched': 1, 'skipped': 0, 'errors': [],
+                'new_images': [f'img{len(fetch_calls)}.jpg']}
+
+    def detect(names):
+        release.wait(5)
+        detected.append(names)
+        return {'processed': len(names)}
+
+    scheduler = Scheduler(mode='poll', fetch=fetch, detect=detect, data_dir=tmp_path)
+    try:
+        scheduler.run_cycle()
+        first = scheduler.detect_future
+        scheduler.run_cycle()  # ei odota edellisen erän tunnistusta
+        assert len(fetch_calls) == 2
+        assert not first.done()
+        release.set()
+        scheduler.detect_future.result(timeout=5)
+    finally:
+        scheduler.close()
+    assert detected == [['img1.jpg'], ['img2.jpg']]
+    status = read_status(tmp_path)
+    assert status['cycles'] == 2
+    assert status['last_detection']['processed'] == 1
+
+
+def test_latency_from_mail_arrival_to_prediction(tmp_path):
+    image_dir = tmp_path / 'images' / 'incoming'
+    prediction_dir = tmp_path / 'predictions'
+    image_dir.mkdir(parents=True)
+    prediction_dir.mkdir()
+    now = time.time()
+    for name, delay in (('a', 30), ('b', 90), ('c', 60)):
+        arrival = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(now - delay))
+        (image_dir / f'{name}.meta.json').write_text(json.dumps({'email_date': arrival}))
+        pred = prediction_dir / f'{name}.json'
+        pred.write_text('{}')
+        os.utime(pred, (now, now))
+
+    stats = measure_latency(['a.jpg', 'b.jpg', 'c.jpg', 'missing.jpg'],
+                            image_dir, prediction_dir)
+    assert stats['images'] == 4
+    assert stats['measured'] == 3
+    assert stats['mean_seconds'] == pytest.approx(60, abs=1.5)
+    assert stats['p50_seconds'] == pytest.approx(60, abs=1.5)
+    assert stats['max_seconds'] == pytest.approx(90, abs=1.5)
+
+
+class _Stop(Exception):
+    pass
+
+
+def test_errors_back_off_then_idle_failures_fall_back_to_polling(tmp_path):
+    outcomes = [{'errors': ['IMAP-yhteys epäonnistui']}, RuntimeError('verkko'),
+                {'fetched': 0, 'errors': [], 'new_images': []}]
+    sleeps = []
+
+    def fetch():
+        outcome = outcomes.pop(0) if outcomes else {'fetched': 0, 'errors': []}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) >= 3:
+            raise _Stop()
+
+    class BrokenWatcher:
+        def wait_for_mail(self, timeout=None):
+            raise OSError('connection reset')
+
+        def close(self):
+            pass
+
+    scheduler = Scheduler(mode='idle', fetch=fetch, detect=lambda names: {},
+                          watcher=BrokenWatcher(), interval=600, data_dir=tmp_path,
+                          backoff=Backoff(base=10, maximum=600, rng=lambda: 1.0),
+                          sleep=sleep)
+    try:
+        with pytest.raises(_Stop):
+            scheduler.run_forever()
+    finally:
+        scheduler.close()
+    # Kaksi epäonnistunutta noutoa (10 s, 20 s), onnistuminen nollaa,
+    # IDLE-virhe pollaa taas 10 s kuluttua
+    assert sleeps == [10, 20, 10]
+    assert read_status(tmp_path)['consecutive_failures'] == 1
@@ -0,0 +1,42 @@
+"""Annotated camera images for the export and training-data tests."""
+import json
+
+import pytest
+
+
+def frame_stem(i):
+    """Camera frame name; frames are a minute apart, so each is its own burst."""
+    return f'15339_25173_20260128_07{i:02d}00'
+
+
+def _annotate(ann_dir, stem, boxes=(), empty=False):
+    data = {'image_name': f'{stem}.jpg', 'is_empty': empty,
+            'annotations': [{'bbox': list(bbox), 'species': sp} for bbox, sp in boxes]}
+    (ann_dir / f'{stem}.json').write_text(json.dumps(data), encoding='utf-8')
+
+
+@pytest.fixture
+def annotate():
+    """Writer: annotate(ann_dir, stem, boxes=[(bbox, species)], empty=False)."""
+    return _annotate
+
+
+@pytest.fixture
+def annotated_images(tmp_path):
+    """
+    Factory: make(count, image, boxes, empty=(), image_dir='images', ext='.jpg').
+
+    image(i) returns the PIL image and boxes(i) its [(bbox, species)]; frames
+    listed in empty are marked empty (background). Returns (image_dir, ann_dir).
+    """
+    def make(count, image, boxes, empty=(), image_dir='images', ext='.jpg'):
+        image_dir = tmp_path / image_dir
+        ann_dir = tmp_path / 'annotations'
+        image_dir.mkdir(parents=True, exist_ok=True)
+        ann_dir.mkdir(exist_ok=True)
+        for i in range(count):
+            stem = frame_stem(i)
+            image(i).save(image_dir / f'{stem}{ext}')
+            _annotate(ann_dir, stem, () if i in empty else boxes(i), empty=i in empty)
+        return image_dir, ann_dir
+    return make
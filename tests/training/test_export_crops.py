@@ -0,0 +1,105 @@
+"""Classification export: per-annotation crops in an ImageFolder layout with a crop cache."""
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import export_yolo
+from detection.frame import Frame
+
+
+FOX_BOX, SMALL_BOX = (100, 200, 900, 600), (1000, 50, 1100, 150)
+
+
+def _boxes(i):
+    if i >= 4:
+        return [(FOX_BOX, 'kettu'), ((0, 0, 5, 5), 'mörkö')]
+    return [(FOX_BOX, 'kettu'), (SMALL_BOX, 'janis' if i % 2 else 'kauris')]
+
+
+@pytest.fixture
+def data(tmp_path, annotated_images):
+    rng = np.random.default_rng(0)
+    image_dir, ann_dir = annotated_images(
+        6, lambda i: Image.fromarray(rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8)),
+        _boxes, empty=(5,), ext='.png')
+    return image_dir, ann_dir, tmp_path / 'dataset_cls'
+
+
+def _export(data, **kwargs):
+    image_dir, ann_dir, out = data
+    return export_yolo.export_crops(ann_dir, image_dir, out, size=64, **kwargs)
+
+
+def _crops(out):
+    return {p.name: p for p in out.glob('*/*/*.jpg') if p.parent.parent.name in ('train', 'val')}
+
+
+def test_layout_matches_class_map_and_inference_crop(data):
+    image_dir, _, out = data
+    stats = _export(data)
+
+    assert stats['success'] and stats['images'] == 5
+    assert stats['total'] == 9 and stats['crops_written'] == 9 and stats['skipped_unknown'] == 1
+    assert stats['species_counts'] == {'kettu': 5, 'kauris': 2, 'janis': 2}
+    # Kansioiden aakkosjärjestys = CLASS_MAP:n id-järjestys (ultralytics numeroi näin)
+    names = sorted(p.name for p in (out / 'train').iterdir())
+    assert names == [f'{i}_{n}' for i, n in export_yolo.DEFAULT_CLASS_MAP.items()]
+
+    stem = '15339_25173_20260128_070000'
+    fox = next(p for n, p in _crops(out).items() if n.startswith(stem) and p.parent.name == '5_kettu')
+    # Sama rajaus kuin lajitunnistuksessa, lyhyempi sivu 64 px
+    expected = Frame.load(image_dir / f'{stem}.png').crop_image(list(FOX_BOX))
+    with Image.open(fox) as crop:
+        assert min(crop.size) == 64
+        assert crop.size == (round(expected.width * 64 / expected.height), 64)
+    assert os.path.samefile(fox, out / 'crops' / fox.name.rsplit('_', 1)[-1])
+
+
+def test_splits_follow_the_detection_export(data, tmp_path):
+    image_dir, ann_dir, out = data
+    _export(data)
+    export_yolo.export_dataset(ann_dir, image_dir, tmp_path / 'dataset')
+    detect = {p.stem: p.parent.name for p in (tmp_path / 'dataset' / 'labels').glob('*/*.txt')}
+    for name, path in _crops(out).items():
+        assert path.parent.parent.name == detect[name.rsplit('_', 1)[0]]
+
+
+def test_reexport_uses_cache_and_handles_changes(data, annotate, monkeypatch):
+    image_dir, ann_dir, out = data
+    _export(data)
+    before = set(_crops(out))
+
+    monkeypatch.setattr(Image, 'open', lambda *a, **k: pytest.fail('kuvaa ei pidä avata'))
+    again = _export(data)
+    assert again['crops_written'] == 0 and again['unchanged'] == 9 and again['removed'] == 0
+    assert set(_crops(out)) == before
+
+    # Lajin vaihto siirtää rajauksen toiseen kansioon rajaamatta uudelleen
+    stem = '15339_25173_20260128_070100'
+    annotate(ann_dir, stem, [(FOX_BOX, 'ilves'), (SMALL_BOX, 'supikoira')])
+    os.utime(ann_dir / f'{stem}.json', ns=(1, 1))
+    moved = _export(data)
+    assert moved['crops_written'] == 0 and moved['removed'] == 2
+    assert moved['skipped_unknown'] == 2
+    assert [p.parent.name for n, p in _crops(out).items() if n.startswith(stem)] == ['4_supikoira']
+    monkeypatch.undo()
+
+    # Poistettu annotaatio poistaa rajaukset ja niiden välimuistin
+    removed = '15339_25173_20260128_070200'
+    (ann_dir / f'{removed}.json').unlink()
+    stats = _export(data)
+    assert stats['removed'] == 2
+    assert not [n for n in _crops(out) if n.startswith(removed)]
+    assert len(list((out / 'crops').iterdir())) == stats['total'] == 6
+
+
+def test_size_change_recrops(data):
+    image_dir, ann_dir, out = data
+    _export(data)
+    stats = export_yolo.export_crops(ann_dir, image_dir, out, size=32)
+    assert stats['crops_written'] == 9 and stats['removed'] == 9
+    for path in _crops(out).values():
+        with Image.open(path) as crop:
+            assert min(crop.size) == 32
@@ -0,0 +1,205 @@
+"""Incremental YOLO export: manifest, linked images, stale cleanup and hash-based splits."""
+import errno
+import json
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+import export_yolo
+
+BOX = (10, 20, 110, 80)
+
+
+@pytest.fixture
+def data(tmp_path, annotated_images):
+    image_dir, ann_dir = annotated_images(
+        10, lambda i: Image.new('RGB', (200, 100), (i * 20, 0, 0)),
+        lambda i: [(BOX, 'kettu' if i % 2 else 'kauris')], empty=(8, 9),
+        image_dir='images/incoming')
+    # Annotoimaton kuva ja tyhjä annotaatio eivät päädy datasetiin
+    Image.new('RGB', (200, 100)).save(image_dir / 'unannotated.jpg')
+    (ann_dir / 'noboxes.json').write_text(json.dumps({'annotations': []}))
+    Image.new('RGB', (200, 100)).save(image_dir / 'noboxes.jpg')
+    return image_dir, ann_dir, tmp_path / 'dataset'
+
+
+def _export(data, **kwargs):
+    image_dir, ann_dir, out = data
+    return export_yolo.export_dataset(ann_dir, image_dir, out, **kwargs)
+
+
+def _splits(out):
+    return {p.stem: p.parent.name for p in (out / 'labels').glob('*/*.txt')}
+
+
+def test_first_export_links_images_and_writes_manifest(data):
+    image_dir, _, out = data
+    stats = _export(data)
+
+    assert stats['success']
+    assert (stats['total'], stats['train'], stats['val']) == (8, 7, 1)
+    assert (stats['background_images'], stats['bg_train'], stats['bg_val']) == (2, 2, 0)
+    assert stats['species_counts'] == {'kauris': 4, 'kettu': 4}
+    assert stats['labels_written'] == 10 and stats['linked'] == 10
+    for p in (out / 'images').glob('*/*.jpg'):
+        assert os.path.samefile(p, image_dir / p.name)
+    label = (out / 'labels' / _splits(out)['15339_25173_20260128_070100']
+             / '15339_25173_20260128_070100.txt').read_text()
+    assert label == '5 0.300000 0.500000 0.500000 0.600000\n'
+    manifest = json.loads((out / 'manifest.json').read_text())
+    assert manifest['images']['15339_25173_20260128_070100']['width'] == 200
+
+
+def test_unchanged_reexport_reads_nothing(data, monkeypatch):
+    _, _, out = data
+    first = _export(data)
+    labels = {p: p.stat().st_mtime_ns for p in (out / 'labels').glob('*/*.txt')}
+
+    def no_open(*args, **kwargs):
+        raise AssertionError('kuvaa ei pidä avata')
+    monkeypatch.setattr(Image, 'open', no_open)
+    second = _export(data)
+
+    assert second['labels_written'] == 0 and second['linked'] == 0
+    assert second['unchanged'] == 10
+    assert {k: second[k] for k in ('total', 'train', 'val', 'species_counts')} == \
+        {k: first[k] for k in ('total', 'train', 'val', 'species_counts')}
+    assert {p: p.stat().st_mtime_ns for p in labels} == labels
+
+
+def test_changes_are_applied_and_splits_kept(data, annotate):
+    image_dir, ann_dir, out = data
+    _export(data)
+    before = _splits(out)
+
+    changed = '15339_25173_20260128_070300'
+    annotate(ann_dir, changed, [(BOX, 'janis')])
+    os.utime(ann_dir / f'{changed}.json', ns=(1, 1))
+    removed = '15339_25173_20260128_070400'
+    (ann_dir / f'{removed}.json').unlink()
+    for i in range(20, 30):
+        stem = f'15339_25173_20260129_07{i:02d}0000'
+        Image.new('RGB', (200, 100)).save(image_dir / f'{stem}.jpg')
+        annotate(ann_dir, stem, [(BOX, 'kauris')])
+
+    stats = _export(data)
+    after = _splits(out)
+    assert stats['labels_written'] == 11
+    assert stats['removed'] == 1
+    assert removed not in after
+    assert not list((out / 'images').glob(f'*/{removed}.jpg'))
+    assert all(after[stem] == split for stem, split in before.items() if stem != removed)
+    assert (stats['total'], stats['val']) == (17, 2)
+    label = (out / 'labels' / after[changed] / f'{changed}.txt').read_text()
+    assert label.startswith('2 ')
+
+
+def test_copy_fallback_across_filesystems(data, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setattr(os, 'link', cross_device)
+    stats = _export(data)
+    assert stats['copied'] == 10 and stats['linked'] == 0
+    # Kopioita ei kopioida uudelleen
+    assert _export(data)['unchanged'] == 10
+
+
+def test_symlink_mode_and_cleanup_of_previous_full_copy(data):
+    image_dir, _, out = data
+    # Vanha täyskopioeksportti: kopiot ja ylimääräinen kuva ilman manifestia
+    (out / 'images' / 'train').mkdir(parents=True)
+    (out / 'labels' / 'train').mkdir(parents=True)
+    (out / 'images' / 'train' / 'orphan.jpg').write_bytes(b'x')
+    stem = '15339_25173_20260128_070000'
+    shutil.copy2(image_dir / f'{stem}.jpg', out / 'images' / 'train' / f'{stem}.jpg')
+    (out / 'labels' / 'train' / 'orphan.txt').write_text('')
+
+    stats = _export(data, link_mode='symlink')
+    assert stats['removed'] == 1
+    assert stats['linked'] == 10               # myös ajan tasalla oleva kopio
+    assert not (out / 'labels' / 'train' / 'orphan.txt').exists()
+    assert all(p.is_symlink() for p in (out / 'images').glob('*/*.jpg'))
+
+
+def test_split_is_stable_as_dataset_grows():
+    items = {f'cam_20260101_{h:02d}{m:02d}00': {'kind': 'annotated'}
+             for h in range(24) for m in range(0, 60, 5)}
+    subset = {stem: dict(e) for stem, e in list(items.items())[::3]}
+    export_yolo.assign_splits(items, 0.2, group_mode='image')
+    export_yolo.assign_splits(subset, 0.2, group_mode='image')
+
+    assert all(subset[s]['split'] == items[s]['split'] for s in subset)
+    val = sum(e['split'] == 'val' for e in items.values()) / len(items)
+    assert 0.12 < val < 0.28
+    # Aiemmin jaettuja ei siirretä, vaikka osuus muuttuisi
+    before = {s: e['split'] for s, e in items.items()}
+    items['cam_20260102_000000'] = {'kind': 'annotated'}
+    export_yolo.assign_splits(items, 0.5, group_mode='image')
+    assert all(items[s]['split'] == split for s, split in before.items())
+
+
+def test_burst_frames_share_split():
+    stems = [f'15339_25173_20260128_{h:02d}00{sec:02d}000' for h in range(24) for sec in range(0, 9, 2)]
+    items = {stem: {'kind': 'annotated'} for stem in stems}
+    export_yolo.assign_splits(items, 0.3, group_mode='burst')
+    for h in range(24):
+        assert len({e['split'] for s, e in items.items() if s[21:23] == f'{h:02d}'}) == 1
+    assert {e['split'] for e in items.values()} == {'train', 'val'}
+
+    # Uusi kuva olemassa olevaan sarjaan seuraa sarjan jakoa
+    burst_split = items['15339_25173_20260128_050000000']['split']
+    items['15339_25173_20260128_050009000'] = {'kind': 'annotated'}
+    export_yolo.assign_splits(items, 0.3, group_mode='burst')
+    assert items['15339_25173_20260128_050009000']['split'] == burst_split
+
+
+def test_validation_gets_an_annotated_image():
+    items = {'a': {'kind': 'background'}, 'b': {'kind': 'annotated'}, 'c': {'kind': 'annotated'}}
+    export_yolo.assign_splits(items, 0.01, group_mode='image')
+    assert sum(e['split'] == 'val' and e['kind'] == 'annotated' for e in items.values()) == 1
+
+
+def test_image_size_reads_headers_only(tmp_path):
+    exif = Image.Exif()
+    exif[0x010f] = 'Riistakamera' * 200         # pitkä APP1-segmentti ennen SOF:ia
+    Image.new('RGB', (321, 123)).save(tmp_path / 'a.jpg', exif=exif)
+    Image.new('RGB', (64, 48)).save(tmp_path / 'b.jpg', progressive=True)
+    Image.new('RGB', (50, 40)).save(tmp_path / 'c.png')
+    Image.new('P', (30, 20)).save(tmp_path / 'd.gif')
+    assert export_yolo.image_size(tmp_path / 'a.jpg') == (321, 123)
+    assert export_yolo.image_size(tmp_path / 'b.jpg') == (64, 48)
+    assert export_yolo.image_size(tmp_path / 'c.png') == (50, 40)
+    assert export_yolo.image_size(tmp_path / 'd.gif') == (30, 20)
+
+
+def test_parallel_export_caches_sizes_in_index(data, tmp_path, monkeypatch):
+    from storage.metadata_index import MetadataIndex
+
+    image_dir, ann_dir, out = data
+    index = MetadataIndex(tmp_path / 'metadata.db')
+    calls = []
+    first = _export(data, index=index, workers=4,
+                    progress=lambda done, total: calls.append((done, total)))
+    assert first['sizes_probed'] == 8
+    assert calls[-1] == (10, 10) and [d for d, _ in calls] == sorted(d for d, _ in calls)
+    assert index.image_sizes()['15339_25173_20260128_070100.jpg'][:2] == (200, 100)
+
+    # Uusi dataset (tai --full) saa mitat indeksistä
+    monkeypatch.setattr(export_yolo, 'image_size', lambda path: pytest.fail('otsaketta luettiin'))
+    serial = export_yolo.export_dataset(ann_dir, image_dir, tmp_path / 'serial',
+                                        index=index, workers=1)
+    assert serial['sizes_probed'] == 0
+    for label in (out / 'labels').glob('*/*.txt'):
+        assert (tmp_path / 'serial' / label.relative_to(out)).read_text() == label.read_text()
+
+
+def test_progress_can_cancel_export(data):
+    class Cancelled(Exception):
+        pass
+
+    def cancel(done, total):
+        raise Cancelled()
+    with pytest.raises(Cancelled):
+        _export(data, workers=2, progress=cancel)
@@ -0,0 +1,209 @@
+"""INT8 species model: calibration crops, detector selection and the FP32/INT8 report."""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import export_yolo
+from detection import onnx_backend
+from detection.detector import WildlifeDetector
+from training import evaluate, quantize, train
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """YOLO dataset: 4 labelled train images, 1 background, 2 val images."""
+    root = tmp_path / 'dataset'
+    for split in ('train', 'val'):
+        (root / 'images' / split).mkdir(parents=True)
+        (root / 'labels' / split).mkdir(parents=True)
+    for i in range(4):
+        Image.new('RGB', (400, 300), (40 * i, 80, 120)).save(root / 'images' / 'train' / f'img{i}.jpg')
+        (root / 'labels' / 'train' / f'img{i}.txt').write_text(
+            f'{i % 3} 0.500000 0.500000 0.250000 0.200000\n'
+            f'5 0.200000 0.300000 0.100000 0.100000\n')
+    Image.new('RGB', (400, 300)).save(root / 'images' / 'train' / 'bg.jpg')
+    (root / 'labels' / 'train' / 'bg.txt').write_text('')
+    for i, cls in enumerate((1, 2)):
+        Image.new('RGB', (400, 300), (200, 40 * i, 0)).save(root / 'images' / 'val' / f'v{i}.jpg')
+        (root / 'labels' / 'val' / f'v{i}.txt').write_text(f'{cls} 0.5 0.5 0.5 0.5\n')
+    return root
+
+
+@pytest.fixture
+def crop_dataset(tmp_path):
+    """Classification crops (export_yolo.py --crops layout): 3 train, 2 val."""
+    root = tmp_path / 'dataset_cls'
+    class_map = export_yolo.DEFAULT_CLASS_MAP
+    for split, crops in (('train', (0, 5, 5)), ('val', (1, 2))):
+        for cid, name in class_map.items():
+            (root / split / export_yolo.class_dirname(cid, name, class_map)).mkdir(parents=True)
+        for i, cid in enumerate(crops):
+            folder = root / split / export_yolo.class_dirname(cid, class_map[cid], class_map)
+            Image.new('RGB', (48 + i, 32), (200, 40 * i, 0)).save(folder / f'c{i}.jpg')
+    return root
+
+
+class FakeSession:
+    def __init__(self, probs):
+        self.probs = np.asarray(probs, dtype=np.float32)
+
+    def get_modelmeta(self):
+        return SimpleNamespace(custom_metadata_map={'task': 'classify', 'imgsz': '[32, 32]'})
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='images')]
+
+    def run(self, outputs, feed):
+        return [self.probs[None]]
+
+
+def test_dataset_crops_use_inference_margin(dataset):
+    crops = quantize.dataset_crops(dataset, 'train', limit=100)
+    assert len(crops) == 8                       # taustakuva ohitetaan
+    assert sorted(c for _, c in crops) == [0, 0, 1, 2, 5, 5, 5, 5]
+    # 100x60 bbox + 10 % pidemmästä sivusta (10 px) joka suuntaan
+    assert {c.size for c, cls in crops if cls != 5} == {(120, 80)}
+    assert len(quantize.dataset_crops(dataset, 'train', limit=3)) == 3
+    assert [c for _, c in quantize.dataset_crops(dataset, 'train', limit=4)] == \
+        [c for _, c in quantize.dataset_crops(dataset, 'train', limit=4)]
+
+
+def test_dataset_crops_read_classification_crops(crop_dataset):
+    crops = quantize.dataset_crops(crop_dataset, 'train', limit=100)
+    assert sorted(c for _, c in crops) == [0, 5, 5]
+    assert {c.size[1] for c, _ in crops} == {32}
+    assert quantize.dataset_root(crop_dataset) == crop_dataset
+    assert quantize.dataset_root(crop_dataset.parent / 'dataset' / 'dataset.yaml') == \
+        crop_dataset.parent / 'dataset'
+    assert quantize.has_calibration_data(crop_dataset)
+    assert not quantize.has_calibration_data(crop_dataset.parent)
+
+
+def test_cls_training_calibrates_on_crop_dataset(crop_dataset, tmp_path, monkeypatch):
+    class FakeYOLO:
+        def __init__(self, base_model):
+            pass
+
+        def add_callback(self, event, fn):
+            pass
+
+        def train(self, project, name, **kwargs):
+            calls['train'] = kwargs
+            weights = tmp_path / project / name / 'weights'
+            weights.mkdir(parents=True)
+            (weights / 'best.pt').write_bytes(b'pt')
+            return SimpleNamespace()
+
+    calls = {}
+    monkeypatch.setitem(sys.modules, 'ultralytics', SimpleNamespace(YOLO=FakeYOLO))
+    monkeypatch.setattr(train, 'DATA_DIR', tmp_path)
+    monkeypatch.setattr(train, 'MODEL_DIR', tmp_path / 'models')
+    monkeypatch.setattr(train, 'HISTORY_FILE', tmp_path / 'history.json')
+    monkeypatch.setattr(train, 'CLS_DATASET_DIR', crop_dataset)
+    monkeypatch.setattr(quantize, 'quantize_species_model',
+                        lambda model, dataset_dir, mode: calls.update(quantize=(dataset_dir, mode)))
+
+    result = train.train_species_model(project=str(tmp_path / 'runs'), name='cls', quantize=True)
+    assert result['success']
+    assert calls['train']['data'] == str(crop_dataset)
+    assert calls['train']['imgsz'] == export_yolo.EXPORT_CROP_SIZE
+    assert calls['quantize'] == (crop_dataset, 'static')
+
+
+def test_detector_uses_current_int8_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(onnx_backend, 'create_session',
+                        lambda path, options=None: FakeSession([0.1, 0.2, 0.7]))
+    model = tmp_path / 'species_latest.pt'
+    model.write_bytes(b'pt')
+    int8 = quantize.quantized_path(model)
+    assert int8.name == 'species_latest.int8.onnx'
+
+    detector = WildlifeDetector(use_speciesnet=False, species_int8=True)
+    int8.write_bytes(b'onnx')
+    detector._load_species_model(str(model))
+    assert isinstance(detector.species_model, onnx_backend.OnnxSpeciesModel)
+
+    from detection.frame import Frame
+    frame = Frame(tmp_path / 'x.jpg', np.zeros((100, 100, 3), dtype=np.uint8))
+    assert detector._classify_species(frame, [10, 10, 60, 60]) == \
+        {'species': 'janis', 'confidence': pytest.approx(0.7)}
+
+    # Uudelleenkoulutettu .pt on uudempi kuin INT8-malli: sitä ei käytetä
+    os.utime(int8, ns=(1, 1))
+    assert not quantize.is_current(model)
+    stale = WildlifeDetector(use_speciesnet=False, species_int8=True)
+    monkeypatch.setattr(stale, 'backend', 'torch')
+    stale._load_species_model(str(model))
+    assert not isinstance(stale.species_model, onnx_backend.OnnxSpeciesModel)
+
+
+def test_compare_quantized_report(dataset, tmp_path, monkeypatch):
+    model = tmp_path / 'species_latest.pt'
+    model.write_bytes(b'pt')
+    quantize.quantized_path(model).write_bytes(b'int8')
+    fp32_path = tmp_path / 'fp32.onnx'
+    monkeypatch.setattr(onnx_backend, 'cached_export', lambda *a, **k: fp32_path)
+    # FP32 ennustaa luokan 1, INT8 luokan 2; val-rajaukset ovat luokkia 1 ja 2
+    sessions = {str(fp32_path): [0.1, 0.8, 0.1], str(quantize.quantized_path(model)): [0, 0.3, 0.7]}
+    monkeypatch.setattr(onnx_backend, 'create_session',
+                        lambda path, options=None: FakeSession(sessions[str(path)]))
+
+    report = evaluate.compare_quantized(str(model), dataset_dir=dataset)
+    assert report['success'] and report['crops'] == 2
+    assert report['fp32']['accuracy'] == 0.5 and report['int8']['accuracy'] == 0.5
+    assert report['agreement'] == 0.0
+    assert report['accuracy_delta'] == 0.0
+    assert report['speedup'] > 0
+
+
+def test_compare_quantized_on_crop_dataset(crop_dataset, tmp_path, monkeypatch):
+    model = tmp_path / 'species_latest.pt'
+    model.write_bytes(b'pt')
+    quantize.quantized_path(model).write_bytes(b'int8')
+    fp32_path = tmp_path / 'fp32.onnx'
+    monkeypatch.setattr(onnx_backend, 'cached_export', lambda *a, **k: fp32_path)
+    monkeypatch.setattr(onnx_backend, 'create_session',
+                        lambda path, options=None: FakeSession([0.1, 0.8, 0.1]))
+
+    report = evaluate.compare_quantized(str(model), dataset_dir=crop_dataset)
+    assert report['success'] and report['crops'] == 2
+    assert report['fp32']['accuracy'] == 0.5 and report['agreement'] == 1.0
+
+
+def test_static_quantization_end_to_end(dataset, tmp_path, monkeypatch):
+    pytest.importorskip('onnxruntime.quantization')
+    onnx = pytest.importorskip('onnx')
+    from onnx import TensorProto, helper, numpy_helper
+
+    # Pieni luokittelija: Conv → GlobalAveragePool → Flatten → Gemm → Softmax
+    rng = np.random.default_rng(0)
+    inits = [
+        numpy_helper.from_array(rng.normal(size=(8, 3, 3, 3)).astype(np.float32), 'w'),
+        numpy_helper.from_array(rng.normal(size=(9, 8)).astype(np.float32), 'fc'),
+    ]
+    graph = helper.make_graph([
+        helper.make_node('Conv', ['images', 'w'], ['c'], pads=[1, 1, 1, 1]),
+        helper.make_node('Relu', ['c'], ['r']),
+        helper.make_node('GlobalAveragePool', ['r'], ['g']),
+        helper.make_node('Flatten', ['g'], ['f']),
+        helper.make_node('Gemm', ['f', 'fc'], ['logits'], transB=1),
+        helper.make_node('Softmax', ['logits'], ['output']),
+    ], 'cls', [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['b', 3, 32, 32])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, ['b', 9])], inits)
+    fp32_path = tmp_path / 'fp32.onnx'
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)]), str(fp32_path))
+    onnx_backend._set_metadata(fp32_path, {'task': 'classify', 'imgsz': '[32, 32]'})
+    monkeypatch.setattr(onnx_backend, 'cached_export', lambda *a, **k: fp32_path)
+
+    model = tmp_path / 'species_latest.pt'
+    model.write_bytes(b'pt')
+    result = quantize.quantize_species_model(model, dataset_dir=dataset)
+    assert result['success'] and result['calibration_crops'] == 8
+    int8 = onnx_backend.OnnxSpeciesModel(result['int8_path'])
+    assert onnx_backend.read_metadata(int8.session)['quantization'] == 'static'
+    report = evaluate.compare_quantized(str(model), dataset_dir=dataset)
+    assert report['success']
@@ -0,0 +1,102 @@
+"""Training straight from annotations: in-memory labels and the memory-mapped image cache."""
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import export_yolo
+from training import streaming
+
+
+@pytest.fixture
+def data(tmp_path, annotated_images):
+    image_dir, ann_dir = annotated_images(
+        6, lambda i: Image.new('RGB', (1280, 720), (40 * i, 100, 0)),
+        lambda i: [((100, 200, 740, 520), 'kettu')], empty=(5,))
+    return image_dir, ann_dir, tmp_path / 'cache'
+
+
+def _prepare(data, **kwargs):
+    image_dir, ann_dir, cache_dir = data
+    return streaming.prepare_stream(ann_dir, image_dir, cache_dir, imgsz=320, **kwargs)
+
+
+def test_decode_resized_matches_ultralytics_geometry(tmp_path):
+    Image.new('RGB', (1920, 1080), (255, 0, 0)).save(tmp_path / 'a.jpg')
+    im, hw0 = streaming.decode_resized(tmp_path / 'a.jpg', 640)
+    assert hw0 == (1080, 1920)
+    assert im.shape == (360, 640, 3) and im.dtype == np.uint8
+    assert im[0, 0, 2] > 200 and im[0, 0, 0] < 50         # BGR
+
+
+def test_stream_labels_and_splits_match_export(data, tmp_path):
+    image_dir, ann_dir, _ = data
+    stream = _prepare(data)
+    assert stream['success'] and stream['decoded'] == 6
+    export_yolo.export_dataset(ann_dir, image_dir, tmp_path / 'dataset')
+
+    for r in stream['records']:
+        stem = r['name'][:-4]
+        label = tmp_path / 'dataset' / 'labels' / r['split'] / f'{stem}.txt'
+        assert label.exists()
+        assert label.read_text() == ''.join(
+            f"{int(c)} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}\n" for c, xc, yc, w, h in r['labels'])
+        assert (r['width'], r['height']) == (1280, 720)
+
+
+def test_second_prepare_reuses_manifest_and_cache(data, monkeypatch):
+    first = _prepare(data)
+    monkeypatch.setattr(export_yolo, '_load_json', lambda path: pytest.fail('JSON luettiin'))
+    monkeypatch.setattr(streaming, 'decode_resized', lambda *a: pytest.fail('kuva dekoodattiin'))
+    second = _prepare(data)
+    assert second['decoded'] == 0 and second['changed'] == 0
+    assert second['records'] == first['records']
+
+    im, hw0 = second['cache'].load(second['records'][0]['name'])
+    assert im.shape == (180, 320, 3) and hw0 == (720, 1280)
+    im[:] = 0                                          # augmentointi saa muokata kopiota
+    assert second['cache'].load(second['records'][0]['name'])[0].any()
+
+
+def test_changed_image_is_redecoded_and_cache_compacted(data):
+    image_dir, _, cache_dir = data
+    _prepare(data)
+    cache_file = cache_dir / 'images_320.bin'
+    size = cache_file.stat().st_size
+
+    for color in ((0, 255, 0), (0, 0, 255)):
+        for p in sorted(image_dir.iterdir())[:4]:
+            Image.new('RGB', (640, 360), color).save(p)
+        stream = _prepare(data)
+        assert stream['decoded'] == 4
+    # Toisella kerralla vanhentuneita tavuja on enemmän kuin voimassa olevia → tiivistys
+    assert cache_file.stat().st_size == size
+    im, hw0 = stream['cache'].load(stream['records'][0]['name'])
+    assert hw0 == (360, 640) and im[0, 0, 0] > 200
+
+    cache = pickle.loads(pickle.dumps(stream['cache']))
+    assert cache._mmap is None and cache.load(stream['records'][-1]['name'])[0].shape == (180, 320, 3)
+
+
+def test_detection_only(data):
+    from training.train import train_from_annotations
+    result = train_from_annotations(base_model='yolo11n-cls.pt', cache_dir=data[2])
+    assert not result['success'] and '-cls' in result['error']
+
+
+def test_streaming_dataset_feeds_ultralytics(data):
+    pytest.importorskip('ultralytics')
+    from ultralytics.cfg import get_cfg
+
+    stream = _prepare(data)
+    dataset_class = streaming._dataset_class()
+    train = [r for r in stream['records'] if r['split'] == 'train']
+    dataset = dataset_class(
+        records=train, image_cache=stream['cache'], img_path=str(data[0]), imgsz=320,
+        batch_size=2, augment=True, hyp=get_cfg(), rect=False, stride=32, pad=0.0,
+        data={'names': export_yolo.DEFAULT_CLASS_MAP, 'nc': 9, 'channels': 3},
+    )
+    sample = dataset[0]
+    assert sample['img'].shape[1:] == (320, 320)
+    assert len(dataset.labels) == len(train)
@@ -71,18 +71,104 @@ def evaluate_model(model_path=None, dataset_yaml=None, device='mps'):
     }
 
 
+def compare_quantized(model_path=None, int8_path=None, dataset_dir=None, split='val',
+                      limit=500):
+    """
+    Vertaa FP32- ja INT8-lajimallia (ONNX Runtime) datasetin rajauksilla.
+
+    Rajaukset tehdään annotaatioiden bboxeista samalla marginaalilla kuin
+    tunnistuksessa (rajausdatasetista ne luetaan valmiina), ja kumpikin malli
+    ajetaan samoilla säikeillä.
+
+    Returns:
+        dict: fp32/int8: tarkkuus ja ms/rajaus, yhtäpitävyys, nopeutus
+    """
+    import time
+    from detection import onnx_backend
+    from training.quantize import dataset_crops, quantized_path
+
+    if model_path is None:
+        model_path = str(MODEL_DIR / 'species_latest.pt')
+    if int8_path is None:
+        int8_path = quantized_path(model_path)
+    if not Path(model_path).exists():
+        return {'success': False, 'error': f'Mallia ei löydy: {model_path}'}
+    if not Path(int8_path).exists():
+        return {'success': False, 'error': f'INT8-mallia ei löydy: {int8_path}'}
+
+    crops = dataset_crops(dataset_dir, split, limit)
+    if not crops:
+        return {'success': False, 'error': f'Ei rajauksia datasetin osassa {split}'}
+
+    fp32_path = onnx_backend.cached_export(
+        model_path, lambda t: onnx_backend.export_species_model(model_path, t))
+    models = {
+        'fp32': onnx_backend.OnnxSpeciesModel(fp32_path),
+        'int8': onnx_backend.OnnxSpeciesModel(int8_path),
+    }
+
+    report = {}
+    predictions = {}
+    for name, model in models.items():
+        model.classify(crops[0][0])  # lämmittely
+        seconds = 0.0
+        correct = 0
+        preds = []
+        for crop, label in crops:
+            start = time.perf_counter()
+            top = model.classify(crop)
+            seconds += time.perf_counter() - start
+            pred = top[0] if top else None
+            preds.append(pred)
+            correct += pred == label
+        predictions[name] = preds
+        report[name] = {
+            'accuracy': round(correct / len(crops), 4),
+            'ms_per_crop': round(1000 * seconds / len(crops), 2),
+        }
+
+    agreement = sum(a == b for a, b in zip(predictions['fp32'], predictions['int8']))
+    return {
+        'success': True,
+        'crops': len(crops),
+        'fp32': report['fp32'],
+        'int8': report['int8'],
+        'agreement': round(agreement / len(crops), 4),
+        'accuracy_delta': round(report['int8']['accuracy'] - report['fp32']['accuracy'], 4),
+        'speedup': round(report['fp32']['ms_per_crop'] / max(report['int8']['ms_per_crop'], 1e-6), 2),
+    }
+
+
 if __name__ == '__main__':
     import argparse
+    import sys
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
     parser = argparse.ArgumentParser(description='Arvioi YOLO-malli')
     parser.add_argument('--model', default=None, help='Mallin polku')
-    parser.add_argument('--dataset', default=None, help='dataset.yaml polku')
+    parser.add_argument('--dataset', default=None,
+                        help='dataset.yaml polku (--quantized: myös rajausdatasetin hakemisto)')
     parser.add_argument('--device', default='mps')
+    parser.add_argument('--quantized', action='store_true',
+                        help='Vertaa FP32- ja INT8-mallin tarkkuutta ja latenssia')
+    parser.add_argument('--int8-model', default=None, help='INT8-mallin polku')
+    parser.add_argument('--limit', type=int, default=500, help='Rajauksia vertailussa')
     args = parser.parse_args()
 
-    print("Arvioidaan malli...")
-    result = evaluate_model(
-        model_path=args.model,
-        dataset_yaml=args.dataset,
-        device=args.device,
-    )
+    if args.quantized:
+        print("Verrataan FP32- ja INT8-mallia...")
+        from training.quantize import dataset_root
+        result = compare_quantized(
+            model_path=args.model,
+            int8_path=args.int8_model,
+            dataset_dir=dataset_root(args.dataset) if args.dataset else None,
+            limit=args.limit,
+        )
+    else:
+        print("Arvioidaan malli...")
+        result = evaluate_model(
+            model_path=args.model,
+            dataset_yaml=args.dataset,
+            device=args.device,
+        )
     print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+YOLO-lajimallin INT8-kvantisointi (ONNX Runtime).
+
+species_latest.pt viedään ONNX-muotoon ja kvantisoidaan tiedostoksi
+species_latest.int8.onnx samaan hakemistoon. Staattinen kvantisointi
+kalibroi aktivaatioiden skaalat eksportoidun YOLO-datasetin rajauksilla
+(sama rajaus ja marginaali kuin tunnistuksessa) tai luokittelumallin
+rajausdatasetin (export_yolo.py --crops) valmiilla rajauksilla; dynaaminen
+kvantisointi ei tarvitse dataa. Tunnistus käyttää mallia, kun SPECIES_INT8=1.
+"""
+import json
+import os
+import random
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+MODEL_DIR = DATA_DIR / 'models'
+DATASET_DIR = DATA_DIR / 'dataset'
+
+QUANTIZED_SUFFIX = '.int8.onnx'
+CALIBRATION_SIZE = 200
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+
+
+def quantized_path(model_path):
+    """species_latest.pt → species_latest.int8.onnx"""
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.stem + QUANTIZED_SUFFIX)
+
+
+def is_current(model_path, int8_path=None):
+    """Onko kvantisoitu malli olemassa ja uudempi kuin lähdemalli."""
+    int8_path = Path(int8_path or quantized_path(model_path))
+    if not int8_path.exists():
+        return False
+    return int8_path.stat().st_mtime_ns >= Path(model_path).stat().st_mtime_ns
+
+
+def dataset_root(dataset):
+    """dataset.yaml → sen hakemisto; rajausdatasetin hakemisto sellaisenaan."""
+    path = Path(dataset)
+    return path if path.is_dir() else path.parent
+
+
+def has_calibration_data(dataset_dir):
+    """Onko hakemistossa YOLO- tai rajausdatasetin opetusjoukko."""
+    dataset_dir = Path(dataset_dir)
+    return (dataset_dir / 'labels' / 'train').is_dir() or _is_crop_dataset(dataset_dir, 'train')
+
+
+def _is_crop_dataset(dataset_dir, split):
+    return not (dataset_dir / 'labels').exists() and (dataset_dir / split).is_dir()
+
+
+def _folder_crops(split_dir, limit, seed):
+    """
+    Rajausdatasetin (ImageFolder) rajaukset.
+
+    Luokka-id on kansion indeksi aakkosjärjestyksessä, kuten ultralytics
+    numeroi luokat koulutuksessa.
+    """
+    from PIL import Image as PILImage
+
+    class_dirs = sorted(p for p in split_dir.iterdir() if p.is_dir())
+    files = [(p, cls) for cls, d in enumerate(class_dirs) for p in sorted(d.iterdir())
+             if p.suffix.lower() in IMAGE_EXTENSIONS]
+    random.Random(seed).shuffle(files)
+    crops = []
+    for path, cls in files[:limit]:
+        with PILImage.open(path) as img:
+            crops.append((img.convert('RGB'), cls))
+    return crops
+
+
+def dataset_crops(dataset_dir=None, split='train', limit=CALIBRATION_SIZE, seed=0):
+    """
+    Eläinrajaukset YOLO-datasetista (labels/<split>/*.txt).
+
+    Kuvat poimitaan toistettavasti satunnaisessa järjestyksessä, jotta
+    kalibrointi kattaa kaikki kamerat ja lajit eikä vain ensimmäisiä kuvia.
+
+    Returns:
+        list: [(PIL-rajaus, luokka-id)], enintään limit kappaletta
+    """
+    from PIL import Image as PILImage
+    from detection.frame import crop_box
+
+    dataset_dir = Path(dataset_dir or DATASET_DIR)
+    if _is_crop_dataset(dataset_dir, split):
+        return _folder_crops(dataset_dir / split, limit, seed)
+    label_dir = dataset_dir / 'labels' / split
+    image_dir = dataset_dir / 'images' / split
+    if not label_dir.exists():
+        return []
+    images = {p.stem: p for p in image_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS}
+    labels = sorted(p for p in label_dir.glob('*.txt') if p.stem in images)
+    random.Random(seed).shuffle(labels)
+
+    crops = []
+    for label_path in labels:
+        lines = [line.split() for line in label_path.read_text().splitlines() if line.strip()]
+        if not lines:
+            continue  # taustakuva
+        with PILImage.open(images[label_path.stem]) as img:
+            img = img.convert('RGB')
+            w, h = img.size
+            for parts in lines:
+                cls, xc, yc, bw, bh = int(parts[0]), *(float(v) for v in parts[1:5])
+                bbox = [int((xc - bw / 2) * w), int((yc - bh / 2) * h),
+                        int((xc + bw / 2) * w), int((yc + bh / 2) * h)]
+                x1, y1, x2, y2 = crop_box(bbox, w, h)
+                if x2 - x1 < 2 or y2 - y1 < 2:
+                    continue
+                crops.append((img.crop((x1, y1, x2, y2)), cls))
+                if len(crops) >= limit:
+                    return crops
+    return crops
+
+
+def _calibration_reader(model, crops):
+    """onnxruntimen CalibrationDataReader valmiiksi esikäsitellyille rajauksille."""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class CropReader(CalibrationDataReader):
+        def __init__(self):
+            self._inputs = iter([{model.input_name: model.preprocess(c)} for c, _ in crops])
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    return CropReader()
+
+
+def quantize_species_model(model_path=None, dataset_dir=None, mode='static',
+                           calibration_size=CALIBRATION_SIZE, output_path=None):
+    """
+    Kvantisoi lajimalli INT8-muotoon.
+
+    Args:
+        model_path: PyTorch-malli (oletus: species_latest.pt)
+        dataset_dir: YOLO- tai rajausdataset kalibrointia varten (staattinen tila)
+        mode: 'static' (kalibroitu, QDQ, kanavakohtaiset painot) tai 'dynamic'
+        calibration_size: Kalibrointirajausten enimmäismäärä
+
+    Returns:
+        dict: Tulokset (fp32_path, int8_path, koot, kalibrointirajaukset)
+    """
+    from detection import onnx_backend
+
+    model_path = Path(model_path or MODEL_DIR / 'species_latest.pt')
+    if not model_path.exists():
+        return {'success': False, 'error': f'Mallia ei löydy: {model_path}'}
+    if mode not in ('static', 'dynamic'):
+        return {'success': False, 'error': f'Tuntematon tila: {mode}'}
+    output_path = Path(output_path or quantized_path(model_path))
+
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    fp32_path = onnx_backend.cached_export(
+        model_path, lambda t: onnx_backend.export_species_model(model_path, t))
+    fp32 = onnx_backend.OnnxSpeciesModel(fp32_path)
+    metadata = onnx_backend.read_metadata(fp32.session)
+
+    tmp = output_path.with_name(output_path.name + '.tmp')
+    crops = []
+    try:
+        if mode == 'dynamic':
+            quantize_dynamic(str(fp32_path), str(tmp), weight_type=QuantType.QInt8)
+        else:
+            crops = dataset_crops(dataset_dir, 'train', calibration_size)
+            if not crops:
+                return {'success': False, 'error': 'Ei kalibrointirajauksia datasetissa'}
+            prepared = fp32_path.with_name(fp32_path.stem + '.prep.onnx')
+            try:
+                from onnxruntime.quantization.shape_inference import quant_pre_process
+                quant_pre_process(str(fp32_path), str(prepared))
+                source = prepared
+            except Exception as e:
+                print(f"Esikäsittely ohitettu: {e}")
+                source = fp32_path
+            quantize_static(
+                str(source), str(tmp), _calibration_reader(fp32, crops),
+                quant_format=QuantFormat.QDQ, per_channel=True,
+                activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+            )
+            if prepared.exists():
+                prepared.unlink()
+        metadata['quantization'] = mode
+        onnx_backend._set_metadata(tmp, metadata)
+        os.replace(tmp, output_path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+    return {
+        'success': True,
+        'mode': mode,
+        'fp32_path': str(fp32_path),
+        'int8_path': str(output_path),
+        'fp32_mb': round(fp32_path.stat().st_size / 1e6, 2),
+        'int8_mb': round(output_path.stat().st_size / 1e6, 2),
+        'calibration_crops': len(crops),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+    parser = argparse.ArgumentParser(description='Kvantisoi lajimalli INT8-muotoon')
+    parser.add_argument('--model', default=None, help='Mallin polku (oletus: species_latest.pt)')
+    parser.add_argument('--dataset-dir', default=None,
+                        help='YOLO- tai rajausdataset (dataset_cls) kalibrointiin')
+    parser.add_argument('--mode', choices=['static', 'dynamic'], default='static')
+    parser.add_argument('--calibration-size', type=int, default=CALIBRATION_SIZE)
+    args = parser.parse_args()
+
+    print("Kvantisoidaan lajimalli...")
+    result = quantize_species_model(
+        model_path=args.model,
+        dataset_dir=args.dataset_dir,
+        mode=args.mode,
+        calibration_size=args.calibration_size,
+    )
+    print(json.dumps(result, indent=2, ensure_ascii=False))
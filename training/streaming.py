@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Koulutusdata suoraan annotaatioista ilman YOLO-eksporttia.
+
+Tunnisteet lasketaan annotaatioista muistissa (samat rivit ja sama
+train/val-jako kuin export_yolo.py:ssä), ja pienennetyt kuvat
+tallennetaan yhteen muistikartoitettuun tiedostoon. Uudelleenkoulutus
+dekoodaa vain uudet tai muuttuneet kuvat; muut luetaan välimuistista
+suoraan sivuvälimuistin kautta. Manifesti (manifest.json) ja kuvat ovat
+hakemistossa DATA_DIR/cache/training.
+
+ultralytics-luokat (StreamingDataset, StreamingTrainer) luodaan vasta
+koulutuksen alkaessa, joten moduulin voi tuoda ilman ultralyticsia.
+"""
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
+ANNOTATION_DIR = Path(os.environ.get('ANNOTATION_DIR', str(DATA_DIR / 'annotations')))
+IMAGE_DIR = Path(os.environ.get('IMAGE_DIR', str(DATA_DIR / 'images' / 'incoming')))
+STREAM_CACHE_DIR = DATA_DIR / 'cache' / 'training'
+
+# Kuvien dekoodaus välimuistiin rinnakkain (PIL vapauttaa GIL:n)
+STREAM_WORKERS = int(os.environ.get('STREAM_WORKERS', min(8, (os.cpu_count() or 1) * 2)))
+# Välimuisti tiivistetään, kun vanhentuneita tavuja on enemmän kuin voimassa olevia
+COMPACT_RATIO = 1.0
+# Edistymisen päivityksiä välimuistin täytössä
+PROGRESS_STEPS = 200
+
+
+def decode_resized(path, imgsz):
+    """
+    Kuva BGR-taulukkona, pidempi sivu imgsz (kuten ultralyticsin load_image).
+
+    JPEG dekoodataan suoraan pienennettynä (draft), mikä on moninkertaisesti
+    nopeampaa kuin täysikokoinen dekoodaus ja skaalaus.
+
+    Returns:
+        tuple: (uint8-taulukko HxWx3, (alkuperäinen korkeus, leveys))
+    """
+    from PIL import Image as PILImage
+
+    with PILImage.open(path) as img:
+        w0, h0 = img.size
+        r = imgsz / max(w0, h0)
+        size = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)) if r != 1 else (w0, h0)
+        if r < 1:
+            img.draft('RGB', size)
+        img = img.convert('RGB')
+        if img.size != size:
+            img = img.resize(size, PILImage.BILINEAR)
+        return np.ascontiguousarray(np.asarray(img)[:, :, ::-1]), (h0, w0)
+
+
+class ImageCache:
+    """
+    Pienennettyjen kuvien välimuisti yhdessä tiedostossa (np.memmap).
+
+    images_<imgsz>.bin sisältää kuvat peräkkäin; images_<imgsz>.json kertoo
+    kunkin kuvan sijainnin, muodon ja lähdetiedoston tilan (mtime, koko).
+    Muuttunut kuva lisätään loppuun; vanhentuneet tavut poistetaan
+    tiivistyksessä.
+    """
+
+    def __init__(self, cache_dir, imgsz):
+        self.cache_dir = Path(cache_dir)
+        self.imgsz = imgsz
+        self.data_path = self.cache_dir / f'images_{imgsz}.bin'
+        self.index_path = self.cache_dir / f'images_{imgsz}.json'
+        self.entries = {}
+        self._mmap = None
+        if self.index_path.exists() and self.data_path.exists():
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+            end = max((e['offset'] + e['nbytes'] for e in self.entries.values()), default=0)
+            if end > self.data_path.stat().st_size:
+                self.entries = {}  # keskeneräinen kirjoitus
+
+    def __getstate__(self):
+        # DataLoader-työprosessit avaavat muistikartan itse (spawn kopioisi sen)
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+    def is_current(self, name, mtime_ns, nbytes):
+        e = self.entries.get(name)
+        return e is not None and e['mtime_ns'] == mtime_ns and e['bytes'] == nbytes
+
+    def ensure(self, sources, workers=None, progress=None):
+        """
+        Lisää puuttuvat ja muuttuneet kuvat välimuistiin.
+
+        Args:
+            sources: [(nimi, polku, mtime_ns, tavut)]
+            progress: Valinnainen kutsu progress(valmiit, yhteensä)
+
+        Returns:
+            int: Dekoodattujen kuvien määrä (rikkinäiset kuvat ohitetaan)
+        """
+        missing = [s for s in sources if not self.is_current(s[0], s[2], s[3])]
+        decoded_count = 0
+        if missing:
+            self._mmap = None
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            if not self.entries:
+                self.data_path.unlink(missing_ok=True)
+            pool = ThreadPoolExecutor(max_workers=max(1, workers or STREAM_WORKERS),
+                                      thread_name_prefix='stream-cache')
+            try:
+                decoded = pool.map(self._decode, missing)
+                step = max(1, len(missing) // PROGRESS_STEPS)
+                with open(self.data_path, 'ab') as f:
+                    offset = f.tell()
+                    for done, ((name, _, mtime_ns, nbytes), result) in enumerate(
+                            zip(missing, decoded), 1):
+                        if progress and (done % step == 0 or done == len(missing)):
+                            progress(done, len(missing))
+                        if result is None:
+                            self.entries.pop(name, None)
+                            continue
+                        im, (h0, w0) = result
+                        f.write(im.data)
+                        self.entries[name] = {
+                            'offset': offset, 'nbytes': im.nbytes,
+                            'h': im.shape[0], 'w': im.shape[1], 'h0': h0, 'w0': w0,
+                            'mtime_ns': mtime_ns, 'bytes': nbytes,
+                        }
+                        offset += im.nbytes
+                        decoded_count += 1
+            finally:
+                pool.shutdown(cancel_futures=True)
+        self._compact({s[0] for s in sources})
+        self.save()
+        return decoded_count
+
+    def _decode(self, source):
+        try:
+            return decode_resized(source[1], self.imgsz)
+        except OSError as e:
+            print(f"Kuvan dekoodaus epäonnistui {source[1]}: {e}")
+            return None
+
+    def _compact(self, keep):
+        """Poista käyttämättömät kuvat ja kirjoita tiedosto uudelleen, jos hukkaa on paljon."""
+        for name in set(self.entries) - keep:
+            del self.entries[name]
+        if not self.data_path.exists():
+            return
+        live = sum(e['nbytes'] for e in self.entries.values())
+        if self.data_path.stat().st_size - live <= COMPACT_RATIO * live:
+            return
+        source = np.memmap(self.data_path, dtype=np.uint8, mode='r') if live else None
+        tmp = self.data_path.with_name(self.data_path.name + '.tmp')
+        offset = 0
+        with open(tmp, 'wb') as f:
+            for e in sorted(self.entries.values(), key=lambda e: e['offset']):
+                f.write(source[e['offset']:e['offset'] + e['nbytes']].data)
+                e['offset'] = offset
+                offset += e['nbytes']
+        del source
+        self._mmap = None
+        os.replace(tmp, self.data_path)
+
+    def save(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_name(self.index_path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.replace(tmp, self.index_path)
+
+    def load(self, name):
+        """
+        Returns:
+            tuple: (BGR-kopio HxWx3, (alkuperäinen korkeus, leveys))
+        """
+        e = self.entries[name]
+        if self._mmap is None:
+            self._mmap = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        view = self._mmap[e['offset']:e['offset'] + e['nbytes']].reshape(e['h'], e['w'], 3)
+        # Augmentoinnit muokkaavat kuvaa paikallaan; muistikartta on vain luku
+        return np.array(view), (e['h0'], e['w0'])
+
+
+def prepare_stream(
+    annotation_dir=None,
+    image_dir=None,
+    cache_dir=None,
+    imgsz=640,
+    class_map=None,
+    species_to_id=None,
+    val_split=0.2,
+    seed=42,
+    split_group=None,
+    workers=None,
+    progress=None,
+):
+    """
+    Rakenna koulutustietueet ja kuvavälimuisti annotaatioista.
+
+    Manifesti on samaa muotoa kuin eksportissa; tunnisteet (YOLO-rivit)
+    tallennetaan siihen, joten muuttumattomia annotaatioita ei lueta.
+
+    Returns:
+        dict: success, records ({'path', 'name', 'split', 'labels',
+        'width', 'height'}), cache (ImageCache) sekä tilastot
+    """
+    from export_yolo import (
+        DEFAULT_CLASS_MAP, DEFAULT_SPECIES_TO_ID, EXPORT_WORKERS, MANIFEST_FILENAME,
+        MANIFEST_VERSION, _read_annotations, _write_atomic, assign_splits, image_size,
+        load_manifest, scan_annotations, yolo_rows,
+    )
+
+    class_map = class_map or DEFAULT_CLASS_MAP
+    species_to_id = species_to_id or DEFAULT_SPECIES_TO_ID
+    annotation_dir = Path(annotation_dir or ANNOTATION_DIR)
+    image_dir = Path(image_dir or IMAGE_DIR)
+    cache_dir = Path(cache_dir or STREAM_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    previous = load_manifest(cache_dir, class_map)['images']
+    pool = ThreadPoolExecutor(max_workers=max(1, workers or EXPORT_WORKERS),
+                              thread_name_prefix='stream-scan')
+    try:
+        entries, changed = scan_annotations(annotation_dir, image_dir, previous, pool)
+        exported = {stem: e for stem, e in entries.items() if e.get('kind')}
+        if not exported:
+            return {'success': False, 'error': 'Ei annotaatioita koulutukseen'}
+        assign_splits(exported, val_split, seed, split_group)
+
+        def labels_for(stem, item):
+            if item['kind'] != 'annotated':
+                return []
+            if 'width' not in item:
+                item['width'], item['height'] = image_size(image_dir / item['image'])
+            rows, item['species'], item['skipped_unknown'] = yolo_rows(
+                item.pop('annotations', None) or _read_annotations(annotation_dir, stem),
+                species_to_id, item['width'], item['height'])
+            return [list(r) for r in rows]
+
+        todo = [(stem, e) for stem, e in exported.items() if stem in changed or 'labels' not in e]
+        for (_, item), labels in zip(todo, pool.map(lambda t: labels_for(*t), todo)):
+            item['labels'] = labels
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    cache = ImageCache(cache_dir, imgsz)
+    decoded = cache.ensure(
+        [(e['image'], image_dir / e['image'], e['image_mtime_ns'], e['image_bytes'])
+         for e in exported.values()],
+        workers=workers, progress=progress,
+    )
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'class_map': {str(k): v for k, v in class_map.items()},
+        'images': entries,
+    }
+    _write_atomic(cache_dir / MANIFEST_FILENAME,
+                  json.dumps(manifest, ensure_ascii=False, separators=(',', ':')))
+
+    records = []
+    for stem, e in sorted(exported.items()):
+        ce = cache.entries.get(e['image'])
+        if ce is None:
+            continue  # kuvaa ei voitu dekoodata
+        records.append({
+            'path': str(image_dir / e['image']),
+            'name': e['image'],
+            'split': e['split'],
+            'labels': e['labels'],
+            'width': ce['w0'],
+            'height': ce['h0'],
+        })
+    return {
+        'success': True,
+        'records': records,
+        'cache': cache,
+        'train': sum(r['split'] == 'train' for r in records),
+        'val': sum(r['split'] == 'val' for r in records),
+        'changed': len(changed),
+        'decoded': decoded,
+    }
+
+
+def write_data_yaml(cache_dir, image_dir, class_map):
+    """
+    ultralyticsin data-tiedosto: polut vain tarkistusta varten (kuvat ovat
+    olemassa), varsinaiset tietueet tulevat StreamingTraineriltä.
+    """
+    image_dir = Path(image_dir).resolve()
+    path = Path(cache_dir) / 'stream.yaml'
+    text = (
+        f"path: {Path(cache_dir).resolve()}\n"
+        f"train: {image_dir}\n"
+        f"val: {image_dir}\n\n"
+        f"nc: {len(class_map)}\n"
+        f"names: {json.dumps({int(k): v for k, v in class_map.items()})}\n"
+    )
+    path.write_text(text, encoding='utf-8')
+    return path
+
+
+def _dataset_class():
+    from ultralytics.data.dataset import YOLODataset
+
+    class StreamingDataset(YOLODataset):
+        """YOLODataset, jonka tunnisteet ovat muistissa ja kuvat ImageCachessa."""
+
+        def __init__(self, *args, records, image_cache, **kwargs):
+            self.records = records
+            self.image_cache = image_cache
+            super().__init__(*args, **kwargs)
+
+        def get_img_files(self, img_path):
+            return [r['path'] for r in self.records]
+
+        def get_labels(self):
+            labels = []
+            for r in self.records:
+                rows = np.array(r['labels'], dtype=np.float32).reshape(-1, 5)
+                labels.append({
+                    'im_file': r['path'],
+                    'shape': (r['height'], r['width']),
+                    'cls': rows[:, :1],
+                    'bboxes': rows[:, 1:],
+                    'segments': [],
+                    'keypoints': None,
+                    'normalized': True,
+                    'bbox_format': 'xywh',
+                })
+            return labels
+
+        def load_image(self, i, rect_mode=True, **kwargs):
+            im, hw0 = self.image_cache.load(self.records[i]['name'])
+            if not rect_mode and im.shape[:2] != (self.imgsz, self.imgsz):
+                import cv2
+                im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+            if self.augment:
+                # Mosaic valitsee lisäkuvat viimeksi ladatuista
+                self.buffer.append(i)
+                if 1 < len(self.buffer) >= self.max_buffer_length:
+                    self.buffer.pop(0)
+            return im, hw0, im.shape[:2]
+
+    return StreamingDataset
+
+
+def make_trainer(records, image_cache):
+    """DetectionTrainer, joka rakentaa train/val-datasetit tietueista."""
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils import colorstr
+
+    dataset_class = _dataset_class()
+
+    class StreamingTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            model = getattr(self.model, 'module', self.model)
+            gs = max(int(model.stride.max()) if hasattr(model, 'stride') else 0, 32)
+            split = 'train' if mode == 'train' else 'val'
+            return dataset_class(
+                records=[r for r in records if r['split'] == split],
+                image_cache=image_cache,
+                img_path=img_path,
+                imgsz=self.args.imgsz,
+                batch_size=batch,
+                augment=mode == 'train',
+                hyp=self.args,
+                rect=self.args.rect or mode == 'val',
+                cache=None,
+                single_cls=self.args.single_cls or False,
+                stride=gs,
+                pad=0.0 if mode == 'train' else 0.5,
+                prefix=colorstr(f'{mode}: '),
+                task=self.args.task,
+                classes=self.args.classes,
+                data=self.data,
+                fraction=self.args.fraction if mode == 'train' else 1.0,
+            )
+
+    return StreamingTrainer
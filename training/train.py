@@ -2,6 +2,12 @@
 """
 YOLO-lajimallin koulutus riistakameradatalla.
 Ajetaan Mac Minin hostissa (Apple Silicon MPS).
+
+train_species_model kouluttaa eksportoidusta YOLO-datasetista
+(export_yolo.py, scripts/train_on_host.sh); luokittelumalli (-cls)
+koulutetaan samoilla rajauksilla kuin lajitunnistus ajaa sitä
+(export_yolo.py --crops). train_from_annotations lukee annotaatiot ja kuvat
+suoraan (training.streaming) ilman eksporttia.
 """
 import json
 import os
@@ -12,6 +18,7 @@ from pathlib import Path
 DATA_DIR = Path(os.environ.get('DATA_DIR', '/data'))
 MODEL_DIR = DATA_DIR / 'models'
 DATASET_DIR = DATA_DIR / 'dataset'
+CLS_DATASET_DIR = DATA_DIR / 'dataset_cls'
 HISTORY_FILE = DATA_DIR / 'training_history.json'
 
 
@@ -50,38 +57,116 @@ def should_retrain(min_new_annotations=50):
     return current_count - last_count >= min_new_annotations
 
 
+def _add_callbacks(model, progress, should_stop):
+    """Edistyminen ja peruminen epookin lopussa."""
+    if progress or should_stop:
+        def on_fit_epoch_end(trainer):
+            if progress:
+                progress(trainer.epoch + 1, trainer.epochs)
+            if should_stop and should_stop():
+                trainer.stop = True
+
+        model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+
+
+def _finish_training(results, base_model, epochs, timestamp, project, name,
+                     should_stop, quantize, dataset_dir):
+    """Ota paras malli käyttöön, päivitä historia ja kvantisoi tarvittaessa."""
+    if should_stop and should_stop():
+        return {'success': False, 'cancelled': True, 'training_dir': str(Path(project) / name)}
+
+    # Kopioi paras malli species_latest.pt:ksi
+    best_model = Path(project) / name / 'weights' / 'best.pt'
+    latest_link = MODEL_DIR / 'species_latest.pt'
+
+    if best_model.exists():
+        MODEL_DIR.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(best_model, latest_link)
+
+    # Päivitä koulutushistoria
+    history = get_training_history()
+    ann_count = count_annotations()
+
+    run_info = {
+        'timestamp': timestamp,
+        'base_model': base_model,
+        'epochs': epochs,
+        'annotation_count': ann_count,
+        'model_path': str(best_model) if best_model.exists() else None,
+    }
+
+    # Lisää metriikat jos saatavilla
+    if hasattr(results, 'results_dict'):
+        run_info['metrics'] = {
+            k: round(float(v), 4) if isinstance(v, (int, float)) else str(v)
+            for k, v in results.results_dict.items()
+        }
+
+    history['runs'].append(run_info)
+    history['last_annotation_count'] = ann_count
+    save_training_history(history)
+
+    result = {
+        'success': True,
+        'model_path': str(latest_link),
+        'training_dir': str(Path(project) / name),
+        'run_info': run_info,
+    }
+    if quantize and latest_link.exists():
+        try:
+            from training.quantize import has_calibration_data, quantize_species_model
+            result['quantized'] = quantize_species_model(
+                latest_link, dataset_dir=dataset_dir,
+                mode='static' if has_calibration_data(dataset_dir) else 'dynamic')
+        except Exception as e:
+            result['quantized'] = {'success': False, 'error': str(e)}
+    return result
+
+
 def train_species_model(
     dataset_yaml=None,
     base_model='yolo11n-cls.pt',
     epochs=100,
-    imgsz=640,
+    imgsz=None,
     batch=8,
     device='mps',
     patience=20,
     project=None,
     name=None,
+    progress=None,
+    should_stop=None,
+    quantize=False,
 ):
     """
     Kouluta YOLO-lajimalli.
 
     Args:
-        dataset_yaml: dataset.yaml polku
+        dataset_yaml: dataset.yaml polku; luokittelumallille rajausdatasetin
+            hakemisto (oletus: CLS_DATASET_DIR)
         base_model: Pohjamalli (yolo11n-cls.pt, yolo11n.pt, yolo11s.pt)
         epochs: Koulutusepookit
-        imgsz: Kuvan koko
+        imgsz: Kuvan koko (oletus 640, luokittelumallille EXPORT_CROP_SIZE)
         batch: Eräkoko
         device: Laite ('mps' Apple Siliconille, 'cpu' Dockerille)
         patience: Early stopping epookit
         project: Tuloshakemisto
         name: Koulutuksen nimi
+        progress: Valinnainen kutsu progress(epookki, epookit) jokaisen epookin jälkeen
+        should_stop: Valinnainen kutsu; kun palauttaa True, koulutus lopetetaan
+            epookin jälkeen eikä mallia oteta käyttöön
+        quantize: Kvantisoi uusi malli INT8-muotoon (training.quantize)
 
     Returns:
         dict: Koulutuksen tulokset
     """
     from ultralytics import YOLO
 
+    classify = '-cls' in Path(base_model).stem
     if dataset_yaml is None:
-        dataset_yaml = str(DATASET_DIR / 'dataset.yaml')
+        dataset_yaml = str(CLS_DATASET_DIR if classify else DATASET_DIR / 'dataset.yaml')
+    if imgsz is None:
+        from export_yolo import EXPORT_CROP_SIZE
+        imgsz = EXPORT_CROP_SIZE if classify else 640
 
     if not Path(dataset_yaml).exists():
         return {'success': False, 'error': f'dataset.yaml not found: {dataset_yaml}'}
@@ -93,6 +178,7 @@ def train_species_model(
         name = f'species_{timestamp}'
 
     model = YOLO(base_model)
+    _add_callbacks(model, progress, should_stop)
 
     results = model.train(
         data=dataset_yaml,
@@ -107,65 +193,131 @@ def train_species_model(
         verbose=True,
     )
 
-    # Kopioi paras malli species_latest.pt:ksi
-    best_model = Path(project) / name / 'weights' / 'best.pt'
-    latest_link = MODEL_DIR / 'species_latest.pt'
+    from training.quantize import dataset_root
+    return _finish_training(results, base_model, epochs, timestamp, project, name,
+                            should_stop, quantize, dataset_root(dataset_yaml))
 
-    if best_model.exists():
-        MODEL_DIR.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(best_model, latest_link)
 
-    # Päivitä koulutushistoria
-    history = get_training_history()
-    ann_count = count_annotations()
+def train_from_annotations(
+    annotation_dir=None,
+    image_dir=None,
+    base_model='yolo11n.pt',
+    epochs=100,
+    imgsz=640,
+    batch=8,
+    device='mps',
+    patience=20,
+    project=None,
+    name=None,
+    progress=None,
+    should_stop=None,
+    quantize=False,
+    class_map=None,
+    species_to_id=None,
+    cache_dir=None,
+    prepare_progress=None,
+):
+    """
+    Kouluta YOLO-tunnistusmalli suoraan annotaatioista ilman eksporttia.
 
-    run_info = {
-        'timestamp': timestamp,
-        'base_model': base_model,
-        'epochs': epochs,
-        'annotation_count': ann_count,
-        'model_path': str(best_model) if best_model.exists() else None,
-    }
+    Tunnisteet lasketaan muistissa ja kuvat luetaan muistikartoitetusta
+    välimuistista (training.streaming); vain uudet ja muuttuneet kuvat
+    dekoodataan ennen koulutusta. Luokittelumallit (-cls) tarvitsevat
+    rajausdatasetin, joten ne koulutetaan train_species_model-funktiolla.
 
-    # Lisää metriikat jos saatavilla
-    if hasattr(results, 'results_dict'):
-        run_info['metrics'] = {
-            k: round(float(v), 4) if isinstance(v, (int, float)) else str(v)
-            for k, v in results.results_dict.items()
-        }
+    Args:
+        annotation_dir: Annotaatiot (oletus: ANNOTATION_DIR)
+        image_dir: Kuvat (oletus: IMAGE_DIR)
+        prepare_progress: Valinnainen kutsu progress(valmiit, yhteensä)
+            kuvavälimuistin täytön aikana
+        muut: kuten train_species_model
 
-    history['runs'].append(run_info)
-    history['last_annotation_count'] = ann_count
-    save_training_history(history)
+    Returns:
+        dict: Koulutuksen tulokset (+ 'stream': valmistelun tilastot)
+    """
+    from training import streaming
 
-    return {
-        'success': True,
-        'model_path': str(latest_link),
-        'training_dir': str(Path(project) / name),
-        'run_info': run_info,
-    }
+    if '-cls' in Path(base_model).name:
+        return {'success': False,
+                'error': 'Suora koulutus tukee vain tunnistusmalleja; käytä eksporttia -cls-malleille'}
+
+    cache_dir = Path(cache_dir or streaming.STREAM_CACHE_DIR)
+    stream = streaming.prepare_stream(
+        annotation_dir=annotation_dir, image_dir=image_dir, cache_dir=cache_dir, imgsz=imgsz,
+        class_map=class_map, species_to_id=species_to_id, progress=prepare_progress,
+    )
+    if not stream.get('success'):
+        return stream
+    if should_stop and should_stop():
+        return {'success': False, 'cancelled': True}
+
+    from export_yolo import DEFAULT_CLASS_MAP
+    from ultralytics import YOLO
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if project is None:
+        project = str(MODEL_DIR)
+    if name is None:
+        name = f'species_{timestamp}'
+    data_yaml = streaming.write_data_yaml(cache_dir, image_dir or streaming.IMAGE_DIR,
+                                          class_map or DEFAULT_CLASS_MAP)
+
+    model = YOLO(base_model)
+    _add_callbacks(model, progress, should_stop)
+
+    results = model.train(
+        trainer=streaming.make_trainer(stream['records'], stream['cache']),
+        data=str(data_yaml),
+        epochs=epochs,
+        imgsz=imgsz,
+        batch=batch,
+        device=device,
+        patience=patience,
+        project=project,
+        name=name,
+        exist_ok=True,
+        verbose=True,
+    )
+
+    result = _finish_training(results, base_model, epochs, timestamp, project, name,
+                              should_stop, quantize, DATASET_DIR)
+    result['stream'] = {k: stream[k] for k in ('train', 'val', 'changed', 'decoded')}
+    return result
 
 
 if __name__ == '__main__':
     import argparse
+    import sys
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
     parser = argparse.ArgumentParser(description='Kouluta YOLO-lajimalli')
     parser.add_argument('--dataset', default=None, help='dataset.yaml polku')
-    parser.add_argument('--base-model', default='yolo11n-cls.pt', help='Pohjamalli')
+    parser.add_argument('--base-model', default=None,
+                        help='Pohjamalli (oletus yolo11n-cls.pt, --from-annotations: yolo11n.pt)')
     parser.add_argument('--epochs', type=int, default=100)
-    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--imgsz', type=int, default=None,
+                        help='Oletus 640 (-cls: rajausten koko, EXPORT_CROP_SIZE)')
     parser.add_argument('--batch', type=int, default=8)
     parser.add_argument('--device', default='mps', help='mps (Mac), cpu, cuda')
     parser.add_argument('--patience', type=int, default=20)
+    parser.add_argument('--quantize', action='store_true',
+                        help='Kvantisoi malli INT8-muotoon koulutuksen jälkeen')
+    parser.add_argument('--from-annotations', action='store_true',
+                        help='Kouluta suoraan annotaatioista ilman eksporttia (detect-mallit)')
     args = parser.parse_args()
 
     print("Aloitetaan koulutus...")
-    result = train_species_model(
-        dataset_yaml=args.dataset,
-        base_model=args.base_model,
+    options = dict(
+        base_model=args.base_model or ('yolo11n.pt' if args.from_annotations else 'yolo11n-cls.pt'),
         epochs=args.epochs,
         imgsz=args.imgsz,
         batch=args.batch,
         device=args.device,
         patience=args.patience,
+        quantize=args.quantize,
     )
+    if args.from_annotations:
+        result = train_from_annotations(**dict(options, imgsz=args.imgsz or 640))
+    else:
+        result = train_species_model(dataset_yaml=args.dataset, **options)
     print(json.dumps(result, indent=2, ensure_ascii=False))